@@ -196,8 +196,22 @@ class ISite(Interface):
         description=u"Should be an integer value",
         default=SITE_NEW)
 
+    version = Int(
+        title=u"Version",
+        required=True,
+        description=u"Backend change version of the last site write (0 if "
+                    u"unknown)",
+        default=0)
+
 
 class ISiteNew(Interface):
     """
     Marker interface to specify that a site is new, and should be added.
     """
+
+
+class ISiteSnapshot(Interface):
+    """
+    Marker interface to specify that a site is an immutable snapshot, which
+    should be promoted to a full site object before being edited.
+    """
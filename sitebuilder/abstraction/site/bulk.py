@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+"""
+Streaming import and export of the sites catalog.
+
+Sites are read from, and written to, CSV or JSON lines files one record at
+a time. Imported records are validated against site components schemas, and
+added to the backend by chunks using the driver add_sites batched insert
+path: memory use doesn't depend on the file size.
+
+CSV files have one column per site attribute, named component.attribute
+(dnshost.name, database.enabled...). JSON lines files hold one record per
+line, as returned by sitebuilder.abstraction.site.record.site_to_dict.
+Missing or empty attributes get their default value.
+"""
+
+from sitebuilder.abstraction.interface import ISite
+from sitebuilder.abstraction.site.record import SITE_FIELDS, site_to_dict
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.parameters import IMPORT_CHUNK_SIZE
+from sitebuilder.exception import SiteError, BackendError
+from zope.schema import Bool, Choice, ValidationError
+import csv
+import json
+
+# Supported file formats
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMATS = (FORMAT_CSV, FORMAT_JSONL)
+
+# Site attributes schema fields, in SITE_FIELDS order
+_SCHEMA = [ (component, attr, ISite[component].schema[attr])
+            for component, attributes in SITE_FIELDS for attr in attributes ]
+
+# CSV columns, in SITE_FIELDS order
+COLUMNS = [ "%s.%s" % (component, attr) for component, attr, field in _SCHEMA ]
+
+
+def _get_choices():
+    """
+    Returns the sets of values already validated for choice fields, in
+    SITE_FIELDS order (None for other fields). Most rows share the same
+    domain, platform or template, and these sets are bounded by vocabularies.
+    """
+    choices = []
+
+    for component, attr, field in _SCHEMA:
+        if isinstance(field, Choice):
+            choices.append(set())
+        else:
+            choices.append(None)
+
+    return choices
+
+
+_CHOICES = _get_choices()
+
+# Boolean values text representations
+_TRUE = ('1', 'true', 'yes', 'on')
+_FALSE = ('0', 'false', 'no', 'off')
+
+
+def parse_bool(value):
+    """
+    Returns a boolean from its text (or JSON) representation.
+
+    >>> parse_bool(u'True'), parse_bool('0'), parse_bool(1)
+    (True, False, True)
+    >>> parse_bool(u'maybe')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid boolean value: u'maybe'
+    """
+    if isinstance(value, bool):
+        return value
+
+    if isinstance(value, basestring):
+        text = value.strip().lower()
+
+        if text in _TRUE:
+            return True
+        if text in _FALSE:
+            return False
+    elif value in (0, 1):
+        return bool(value)
+
+    raise ValueError("Invalid boolean value: %r" % value)
+
+
+def record_to_site(record):
+    """
+    Returns the immutable snapshot of a site from a record: a dictionnary of
+    site components values dictionnaries. Values are validated using site
+    components schemas, missing or empty values get their default value.
+
+    >>> site = record_to_site({'dnshost': {'name': u'name0'},
+    ...                        'database': {'enabled': u'yes'}})
+    >>> site.dnshost.name, site.dnshost.domain, site.database.enabled
+    (u'name0', u'bpinet.com', True)
+    >>> record_to_site({'dnshost': {'name': u'name 0'}})
+    Traceback (most recent call last):
+        ...
+    SiteError: Invalid dnshost.name value u'name 0': Constraint not satisfied
+    >>> record_to_site({'dnshost': {'domain': u'bpinet.com'}})
+    Traceback (most recent call last):
+        ...
+    SiteError: Missing dnshost.name value
+    """
+    values = []
+
+    for (component, attr, field), valid in zip(_SCHEMA, _CHOICES):
+        value = record.get(component, {}).get(attr)
+
+        try:
+            if value is None or value == '':
+                value = field.default
+            elif isinstance(field, Bool):
+                value = parse_bool(value)
+            else:
+                value = unicode(value)
+
+            if valid is None:
+                field.validate(value)
+            elif not value in valid:
+                field.validate(value)
+                valid.add(value)
+        except ValidationError, e:
+            raise SiteError("Invalid %s.%s value %r: %s" % (
+                component, attr, value, e.doc()))
+        except ValueError, e:
+            raise SiteError("Invalid %s.%s value: %s" % (component, attr, e))
+
+        values.append(value)
+
+    site = SiteSnapshot.from_tuple(values)
+
+    if not site.dnshost.name:
+        raise SiteError("Missing dnshost.name value")
+
+    return site
+
+
+def read_csv(stream):
+    """
+    Generator yielding the (line number, record) tuples of a CSV stream.
+
+    >>> from StringIO import StringIO
+    >>> stream = StringIO('dnshost.name,database.enabled\\nname0,true\\n')
+    >>> list(read_csv(stream))
+    [(2, {'dnshost': {'name': u'name0'}, 'database': {'enabled': u'true'}})]
+    """
+    reader = csv.reader(stream)
+
+    try:
+        header = reader.next()
+    except StopIteration:
+        return
+
+    columns = []
+
+    for column in header:
+        if not column in COLUMNS:
+            raise SiteError("Unknown column %s" % column)
+
+        columns.append(column.split('.', 1))
+
+    for row in reader:
+        if not len(row):
+            continue
+
+        record = {}
+
+        for (component, attr), value in zip(columns, row):
+            record.setdefault(component, {})[attr] = value.decode('utf-8')
+
+        yield int(reader.line_num), record
+
+
+def read_jsonl(stream):
+    """
+    Generator yielding the (line number, record) tuples of a JSON lines
+    stream.
+
+    >>> from StringIO import StringIO
+    >>> list(read_jsonl(StringIO('{"dnshost": {"name": "name0"}}\\n\\n')))
+    [(1, {u'dnshost': {u'name': u'name0'}})]
+    """
+    for num, line in enumerate(stream):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError, e:
+            raise SiteError("Line %d: invalid JSON record: %s" % (num + 1, e))
+
+        yield num + 1, record
+
+
+def read_sites(stream, format=FORMAT_CSV, errors=None):
+    """
+    Generator yielding the validated site snapshots read from a stream.
+
+    Invalid records raise a SiteError, unless errors is a list: (line
+    number, message) tuples are then appended to it, and invalid records
+    skipped.
+
+    >>> from StringIO import StringIO
+    >>> errors = []
+    >>> stream = StringIO('dnshost.name\\nname0\\nname 1\\nname2\\n')
+    >>> [ site.dnshost.name for site in read_sites(stream, errors=errors) ]
+    [u'name0', u'name2']
+    >>> errors
+    [(3, "Invalid dnshost.name value u'name 1': Constraint not satisfied")]
+    """
+    for num, site in _read_numbered_sites(stream, format, errors):
+        yield site
+
+
+def _read_numbered_sites(stream, format, errors):
+    """
+    Generator yielding the (line number, site snapshot) tuples of the
+    validated sites read from a stream (see read_sites)
+    """
+    if format == FORMAT_CSV:
+        records = read_csv(stream)
+    elif format == FORMAT_JSONL:
+        records = read_jsonl(stream)
+    else:
+        raise SiteError("Unknown format %s" % format)
+
+    for num, record in records:
+        try:
+            yield num, record_to_site(record)
+        except SiteError, e:
+            if errors is None:
+                raise SiteError("Line %d: %s" % (num, e))
+
+            errors.append((num, str(e)))
+
+
+def write_sites(sites, stream, format=FORMAT_CSV):
+    """
+    Writes sites (or snapshots) to a stream, and returns their number.
+
+    >>> from StringIO import StringIO
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> site = site_factory()
+    >>> site.dnshost.name = u'name0'
+    >>> stream = StringIO()
+    >>> write_sites([ site ], stream)
+    1
+    >>> stream.getvalue().splitlines()[1].split(',')[:5]
+    ['name0', 'bpinet.com', 'prod', '', 'false']
+    >>> stream.seek(0)
+    >>> site_to_dict(list(read_sites(stream))[0]) == site_to_dict(site)
+    True
+    """
+    count = 0
+
+    if format == FORMAT_CSV:
+        writer = csv.writer(stream)
+        writer.writerow(COLUMNS)
+
+        for site in sites:
+            row = []
+
+            for component, attr, field in _SCHEMA:
+                value = getattr(getattr(site, component), attr)
+
+                if value is None:
+                    value = ''
+                elif isinstance(value, bool):
+                    value = value and 'true' or 'false'
+                else:
+                    value = value.encode('utf-8')
+
+                row.append(value)
+
+            writer.writerow(row)
+            count += 1
+    elif format == FORMAT_JSONL:
+        for site in sites:
+            stream.write(json.dumps(site_to_dict(site), sort_keys=True))
+            stream.write('\n')
+            count += 1
+    else:
+        raise SiteError("Unknown format %s" % format)
+
+    return count
+
+
+def iter_chunks(iterable, size):
+    """
+    Generator yielding lists of at most size items read from an iterable.
+
+    >>> list(iter_chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    chunk = []
+
+    for item in iterable:
+        chunk.append(item)
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if len(chunk):
+        yield chunk
+
+
+def import_sites(driver, stream, format=FORMAT_CSV,
+                 chunk_size=IMPORT_CHUNK_SIZE, errors=None):
+    """
+    Imports the sites read from a stream using a backend driver, chunk_size
+    sites at a time, and returns the number of imported sites (see
+    read_sites for errors handling). Each chunk is added at once: if one of
+    its sites already exists, none is.
+
+    If errors is a list, sites that already exist are skipped as well, and
+    reported in it: an interrupted import can be run again. Errors are
+    sorted by line number.
+
+    Otherwise, the error stopping the import gets an imported attribute set
+    to the number of sites imported by the previous chunks.
+
+    >>> from StringIO import StringIO
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> driver = MemoryBackendDriver()
+    >>> stream = StringIO('\\n'.join([ 'dnshost.name' ] +
+    ...                              [ 'name%d' % i for i in range(5) ]))
+    >>> import_sites(driver, stream, chunk_size=2)
+    5
+    >>> out = StringIO()
+    >>> export_sites(driver, out, FORMAT_JSONL)
+    5
+    >>> len(out.getvalue().splitlines())
+    5
+
+    Importing the same sites again fails, unless existing ones are skipped
+
+    >>> stream.seek(0)
+    >>> try:
+    ...     import_sites(driver, stream, chunk_size=2)
+    ... except BackendError, e:
+    ...     print e.imported, e
+    0 Site name0.bpinet.com already exists
+    >>> stream = StringIO('\\n'.join([ 'dnshost.name' ] +
+    ...                              [ 'name%d' % i for i in range(3, 8) ]))
+    >>> errors = []
+    >>> import_sites(driver, stream, chunk_size=2, errors=errors)
+    3
+    >>> errors
+    [(2, 'Site name3.bpinet.com already exists'), \
+(3, 'Site name4.bpinet.com already exists')]
+    """
+    count = 0
+
+    try:
+        for chunk in iter_chunks(_read_numbered_sites(stream, format, errors),
+                                 chunk_size):
+            try:
+                driver.add_sites([ site for num, site in chunk ])
+                count += len(chunk)
+            except BackendError:
+                if errors is None:
+                    raise
+
+                # Some sites already exist: they are added one by one
+                for num, site in chunk:
+                    if driver.insert_if_absent(site):
+                        count += 1
+                    else:
+                        errors.append((num, str("Site %s.%s already exists"
+                                                % (site.dnshost.name,
+                                                   site.dnshost.domain))))
+    except (SiteError, BackendError), e:
+        e.imported = count
+        raise
+
+    if errors is not None:
+        errors.sort()
+
+    return count
+
+
+def export_sites(driver, stream, format=FORMAT_CSV,
+                 batch_size=IMPORT_CHUNK_SIZE):
+    """
+    Writes all the sites of a backend driver to a stream, read batch_size
+    sites at a time, and returns their number.
+    """
+    return write_sites(driver.iter_sites(batch_size), stream, format)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -5,11 +5,9 @@ Site configuration management calsses. It supports search, load, create, save
 and delete operations.
 """
 
-from sitebuilder.utils.parameters import get_application_context
-from sitebuilder.utils.parameters import CONTEXT_NORMAL, CONTEXT_TEST
 from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
 from sitebuilder.abstraction.site.factory import site_factory
-from sitebuilder.utils.driver.test import TestBackendDriver
+from sitebuilder.utils.driver.registry import get_backend_driver
 
 def get_default_config_data():
     """
@@ -96,21 +94,13 @@ class SiteConfigurationManager(object):
     @staticmethod
     def get_backend_driver():
         """
-        Returns backend driver depending on application execution context
+        Returns backend driver depending on application execution context,
+        unless a driver has been explicitly set
         """
-        if SiteConfigurationManager.backend_driver is None:
-            context = get_application_context()
+        if SiteConfigurationManager.backend_driver is not None:
+            return SiteConfigurationManager.backend_driver
 
-            if context == CONTEXT_NORMAL:
-                driver = TestBackendDriver
-            elif context == CONTEXT_TEST:
-                driver = TestBackendDriver
-            else:
-                raise RuntimeError("unknonw application context: %s" % context)
-
-            SiteConfigurationManager.backend_driver = driver
-
-        return SiteConfigurationManager.backend_driver
+        return get_backend_driver()
 
     @staticmethod
     def get_blank_site():
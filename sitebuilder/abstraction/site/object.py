@@ -258,6 +258,7 @@ class Site(BaseObject):
     repository = TriggerFieldProperty(ISite['repository'])
     database = TriggerFieldProperty(ISite['database'])
     status = FieldProperty(ISite['status'])
+    version = FieldProperty(ISite['version'])
 
     def __init__(self):
         """
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Plain record representations of site objects.
+
+Site objects carry event buses and zope field state, which makes them
+expensive to hash, copy or send to an other process. This module gives the
+canonical list of site attributes and conversion routines between site
+objects and plain dictionnaries.
+"""
+
+from sitebuilder.abstraction.site.factory import site_factory
+
+# Site attributes, grouped by site component, in canonical order
+SITE_FIELDS = (
+    ('dnshost', ('name', 'domain', 'platform', 'description', 'done')),
+    ('repository', ('enabled', 'name', 'type', 'done')),
+    ('website', ('enabled', 'template', 'access', 'maintenance', 'done')),
+    ('database', ('enabled', 'type', 'name', 'username', 'password', 'done')),
+    )
+
+
+def get_site_key(name, domain):
+    """
+    Returns the normalized key identifying a site (name and domain are
+    case insensitive).
+
+    >>> get_site_key(u'Name0', u'bpinet.com')
+    u'name0.bpinet.com'
+    """
+    return u"%s.%s" % (name.lower(), domain.lower())
+
+
+def site_to_dict(site):
+    """
+    Returns a dictionnary of site components dictionnaries holding site
+    attributes values.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> site = site_factory()
+    >>> site.dnshost.name = u'test'
+    >>> record = site_to_dict(site)
+    >>> record['dnshost']['name']
+    u'test'
+    >>> record['database']['enabled']
+    False
+    """
+    record = {}
+
+    for component, attributes in SITE_FIELDS:
+        obj = getattr(site, component)
+        record[component] = dict(
+            [ (attr, getattr(obj, attr)) for attr in attributes ])
+
+    return record
+
+
+def site_from_dict(record):
+    """
+    Returns a new site object whose attributes are set from a dictionnary as
+    returned by site_to_dict. Missing attributes keep their default value.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> site = site_factory()
+    >>> site.dnshost.name = u'test'
+    >>> site.database.enabled = True
+    >>> copy = site_from_dict(site_to_dict(site))
+    >>> copy.dnshost.name, copy.database.enabled
+    (u'test', True)
+    """
+    site = site_factory()
+
+    for component, attributes in SITE_FIELDS:
+        values = record.get(component, {})
+        obj = getattr(site, component)
+
+        for attr in attributes:
+            if attr in values:
+                setattr(obj, attr, values[attr])
+
+    return site
+
+
+def site_to_tuple(site):
+    """
+    Returns site attributes values as a flat tuple following SITE_FIELDS
+    order. Useful to compare or hash sites.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> site_to_tuple(site_factory()) == site_to_tuple(site_factory())
+    True
+    """
+    values = []
+
+    for component, attributes in SITE_FIELDS:
+        obj = getattr(site, component)
+        values.extend([ getattr(obj, attr) for attr in attributes ])
+
+    return tuple(values)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
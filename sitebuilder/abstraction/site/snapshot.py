@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""
+Immutable site snapshots.
+
+Site objects carry event buses and validated zope fields, which makes them
+expensive to build and to copy. Backend drivers read paths return snapshots
+instead: slot based records holding the same attributes, that can't be
+modified and may thus be shared without being copied.
+
+A snapshot is promoted to a full mutable site object (see to_site) only
+when it has to be edited.
+"""
+
+from sitebuilder.abstraction.interface import IDNSHost, IRCSRepository
+from sitebuilder.abstraction.interface import IWebsite, IDatabase
+from sitebuilder.abstraction.interface import ISiteSnapshot
+from sitebuilder.abstraction.site.factory import site_factory
+from sitebuilder.abstraction.site.record import SITE_FIELDS
+from zope.interface import implements
+
+_FIELDS = dict(SITE_FIELDS)
+
+
+class Snapshot(object):
+    """
+    Base class for immutable snapshots. Subclasses define their attributes
+    as __slots__.
+
+    >>> host = DNSHostSnapshot(name=u'name0', domain=u'bpinet.com')
+    >>> host.name, host.done
+    (u'name0', None)
+    >>> host.name = u'name1'
+    Traceback (most recent call last):
+        ...
+    AttributeError: DNSHostSnapshot object is immutable
+    """
+    __slots__ = ()
+
+    def __init__(self, **values):
+        """
+        Snapshot initialization. Missing attributes are set to None.
+        """
+        for attr in self.__slots__:
+            object.__setattr__(self, attr, values.get(attr))
+
+    def __setattr__(self, name, value):
+        """
+        Snapshots can't be modified
+        """
+        raise AttributeError("%s object is immutable" % type(self).__name__)
+
+    def __delattr__(self, name):
+        """
+        Snapshots can't be modified
+        """
+        raise AttributeError("%s object is immutable" % type(self).__name__)
+
+    def __copy__(self):
+        """
+        Snapshots are immutable: copies are the snapshot itself
+        """
+        return self
+
+    def __deepcopy__(self, memo):
+        """
+        Snapshots are immutable: copies are the snapshot itself
+        """
+        return self
+
+    def __reduce__(self):
+        """
+        Pickling support
+        """
+        return (_build_snapshot, (type(self), self.get_values()))
+
+    def __repr__(self):
+        """
+        Returns snapshot representation
+        """
+        return "<%s %s>" % (type(self).__name__, " ".join(
+            [ "%s=%r" % (attr, getattr(self, attr)) for attr in self.__slots__
+              if not isinstance(getattr(self, attr), Snapshot) ]))
+
+    def get_values(self):
+        """
+        Returns snapshot attributes values as a dictionnary
+        """
+        return dict([ (attr, getattr(self, attr)) for attr in self.__slots__ ])
+
+    @classmethod
+    def from_tuple(cls, values):
+        """
+        Returns a snapshot from attributes values, in __slots__ order
+        """
+        snapshot = object.__new__(cls)
+
+        for attr, value in zip(cls.__slots__, values):
+            object.__setattr__(snapshot, attr, value)
+
+        return snapshot
+
+    @classmethod
+    def from_object(cls, obj):
+        """
+        Returns a snapshot of an object attributes
+        """
+        snapshot = object.__new__(cls)
+
+        for attr in cls.__slots__:
+            object.__setattr__(snapshot, attr, getattr(obj, attr))
+
+        return snapshot
+
+
+def _build_snapshot(cls, values):
+    """
+    Rebuilds a snapshot when unpickled
+    """
+    return cls(**values)
+
+
+class DNSHostSnapshot(Snapshot):
+    """
+    DNS configuration snapshot
+    """
+    implements(IDNSHost)
+    __slots__ = _FIELDS['dnshost']
+
+
+class RCSRepositorySnapshot(Snapshot):
+    """
+    RCS repository configuration snapshot
+    """
+    implements(IRCSRepository)
+    __slots__ = _FIELDS['repository']
+
+
+class WebsiteSnapshot(Snapshot):
+    """
+    Website configuration snapshot
+    """
+    implements(IWebsite)
+    __slots__ = _FIELDS['website']
+
+
+class DatabaseSnapshot(Snapshot):
+    """
+    Database configuration snapshot
+    """
+    implements(IDatabase)
+    __slots__ = _FIELDS['database']
+
+
+# Snapshot classes, by site component
+_COMPONENTS = (
+    ('dnshost', DNSHostSnapshot),
+    ('repository', RCSRepositorySnapshot),
+    ('website', WebsiteSnapshot),
+    ('database', DatabaseSnapshot),
+    )
+
+
+class SiteSnapshot(Snapshot):
+    """
+    Whole site configuration snapshot.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> site = site_factory()
+    >>> site.dnshost.name = u'name0'
+    >>> site.database.enabled = True
+    >>> snapshot = SiteSnapshot.from_site(site)
+    >>> snapshot.dnshost.name, snapshot.database.enabled
+    (u'name0', True)
+    >>> ISiteSnapshot.providedBy(snapshot)
+    True
+
+    Snapshots are promoted to new site objects to be edited
+
+    >>> copy = snapshot.to_site()
+    >>> copy.dnshost.name = u'name1'
+    >>> copy.dnshost.name, snapshot.dnshost.name
+    (u'name1', u'name0')
+
+    Snapshots may be rebuilt with some attributes changed
+
+    >>> renamed = snapshot.replace('dnshost', name=u'name2')
+    >>> renamed.dnshost.name, renamed.database is snapshot.database
+    (u'name2', True)
+
+    Snapshots carry the backend version of the site (see ISite.version)
+
+    >>> stamped = snapshot.stamp(3)
+    >>> stamped.version, stamped.to_site().version, snapshot.version
+    (3, 3, 0)
+    >>> import pickle
+    >>> copy = pickle.loads(pickle.dumps(stamped))
+    >>> copy.dnshost.name, copy.version
+    (u'name0', 3)
+    """
+    implements(ISiteSnapshot)
+    __slots__ = ('dnshost', 'repository', 'website', 'database', 'version')
+
+    @classmethod
+    def from_site(cls, site):
+        """
+        Returns a snapshot of a site object (or snapshot)
+        """
+        if isinstance(site, SiteSnapshot):
+            return site
+
+        snapshot = object.__new__(cls)
+
+        for component, klass in _COMPONENTS:
+            object.__setattr__(snapshot, component,
+                               klass.from_object(getattr(site, component)))
+
+        object.__setattr__(snapshot, 'version', getattr(site, 'version', 0))
+
+        return snapshot
+
+    @classmethod
+    def from_values(cls, values, version=0):
+        """
+        Returns a snapshot from a dictionnary of site components values
+        dictionnaries (see sitebuilder.abstraction.site.record.site_to_dict)
+        """
+        snapshot = object.__new__(cls)
+
+        for component, klass in _COMPONENTS:
+            object.__setattr__(snapshot, component,
+                               klass(**values.get(component, {})))
+
+        object.__setattr__(snapshot, 'version', version)
+
+        return snapshot
+
+    @classmethod
+    def from_tuple(cls, values, version=0):
+        """
+        Returns a snapshot from a flat tuple of site attributes values, in
+        SITE_FIELDS order (see sitebuilder.abstraction.site.record.site_to_tuple)
+
+        >>> from sitebuilder.abstraction.site.record import site_to_tuple
+        >>> site = site_factory()
+        >>> site.dnshost.name = u'name0'
+        >>> snapshot = SiteSnapshot.from_tuple(site_to_tuple(site))
+        >>> snapshot.dnshost.name, site_to_tuple(snapshot) == site_to_tuple(site)
+        (u'name0', True)
+        """
+        snapshot = object.__new__(cls)
+        start = 0
+
+        for component, klass in _COMPONENTS:
+            end = start + len(klass.__slots__)
+            object.__setattr__(snapshot, component,
+                               klass.from_tuple(values[start:end]))
+            start = end
+
+        object.__setattr__(snapshot, 'version', version)
+
+        return snapshot
+
+    def __reduce__(self):
+        """
+        Pickling support
+        """
+        return (_build_site_snapshot, (self.get_values(), self.version))
+
+    def get_values(self):
+        """
+        Returns site components values dictionnaries
+        """
+        return dict([ (component, getattr(self, component).get_values())
+                      for component, klass in _COMPONENTS ])
+
+    def replace(self, component, **values):
+        """
+        Returns a new snapshot, with some attributes of a component changed.
+        Other components are shared.
+        """
+        snapshot = object.__new__(type(self))
+
+        for name, klass in _COMPONENTS:
+            obj = getattr(self, name)
+
+            if name == component:
+                changed = obj.get_values()
+                changed.update(values)
+                obj = klass(**changed)
+
+            object.__setattr__(snapshot, name, obj)
+
+        object.__setattr__(snapshot, 'version', self.version)
+
+        return snapshot
+
+    def stamp(self, version):
+        """
+        Returns a new snapshot sharing this one components, with version
+        changed
+        """
+        snapshot = object.__new__(type(self))
+
+        for name, klass in _COMPONENTS:
+            object.__setattr__(snapshot, name, getattr(self, name))
+
+        object.__setattr__(snapshot, 'version', version)
+
+        return snapshot
+
+    def to_site(self):
+        """
+        Returns a new mutable site object holding snapshot values
+        """
+        site = site_factory()
+
+        for component, attributes in SITE_FIELDS:
+            source = getattr(self, component)
+            target = getattr(site, component)
+
+            for attr in attributes:
+                value = getattr(source, attr)
+
+                if value is not None:
+                    setattr(target, attr, value)
+
+        site.version = self.version
+
+        return site
+
+
+def _build_site_snapshot(values, version):
+    """
+    Rebuilds a site snapshot when unpickled
+    """
+    return SiteSnapshot.from_values(values, version)
+
+
+def get_mutable_site(site):
+    """
+    Returns a site object that may be edited: snapshots are promoted to new
+    site objects, other objects are returned as is.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> site = site_factory()
+    >>> get_mutable_site(site) is site
+    True
+    >>> ISiteSnapshot.providedBy(get_mutable_site(SiteSnapshot.from_site(site)))
+    False
+    """
+    if ISiteSnapshot.providedBy(site):
+        return site.to_site()
+
+    return site
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -4,11 +4,34 @@ This module contains application wide functions and settings
 """
 
 #from signal import signal, SIGTERM
+from sitebuilder.command.scheduler import PeriodicJob, add_periodic_job
+from sitebuilder.command.reconcile import ReconcileSites
+from sitebuilder.command.artifact import GenerateArtifacts, BuildZones
+from sitebuilder.generator.artifact import ArtifactGenerator
+from sitebuilder.generator.zone import ZoneBuilder
+from sitebuilder.command.queue import SQLiteQueue
+from sitebuilder.command.sink import JSONLinesFileSink, StreamLogSink
+from sitebuilder.command.store import HistoryStore, HistoryStoreSink
+from sitebuilder.utils.parameters import RECONCILE_INTERVAL, RECONCILE_JITTER
+from sitebuilder.utils.parameters import ARTIFACTS_INTERVAL, ARTIFACTS_JITTER
+from sitebuilder.utils.parameters import ZONES_INTERVAL, ZONES_JITTER
+from sitebuilder.utils.parameters import LOG_FILE, HISTORY_FILE
+from sitebuilder.utils.parameters import JOBS_LOCK_FILE
+from sitebuilder.utils.parameters import HISTORY_RETENTION
+from sitebuilder.utils.parameters import get_application_context
+from sitebuilder.utils.driver.registry import configure_driver
+from sitebuilder.utils.driver.registry import save_snapshot
+from sitebuilder.utils.lock import ProcessLock
+from sitebuilder.exception import BackendError
 import sitebuilder.command.scheduler
 import sitebuilder.command.log
 import sys
 import gobject
 
+# Lock of the periodic jobs writing shared files, which only run in the
+# process holding it
+_jobs_lock = ProcessLock(JOBS_LOCK_FILE)
+
 
 def sig_stop(signum, frame):
     """
@@ -18,20 +41,95 @@ def sig_stop(signum, frame):
     sys._exit()
 
 
-def init():
+def init(queue_file=None, log_file=LOG_FILE, history_file=HISTORY_FILE,
+         catalog_socket=None, reconcile_probe=None, artifacts_dir=None,
+         zones_dir=None):
     """
     Setup application wide locks
+
+    If queue_file is set, execution and log queues are stored in this SQLite
+    database file, so that other processes may feed the scheduler.
+
+    Logged commands are written as JSON lines into log_file. If log_file is
+    None, they are written on standard output.
+
+    Logged commands are also stored into the history_file database, unless
+    it is None. Expired records are purged at startup.
+
+    If catalog_socket is set, sites are read and written through the catalog
+    server listening on it (see sitebuilder.server), shared with other
+    processes.
+
+    If reconcile_probe is set, sites are periodically reconciled using this
+    probe (see sitebuilder.command.reconcile.ReconcileSites).
+
+    If artifacts_dir is set, sites configuration artifacts are periodically
+    generated in this directory (see
+    sitebuilder.command.artifact.GenerateArtifacts).
+
+    If zones_dir is set, DNS zone files are periodically built in this
+    directory (see sitebuilder.command.artifact.BuildZones).
+
+    Artifacts and zone files are periodically written by a single process,
+    holding the JOBS_LOCK_FILE lock: if it exits, an other one takes over.
     """
     # Registers signal handlers
     #signal(SIGTERM, sig_stop)
     gobject.threads_init()
+
+    if catalog_socket is not None:
+        configure_driver(get_application_context(), 'remote',
+                         path=catalog_socket)
+
+    if queue_file is not None:
+        sitebuilder.command.scheduler.set_exec_queue(
+            SQLiteQueue(queue_file, 'exec', consumer=True))
+        sitebuilder.command.log.set_log_queue(
+            SQLiteQueue(queue_file, 'log', with_state=True,
+                        consumer=True))
+
     sitebuilder.command.scheduler.start()
-    sitebuilder.command.log.start()
+
+    if log_file is not None:
+        sinks = [ JSONLinesFileSink(log_file) ]
+    else:
+        sinks = [ StreamLogSink() ]
+
+    if history_file is not None:
+        store = HistoryStore(history_file, HISTORY_RETENTION)
+        store.purge()
+        store.close()
+        sinks.append(HistoryStoreSink(store))
+
+    sitebuilder.command.log.start(sinks)
+
+    if reconcile_probe is not None:
+        add_periodic_job(PeriodicJob(lambda: ReconcileSites(reconcile_probe),
+                                     RECONCILE_INTERVAL, RECONCILE_JITTER))
+
+    if artifacts_dir is not None:
+        generator = ArtifactGenerator(artifacts_dir)
+        add_periodic_job(PeriodicJob(lambda: GenerateArtifacts(generator),
+                                     ARTIFACTS_INTERVAL, ARTIFACTS_JITTER,
+                                     _jobs_lock))
+
+    if zones_dir is not None:
+        builder = ZoneBuilder(zones_dir)
+        add_periodic_job(PeriodicJob(lambda: BuildZones(builder),
+                                     ZONES_INTERVAL, ZONES_JITTER,
+                                     _jobs_lock))
 
 
 def uninit():
     """
-    Leaves application
+    Leaves application. The catalog snapshot is written if outdated, so
+    that next startups map it (see sitebuilder.utils.driver.registry).
     """
     sitebuilder.command.scheduler.stop()
     sitebuilder.command.log.stop()
+    _jobs_lock.release()
+
+    try:
+        save_snapshot()
+    except (BackendError, EnvironmentError), e:
+        print >> sys.stderr, "Catalog snapshot not written: %s" % e
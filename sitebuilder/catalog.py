@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Site builder catalog is a command line interface used to import or export
+the sites catalog, as CSV or JSON lines files. It also writes catalog
+snapshots, memory mapped by the snapshot driver (see
+sitebuilder.utils.driver.mapped).
+
+Example: create the sites of a new platform, then backup the whole catalog
+
+    python -m sitebuilder.catalog import newplatform.csv
+    python -m sitebuilder.catalog export catalog.jsonl
+    python -m sitebuilder.catalog snapshot ~/.sitebuilder/sites.snap
+
+The ~/.sitebuilder/sites.snap snapshot is mapped by the application at
+startup, as long as it is up to date. The application writes it on exit.
+"""
+
+from sitebuilder.abstraction.site.bulk import import_sites, export_sites
+from sitebuilder.abstraction.site.bulk import FORMATS, FORMAT_CSV
+from sitebuilder.utils.driver.registry import get_backend_driver
+from sitebuilder.utils.driver.registry import configure_driver
+from sitebuilder.utils.driver.mapped import save_catalog
+from sitebuilder.utils.parameters import IMPORT_CHUNK_SIZE, CATALOG_SOCKET
+from sitebuilder.utils.parameters import get_application_context
+from sitebuilder.exception import SiteError, BackendError
+from argparse import ArgumentParser
+import sys
+
+
+def get_format(path, format=None):
+    """
+    Returns the format of a file: the given one, else the one matching its
+    extension, else CSV.
+
+    >>> get_format('sites.jsonl'), get_format('sites.txt', 'jsonl')
+    ('jsonl', 'jsonl')
+    >>> get_format('-')
+    'csv'
+    """
+    if format is None:
+        extension = path.rsplit('.', 1)[-1].lower()
+
+        if extension in FORMATS:
+            return extension
+
+        return FORMAT_CSV
+
+    return format
+
+
+def main(argv=None):
+    """
+    Command line main function
+    """
+    parser = ArgumentParser(description="Import or export the sites catalog")
+    parser.add_argument('action', choices=('import', 'export', 'snapshot'))
+    parser.add_argument('file', help="CSV or JSON lines file (- for stdin or "
+                        "stdout), or catalog snapshot file")
+    parser.add_argument('--format', choices=FORMATS,
+                        help="file format (default: file extension, or csv)")
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                        help="number of sites added or read at once "
+                        "(default: %(default)s)")
+    parser.add_argument('--keep-going', action='store_true',
+                        help="skip invalid records and existing sites "
+                        "instead of stopping")
+    parser.add_argument('--server', action='store_true',
+                        help="use the catalog of the running catalog server")
+    options = parser.parse_args(argv)
+
+    format = get_format(options.file, options.format)
+
+    if options.server:
+        configure_driver(get_application_context(), 'remote',
+                         path=CATALOG_SOCKET)
+
+    driver = get_backend_driver()
+
+    if options.action == 'snapshot':
+        count = save_catalog(driver, options.file)
+        print >> sys.stderr, "%d sites written" % count
+        return 0
+
+    if options.action == 'export':
+        if options.file == '-':
+            count = export_sites(driver, sys.stdout, format,
+                                 options.chunk_size)
+        else:
+            with open(options.file, 'wb') as stream:
+                count = export_sites(driver, stream, format,
+                                     options.chunk_size)
+
+        print >> sys.stderr, "%d sites exported" % count
+        return 0
+
+    errors = None
+
+    if options.keep_going:
+        errors = []
+
+    try:
+        if options.file == '-':
+            count = import_sites(driver, sys.stdin, format,
+                                 options.chunk_size, errors)
+        else:
+            with open(options.file, 'rb') as stream:
+                count = import_sites(driver, stream, format,
+                                     options.chunk_size, errors)
+    except (SiteError, BackendError), e:
+        print >> sys.stderr, "Import failed: %s" % e
+        print >> sys.stderr, "%d sites imported before the failure" % \
+            e.imported
+
+        if errors is None:
+            print >> sys.stderr, "Run again with --keep-going to skip them"
+
+        return 1
+
+    for num, mesg in errors or ():
+        print >> sys.stderr, "Line %d skipped: %s" % (num, mesg)
+
+    print >> sys.stderr, "%d sites imported" % count
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Configuration artifacts and DNS zones related commands (see
+sitebuilder.generator.artifact and sitebuilder.generator.zone).
+"""
+
+from sitebuilder.command.interface import ICommand, ICommandLogged
+from sitebuilder.command.base import BaseCommand
+from sitebuilder.generator.artifact import ArtifactGenerator
+from sitebuilder.generator.zone import ZoneBuilder
+from zope.interface import implements
+from threading import Lock
+
+_generator = None
+_builder = None
+_lock = Lock()
+
+
+def get_artifact_generator():
+    """
+    Returns the module level artifacts generator, writing artifacts in
+    ARTIFACTS_DIR. It is built on first use.
+    """
+    global _generator
+
+    with _lock:
+        if _generator is None:
+            _generator = ArtifactGenerator()
+
+    return _generator
+
+
+def get_zone_builder():
+    """
+    Returns the module level zones builder, writing zone files in
+    ZONES_DIR. It is built on first use.
+    """
+    global _builder
+
+    with _lock:
+        if _builder is None:
+            _builder = ZoneBuilder()
+
+    return _builder
+
+
+class GenerateArtifacts(BaseCommand):
+    """
+    Renders the configuration artifacts of the sites changed since the
+    previous pass.
+
+    Result is set to the (written, removed) tuple of the lists of the
+    changed artifacts paths.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> command = GenerateArtifacts(ArtifactGenerator(directory))
+    >>> command.execute(TestBackendDriver)
+    >>> len(command.result[0]) > 0
+    True
+    >>> command = GenerateArtifacts(command.generator)
+    >>> command.execute(TestBackendDriver)
+    >>> command.mesg
+    '0 artifacts written, 0 removed'
+    >>> rmtree(directory)
+    """
+    implements(ICommand, ICommandLogged)
+
+    description = "Generate artifacts"
+
+    def __init__(self, generator=None):
+        """
+        Command initialization.
+
+        Parameters:
+            generator   Artifacts generator (module level generator by
+                        default)
+        """
+        BaseCommand.__init__(self)
+
+        if generator is None:
+            generator = get_artifact_generator()
+
+        self.generator = generator
+
+    def execute(self, driver):
+        """
+        Executes command
+        """
+        written, removed = self.generator.update(driver)
+
+        self.result = (written, removed)
+        self.mesg = "%d artifacts written, %d removed" % (len(written),
+                                                          len(removed))
+
+
+class BuildZones(BaseCommand):
+    """
+    Builds the DNS zone files of the domains whose hosts changed since the
+    previous pass.
+
+    Result is set to the list of the (domain, serial) tuples of the
+    replaced zone files.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> command = BuildZones(ZoneBuilder(directory))
+    >>> command.execute(TestBackendDriver)
+    >>> len(command.result) > 0
+    True
+    >>> command = BuildZones(command.builder)
+    >>> command.execute(TestBackendDriver)
+    >>> command.mesg
+    '0 zones updated'
+    >>> rmtree(directory)
+    """
+    implements(ICommand, ICommandLogged)
+
+    description = "Build zones"
+
+    def __init__(self, builder=None):
+        """
+        Command initialization.
+
+        Parameters:
+            builder     Zones builder (module level builder by default)
+        """
+        BaseCommand.__init__(self)
+
+        if builder is None:
+            builder = get_zone_builder()
+
+        self.builder = builder
+
+    def execute(self, driver):
+        """
+        Executes command
+        """
+        self.result = [ (domain, serial)
+                        for domain, changed, serial, count
+                        in self.builder.update(driver) if changed ]
+        self.mesg = "%d zones updated" % len(self.result)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -21,11 +21,16 @@ class BaseCommand(object):
     """
     implements(ICommand, IEventBroker)
 
+    description = ""
     status = FieldProperty(ICommand['status'])
     return_code = FieldProperty(ICommand['return_code'])
     mesg = None
     result = None
     exception = None
+    traceback = None
+    enqueued = None
+    started = None
+    finished = None
 
     def __init__(self):
         self.state = COMMAND_PENDING
@@ -49,3 +54,35 @@ class BaseCommand(object):
         Releases execution lock
         """
         self._lock.set()
+
+    def get_target(self):
+        """
+        Returns the name of the site (or site filter) the command applies
+        to, or None.
+        """
+        site = getattr(self, 'site', None)
+
+        if site is not None:
+            return u"%s.%s" % (site.dnshost.name, site.dnshost.domain)
+
+        name = getattr(self, 'name', None)
+        domain = getattr(self, 'domain', None)
+
+        if name is not None and domain is not None:
+            return u"%s.%s" % (name, domain)
+
+        return None
+
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters as a dictionnary of
+        plain values, used to rebuild the command in an other process.
+        """
+        return {}
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """
+        Builds a command from parameters returned by get_parameters
+        """
+        return cls(**parameters)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+In memory history of executed commands
+"""
+
+from sitebuilder.command.interface import COMMAND_SUCCESS
+from collections import deque
+
+
+class CommandSummary(object):
+    """
+    Compact record of an executed command, kept in place of the command
+    object itself once the command is old enough.
+
+    It exposes the command attributes used to display logs, but holds no
+    reference to the command site object, exception or traceback.
+
+    >>> from sitebuilder.command.site import DeleteSite
+    >>> command = DeleteSite('name0', 'bpinet.com')
+    >>> command.status = COMMAND_SUCCESS
+    >>> command.mesg = 'Site name0.bpinet.com successfully deleted'
+    >>> summary = CommandSummary(command)
+    >>> summary.description, summary.target, summary.status == COMMAND_SUCCESS
+    ('Delete site', u'name0.bpinet.com', True)
+    >>> summary.traceback is None
+    True
+    """
+    __slots__ = ('description', 'target', 'status', 'mesg', 'exception',
+                 'traceback', 'finished')
+
+    def __init__(self, command):
+        """
+        Summary initialization
+        """
+        self.description = command.description
+        self.target = command.get_target()
+        self.status = command.status
+        self.mesg = command.mesg
+        self.finished = command.finished
+        self.traceback = None
+
+        if command.exception is not None:
+            self.exception = u"%s" % command.exception
+        else:
+            self.exception = None
+
+
+class CommandHistory(object):
+    """
+    Capacity bounded history of executed commands.
+
+    Only the detail_capacity most recent entries are kept as full command
+    objects. Older ones are reduced to CommandSummary records, and entries
+    over capacity are evicted, oldest first.
+
+    append returns what changed so that views may be updated incrementally.
+
+    >>> from sitebuilder.command.base import BaseCommand
+    >>> history = CommandHistory(capacity=3, detail_capacity=2)
+    >>> history.append(BaseCommand())
+    (0, None)
+    >>> history.append(BaseCommand())
+    (0, None)
+
+    Third entry pushes the first one out of the detailed entries
+
+    >>> history.append(BaseCommand())
+    (0, 0)
+    >>> isinstance(history[0], CommandSummary), len(history)
+    (True, 3)
+
+    Fourth entry evicts the first one
+
+    >>> history.append(BaseCommand())
+    (1, 0)
+    >>> [ isinstance(entry, CommandSummary) for entry in history ]
+    [True, False, False]
+    >>> history.clear()
+    >>> len(history)
+    0
+    """
+
+    def __init__(self, capacity=1000, detail_capacity=50):
+        """
+        History initialization.
+
+        Parameters:
+            capacity        Maximum number of entries kept
+            detail_capacity Number of most recent entries kept as full
+                            command objects
+        """
+        if capacity <= 0 or detail_capacity < 0:
+            raise AttributeError("capacities should be positive numbers")
+
+        self.capacity = capacity
+        self.detail_capacity = min(detail_capacity, capacity)
+        self._entries = deque()
+
+    def __len__(self):
+        """
+        Returns the number of entries
+        """
+        return len(self._entries)
+
+    def __iter__(self):
+        """
+        Iterates over entries, oldest first
+        """
+        return iter(self._entries)
+
+    def __getitem__(self, index):
+        """
+        Returns an entry using its index, oldest first
+        """
+        return self._entries[index]
+
+    def append(self, command):
+        """
+        Appends a command to the history.
+
+        Returns an (evicted, demoted) tuple, where evicted is the number of
+        entries removed from the head of the history, and demoted the index
+        (after append) of the entry reduced to a summary, or None.
+        """
+        entries = self._entries
+        evicted = 0
+
+        while len(entries) >= self.capacity:
+            entries.popleft()
+            evicted += 1
+
+        entries.append(command)
+        demoted = None
+        index = len(entries) - self.detail_capacity - 1
+
+        if index >= 0 and not isinstance(entries[index], CommandSummary):
+            entries[index] = CommandSummary(entries[index])
+            demoted = index
+
+        return evicted, demoted
+
+    def clear(self):
+        """
+        Removes all entries
+        """
+        self._entries.clear()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
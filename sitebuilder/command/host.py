@@ -5,6 +5,10 @@ DNSHost objects related commands
 
 from sitebuilder.command.interface import ICommand
 from sitebuilder.command.base import BaseCommand
+from sitebuilder.utils.driver.index import get_host_cursor, get_cursor
+from sitebuilder.utils.driver.index import SORT_DOMAIN, SORT_ORDERS
+from sitebuilder.utils.driver.index import get_wildcard_re
+from sitebuilder.utils.driver.changes import merge_changes, CHANGE_DELETE
 from threading import Event
 from zope.interface import implements
 import re
@@ -12,23 +16,62 @@ import re
 
 class LookupHostByName(BaseCommand):
     """
-    Looks for a host using its name and domain
+    Looks for a host using its name and domain.
+
+    Results may be paginated: when a full page of hosts is returned, the
+    cursor attribute is set to the cursor of the last host, to be passed as
+    after parameter to look for the next page. Otherwise it is None.
+
+    If fields are given, result is a list of tuples of these dnshost fields
+    values instead of host objects. Fields must include name and domain.
+
+    The version attribute is set to the driver change version read before
+    the lookup: later changes may be applied using GetHostChanges.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> command = LookupHostByName(u'*', u'*', limit=4)
+    >>> command.execute(TestBackendDriver)
+    >>> len(command.result), command.cursor
+    (4, (u'bpinet.com', u'name3'))
+    >>> command = LookupHostByName(u'*', u'*', limit=4, after=command.cursor)
+    >>> command.execute(TestBackendDriver)
+    >>> [ host.name for host in command.result ]
+    [u'name4', u'name5', u'name6', u'name7']
+    >>> sorted(command.get_parameters().keys())
+    ['after', 'domain', 'limit', 'name']
+    >>> command = LookupHostByName(u'name1*', u'*', fields=('name', 'domain'))
+    >>> command.execute(TestBackendDriver)
+    >>> command.result
+    [(u'name1', u'bpinet.com')]
     """
     implements(ICommand)
 
     description = "Host lookup by name"
     name = ""
     domain = ""
+    limit = None
+    offset = 0
+    after = None
+    sort = SORT_DOMAIN
+    fields = None
+    cursor = None
+    version = None
     name_re = re.compile(r"^[\w\d\*_-]+$")
     domain_re = re.compile(r"^[\w\d\*\._-]+$")
 
-    def __init__(self, name, domain):
+    def __init__(self, name, domain, limit=None, offset=0, after=None,
+                 sort=SORT_DOMAIN, fields=None):
         """
         Command initialization.
 
         Parameters:
             name    Host name (may use wilcards characher *)
             domain  Domain name (may use wilcards characher *)
+            limit   Maximum number of hosts returned (None for no limit)
+            offset  Number of hosts skipped
+            after   Cursor of the last host of the previous page
+            sort    Sort order (see sitebuilder.utils.driver.index)
+            fields  dnshost fields returned (None for host objects)
         """
         BaseCommand.__init__(self)
 
@@ -37,9 +80,22 @@ class LookupHostByName(BaseCommand):
             raise AttributeError("Invalid host name. Should match /^[\w\d\*_-]+$/")
         if not self.domain_re.match(domain):
             raise AttributeError("Invalid domain name. Should match /^^[\w\d\*\._-]+$/")
+        if not sort in SORT_ORDERS:
+            raise AttributeError("Invalid sort order %s" % sort)
+        if fields is not None and not ('name' in fields and 'domain' in fields):
+            raise AttributeError("Fields should include name and domain")
 
         self.name = name
         self.domain = domain
+        self.limit = limit
+        self.offset = offset
+        self.sort = sort
+
+        # Cursors and fields are lists once serialized
+        if after is not None:
+            self.after = tuple(after)
+        if fields is not None:
+            self.fields = tuple(fields)
         self.executed = Event()
 
     def execute(self, driver):
@@ -47,5 +103,246 @@ class LookupHostByName(BaseCommand):
         Looks for an host by host and domain name. Result is set a list of
         DNSHost objects.
         """
-        result = driver.lookup_host_by_name(self.name, self.domain)
+        self.version = driver.get_version()
+
+        if self.fields is None:
+            result = driver.lookup_host_by_name(self.name, self.domain,
+                                                self.limit, self.offset,
+                                                self.after, self.sort)
+        else:
+            result = driver.lookup_host_fields(self.name, self.domain,
+                                               self.fields, self.limit,
+                                               self.offset, self.after,
+                                               self.sort)
+
+        if not self.limit or len(result) < self.limit:
+            self.cursor = None
+        elif self.fields is None:
+            self.cursor = get_host_cursor(result[-1], self.sort)
+        else:
+            last = result[-1]
+            self.cursor = get_cursor(last[self.fields.index('name')],
+                                     last[self.fields.index('domain')],
+                                     self.sort)
+
         self.result = result
+
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        parameters = {'name': self.name, 'domain': self.domain}
+
+        # Pagination parameters are only given when set
+        for attr, default in (('limit', None), ('offset', 0), ('after', None),
+                              ('sort', SORT_DOMAIN), ('fields', None)):
+            value = getattr(self, attr)
+
+            if value != default:
+                parameters[attr] = value
+
+        return parameters
+
+
+class SearchHostDescription(BaseCommand):
+    """
+    Looks for the hosts whose description holds all the words of a query.
+    Words ending with * are prefixes: u'market* blog' matches u'Marketing
+    team blog'.
+
+    Results are ordered by domain then name, and may be paginated like
+    LookupHostByName ones (see its cursor and fields attributes).
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> command = SearchHostDescription(u'desc name6*', limit=1,
+    ...                                 fields=('name', 'domain'))
+    >>> command.execute(TestBackendDriver)
+    >>> command.result, command.cursor
+    ([(u'name6', u'bpinet.com')], (u'bpinet.com', u'name6'))
+    >>> command = SearchHostDescription(u'desc name6*', after=command.cursor)
+    >>> command.execute(TestBackendDriver)
+    >>> command.result, command.cursor
+    ([], None)
+    """
+    implements(ICommand)
+
+    description = "Host description search"
+    query = u""
+    limit = None
+    after = None
+    fields = None
+    cursor = None
+    version = None
+
+    def __init__(self, query, limit=None, after=None, fields=None):
+        """
+        Command initialization.
+
+        Parameters:
+            query   Words descriptions should hold (see
+                    sitebuilder.utils.driver.text.parse_query)
+            limit   Maximum number of hosts returned (None for no limit)
+            after   Cursor of the last host of the previous page
+            fields  dnshost fields returned (None for host objects)
+        """
+        BaseCommand.__init__(self)
+
+        if not query.strip():
+            raise AttributeError("Empty description query")
+        if fields is not None and not ('name' in fields and 'domain' in fields):
+            raise AttributeError("Fields should include name and domain")
+
+        self.query = query
+        self.limit = limit
+
+        # Cursors and fields are lists once serialized
+        if after is not None:
+            self.after = tuple(after)
+        if fields is not None:
+            self.fields = tuple(fields)
+
+    def execute(self, driver):
+        """
+        Searches hosts descriptions. Result is set to a list of DNSHost
+        objects, or of fields values tuples.
+        """
+        self.version = driver.get_version()
+        hosts = driver.search_descriptions(self.query, self.limit,
+                                           self.after)
+
+        if not self.limit or len(hosts) < self.limit:
+            self.cursor = None
+        else:
+            self.cursor = get_host_cursor(hosts[-1])
+
+        if self.fields is None:
+            self.result = hosts
+        else:
+            self.result = [ tuple([ getattr(host, field)
+                                    for field in self.fields ])
+                            for host in hosts ]
+
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        parameters = {'query': self.query}
+
+        # Pagination parameters are only given when set
+        for attr in ('limit', 'after', 'fields'):
+            value = getattr(self, attr)
+
+            if value is not None:
+                parameters[attr] = value
+
+        return parameters
+
+
+class GetHostChanges(BaseCommand):
+    """
+    Looks for the hosts changed since a driver change version, among the
+    hosts matching name and domain patterns.
+
+    Result is None if the driver no longer knows all the changes since
+    version: hosts have to be looked up again. Otherwise, it is a (deleted,
+    hosts) tuple: the (name, domain) tuples of deleted hosts, and the
+    current hosts inserted or updated (fields values tuples if fields are
+    given, like LookupHostByName). The current attribute is set to the
+    driver change version the result is up to date with.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> version = TestBackendDriver.get_version()
+    >>> site = TestBackendDriver.get_site_by_name(u'name3', u'bpinet.com')
+    >>> TestBackendDriver.update_site(site)
+    >>> command = GetHostChanges(version, u'name*', u'*', ('name', 'domain'))
+    >>> command.execute(TestBackendDriver)
+    >>> command.result, command.current == version + 1
+    (([], [(u'name3', u'bpinet.com')]), True)
+    >>> command = GetHostChanges(version, u'other*', u'*')
+    >>> command.execute(TestBackendDriver)
+    >>> command.result
+    ([], [])
+    """
+    implements(ICommand)
+
+    description = "Host changes lookup"
+    version = 0
+    name = ""
+    domain = ""
+    fields = None
+    current = None
+    name_re = LookupHostByName.name_re
+    domain_re = LookupHostByName.domain_re
+
+    def __init__(self, version, name, domain, fields=None):
+        """
+        Command initialization.
+
+        Parameters:
+            version Driver change version hosts were looked up at
+            name    Host name (may use wilcards characher *)
+            domain  Domain name (may use wilcards characher *)
+            fields  dnshost fields returned (None for host objects)
+        """
+        BaseCommand.__init__(self)
+
+        if not self.name_re.match(name):
+            raise AttributeError("Invalid host name. Should match /^[\w\d\*_-]+$/")
+        if not self.domain_re.match(domain):
+            raise AttributeError("Invalid domain name. Should match /^^[\w\d\*\._-]+$/")
+
+        self.version = version
+        self.name = name
+        self.domain = domain
+
+        if fields is not None:
+            self.fields = tuple(fields)
+
+    def execute(self, driver):
+        """
+        Reads driver changes, and looks for the changed hosts matching name
+        and domain patterns
+        """
+        self.current, changes = driver.changes_since(self.version)
+
+        if changes is None:
+            self.result = None
+            return
+
+        match_name = get_wildcard_re(self.name.lower()).match
+        match_domain = get_wildcard_re(self.domain.lower()).match
+        deleted = []
+        hosts = []
+
+        for kind, name, domain in merge_changes(changes):
+            if not match_name(name.lower()) or not match_domain(domain.lower()):
+                continue
+
+            if kind == CHANGE_DELETE:
+                deleted.append((name, domain))
+                continue
+
+            if self.fields is None:
+                found = driver.lookup_host_by_name(name, domain)
+            else:
+                found = driver.lookup_host_fields(name, domain, self.fields)
+
+            # Hosts may have been deleted since
+            if len(found):
+                hosts.extend(found)
+            else:
+                deleted.append((name, domain))
+
+        self.result = (deleted, hosts)
+
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        return {'version': self.version, 'name': self.name,
+                'domain': self.domain, 'fields': self.fields}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
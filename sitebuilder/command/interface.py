@@ -12,6 +12,14 @@ COMMAND_RUNNING = 1
 COMMAND_SUCCESS = 2
 COMMAND_ERROR   = 3
 
+# Command status names, used in logs
+COMMAND_STATUS_NAMES = {
+    COMMAND_PENDING: u'pending',
+    COMMAND_RUNNING: u'running',
+    COMMAND_SUCCESS: u'success',
+    COMMAND_ERROR: u'error',
+    }
+
 
 class ICommand(Interface):
     """
@@ -39,6 +47,11 @@ class ICommand(Interface):
     # Error message is error occured
     traceback = Attribute(u"Exception traceback")
 
+    # Execution timestamps (seconds since epoch, None if not reached yet)
+    enqueued = Attribute(u"Time the command was enqueued")
+    started = Attribute(u"Time the command execution started")
+    finished = Attribute(u"Time the command execution finished")
+
     def execute(driver):
         """
         Executes the specific command actions using a backend driver.
@@ -58,9 +71,37 @@ class ICommand(Interface):
         Releases a locked command
         """
 
+    def get_target():
+        """
+        Returns the name of the site (or site filter) the command applies
+        to, or None.
+        """
+
 
 class ICommandLogged(Interface):
     """
     Marker interface a command should implement for its result to be logged
     in log subsystem
     """
+
+
+class ILogSink(Interface):
+    """
+    Log sinks receive a record (a dictionnary of plain values) for each
+    logged command. See sitebuilder.command.sink.get_command_record.
+    """
+
+    def write(record):
+        """
+        Writes (or buffers) a log record
+        """
+
+    def flush():
+        """
+        Writes buffered records
+        """
+
+    def close():
+        """
+        Flushes buffered records and releases sink resources
+        """
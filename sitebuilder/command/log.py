@@ -4,13 +4,13 @@ Log manager classes
 """
 
 from sitebuilder.observer.command import ICommandObserver
-from sitebuilder.command.interface import ICommand
-from sitebuilder.command.interface import COMMAND_SUCCESS, COMMAND_ERROR
+from sitebuilder.command.interface import ICommand, ILogSink
+from sitebuilder.command.sink import StreamLogSink, get_command_record
+from sitebuilder.utils.parameters import QUEUE_BATCH_SIZE
 from zope.interface import implements
 from Queue import Queue, Empty
 from warnings import warn
 from threading import Thread, Event
-import sys
 
 # Module level log queue
 log_queue = Queue()
@@ -18,14 +18,17 @@ thread_stop = Event()
 logger = None
 
 
-def start():
+def start(sinks=None):
     """
-    Initialises logger instance and start threads
+    Initialises logger instance and start threads.
+
+    Logged commands records are written to sinks (a list of ILogSink
+    objects). By default, records are written on standard output.
     """
     global logger
 
     if logger is None:
-        logger = LogManager()
+        logger = LogManager(sinks)
         logger.start()
     else:
         warn("'start' called on an already initialized instance")
@@ -35,8 +38,28 @@ def stop():
     """
     Stops logger instances
     """
+    global logger
+
     thread_stop.set()
 
+    if logger is not None:
+        logger.join()
+        logger = None
+
+
+def set_log_queue(queue):
+    """
+    Replaces the log queue by an other Queue compatible object (for instance
+    a durable SQLiteQueue keeping commands state). Should be called before
+    start.
+    """
+    global log_queue
+
+    if logger is not None:
+        warn("log queue replaced while logger is running")
+
+    log_queue = queue
+
 
 def enqueue_command(command):
     """
@@ -61,29 +84,53 @@ class LogManager(Thread):
 
     name = "LogManager"
 
-    def __init__(self):
+    def __init__(self, sinks=None):
         """
         Logger initialization
         """
         Thread.__init__(self)
 
+        if sinks is None:
+            sinks = [ StreamLogSink() ]
+
+        for sink in sinks:
+            if not ILogSink.providedBy(sink):
+                raise AttributeError("sinks should implement ILogSink")
+
+        self.sinks = list(sinks)
+
     def run(self):
         """
         Continuously loops on commands and log messages
         """
+        # Queues supporting batches are read one batch at a time
+        batched = hasattr(log_queue, 'get_batch')
+
         while not thread_stop.is_set():
             try:
-                command = log_queue.get(timeout=0.1)
+                if batched:
+                    commands = log_queue.get_batch(QUEUE_BATCH_SIZE,
+                                                   timeout=0.1)
+                else:
+                    commands = [ log_queue.get(timeout=0.1) ]
             except Empty:
                 continue
 
-            if command.status == COMMAND_SUCCESS:
-                print "%s: success: %s" % (str(type(command)), command.result)
-            elif command.status == COMMAND_ERROR:
-                print "%s: error: %s" % (str(type(command)), command.mesg)
-            else:
-                print "Unknown command status: %s" % command.status
+            for command in commands:
+                record = get_command_record(command)
+
+                for sink in self.sinks:
+                    try:
+                        sink.write(record)
+                    except Exception, e:
+                        warn("log sink %s failed: %s" % (sink, e))
 
-            sys.stdout.flush()
-            log_queue.task_done()
+                log_queue.task_done()
         # End while
+
+        for sink in self.sinks:
+            sink.close()
+
+        # Deletes acknowledged commands from durable queues
+        if hasattr(log_queue, 'flush'):
+            log_queue.flush()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Provisioning related commands (see sitebuilder.provision.database).
+"""
+
+from sitebuilder.command.interface import ICommand, ICommandLogged
+from sitebuilder.command.base import BaseCommand
+from sitebuilder.provision.database import DatabaseProvisioner
+from zope.interface import implements
+from threading import Lock
+
+_provisioner = None
+_lock = Lock()
+
+
+def get_database_provisioner():
+    """
+    Returns the module level databases provisioner, using DATABASE_SERVERS.
+    It is built on first use, so that its connections are reused by all the
+    commands.
+    """
+    global _provisioner
+
+    with _lock:
+        if _provisioner is None:
+            _provisioner = DatabaseProvisioner()
+
+    return _provisioner
+
+
+class ProvisionDatabases(BaseCommand):
+    """
+    Provisions the databases of the sites whose database is enabled but not
+    done yet, and marks them as done.
+
+    Result is set to the (done, failed) tuple of the lists of provisioned
+    sites (name, domain) tuples, and of failed sites (name, domain, error
+    message) tuples.
+
+    >>> from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+    >>> from sitebuilder.provision.adapter import SQLiteAdapter
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> import os
+    >>> directory = mkdtemp()
+    >>> driver = MemoryBackendDriver()
+    >>> driver.add_sites([ SiteSnapshot.from_site(get_test_site(
+    ...     u'name%d' % num)).replace('database', done=False)
+    ...     for num in range(3) ])
+    >>> adapter = SQLiteAdapter(os.path.join(directory, 'server.db'))
+    >>> command = ProvisionDatabases(DatabaseProvisioner({u'mysql': adapter}))
+    >>> command.execute(driver)
+    >>> command.mesg
+    '3 databases provisioned, 0 failed'
+    >>> command.result[0][0]
+    (u'name0', u'bpinet.com')
+    >>> command = ProvisionDatabases(command.provisioner)
+    >>> command.execute(driver)
+    >>> command.mesg
+    '0 databases provisioned, 0 failed'
+    >>> command.provisioner.close()
+    >>> rmtree(directory)
+    """
+    implements(ICommand, ICommandLogged)
+
+    description = "Provision databases"
+
+    def __init__(self, provisioner=None):
+        """
+        Command initialization.
+
+        Parameters:
+            provisioner     Databases provisioner (module level provisioner
+                            by default)
+        """
+        BaseCommand.__init__(self)
+
+        if provisioner is None:
+            provisioner = get_database_provisioner()
+
+        self.provisioner = provisioner
+
+    def execute(self, driver):
+        """
+        Executes command
+        """
+        done, failed = self.provisioner.run(driver)
+
+        self.result = (
+            [ (site.dnshost.name, site.dnshost.domain) for site in done ],
+            [ (site.dnshost.name, site.dnshost.domain, str(e))
+              for site, e in failed ])
+        self.mesg = "%d databases provisioned, %d failed" % (len(done),
+                                                             len(failed))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,759 @@
+#!/usr/bin/env python
+"""
+Durable command queues.
+
+SQLiteQueue is a Queue compatible command queue stored in a local SQLite
+database file. It may be used as scheduler exec_queue or as logger log_queue.
+Several processes may feed and consume the same queue file (for instance a
+command line bulk import and several GUIs).
+
+Commands are not pickled: they are stored as their class path and their
+initialization parameters (see BaseCommand.get_parameters). Commands put by
+a consumer are only handed to this consumer, as the original live objects,
+so that their event bus subscribers are still notified. Commands put by
+processes that don't consume the queue are handed to any consumer.
+
+Each consumer is identified by a token, and keeps a heartbeat in the queue
+file. Commands are leased by a consumer (the lease records its token and
+time) until acknowledged. Leases of consumers whose heartbeat is older than
+QUEUE_LEASE_TIMEOUT (after a crash for instance) expire: their commands are
+made available again. Commands put by such consumers are handed to any
+consumer.
+"""
+
+from sitebuilder.command.interface import ICommand
+from sitebuilder.exception import CommandError
+from sitebuilder.utils.parameters import QUEUE_BATCH_SIZE
+from sitebuilder.utils.parameters import QUEUE_LEASE_TIMEOUT
+from sitebuilder.utils.parameters import QUEUE_HEARTBEAT_INTERVAL
+from Queue import Empty, Full
+from threading import local, Lock, Event, Thread
+from collections import deque
+from warnings import warn
+from time import time, sleep
+from uuid import uuid4
+import socket
+import sqlite3
+import json
+import os
+
+# Schema statements, by schema version (see PRAGMA user_version)
+_SCHEMA = (
+    (1, (
+        "CREATE TABLE IF NOT EXISTS command_queue (\n"
+        "    id INTEGER PRIMARY KEY AUTOINCREMENT,\n"
+        "    queue TEXT NOT NULL,\n"
+        "    command TEXT NOT NULL,\n"
+        "    parameters TEXT NOT NULL,\n"
+        "    state TEXT,\n"
+        "    leased INTEGER NOT NULL DEFAULT 0,\n"
+        "    created REAL NOT NULL\n"
+        ")",
+        "CREATE INDEX IF NOT EXISTS command_queue_pending\n"
+        "    ON command_queue (queue, leased, id)",
+        )),
+    (2, (
+        "ALTER TABLE command_queue ADD COLUMN producer TEXT",
+        "ALTER TABLE command_queue ADD COLUMN owner TEXT",
+        "ALTER TABLE command_queue ADD COLUMN leased_at REAL",
+        "CREATE TABLE IF NOT EXISTS queue_consumer (\n"
+        "    token TEXT PRIMARY KEY,\n"
+        "    heartbeat REAL NOT NULL\n"
+        ")",
+        )),
+    )
+
+# Filter of the commands a consumer may lease: commands put by itself, by
+# a process that doesn't consume the queue, or by an expired consumer
+_LEASABLE = ("queue = ? AND leased = 0 AND (producer IS NULL "
+             "OR producer = ? OR producer NOT IN "
+             "(SELECT token FROM queue_consumer WHERE heartbeat >= ?))")
+
+# Maximum number of SQL variables used in a single statement
+_MAX_VARIABLES = 500
+
+
+def serialize_command(command, with_state=False):
+    """
+    Returns a (class path, parameters, state) tuple describing a command.
+    Parameters and state are compact JSON strings. State is None unless
+    with_state is True.
+
+    >>> from sitebuilder.command.host import LookupHostByName
+    >>> serialize_command(LookupHostByName('name*', '*'))
+    ('sitebuilder.command.host.LookupHostByName', '{"domain":"*","name":"name*"}', None)
+    """
+    klass = type(command)
+    path = "%s.%s" % (klass.__module__, klass.__name__)
+    parameters = json.dumps(command.get_parameters(), sort_keys=True,
+                            separators=(',', ':'))
+    state = None
+
+    if with_state:
+        exception = command.exception
+
+        if exception is not None:
+            exception = u"%s" % exception
+
+        state = json.dumps({
+            'status': command.status,
+            'return_code': command.return_code,
+            'mesg': command.mesg,
+            'exception': exception,
+            'traceback': command.traceback,
+            'enqueued': command.enqueued,
+            'started': command.started,
+            'finished': command.finished,
+            }, sort_keys=True, separators=(',', ':'))
+
+    return path, parameters, state
+
+
+def unserialize_command(path, parameters, state=None):
+    """
+    Builds a command from a description returned by serialize_command.
+
+    Only command classes from sitebuilder package may be loaded.
+
+    >>> path, parameters, state = serialize_command(
+    ...     _test_command(), with_state=True)
+    >>> command = unserialize_command(path, parameters, state)
+    >>> command.name, command.status, str(command.exception)
+    (u'name0', 3, 'Unknown site')
+    >>> unserialize_command('os.path.join', '{}')
+    Traceback (most recent call last):
+        ...
+    CommandError: Refusing to load command class os.path.join
+    """
+    module_name, class_name = path.rsplit('.', 1)
+
+    if not module_name.startswith('sitebuilder.'):
+        raise CommandError("Refusing to load command class %s" % path)
+
+    module = __import__(module_name, fromlist=[class_name])
+    klass = getattr(module, class_name, None)
+
+    if klass is None or not ICommand.implementedBy(klass):
+        raise CommandError("%s is not a command class" % path)
+
+    command = klass.from_parameters(json.loads(parameters))
+
+    if state is not None:
+        state = json.loads(state)
+        command.status = state['status']
+        command.return_code = state['return_code']
+        command.mesg = state['mesg']
+        command.traceback = state['traceback']
+        command.enqueued = state['enqueued']
+        command.started = state['started']
+        command.finished = state['finished']
+
+        if state['exception'] is not None:
+            command.exception = CommandError(state['exception'])
+
+    return command
+
+
+def get_consumer_token():
+    """
+    Returns a new token identifying a queue consumer: host name, process id
+    and a random part, as a process may open several queues.
+
+    >>> token = get_consumer_token()
+    >>> token.split(':')[1] == str(os.getpid())
+    True
+    >>> token == get_consumer_token()
+    False
+    """
+    return "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid4().hex[:8])
+
+
+def _create_schema(connection):
+    """
+    Creates or upgrades the queue file schema
+    """
+    connection.execute("BEGIN IMMEDIATE")
+
+    try:
+        current = connection.execute("PRAGMA user_version").fetchone()[0]
+
+        for version, statements in _SCHEMA:
+            if version > current:
+                for statement in statements:
+                    connection.execute(statement)
+                connection.execute("PRAGMA user_version = %d" % version)
+
+        connection.execute("COMMIT")
+    except:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def _test_command():
+    """
+    Returns a failed command used in doctests
+    """
+    from sitebuilder.command.site import DeleteSite
+    from sitebuilder.command.interface import COMMAND_ERROR
+
+    command = DeleteSite('name0', 'bpinet.com')
+    command.status = COMMAND_ERROR
+    command.exception = ValueError('Unknown site')
+    return command
+
+
+class SQLiteQueue(object):
+    """
+    Queue compatible command queue stored in an SQLite database in WAL mode.
+
+    Commands are leased by batches (one transaction per batch), and deleted
+    once acknowledged using task_done. Leased commands that were never
+    acknowledged are made available again by recover, or once their
+    consumer lease expired.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> from sitebuilder.command.host import LookupHostByName
+    >>> tmpdir = mkdtemp()
+    >>> queue = SQLiteQueue(os.path.join(tmpdir, 'queue.db'), consumer=True)
+    >>> command = LookupHostByName('name*', '*')
+    >>> queue.put(command)
+    >>> queue.qsize()
+    1
+
+    A command put by a consumer is handed back to it as is
+
+    >>> queue.get() is command
+    True
+    >>> queue.task_done()
+
+    Commands put by a process that doesn't consume the queue are rebuilt
+
+    >>> producer = SQLiteQueue(os.path.join(tmpdir, 'queue.db'))
+    >>> producer.put_many([ LookupHostByName('name%d' % i, '*')
+    ...                     for i in range(3) ])
+    >>> commands = queue.get_batch(10)
+    >>> [ c.name for c in commands ]
+    [u'name0', u'name1', u'name2']
+    >>> queue.get_nowait()
+    Traceback (most recent call last):
+        ...
+    Empty
+
+    Unacknowledged commands may be recovered by their consumer
+
+    >>> queue.recover()
+    3
+    >>> len(queue.get_batch(10))
+    3
+
+    An other consumer neither recovers them, nor gets the commands put by
+    the first one
+
+    >>> other = SQLiteQueue(os.path.join(tmpdir, 'queue.db'), consumer=True)
+    >>> other.recover()
+    0
+    >>> queue.put(command)
+    >>> other.get_nowait()
+    Traceback (most recent call last):
+        ...
+    Empty
+    >>> queue.get() is command
+    True
+
+    Once the first consumer lease expired (it stopped without closing the
+    queue), its commands are handed to other consumers of the same queue
+
+    >>> logs = SQLiteQueue(os.path.join(tmpdir, 'queue.db'), 'log',
+    ...                    consumer=True)
+    >>> logs.put(command)
+    >>> logs.get() is command
+    True
+    >>> for expired in (queue, logs):
+    ...     expired._stop_event.set()
+    ...     expired._heartbeat_thread.join()
+    >>> connection = other._get_connection()
+    >>> connection.execute("UPDATE queue_consumer SET heartbeat = 0 "
+    ...                    "WHERE token IN (?, ?)",
+    ...                    (queue.token, logs.token)).rowcount
+    2
+    >>> connection.execute("UPDATE command_queue SET leased_at = 0 "
+    ...                    "WHERE owner IN (?, ?)",
+    ...                    (queue.token, logs.token)).rowcount
+    5
+    >>> other.recover()
+    4
+    >>> connection.execute("SELECT COUNT(*) FROM command_queue "
+    ...                    "WHERE queue = 'log' AND leased = 1").fetchone()[0]
+    1
+    >>> [ c.name for c in other.get_batch(10) ]
+    [u'name0', u'name1', u'name2', u'name*']
+    >>> for i in range(4):
+    ...     other.task_done()
+    >>> other.join()
+    >>> other.close()
+    >>> queue.close()
+    >>> logs.close()
+    >>> producer.close()
+    >>> rmtree(tmpdir)
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, path, name='exec', with_state=False, maxsize=0,
+                 consumer=False):
+        """
+        Queue initialization.
+
+        Parameters:
+            path        SQLite database file path
+            name        Queue name (several queues may share the same file)
+            with_state  If True, command execution state (status, message,
+                        exception) is kept as well. Should be set on log
+                        queues.
+            maxsize     Maximum number of pending commands (0 means no
+                        limit)
+            consumer    If True, the queue is registered as a consumer
+                        right away, so that the commands it puts are handed
+                        back to it. Otherwise, it is registered when it
+                        first gets commands.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.name = name
+        self.with_state = with_state
+        self.maxsize = maxsize
+        self._local = local()
+        self._lock = Lock()
+        self._live = {}
+        self._delivered = deque()
+        self._acked = []
+        self._put_event = Event()
+        self._stop_event = Event()
+        self._heartbeat_thread = None
+        self.token = get_consumer_token()
+        _create_schema(self._get_connection())
+
+        if consumer:
+            self._register()
+
+    def _get_connection(self):
+        """
+        Returns the calling thread database connection
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    def _register(self):
+        """
+        Registers the queue as a consumer, and starts its heartbeat thread
+        """
+        with self._lock:
+            if self._heartbeat_thread is not None:
+                return
+
+            self._heartbeat_thread = Thread(target=self._run_heartbeat,
+                                            name="SQLiteQueueHeartbeat")
+            self._heartbeat_thread.daemon = True
+
+        self._heartbeat()
+        self._heartbeat_thread.start()
+
+    def _run_heartbeat(self):
+        """
+        Heartbeat thread loop
+        """
+        while not self._stop_event.wait(QUEUE_HEARTBEAT_INTERVAL):
+            try:
+                self._heartbeat()
+            except sqlite3.Error, e:
+                warn("queue heartbeat failed: %s" % e)
+
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None:
+            connection.close()
+
+    def _release_expired(self, connection, now):
+        """
+        Makes the commands leased by expired consumers available again, and
+        forgets these consumers. Should be called inside a transaction.
+        Returns the number of released commands of this queue.
+        """
+        expired = now - QUEUE_LEASE_TIMEOUT
+        count = connection.execute(
+            "UPDATE command_queue SET leased = 0, owner = NULL, "
+            "leased_at = NULL WHERE queue = ? AND leased = 1 "
+            "AND (leased_at IS NULL OR leased_at < ?) "
+            "AND (owner IS NULL OR owner NOT IN "
+            "(SELECT token FROM queue_consumer WHERE heartbeat >= ?))",
+            (self.name, expired, expired)).rowcount
+
+        # Leases of other queues held by forgotten consumers are released
+        # by these queues consumers
+        connection.execute("DELETE FROM queue_consumer WHERE heartbeat < ?",
+                           (expired,))
+
+        return count
+
+    def _heartbeat(self):
+        """
+        Renews the consumer heartbeat, releases expired leases, and forgets
+        the live commands that are no longer queued (consumed by an other
+        consumer while this one was considered as expired)
+        """
+        connection = self._get_connection()
+        now = time()
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO queue_consumer (token, heartbeat) "
+                "VALUES (?, ?)", (self.token, now))
+            self._release_expired(connection, now)
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+
+        with self._lock:
+            live = self._live.keys()
+
+        for i in range(0, len(live), _MAX_VARIABLES):
+            ids = live[i:i + _MAX_VARIABLES]
+            found = set([ row[0] for row in connection.execute(
+                "SELECT id FROM command_queue WHERE id IN (%s)" %
+                ",".join("?" * len(ids)), ids) ])
+
+            with self._lock:
+                for rowid in ids:
+                    if not rowid in found:
+                        self._live.pop(rowid, None)
+
+    def _delete_acked(self, connection):
+        """
+        Deletes acknowledged commands. Should be called inside a transaction.
+        """
+        with self._lock:
+            acked = self._acked
+            self._acked = []
+
+        for i in range(0, len(acked), _MAX_VARIABLES):
+            ids = acked[i:i + _MAX_VARIABLES]
+            connection.execute(
+                "DELETE FROM command_queue WHERE id IN (%s)" %
+                ",".join("?" * len(ids)), ids)
+
+    def _lease(self, size):
+        """
+        Leases up to size pending commands in a single transaction and
+        returns their rows
+        """
+        if self._heartbeat_thread is None:
+            self._register()
+
+        connection = self._get_connection()
+        now = time()
+        parameters = (self.name, self.token, now - QUEUE_LEASE_TIMEOUT)
+
+        # Avoids taking the write lock when there is nothing to do
+        if not len(self._acked) and connection.execute(
+                "SELECT 1 FROM command_queue WHERE %s LIMIT 1" % _LEASABLE,
+                parameters).fetchone() is None:
+            return []
+
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            self._delete_acked(connection)
+            rows = connection.execute(
+                "SELECT id, command, parameters, state, created "
+                "FROM command_queue WHERE %s ORDER BY id LIMIT ?" % _LEASABLE,
+                parameters + (size,)).fetchall()
+
+            for i in range(0, len(rows), _MAX_VARIABLES):
+                ids = [ row[0] for row in rows[i:i + _MAX_VARIABLES] ]
+                connection.execute(
+                    "UPDATE command_queue SET leased = 1, owner = ?, "
+                    "leased_at = ? WHERE id IN (%s)" %
+                    ",".join("?" * len(ids)), [ self.token, now ] + ids)
+
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+
+        return rows
+
+    def put(self, command, block=True, timeout=None):
+        """
+        Adds a command to the queue
+        """
+        self.put_many([command], block, timeout)
+
+    def put_nowait(self, command):
+        """
+        Adds a command to the queue without blocking
+        """
+        self.put(command, False)
+
+    def put_many(self, commands, block=True, timeout=None):
+        """
+        Adds several commands to the queue in a single transaction
+        """
+        for command in commands:
+            if not ICommand.providedBy(command):
+                raise AttributeError(
+                    "command parameter should be an instance of ICommand")
+
+        if self.maxsize > 0:
+            deadline = None
+
+            if timeout is not None:
+                deadline = time() + timeout
+
+            while self.qsize() + len(commands) > self.maxsize:
+                if not block or (deadline is not None and time() > deadline):
+                    raise Full
+                sleep(self.poll_interval)
+
+        # Commands put by a consumer are handed back to it only
+        producer = None
+
+        if self._heartbeat_thread is not None:
+            producer = self.token
+
+        connection = self._get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            ids = []
+
+            for command in commands:
+                if command.enqueued is None:
+                    command.enqueued = time()
+
+                path, parameters, state = serialize_command(
+                    command, self.with_state)
+                cursor = connection.execute(
+                    "INSERT INTO command_queue "
+                    "(queue, command, parameters, state, created, producer) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.name, path, parameters, state, command.enqueued,
+                     producer))
+                ids.append(cursor.lastrowid)
+
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+
+        # Commands put by other queues of a producer are never handed back
+        if producer is not None:
+            with self._lock:
+                self._live.update(zip(ids, commands))
+
+        self._put_event.set()
+
+    def get_batch(self, size=QUEUE_BATCH_SIZE, block=True, timeout=None):
+        """
+        Removes and returns a list of at most size commands from the queue.
+
+        Each returned command should be acknowledged using task_done.
+        """
+        deadline = None
+
+        if timeout is not None:
+            deadline = time() + timeout
+
+        while True:
+            rows = self._lease(size)
+            commands = []
+
+            for rowid, path, parameters, state, created in rows:
+                with self._lock:
+                    command = self._live.pop(rowid, None)
+
+                if command is None:
+                    try:
+                        command = unserialize_command(path, parameters, state)
+                        if command.enqueued is None:
+                            command.enqueued = created
+                    except Exception, e:
+                        warn("dropped invalid queued command %d: %s" %
+                             (rowid, e))
+                        with self._lock:
+                            self._acked.append(rowid)
+                        continue
+
+                with self._lock:
+                    self._delivered.append(rowid)
+
+                commands.append(command)
+
+            if len(commands):
+                return commands
+
+            if not block:
+                raise Empty
+
+            delay = self.poll_interval
+
+            if deadline is not None:
+                delay = min(delay, deadline - time())
+                if delay <= 0:
+                    raise Empty
+
+            self._put_event.wait(delay)
+            self._put_event.clear()
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes and returns a command from the queue
+        """
+        return self.get_batch(1, block, timeout)[0]
+
+    def get_nowait(self):
+        """
+        Removes and returns a command from the queue without blocking
+        """
+        return self.get(False)
+
+    def task_done(self):
+        """
+        Acknowledges a previously dequeued command. Acknowledged commands are
+        deleted by batches.
+        """
+        with self._lock:
+            if not len(self._delivered):
+                raise ValueError('task_done() called too many times')
+
+            self._acked.append(self._delivered.popleft())
+            flush = len(self._acked) >= QUEUE_BATCH_SIZE
+
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Deletes acknowledged commands from the database
+        """
+        connection = self._get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            self._delete_acked(connection)
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+
+    def recover(self):
+        """
+        Makes the commands leased by this consumer but unacknowledged, and
+        those leased by expired consumers, available again. Commands leased
+        by other running consumers are left alone. Returns the number of
+        recovered commands.
+        """
+        self._register()
+
+        with self._lock:
+            self._delivered.clear()
+
+        connection = self._get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            count = connection.execute(
+                "UPDATE command_queue SET leased = 0, owner = NULL, "
+                "leased_at = NULL WHERE queue = ? AND leased = 1 "
+                "AND owner = ?", (self.name, self.token)).rowcount
+            count += self._release_expired(connection, time())
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+
+        return count
+
+    def qsize(self):
+        """
+        Returns the number of pending commands
+        """
+        return self._get_connection().execute(
+            "SELECT COUNT(*) FROM command_queue WHERE queue = ? "
+            "AND leased = 0", (self.name,)).fetchone()[0]
+
+    def empty(self):
+        """
+        Tells if no command is pending
+        """
+        return self.qsize() == 0
+
+    def full(self):
+        """
+        Tells if the queue is full
+        """
+        return self.maxsize > 0 and self.qsize() >= self.maxsize
+
+    def join(self):
+        """
+        Blocks until all commands, put by any process, have been dequeued
+        and acknowledged
+        """
+        self.flush()
+        connection = self._get_connection()
+
+        while connection.execute(
+                "SELECT COUNT(*) FROM command_queue WHERE queue = ?",
+                (self.name,)).fetchone()[0]:
+            sleep(self.poll_interval)
+            self.flush()
+
+    def close(self):
+        """
+        Deletes acknowledged commands, makes unacknowledged ones available
+        again, unregisters the consumer and closes the calling thread
+        database connection
+        """
+        self.flush()
+
+        if self._heartbeat_thread is not None:
+            self._stop_event.set()
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+            connection = self._get_connection()
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                connection.execute(
+                    "UPDATE command_queue SET leased = 0, owner = NULL, "
+                    "leased_at = NULL WHERE leased = 1 AND owner = ?",
+                    (self.token,))
+                connection.execute(
+                    "DELETE FROM queue_consumer WHERE token = ?",
+                    (self.token,))
+                connection.execute("COMMIT")
+            except:
+                connection.execute("ROLLBACK")
+                raise
+
+        self._local.connection.close()
+        self._local.connection = None
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+"""
+Reconciliation related commands.
+
+Reconciliation checks that the state observed on the infrastructure still
+matches the desired site configuration held by the backend.
+
+To keep a pass cheap on big catalogs, a content digest is kept per site for
+both the desired and the observed state. Only sites marked as changed since
+the previous pass are checked again:
+
+    - sites changed in the backend since the previous pass, by any process,
+      are read from the driver change feed (see driver.changes_since)
+    - probes (or provisioning agents) report observed digests using
+      ReconcileState.set_observed, which marks sites whose observed digest
+      changed
+
+A pass then costs time in proportion to what changed, not to the catalog
+size.
+
+Without a probe, sites whose observed state was never reported can't be
+compared and are not reported as drifted. As no probe ships with the
+application, reconciliation is not scheduled by default.
+"""
+
+from sitebuilder.abstraction.site.record import get_site_key, site_to_tuple
+from sitebuilder.command.interface import ICommand, ICommandLogged
+from sitebuilder.command.base import BaseCommand
+from zope.interface import implements
+from threading import Lock
+from hashlib import sha1
+
+
+def get_site_digest(site):
+    """
+    Returns a digest of a site configuration content.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> site = site_factory()
+    >>> digest = get_site_digest(site)
+    >>> digest == get_site_digest(site_factory())
+    True
+    >>> site.dnshost.description = u'changed'
+    >>> digest == get_site_digest(site)
+    False
+    """
+    return sha1(repr(site_to_tuple(site))).hexdigest()
+
+
+class ReconcileState(object):
+    """
+    Keeps desired and observed site digests between reconciliation passes,
+    and the set of sites that need to be checked again.
+
+    >>> state = ReconcileState()
+    >>> state.mark_changed(u'name0', u'bpinet.com')
+    >>> state.pop_changed()
+    [(u'name0', u'bpinet.com')]
+    >>> state.pop_changed()
+    []
+
+    An observed digest only marks a site if it differs from the known one
+
+    >>> state.set_observed(u'name0', u'bpinet.com', 'abc')
+    >>> state.set_observed(u'name0', u'bpinet.com', 'abc')
+    >>> state.pop_changed()
+    [(u'name0', u'bpinet.com')]
+    >>> state.get_observed(u'NAME0', u'bpinet.com')
+    'abc'
+
+    Sites with a known digest are marked using their name and domain
+
+    >>> state.set_desired(u'name1', u'bpinet.com', 'def')
+    >>> state.mark_known()
+    >>> sorted(state.pop_changed())
+    [(u'name0', u'bpinet.com'), (u'name1', u'bpinet.com')]
+    >>> state.set_desired(u'name1', u'bpinet.com', None)
+    >>> state.mark_known()
+    >>> state.pop_changed()
+    [(u'name0', u'bpinet.com')]
+    """
+
+    def __init__(self):
+        """
+        State initialization
+        """
+        self._lock = Lock()
+        self._desired = {}
+        self._observed = {}
+        self._changed = {}
+
+        # (name, domain) couples of the sites with a known digest, by key
+        self._names = {}
+
+        # Backend version checked by the previous pass (None before the
+        # first pass)
+        self.version = None
+
+    def mark_changed(self, name, domain):
+        """
+        Marks a site as needing to be checked on next pass
+        """
+        with self._lock:
+            self._changed[get_site_key(name, domain)] = (name, domain)
+
+    def set_desired(self, name, domain, digest):
+        """
+        Records the desired state digest of a site
+        """
+        key = get_site_key(name, domain)
+
+        with self._lock:
+            if digest is None:
+                self._desired.pop(key, None)
+            else:
+                self._desired[key] = digest
+
+            self._update_names(key, name, domain)
+
+    def get_desired(self, name, domain):
+        """
+        Returns the last known desired state digest of a site
+        """
+        return self._desired.get(get_site_key(name, domain))
+
+    def set_observed(self, name, domain, digest, mark=True):
+        """
+        Records the observed state digest of a site. Unless mark is False,
+        the site is marked as changed if its digest differs from the known
+        one.
+        """
+        key = get_site_key(name, domain)
+
+        with self._lock:
+            if self._observed.get(key) == digest:
+                return
+
+            if digest is None:
+                self._observed.pop(key, None)
+            else:
+                self._observed[key] = digest
+
+            self._update_names(key, name, domain)
+
+            if mark:
+                self._changed[key] = (name, domain)
+
+    def _update_names(self, key, name, domain):
+        """
+        Keeps the name and domain of a site as long as one of its digests
+        is known. Must be called holding the lock.
+        """
+        if key in self._desired or key in self._observed:
+            self._names[key] = (name, domain)
+        else:
+            self._names.pop(key, None)
+
+    def get_observed(self, name, domain):
+        """
+        Returns the last known observed state digest of a site
+        """
+        return self._observed.get(get_site_key(name, domain))
+
+    def has_observed(self, name, domain):
+        """
+        Tells if the observed state of a site was ever reported
+        """
+        return get_site_key(name, domain) in self._observed
+
+    def mark_known(self):
+        """
+        Marks all the sites with a known desired or observed state as
+        needing to be checked on next pass
+        """
+        with self._lock:
+            for key, names in self._names.iteritems():
+                if not key in self._changed:
+                    self._changed[key] = names
+
+    def pop_changed(self):
+        """
+        Returns the list of (name, domain) couples marked as changed, and
+        clears it
+        """
+        with self._lock:
+            changed = self._changed.values()
+            self._changed = {}
+
+        return changed
+
+    def clear(self):
+        """
+        Forgets all known digests
+        """
+        with self._lock:
+            self._desired.clear()
+            self._observed.clear()
+            self._changed.clear()
+            self._names.clear()
+            self.version = None
+
+
+# Module level reconciliation state
+reconcile_state = ReconcileState()
+
+
+class ReconcileSites(BaseCommand):
+    """
+    Checks that observed state still matches the desired configuration of
+    sites that changed since the previous pass.
+
+    The first pass over a state checks all the sites known by the backend,
+    as do passes for which the backend no longer knows the changes made
+    since the previous one.
+
+    Result is set to the list of (name, domain) couples that drifted.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
+    >>> domain = SiteDefaultsManager.get_default_domain()
+    >>> state = ReconcileState()
+    >>> digests = {}
+    >>> def probe(name, domain):
+    ...     return digests.get(get_site_key(name, domain))
+    ...
+    >>> command = ReconcileSites(probe, state)
+    >>> command.execute(TestBackendDriver)
+    >>> command.checked == len(TestBackendDriver.lookup_host_by_name('*', '*'))
+    True
+    >>> len(command.result) == command.checked
+    True
+
+    Once observed state matches, nothing drifts any more
+
+    >>> site = TestBackendDriver.get_site_by_name(u'name2', domain)
+    >>> digests[get_site_key(u'name2', domain)] = get_site_digest(site)
+    >>> state.mark_changed(u'name2', domain)
+    >>> command = ReconcileSites(probe, state)
+    >>> command.execute(TestBackendDriver)
+    >>> command.checked, command.result
+    (1, [])
+
+    A pass without any change checks nothing
+
+    >>> command = ReconcileSites(probe, state)
+    >>> command.execute(TestBackendDriver)
+    >>> command.checked
+    0
+
+    Sites changed in the backend are checked again
+
+    >>> site.dnshost.description = u'changed'
+    >>> TestBackendDriver.update_site(site)
+    >>> command = ReconcileSites(probe, state)
+    >>> command.execute(TestBackendDriver)
+    >>> command.checked, command.result
+    (1, [(u'name2', u'bpinet.com')])
+    >>> site.dnshost.description = u'desc name2'
+    >>> TestBackendDriver.update_site(site)
+
+    Sites deleted while changes are no longer known are checked too
+
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.changes import ChangeLog
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> memory = MemoryBackendDriver()
+    >>> memory.changes = ChangeLog(2)
+    >>> memory.add_sites([ get_test_site(u'name%d' % num) for num in range(3) ])
+    >>> state = ReconcileState()
+    >>> command = ReconcileSites(lambda name, domain: None, state)
+    >>> command.execute(memory)
+    >>> memory.delete_site(u'name2', domain)
+    >>> site = memory.get_site_by_name(u'name0', domain)
+    >>> for num in range(3):
+    ...     memory.update_site(site)
+    >>> command = ReconcileSites(lambda name, domain: None, state)
+    >>> command.execute(memory)
+    >>> command.checked, sorted(command.result)
+    (3, [(u'name0', u'bpinet.com'), (u'name1', u'bpinet.com')])
+
+    Without probe, sites never observed are not reported as drifted
+
+    >>> command = ReconcileSites(state=ReconcileState())
+    >>> command.execute(TestBackendDriver)
+    >>> command.checked > 0, command.result
+    (True, [])
+    """
+    implements(ICommand, ICommandLogged)
+
+    description = "Reconcile sites"
+
+    def __init__(self, probe=None, state=None):
+        """
+        Command initialization.
+
+        Parameters:
+            probe   Optional callable taking name and domain parameters, and
+                    returning the observed state digest of a site (or None
+                    if the site does not exist). If not set, the digests
+                    reported using ReconcileState.set_observed are used.
+            state   Reconciliation state (module level state by default)
+        """
+        BaseCommand.__init__(self)
+
+        if state is None:
+            state = reconcile_state
+
+        self.probe = probe
+        self.state = state
+        self.checked = 0
+
+    def execute(self, driver):
+        """
+        Executes command
+        """
+        state = self.state
+
+        if state.version is None:
+            version, changes = driver.get_version(), None
+        else:
+            version, changes = driver.changes_since(state.version)
+
+        if changes is None:
+            # Changes are unknown: all the sites are checked
+            state.mark_known()
+
+            for dnshost in driver.iter_hosts_by_name(u'*', u'*'):
+                state.mark_changed(dnshost.name, dnshost.domain)
+        else:
+            for num, kind, name, domain in changes:
+                state.mark_changed(name, domain)
+
+        state.version = version
+        drifted = []
+        changed = state.pop_changed()
+
+        for name, domain in changed:
+            site = driver.get_site_snapshot(name, domain)
+
+            if site is None:
+                desired = None
+            else:
+                desired = get_site_digest(site)
+
+            state.set_desired(name, domain, desired)
+
+            if self.probe is not None:
+                observed = self.probe(name, domain)
+                state.set_observed(name, domain, observed, mark=False)
+            elif state.has_observed(name, domain):
+                observed = state.get_observed(name, domain)
+            else:
+                continue
+
+            if desired != observed:
+                drifted.append((name, domain))
+
+        self.checked = len(changed)
+        self.result = drifted
+        self.mesg = "%d sites checked, %d drifted" % (len(changed),
+                                                      len(drifted))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -4,19 +4,21 @@
 Command scheduler class
 """
 
-from sitebuilder.utils.parameters import get_application_context
-from sitebuilder.utils.parameters import CONTEXT_NORMAL, CONTEXT_TEST
-from sitebuilder.utils.driver.test import TestBackendDriver
+from sitebuilder.utils.parameters import QUEUE_BATCH_SIZE
+from sitebuilder.utils.driver.registry import get_backend_driver
 from sitebuilder.command.interface import ICommand, ICommandLogged
-from sitebuilder.command.interface import COMMAND_RUNNING
+from sitebuilder.command.interface import COMMAND_PENDING, COMMAND_RUNNING
 from sitebuilder.command.interface import COMMAND_SUCCESS
 from sitebuilder.command.interface import COMMAND_ERROR
 from sitebuilder.event.events import CommandExecEvent
 from sitebuilder.command.log import enqueue_command as log_enqueue_command
 from traceback import format_exc
 from Queue import Queue, Empty
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 from warnings import warn
+from random import uniform
+from time import time
+import heapq
 import gobject
 
 
@@ -25,6 +27,7 @@ exec_queue = Queue()
 notify_queue = Queue()
 thread_stop = Event()
 scheduler = None
+periodic_scheduler = None
 
 
 def start():
@@ -32,11 +35,15 @@ def start():
     Initialises scheduler and notifier instances and start threads
     """
     global scheduler
+    global periodic_scheduler
 
     if scheduler is None:
         # Command execution scheduler module level instance
         scheduler = CommandExecScheduler()
         scheduler.start()
+        # Periodic jobs scheduler module level instance
+        periodic_scheduler = PeriodicJobScheduler()
+        periodic_scheduler.start()
     else:
         warn("'start' called on an already initialized instance")
 
@@ -46,14 +53,30 @@ def stop():
     Stops scheduler and notifier instances
     """
     global scheduler
+    global periodic_scheduler
     global notifier
 
     thread_stop.set()
     scheduler.join()
+    periodic_scheduler.join()
     scheduler = None
+    periodic_scheduler = None
     notifier = None
 
 
+def set_exec_queue(queue):
+    """
+    Replaces the execution queue by an other Queue compatible object (for
+    instance a durable SQLiteQueue). Should be called before start.
+    """
+    global exec_queue
+
+    if scheduler is not None:
+        warn("execution queue replaced while scheduler is running")
+
+    exec_queue = queue
+
+
 def enqueue_command(command):
     """
     Adds a command to the execution queue
@@ -66,9 +89,140 @@ def enqueue_command(command):
         raise AttributeError("command parameter should be an instance of ICommand")
 
     # Adds command to execution queue
+    command.enqueued = time()
     exec_queue.put(command)
 
 
+def add_periodic_job(job):
+    """
+    Registers a periodic job. Its first command is enqueued after one
+    interval.
+    """
+    if periodic_scheduler is None:
+        warn("added periodic job but scheduler has not been initialized. " +
+             "use 'start' function to initialize it")
+
+    if not isinstance(job, PeriodicJob):
+        raise AttributeError("job parameter should be a PeriodicJob instance")
+
+    PeriodicJobScheduler.add_job(job)
+
+
+def remove_periodic_job(job):
+    """
+    Unregisters a periodic job. A command already enqueued is not cancelled.
+    """
+    PeriodicJobScheduler.remove_job(job)
+
+
+class PeriodicJob(object):
+    """
+    Job enqueuing a new command every interval seconds.
+
+    A random jitter, up to jitter seconds before or after the interval, is
+    applied to each run so that jobs started together do not keep firing at
+    the same time.
+
+    A new command is not enqueued as long as the previous one is pending or
+    running, so that a slow job does not pile up commands in the execution
+    queue.
+
+    Jobs writing files shared by several processes are given a process lock
+    (see sitebuilder.utils.lock.ProcessLock): their commands are only
+    enqueued by the process holding it, the other processes trying to take
+    it over on each run.
+
+    >>> from sitebuilder.command.base import BaseCommand
+    >>> job = PeriodicJob(BaseCommand, 60, jitter=5)
+    >>> job.schedule(0)
+    >>> 55 <= job.next_run <= 65
+    True
+    >>> command = job.fire()
+    >>> isinstance(command, BaseCommand)
+    True
+
+    As long as the command is pending, no new command is created
+
+    >>> job.fire() is None
+    True
+    >>> command.status = COMMAND_SUCCESS
+    >>> job.fire() is None
+    False
+
+    Jobs given a process lock only fire in the process holding it
+
+    >>> from sitebuilder.utils.lock import ProcessLock
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> import os
+    >>> directory = mkdtemp()
+    >>> holder = ProcessLock(os.path.join(directory, 'jobs.lock'))
+    >>> holder.try_acquire()
+    True
+    >>> job = PeriodicJob(BaseCommand, 60, lock=ProcessLock(holder.path))
+    >>> job.fire() is None
+    True
+    >>> holder.release()
+    >>> job.fire() is None
+    False
+    >>> job.lock.release()
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, factory, interval, jitter=0.0, lock=None):
+        """
+        Job initialization.
+
+        Parameters:
+            factory     Callable returning the ICommand object to enqueue
+            interval    Number of seconds between two runs
+            jitter      Maximum number of seconds a run may be moved
+                        before or after its nominal time
+            lock        Process lock the process must hold for the job to
+                        fire, or None
+        """
+        if interval <= 0:
+            raise AttributeError("interval should be a positive number")
+        if jitter < 0 or jitter >= interval:
+            raise AttributeError("jitter should be a positive number lower " +
+                                 "than interval")
+
+        self.factory = factory
+        self.interval = interval
+        self.jitter = jitter
+        self.lock = lock
+        self.next_run = None
+        self.command = None
+
+    def schedule(self, now):
+        """
+        Computes next run time relatively to now
+        """
+        self.next_run = now + self.interval + \
+            uniform(-self.jitter, self.jitter)
+
+    def is_running(self):
+        """
+        Tells if the last enqueued command has not finished yet
+        """
+        return self.command is not None and \
+            self.command.status in (COMMAND_PENDING, COMMAND_RUNNING)
+
+    def fire(self):
+        """
+        Returns a new command to enqueue, or None if the previous one has
+        not finished yet, or if an other process holds the job lock
+        """
+        if self.is_running():
+            return None
+
+        if self.lock is not None and not self.lock.try_acquire():
+            return None
+
+        self.command = self.factory()
+        return self.command
+
+
 class CommandExecScheduler(Thread):
     """
     Command scheduler enques commands and exectes them. Command queue is
@@ -86,55 +240,71 @@ class CommandExecScheduler(Thread):
 
     def get_backend_driver(self):
         """
-        Returns backend driver depending on application execution context
+        Returns backend driver depending on application execution context,
+        unless a driver has been explicitly set
         """
-        if self.backend_driver is None:
-            context = get_application_context()
+        if self.backend_driver is not None:
+            return self.backend_driver
 
-            if context == CONTEXT_NORMAL:
-                driver = TestBackendDriver
-            elif context == CONTEXT_TEST:
-                driver = TestBackendDriver
-            else:
-                raise RuntimeError("unknonw application context: %s" % context)
-
-            self.backend_driver = driver
-
-        return self.backend_driver
+        return get_backend_driver()
 
     def run(self):
         """
         Continuously loops on commands and executes them
         """
+        # Queues supporting batches are read one batch at a time
+        batched = hasattr(exec_queue, 'get_batch')
+
+        # Durable queues may hold commands leased before a crash
+        if hasattr(exec_queue, 'recover'):
+            exec_queue.recover()
+
         while not thread_stop.is_set():
             try:
-                command = exec_queue.get(timeout=0.1)
+                if batched:
+                    commands = exec_queue.get_batch(QUEUE_BATCH_SIZE,
+                                                    timeout=0.1)
+                else:
+                    commands = [ exec_queue.get(timeout=0.1) ]
             except Empty:
                 continue
 
-            if ICommandLogged.providedBy(command):
-                # Register logger as command observer for it to be notified
-                # when execution has finished
-                command.get_event_bus().subscribe(CommandExecEvent,
-                                                  self.log_command)
+            for command in commands:
+                self.execute_command(command)
+        # End while
 
-            command.status = COMMAND_RUNNING
+        # Deletes acknowledged commands from durable queues
+        if hasattr(exec_queue, 'flush'):
+            exec_queue.flush()
 
-            try:
-                command.execute(self.get_backend_driver())
-                command.status = COMMAND_SUCCESS
-            except Exception, e:
-                command.status = COMMAND_ERROR
-                command.exception = e
-                command.traceback = format_exc(e)
-
-            command.release()
-            exec_queue.task_done()
-
-            # Notifies followers that the command has been executed
-            gobject.idle_add(
-                lambda: command.get_event_bus().publish(CommandExecEvent(command)))
-        # End while
+    def execute_command(self, command):
+        """
+        Executes a command and notifies its followers
+        """
+        if ICommandLogged.providedBy(command):
+            # Register logger as command observer for it to be notified
+            # when execution has finished
+            command.get_event_bus().subscribe(CommandExecEvent,
+                                              self.log_command)
+
+        command.status = COMMAND_RUNNING
+        command.started = time()
+
+        try:
+            command.execute(self.get_backend_driver())
+            command.status = COMMAND_SUCCESS
+        except Exception, e:
+            command.status = COMMAND_ERROR
+            command.exception = e
+            command.traceback = format_exc(e)
+
+        command.finished = time()
+
+        command.release()
+        exec_queue.task_done()
+
+        # Notifies followers that the command has been executed
+        gobject.idle_add(self.notify_command_executed, command)
 
     def log_command(self, event):
         """
@@ -142,10 +312,78 @@ class CommandExecScheduler(Thread):
         """
         log_enqueue_command(event.source)
 
-    def notify_command_executed(self):
+    def notify_command_executed(self, command):
         """
         Publishes an event to indacate that the commande has been executed.
         """
+        command.get_event_bus().publish(CommandExecEvent(command))
+
+
+class PeriodicJobScheduler(Thread):
+    """
+    Periodic jobs scheduler enqueues periodic jobs commands in the execution
+    queue when they are due.
+
+    Jobs are kept in a heap ordered by next run time, so that each loop only
+    looks at the jobs that are due.
+    """
+    _jobs = []
+    _lock = Lock()
+
+    def __init__(self):
+        """
+        Schedule initialization
+        """
+        Thread.__init__(self)
+        self.name = "PeriodicJobScheduler"
+        self.daemon = True
+
+    @staticmethod
+    def add_job(job):
+        """
+        Adds a job to the jobs heap
+        """
+        with PeriodicJobScheduler._lock:
+            job.schedule(time())
+            heapq.heappush(PeriodicJobScheduler._jobs, (job.next_run, job))
+
+    @staticmethod
+    def remove_job(job):
+        """
+        Removes a job from the jobs heap
+        """
+        with PeriodicJobScheduler._lock:
+            jobs = PeriodicJobScheduler._jobs
+            jobs[:] = [ item for item in jobs if item[1] is not job ]
+            heapq.heapify(jobs)
+
+    def run(self):
+        """
+        Continuously loops on jobs and enqueues due ones commands
+        """
+        jobs = PeriodicJobScheduler._jobs
+
+        while not thread_stop.is_set():
+            now = time()
+
+            with PeriodicJobScheduler._lock:
+                while len(jobs) and jobs[0][0] <= now:
+                    next_run, job = heapq.heappop(jobs)
+                    command = job.fire()
+
+                    if command is not None:
+                        enqueue_command(command)
+
+                    job.schedule(now)
+                    heapq.heappush(jobs, (job.next_run, job))
+
+                if len(jobs):
+                    delay = min(jobs[0][0] - now, 0.1)
+                else:
+                    delay = 0.1
+
+            thread_stop.wait(delay)
+        # End while
 
 
 if __name__ == "__main__":
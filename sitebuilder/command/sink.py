@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Log sinks used by the log manager to write logged commands records.
+
+A record is a dictionnary of plain values describing an executed command
+(see get_command_record). Sinks implement ILogSink and may be freely
+combined.
+"""
+
+from sitebuilder.command.interface import ILogSink, COMMAND_STATUS_NAMES
+from zope.interface import implements
+from threading import Thread, Condition
+from warnings import warn
+from time import time
+import json
+import sys
+import os
+
+# Key sorting disables the fast C encoder: records are written unsorted
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def get_command_record(command):
+    """
+    Returns a log record describing an executed command.
+
+    >>> from sitebuilder.command.site import DeleteSite
+    >>> from sitebuilder.command.interface import COMMAND_ERROR
+    >>> command = DeleteSite('name0', 'bpinet.com')
+    >>> command.status = COMMAND_ERROR
+    >>> command.mesg = 'Unknown site name0.bpinet.com'
+    >>> command.enqueued, command.started, command.finished = 10.0, 10.5, 12.0
+    >>> record = get_command_record(command)
+    >>> record['command'], record['target'], record['status']
+    ('DeleteSite', u'name0.bpinet.com', u'error')
+    >>> record['wait'], record['duration']
+    (0.5, 1.5)
+    """
+    wait = duration = None
+
+    if command.enqueued is not None and command.started is not None:
+        wait = command.started - command.enqueued
+
+    if command.started is not None and command.finished is not None:
+        duration = command.finished - command.started
+
+    exception = command.exception
+
+    if exception is not None:
+        exception = u"%s" % exception
+
+    return {
+        'time': command.finished,
+        'command': type(command).__name__,
+        'description': command.description,
+        'target': command.get_target(),
+        'status': COMMAND_STATUS_NAMES.get(command.status, command.status),
+        'enqueued': command.enqueued,
+        'started': command.started,
+        'finished': command.finished,
+        'wait': wait,
+        'duration': duration,
+        'mesg': command.mesg,
+        'exception': exception,
+        }
+
+
+class StreamLogSink(object):
+    """
+    Writes records as human readable lines on a stream (stdout by default).
+
+    >>> from StringIO import StringIO
+    >>> stream = StringIO()
+    >>> sink = StreamLogSink(stream)
+    >>> sink.write({'description': 'Delete site', 'target': 'name0.bpinet.com',
+    ...             'status': 'error', 'duration': 0.0015,
+    ...             'mesg': 'Unknown site'})
+    >>> stream.getvalue()
+    'Delete site name0.bpinet.com: error (1.5 ms): Unknown site\\n'
+    """
+    implements(ILogSink)
+
+    def __init__(self, stream=None):
+        """
+        Sink initialization
+        """
+        if stream is None:
+            stream = sys.stdout
+
+        self.stream = stream
+
+    def write(self, record):
+        """
+        Writes a log record
+        """
+        duration = record.get('duration')
+
+        if duration is None:
+            duration = u'-'
+        else:
+            duration = u"%.1f ms" % (duration * 1000)
+
+        line = u"%s %s: %s (%s): %s\n" % (
+            record['description'], record['target'], record['status'],
+            duration, record['mesg'])
+        self.stream.write(line.encode('utf-8'))
+
+    def flush(self):
+        """
+        Flushes stream
+        """
+        self.stream.flush()
+
+    def close(self):
+        """
+        Flushes stream. The stream itself is not closed.
+        """
+        self.flush()
+
+
+class BufferedLogSink(object):
+    """
+    Base class for sinks writing records by batches.
+
+    Records are buffered in memory and written by a dedicated thread, either
+    when buffer_size records are pending or every flush_interval seconds, so
+    that callers never wait for writes.
+
+    Subclasses should implement write_records, and may implement
+    close_output to release their resources.
+    """
+    implements(ILogSink)
+
+    def __init__(self, buffer_size=256, flush_interval=1.0):
+        """
+        Sink initialization.
+
+        Parameters:
+            buffer_size     Number of pending records triggering a write
+            flush_interval  Maximum number of seconds a record is kept in
+                            memory
+        """
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._written = 0
+        self._closed = False
+        self._flush_requested = False
+        self._condition = Condition()
+        self._writer = Thread(target=self._run, name=type(self).__name__)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def write(self, record):
+        """
+        Buffers a log record
+        """
+        with self._condition:
+            if self._closed:
+                raise ValueError("write on a closed sink")
+
+            self._buffer.append(record)
+
+            if len(self._buffer) >= self.buffer_size:
+                self._condition.notify_all()
+
+    def flush(self):
+        """
+        Blocks until all records buffered so far have been written
+        """
+        with self._condition:
+            target = self._written + len(self._buffer)
+            self._flush_requested = True
+            self._condition.notify_all()
+
+            while self._written < target and self._writer.is_alive():
+                self._condition.wait(0.1)
+
+    def close(self):
+        """
+        Writes buffered records and releases sink resources
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        self._writer.join()
+
+    def write_records(self, records):
+        """
+        Writes a batch of records. Called from the writer thread.
+        """
+        raise NotImplementedError("write_records should be implemented")
+
+    def close_output(self):
+        """
+        Releases sink resources. Called from the writer thread once all
+        records have been written.
+        """
+
+    def _run(self):
+        """
+        Writer thread main loop
+        """
+        while True:
+            with self._condition:
+                deadline = time() + self.flush_interval
+
+                while not self._closed and not self._flush_requested and \
+                      len(self._buffer) < self.buffer_size:
+                    delay = deadline - time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+
+                records = self._buffer
+                self._buffer = []
+                self._flush_requested = False
+                closed = self._closed
+
+            if len(records):
+                try:
+                    self.write_records(records)
+                except Exception, e:
+                    warn("%s failed to write %d records: %s" % (
+                        type(self).__name__, len(records), e))
+
+            with self._condition:
+                self._written += len(records)
+                self._condition.notify_all()
+
+            if closed:
+                break
+
+        self.close_output()
+
+
+class JSONLinesFileSink(BufferedLogSink):
+    """
+    Writes records as JSON lines into a file.
+
+    Records are buffered and written by batches (see BufferedLogSink).
+
+    When the file grows over max_bytes, it is rotated: the current file is
+    renamed with a .1 suffix, .1 to .2 and so on, up to backup_count files.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> tmpdir = mkdtemp()
+    >>> path = os.path.join(tmpdir, 'commands.log')
+    >>> sink = JSONLinesFileSink(path, max_bytes=100, backup_count=2)
+    >>> for i in range(5):
+    ...     sink.write({'target': 'name%d.bpinet.com' % i, 'status': 'success'})
+    >>> sink.flush()
+    >>> sorted(os.listdir(tmpdir))
+    ['commands.log', 'commands.log.1', 'commands.log.2']
+    >>> sink.close()
+    >>> json.loads(open(path).readline())['target']
+    u'name4.bpinet.com'
+    >>> rmtree(tmpdir)
+    """
+
+    def __init__(self, path, buffer_size=256, flush_interval=1.0,
+                 max_bytes=10 * 1024 * 1024, backup_count=5):
+        """
+        Sink initialization.
+
+        Parameters:
+            path            Log file path
+            buffer_size     Number of pending records triggering a write
+            flush_interval  Maximum number of seconds a record is kept in
+                            memory
+            max_bytes       File size triggering a rotation (0 disables
+                            rotation)
+            backup_count    Number of rotated files kept
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = open(path, 'a')
+        self._size = self._file.tell()
+        BufferedLogSink.__init__(self, buffer_size, flush_interval)
+
+    def write_records(self, records):
+        """
+        Writes records into the file, rotating it when needed
+        """
+        lines = []
+        size = self._size
+
+        for record in records:
+            line = _encoder.encode(record) + "\n"
+
+            if self.max_bytes and size and size + len(line) > self.max_bytes:
+                self._file.write("".join(lines))
+                self._rotate()
+                lines = []
+                size = 0
+
+            lines.append(line)
+            size += len(line)
+
+        self._file.write("".join(lines))
+        self._file.flush()
+        self._size = size
+
+    def close_output(self):
+        """
+        Closes log file
+        """
+        self._file.close()
+
+    def _rotate(self):
+        """
+        Rotates log files
+        """
+        self._file.close()
+
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = "%s.%d" % (self.path, i)
+                if os.path.exists(source):
+                    os.rename(source, "%s.%d" % (self.path, i + 1))
+
+            os.rename(self.path, "%s.1" % self.path)
+
+        self._file = open(self.path, 'w')
+        self._size = 0
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -4,8 +4,11 @@ DNSHost objects related commands
 """
 
 from sitebuilder.abstraction.interface import ISite
+from sitebuilder.abstraction.site.record import site_to_dict, site_from_dict
 from sitebuilder.command.interface import ICommand, ICommandLogged
 from sitebuilder.command.base import BaseCommand
+from sitebuilder.utils.driver.index import SITE_CRITERIA, get_cursor
+from sitebuilder.exception import BackendError, ConflictError
 from zope.interface import implements
 import re
 
@@ -42,12 +45,153 @@ class GetSiteByName(BaseCommand):
 
     def execute(self, driver):
         """
-        Looks for an host by host and domain name. Result is set a list of
-        DNSHost objects.
+        Looks for a site by host and domain name. Result is set to an
+        immutable site snapshot (see sitebuilder.abstraction.site.snapshot),
+        or None if no site matches.
         """
-        result = driver.get_site_by_name(self.name, self.domain)
+        result = driver.get_site_snapshot(self.name, self.domain)
         self.result = result
 
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        return {'name': self.name, 'domain': self.domain}
+
+
+class FindSites(BaseCommand):
+    """
+    Looks for the sites matching several criteria, such as all the
+    production sites using a pgsql database (see
+    sitebuilder.utils.driver.index.SITE_CRITERIA).
+
+    Results are ordered by domain then name, and may be paginated like
+    LookupHostByName ones. If fields are given, result is a list of tuples
+    of these dnshost fields values, as used by the sites list, instead of
+    site snapshots. Fields must include name and domain.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> command = FindSites({'platform': u'prod', 'website_maintenance': True},
+    ...                     limit=2, fields=('name', 'domain'))
+    >>> command.execute(TestBackendDriver)
+    >>> len(command.result), command.cursor == get_cursor(*command.result[-1])
+    (2, True)
+    >>> last = command.result[-1]
+    >>> command = FindSites(command.criteria, after=command.cursor)
+    >>> command.execute(TestBackendDriver)
+    >>> command.result[0].dnshost.name > last[0], command.cursor
+    (True, None)
+    >>> FindSites({'owner': u'me'})
+    Traceback (most recent call last):
+        ...
+    AttributeError: Unknown site criterion owner
+    """
+    implements(ICommand)
+
+    description = "Sites query"
+    criteria = None
+    limit = None
+    after = None
+    fields = None
+    cursor = None
+    version = None
+
+    def __init__(self, criteria, limit=None, after=None, fields=None):
+        """
+        Command initialization.
+
+        Parameters:
+            criteria    Dictionnary of the values sites attributes should
+                        have, by criterion name
+            limit       Maximum number of sites returned (None for no limit)
+            after       Cursor of the last site of the previous page
+            fields      dnshost fields returned (None for site snapshots)
+        """
+        BaseCommand.__init__(self)
+
+        for criterion in criteria:
+            if not criterion in SITE_CRITERIA:
+                raise AttributeError("Unknown site criterion %s" % criterion)
+        if fields is not None and not ('name' in fields and 'domain' in fields):
+            raise AttributeError("Fields should include name and domain")
+
+        # Criteria names are unicode strings once serialized
+        self.criteria = dict([ (str(criterion), value)
+                               for criterion, value in criteria.items() ])
+        self.limit = limit
+
+        if after is not None:
+            self.after = tuple(after)
+        if fields is not None:
+            self.fields = tuple(fields)
+
+    def execute(self, driver):
+        """
+        Looks for the sites matching the criteria
+        """
+        self.version = driver.get_version()
+        sites = driver.find_sites(self.limit, self.after, **self.criteria)
+
+        if not self.limit or len(sites) < self.limit:
+            self.cursor = None
+        else:
+            dnshost = sites[-1].dnshost
+            self.cursor = get_cursor(dnshost.name, dnshost.domain)
+
+        if self.fields is None:
+            self.result = sites
+        else:
+            self.result = [ tuple([ getattr(site.dnshost, field)
+                                    for field in self.fields ])
+                            for site in sites ]
+
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        parameters = {'criteria': self.criteria}
+
+        # Pagination parameters are only given when set
+        for attr in ('limit', 'after', 'fields'):
+            value = getattr(self, attr)
+
+            if value is not None:
+                parameters[attr] = value
+
+        return parameters
+
+
+class GetCatalogStats(BaseCommand):
+    """
+    Returns the catalog statistics: numbers of sites per platform, domain and
+    database type, and of done provisioning steps (see
+    sitebuilder.utils.driver.stats). Drivers keep them up to date, so that
+    dashboards don't need to read all the sites.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> command = GetCatalogStats()
+    >>> command.execute(TestBackendDriver)
+    >>> sorted(command.result['done'])
+    ['database', 'dnshost', 'repository', 'website']
+    >>> command.result['sites'] >= command.result['done']['website']
+    True
+    """
+    implements(ICommand)
+
+    description = "Catalog statistics"
+
+    def execute(self, driver):
+        """
+        Reads the catalog statistics
+        """
+        self.result = driver.get_catalog_stats()
+
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        return {}
+
 
 class AddSite(BaseCommand):
     """
@@ -79,38 +223,76 @@ class AddSite(BaseCommand):
         """
         name = self.site.dnshost.name
         domain = self.site.dnshost.domain
-        hosts = driver.lookup_host_by_name(name, domain)
 
-        if len(hosts):
+        if not driver.insert_if_absent(self.site):
             self.mesg = "Site %s.%s already exists" % (name, domain)
             raise ValueError(self.mesg)
 
-        driver.add_site(self.site)
         self.mesg = "Site %s.%s successfully added" % (name, domain)
 
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        return {'site': site_to_dict(self.site)}
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """
+        Builds a command from parameters returned by get_parameters
+        """
+        return cls(site_from_dict(parameters['site']))
+
 
 class UpdateSite(BaseCommand):
     """
-    Edits a new site into the backend applying the values from site object
+    Edits a new site into the backend applying the values from site object.
+
+    Changes are only applied if the stored site was not changed since the
+    version they are based on (the site version by default): concurrent
+    updates of the same site fail instead of overwriting each other.
+
+    >>> from sitebuilder.utils.driver.test import TestBackendDriver
+    >>> site = TestBackendDriver.get_site_by_name(u'name5', u'bpinet.com')
+    >>> site.dnshost.description = u'updated'
+    >>> command = UpdateSite(site)
+    >>> command.execute(TestBackendDriver)
+    >>> command.mesg
+    u'Site name5.bpinet.com successfully updated'
+    >>> command = UpdateSite(site, site.version - 1)
+    >>> command.execute(TestBackendDriver)
+    Traceback (most recent call last):
+        ...
+    ValueError: Site name5.bpinet.com was changed meanwhile, reload it
+    >>> command = UpdateSite.from_parameters(command.get_parameters())
+    >>> command.version == site.version - 1
+    True
     """
     implements(ICommand, ICommandLogged)
     description = "Update site"
 
     site = None
+    version = None
 
-    def __init__(self, site):
+    def __init__(self, site, version=None):
         """
         Command initialization.
 
         Parameters:
             site    Site object to apply attributes to backend
+            version Stored site version changes are based on (None for the
+                    site version)
         """
         BaseCommand.__init__(self)
 
         if not ISite.providedBy(site):
             raise AttributeError("Invalid site parametee. Should implement ISite")
 
+        if version is None:
+            version = site.version
+
         self.site = site
+        self.version = version
 
     def execute(self, driver):
         """
@@ -118,19 +300,34 @@ class UpdateSite(BaseCommand):
         """
         name = self.site.dnshost.name
         domain = self.site.dnshost.domain
-        hosts = driver.lookup_host_by_name(name, domain)
 
-        if not len(hosts):
-            self.mesg = "Unknown site %s.%s" % (name, domain)
+        try:
+            self.site.version = driver.update_if_version(self.site,
+                                                         self.version)
+        except ConflictError:
+            self.mesg = "Site %s.%s was changed meanwhile, reload it" % (
+                name, domain)
             raise ValueError(self.mesg)
-
-        if len(hosts) > 1:
-            self.mesg = "Several sites named %s.%s found" % (name, domain)
+        except BackendError:
+            self.mesg = "Unknown site %s.%s" % (name, domain)
             raise ValueError(self.mesg)
 
-        driver.update_site(self.site)
         self.mesg = "Site %s.%s successfully updated" % (name, domain)
 
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        return {'site': site_to_dict(self.site), 'version': self.version}
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """
+        Builds a command from parameters returned by get_parameters
+        """
+        return cls(site_from_dict(parameters['site']),
+                   parameters.get('version'))
+
 
 class DeleteSite(BaseCommand):
     """
@@ -167,15 +364,19 @@ class DeleteSite(BaseCommand):
         Tells backend driver to delete site idetified by name and domain
         parameter
         """
-        hosts = driver.lookup_host_by_name(self.name, self.domain)
-
-        if not len(hosts):
+        if not driver.delete_if_exists(self.name, self.domain):
             self.mesg = "Unknown site %s.%s" % (self.name, self.domain)
             raise ValueError(self.mesg)
 
-        if len(hosts) > 1:
-            self.mesg = "Several sites named %s.%s found" % (self.name, self.domain)
-            raise ValueError(self.mesg)
-
-        driver.delete_site(self.name, self.domain)
         self.mesg = "Site %s.%s successfully deleted" % (self.name, self.domain)
+
+    def get_parameters(self):
+        """
+        Returns the command initialization parameters
+        """
+        return {'name': self.name, 'domain': self.domain}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""
+Persistent command history store.
+
+Logged commands records (see sitebuilder.command.sink.get_command_record)
+are stored in a local SQLite database, indexed by target site, command
+class, status and time, so that questions like "what happened to
+foo.bpinet.com this week" are answered without scanning the whole history.
+"""
+
+from sitebuilder.command.sink import BufferedLogSink
+from threading import local
+from time import time
+import sqlite3
+import os
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    target TEXT,
+    command TEXT NOT NULL,
+    status TEXT NOT NULL,
+    description TEXT,
+    wait REAL,
+    duration REAL,
+    mesg TEXT,
+    exception TEXT
+);
+CREATE INDEX IF NOT EXISTS history_time ON history (time);
+CREATE INDEX IF NOT EXISTS history_target ON history (target, time);
+CREATE INDEX IF NOT EXISTS history_command ON history (command, time);
+CREATE INDEX IF NOT EXISTS history_status ON history (status, time);
+"""
+
+_COLUMNS = ('time', 'target', 'command', 'status', 'description', 'wait',
+            'duration', 'mesg', 'exception')
+
+
+class HistoryStore(object):
+    """
+    SQLite backed command history store.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> tmpdir = mkdtemp()
+    >>> store = HistoryStore(os.path.join(tmpdir, 'history.db'))
+    >>> store.insert_many([
+    ...     {'time': 100.0, 'target': u'Name0.bpinet.com', 'command': 'AddSite',
+    ...      'status': 'success', 'mesg': 'Site name0.bpinet.com added'},
+    ...     {'time': 200.0, 'target': u'name0.bpinet.com',
+    ...      'command': 'UpdateSite', 'status': 'error', 'mesg': 'Failed'},
+    ...     {'time': 300.0, 'target': u'name1.bpinet.com',
+    ...      'command': 'UpdateSite', 'status': 'success'},
+    ...     ])
+
+    Targets are case insensitive. Most recent records come first.
+
+    >>> [ r['command'] for r in store.query(target='NAME0.bpinet.com') ]
+    [u'UpdateSite', u'AddSite']
+    >>> [ r['target'] for r in store.query(command='UpdateSite',
+    ...                                    status='success') ]
+    [u'name1.bpinet.com']
+    >>> [ r['time'] for r in store.query(target='name*', since=150) ]
+    [300.0, 200.0]
+
+    Expired records may be purged, and the database compacted
+
+    >>> store.purge(before=250)
+    2
+    >>> store.count()
+    1
+    >>> store.compact()
+    >>> store.close()
+    >>> rmtree(tmpdir)
+    """
+
+    def __init__(self, path, retention=None):
+        """
+        Store initialization.
+
+        Parameters:
+            path        SQLite database file path
+            retention   Number of seconds records are kept when purging
+                        expired records (None means forever)
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.retention = retention
+        self._local = local()
+        self._get_connection().executescript(_SCHEMA)
+
+    def _get_connection(self):
+        """
+        Returns the calling thread database connection
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+
+        return connection
+
+    def insert_many(self, records):
+        """
+        Inserts log records in a single transaction
+        """
+        rows = []
+
+        for record in records:
+            row = [ record.get(column) for column in _COLUMNS ]
+
+            # Records of commands that were never run have no finish time
+            if row[0] is None:
+                row[0] = time()
+
+            # Site targets are case insensitive
+            if row[1] is not None:
+                row[1] = row[1].lower()
+
+            rows.append(row)
+
+        connection = self._get_connection()
+
+        with connection:
+            connection.executemany(
+                "INSERT INTO history (%s) VALUES (%s)" % (
+                    ", ".join(_COLUMNS), ", ".join("?" * len(_COLUMNS))),
+                rows)
+
+    def query(self, target=None, command=None, status=None, since=None,
+              until=None, limit=100):
+        """
+        Returns the records matching all the set criteria, most recent
+        first, as a list of dictionnaries.
+
+        Parameters:
+            target  Site name (name.domain). A trailing * matches any site
+                    starting with the given prefix.
+            command Command class name
+            status  Command status name (success, error)
+            since   Minimum record time (seconds since epoch)
+            until   Maximum record time (seconds since epoch)
+            limit   Maximum number of records returned (None for no limit)
+        """
+        clauses = []
+        parameters = []
+
+        if target is not None:
+            target = target.lower()
+
+            if target.endswith('*') and not '*' in target[:-1]:
+                # Prefix search is an index range scan
+                prefix = target[:-1]
+                clauses.append("target >= ? AND target < ?")
+                parameters.extend([prefix, prefix + u'\uffff'])
+            elif '*' in target:
+                clauses.append("target GLOB ?")
+                parameters.append(target)
+            else:
+                clauses.append("target = ?")
+                parameters.append(target)
+
+        if command is not None:
+            clauses.append("command = ?")
+            parameters.append(command)
+
+        if status is not None:
+            clauses.append("status = ?")
+            parameters.append(status)
+
+        if since is not None:
+            clauses.append("time >= ?")
+            parameters.append(since)
+
+        if until is not None:
+            clauses.append("time <= ?")
+            parameters.append(until)
+
+        sql = "SELECT %s FROM history" % ", ".join(_COLUMNS)
+
+        if len(clauses):
+            sql += " WHERE " + " AND ".join(clauses)
+
+        sql += " ORDER BY time DESC"
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+
+        cursor = self._get_connection().execute(sql, parameters)
+        return [ dict(zip(_COLUMNS, row)) for row in cursor ]
+
+    def count(self):
+        """
+        Returns the number of stored records
+        """
+        return self._get_connection().execute(
+            "SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def purge(self, before=None):
+        """
+        Deletes records older than before (seconds since epoch). If before
+        is not set, records older than retention are deleted. Returns the
+        number of deleted records.
+        """
+        if before is None:
+            if self.retention is None:
+                return 0
+            before = time() - self.retention
+
+        connection = self._get_connection()
+
+        with connection:
+            cursor = connection.execute(
+                "DELETE FROM history WHERE time < ?", (before,))
+
+        return cursor.rowcount
+
+    def compact(self):
+        """
+        Purges expired records and gives free pages back to the file system
+        """
+        self.purge()
+        connection = self._get_connection()
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.execute("VACUUM")
+
+    def close(self):
+        """
+        Closes the calling thread database connection
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class HistoryStoreSink(BufferedLogSink):
+    """
+    Log sink writing records into a HistoryStore, one transaction per batch.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> tmpdir = mkdtemp()
+    >>> store = HistoryStore(os.path.join(tmpdir, 'history.db'))
+    >>> sink = HistoryStoreSink(store)
+    >>> sink.write({'time': 100.0, 'target': u'name0.bpinet.com',
+    ...             'command': 'AddSite', 'status': 'success'})
+    >>> sink.close()
+    >>> store.count()
+    1
+    >>> rmtree(tmpdir)
+    """
+
+    def __init__(self, store, buffer_size=256, flush_interval=1.0):
+        """
+        Sink initialization
+        """
+        self.store = store
+        BufferedLogSink.__init__(self, buffer_size, flush_interval)
+
+    def write_records(self, records):
+        """
+        Writes records into the store
+        """
+        self.store.insert_many(records)
+
+    def close_output(self):
+        """
+        Closes writer thread database connection
+        """
+        self.store.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -9,25 +9,34 @@ from sitebuilder.presentation.gtk.list import ListLogsPresentationAgent
 from sitebuilder.control.base import BaseControlAgent
 from sitebuilder.control.detail import DetailMainControlAgent
 from sitebuilder.abstraction.site.factory import site_factory
+from sitebuilder.abstraction.site.snapshot import get_mutable_site
 from sitebuilder.command.interface import COMMAND_SUCCESS
 from sitebuilder.abstraction.interface import ISiteNew
 from sitebuilder.presentation.interface import IPresentationAgent
 from sitebuilder.utils.parameters import ACTION_ADD, ACTION_VIEW, ACTION_SUBMIT
 from sitebuilder.utils.parameters import ACTION_EDIT, ACTION_DELETE
 from sitebuilder.utils.parameters import ACTION_RELOAD, ACTION_CLEARLOGS
-from sitebuilder.utils.parameters import ACTION_SHOWLOGS
+from sitebuilder.utils.parameters import ACTION_SHOWLOGS, ACTION_LOADMORE
+from sitebuilder.utils.parameters import SITES_PAGE_SIZE
+from sitebuilder.utils.parameters import LOGS_HISTORY_SIZE, LOGS_DETAIL_SIZE
 from sitebuilder.command.scheduler import enqueue_command
-from sitebuilder.command.host import LookupHostByName
+from sitebuilder.command.host import LookupHostByName, GetHostChanges
+from sitebuilder.utils.driver.index import get_cursor
 from sitebuilder.command.site import GetSiteByName, AddSite, UpdateSite
-from sitebuilder.command.site import DeleteSite
+from sitebuilder.command.site import DeleteSite, FindSites
+from sitebuilder.command.history import CommandHistory
 from sitebuilder.exception import SiteError, FieldFormatError
 from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
 from sitebuilder.event.events import UIActionEvent, AppActionEvent
 from sitebuilder.event.events import UIWidgetEvent, CommandExecEvent
 from zope.interface import alsoProvides
+from bisect import bisect_left
 import re
 import gtk
 
+# Host fields displayed by the sites list, in columns order
+SITES_LIST_FIELDS = ('name', 'domain', 'platform', 'description')
+
 
 class ListMainControlAgent(object):
     """
@@ -59,7 +68,19 @@ class ListMainControlAgent(object):
         self._presentation_agent.attach_slave('logs', 'vbox_general',
                                               slave.get_presentation_agent())
 
-        # Initial sites search (may be disabled id database is really big)
+        # Sites are looked up one page at a time. The last lookup command is
+        # kept so that results of outdated lookups are ignored, and the next
+        # page starts after the cursor of the last one.
+        self._sites_command = None
+        self._sites_cursor = None
+        self._sites_loading = False
+
+        # Driver change version the list is up to date with, and the pending
+        # changes lookup: after writes, only changed rows are reloaded
+        self._sites_version = None
+        self._changes_command = None
+
+        # Initial sites search: only the first page is loaded
         self.reload_sites()
 
     def app_action_evt_callback(self, event):
@@ -73,6 +94,9 @@ class ListMainControlAgent(object):
         if event.action == ACTION_RELOAD:
             self.reload_sites()
             return
+        if event.action == ACTION_LOADMORE:
+            self.load_more_sites()
+            return
 
         # Checks that ids parameter is correctly set in event parameters
         parms = event.parameters
@@ -195,28 +219,138 @@ class ListMainControlAgent(object):
 
     def reload_sites(self):
         """
-        Reloads site list by submitting a lookup query
+        Reloads site list by submitting a lookup query for the first page of
+        sites
         """
         sca = self._sites_control_agent
         filter_name = sca.get_value('filter_name')
         filter_domain = sca.get_value('filter_domain')
 
-        command = LookupHostByName(filter_name, filter_domain)
+        self._sites_cursor = None
+        self._sites_version = None
+        self._changes_command = None
+        self.enqueue_sites_lookup(
+            LookupHostByName(filter_name, filter_domain, SITES_PAGE_SIZE,
+                             fields=SITES_LIST_FIELDS))
+
+    def find_sites(self, **criteria):
+        """
+        Replaces the sites list with the first page of the sites matching
+        criteria (see sitebuilder.utils.driver.index.SITE_CRITERIA), such as
+        find_sites(platform=u'prod', database_type=u'pgsql')
+        """
+        self._sites_cursor = None
+        self._sites_version = None
+        self._changes_command = None
+        self.enqueue_sites_lookup(
+            FindSites(criteria, SITES_PAGE_SIZE, fields=SITES_LIST_FIELDS))
+
+    def load_more_sites(self):
+        """
+        Submits a lookup query for the next page of sites, if the last page
+        was full and is not being loaded
+        """
+        if self._sites_loading or self._sites_cursor is None:
+            return
+
+        command = self._sites_command
+
+        if isinstance(command, FindSites):
+            command = FindSites(command.criteria, SITES_PAGE_SIZE,
+                                after=self._sites_cursor,
+                                fields=SITES_LIST_FIELDS)
+        else:
+            command = LookupHostByName(command.name, command.domain,
+                                       SITES_PAGE_SIZE,
+                                       after=self._sites_cursor,
+                                       fields=SITES_LIST_FIELDS)
+
+        self.enqueue_sites_lookup(command)
+
+    def enqueue_sites_lookup(self, command):
+        """
+        Enqueues a sites lookup command, which replaces the pending one
+        """
+        self._sites_command = command
+        self._sites_loading = True
         command.get_event_bus().subscribe(CommandExecEvent,
                                           self.cb_set_sites)
         enqueue_command(command)
 
     def cb_set_sites(self, event):
         """
-        Site list has been reloaded and result has to be taken in account
+        Site list page has been loaded and result has to be taken in account
         """
         command = event.source
         sca = self._sites_control_agent
 
+        # Ignores the results of lookups replaced by a newer one
+        if command is not self._sites_command:
+            return
+
+        self._sites_loading = False
+
         if command.status == COMMAND_SUCCESS:
-            sca.set_value('hosts', command.result)
+            self._sites_cursor = command.cursor
+
+            if command.after is None:
+                self._sites_version = command.version
+                sca.set_value('hosts', command.result)
+            else:
+                sca.set_value('more_hosts', command.result)
         # TODO: manage error reporting for non logged commands
 
+    def refresh_sites(self):
+        """
+        Submits a lookup query for the sites changed since the list was
+        loaded. The whole list is reloaded if its first page isn't loaded
+        yet. Query results are reloaded, as changes are filtered on names
+        only.
+        """
+        command = self._sites_command
+
+        if isinstance(command, FindSites):
+            self.find_sites(**command.criteria)
+            return
+
+        if self._sites_version is None:
+            self.reload_sites()
+            return
+
+        command = GetHostChanges(self._sites_version, command.name,
+                                 command.domain, SITES_LIST_FIELDS)
+        self._changes_command = command
+        command.get_event_bus().subscribe(CommandExecEvent,
+                                          self.cb_apply_site_changes)
+        enqueue_command(command)
+
+    def cb_apply_site_changes(self, event):
+        """
+        Changed sites have been looked up, and have to be applied to the
+        list
+        """
+        command = event.source
+
+        # Ignores the results of lookups replaced by a newer one, or by a
+        # reload
+        if command is not self._changes_command:
+            return
+
+        self._changes_command = None
+
+        if command.status != COMMAND_SUCCESS:
+            return
+
+        # Driver no longer knows all the changes
+        if command.result is None:
+            self.reload_sites()
+            return
+
+        deleted, hosts = command.result
+        self._sites_version = command.current
+        self._sites_control_agent.apply_host_changes(deleted, hosts,
+                                                     self._sites_cursor)
+
     def cb_reload_sites(self, event):
         """
         A command has been executted that needs sites list to be refreshed
@@ -224,7 +358,7 @@ class ListMainControlAgent(object):
         command = event.source
 
         if command.status == COMMAND_SUCCESS:
-            self.reload_sites()
+            self.refresh_sites()
         # TODO: manage error reporting for non logged commands
 
     def cb_show_detail_dialog_rw(self, event):
@@ -234,7 +368,8 @@ class ListMainControlAgent(object):
         command = event.source
 
         if command.status == COMMAND_SUCCESS:
-            site = command.result
+            # Detail dialogs observe site changes: snapshots are promoted
+            site = get_mutable_site(command.result)
             self.show_detail_dialog(site, False)
         # TODO: manage error reporting for non logged commands
 
@@ -245,7 +380,8 @@ class ListMainControlAgent(object):
         command = event.source
 
         if command.status == COMMAND_SUCCESS:
-            site = command.result
+            # Detail dialogs observe site changes: snapshots are promoted
+            site = get_mutable_site(command.result)
             self.show_detail_dialog(site, True)
         # TODO: manage error reporting for non logged commands
 
@@ -295,6 +431,7 @@ class ListSitesControlAgent(BaseControlAgent):
         """
         BaseControlAgent.__init__(self)
         self._hosts = []
+        self._keys = []
         self._filter_name = '*'
         self._filter_name_re = re.compile(r"^[\w\d\*_-]*$")
         self._filter_domain = '*'
@@ -342,26 +479,57 @@ class ListSitesControlAgent(BaseControlAgent):
             self._filter_domain = value
             self.reload_sites()
         elif name == "hosts":
-            self._hosts = value
+            self._hosts = list(value)
+            self._keys = [ get_cursor(row[0], row[1]) for row in value ]
             self.load_widgets_data()
+        elif name == "more_hosts":
+            self._hosts.extend(value)
+            self._keys.extend([ get_cursor(row[0], row[1]) for row in value ])
+            self.get_presentation_agent().append_items('site_list', value)
         else:
             raise AttributeError("%s object has no attribute '%s'" %
                                  (self.__class__.__name__, name))
 
-    def load_widgets_data(self):
+    def apply_host_changes(self, deleted, hosts, cursor=None):
         """
-        Roloads hosts list widget
+        Applies host changes to the list, without reloading it.
+
+        Parameters:
+            deleted (name, domain) tuples of deleted hosts
+            hosts   Inserted or updated hosts rows
+            cursor  Cursor of the last loaded host if more hosts may be
+                    loaded: inserted hosts following it are ignored, as they
+                    will be part of next pages.
         """
-        sites = []
+        pa = self.get_presentation_agent()
+
+        for name, domain in deleted:
+            key = get_cursor(name, domain)
+            index = bisect_left(self._keys, key)
 
-        for dnshost in self._hosts:
-            name = dnshost.name
-            domain = dnshost.domain
-            platform = dnshost.platform
-            description = dnshost.description
-            sites.append((name, domain, platform, description))
+            if index < len(self._keys) and self._keys[index] == key:
+                del self._keys[index]
+                del self._hosts[index]
+                pa.remove_site_row(name, domain)
 
-        self.get_presentation_agent().set_items('site_list', sites)
+        for row in hosts:
+            key = get_cursor(row[0], row[1])
+            index = bisect_left(self._keys, key)
+
+            if index < len(self._keys) and self._keys[index] == key:
+                self._hosts[index] = row
+                pa.update_site_row(row)
+            elif cursor is None or key <= cursor:
+                self._keys.insert(index, key)
+                self._hosts.insert(index, row)
+                pa.insert_site_row(index, row)
+
+    def load_widgets_data(self):
+        """
+        Roloads hosts list widget. Hosts are SITES_LIST_FIELDS values tuples,
+        used as list rows as is.
+        """
+        self.get_presentation_agent().set_items('site_list', self._hosts)
 
     def get_presentation_agent(self):
         """
@@ -380,7 +548,7 @@ class ListSitesControlAgent(BaseControlAgent):
                 AppActionEvent(self, action=event.action,
                     parameters={'sites': pa.get_value('site_list')}))
 
-        elif event.action in (ACTION_ADD, ACTION_RELOAD):
+        elif event.action in (ACTION_ADD, ACTION_RELOAD, ACTION_LOADMORE):
             self.get_event_bus().publish(AppActionEvent(self, action=event.action))
         else:
             raise NotImplementedError("Unhandled action %d triggered" %
@@ -423,7 +591,7 @@ class ListLogsControlAgent(object):
         """
         Initializes control agent.
         """
-        self._commands = []
+        self._commands = CommandHistory(LOGS_HISTORY_SIZE, LOGS_DETAIL_SIZE)
         pa = ListLogsPresentationAgent(self)
         pa.get_event_bus().subscribe(UIActionEvent, self.action_evt_callback)
         self._presentation_agent = pa
@@ -453,7 +621,7 @@ class ListLogsControlAgent(object):
         """
         # Handles add action that do nat need any parameter
         if event.action == ACTION_CLEARLOGS:
-            del (self._commands[:])
+            self._commands.clear()
             self.load_widgets_data()
         elif event.action == ACTION_SHOWLOGS:
             # Checks that ids parameter is correctly set in event parameters
@@ -475,9 +643,15 @@ class ListLogsControlAgent(object):
             text = "%s\n\nCommand status:\n\nCommand was successfully executed" % \
                 command.mesg
         else:
+            traceback = command.traceback
+
+            # Old commands are reduced to summaries without traceback
+            if traceback is None:
+                traceback = "(no longer available)"
+
             text = ("%s\n\nCommand status:\n\nAn error occured: %s\n\n" + \
-                "Stack trace:\n\n%s") % (command.mesg, str(command.exception),
-                command.traceback)
+                "Stack trace:\n\n%s") % (command.mesg, command.exception,
+                traceback)
 
         dialog = gtk.MessageDialog(
             self.get_presentation_agent().get_toplevel(),
@@ -498,8 +672,17 @@ class ListLogsControlAgent(object):
         """
         CommandObserver trigger mmethod local implementation
         """
-        self._commands.append(event.source)
-        self.load_widgets_data()
+        evicted, demoted = self._commands.append(event.source)
+        pa = self._presentation_agent
+
+        # Updates only the rows that changed instead of reloading the list
+        if evicted:
+            pa.remove_items('logs_list', evicted)
+
+        pa.append_item('logs_list', event.source)
+
+        if demoted is not None:
+            pa.update_item('logs_list', demoted, self._commands[demoted])
 
     def destroy(self):
         """
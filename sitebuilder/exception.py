@@ -19,7 +19,21 @@ class BackendError(Exception):
     """
 
 
+class ConflictError(BackendError):
+    """
+    Exception that should be risen when a site was changed in the backend
+    since the version a write was based on
+    """
+
+
 class SiteError(Exception):
     """
     Exception that should be risen when an error occurs on a site configuration
     """
+
+
+class CommandError(Exception):
+    """
+    Exception standing for an error risen by a command that was executed in
+    an other process. Only the original error message is kept.
+    """
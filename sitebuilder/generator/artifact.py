@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+"""
+Configuration artifacts generator.
+
+Each site configuration is rendered into configuration files (artifacts)
+from templates (see TEMPLATES_BASEDIR): a web server virtual host when its
+website is enabled, a DNS record, and database grants when its database is
+enabled. Artifacts are stored by kind and domain:
+
+    vhost/bpinet.com/name0.conf
+    dns/bpinet.com/name0.zone
+    grants/bpinet.com/name0.sql
+
+Templates are string.Template files. They are compiled once, and cached
+with a digest of their source and the names of the variables they use.
+
+The fingerprint of an artifact digests its inputs: the templates it uses,
+and the site values these templates use. Fingerprints are kept in a manifest
+(an SQLite database in the artifacts directory), so that an artifact is
+only rendered and written again if its inputs changed. Files are replaced
+atomically: readers never see partial files. Generators of several
+processes sharing a directory must not run at the same time, the
+application runs them in a single process (see
+sitebuilder.command.scheduler.PeriodicJob).
+
+A generator pass only looks at the sites changed since the previous pass
+(see sitebuilder.utils.driver.changes), so that regenerating artifacts after
+a single site edit touches a single file, whatever the catalog size. A full
+pass is done the first time, when changes are no longer kept by the driver,
+when templates changed, or when the catalog version is lower than the one
+of the previous pass: the catalog was then replaced (such as a recreated
+sites file), and its changes don't follow the previous pass ones.
+"""
+
+from sitebuilder.abstraction.site.record import get_site_key
+from sitebuilder.utils.parameters import TEMPLATES_BASEDIR, ARTIFACTS_DIR
+from sitebuilder.exception import SiteError
+from string import Template
+from threading import Lock, local
+from hashlib import sha1
+from tempfile import mkstemp
+import sqlite3
+import os
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifact (
+    path TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS generator (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Manifest file name, in the artifacts directory
+MANIFEST_FILE = '.manifest.db'
+
+# Permissions of written files, temporary files being private
+_FILE_MODE = 0644
+
+
+def get_variables(site):
+    """
+    Returns the dictionnary of the site values templates are given. Missing
+    values are empty strings.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> variables = get_variables(get_test_site(u'name0'))
+    >>> variables['fqdn'], variables['platform'], variables['access']
+    (u'name0.bpinet.com', u'prod', u'internal')
+    """
+    dnshost = site.dnshost
+    variables = {
+        'name': dnshost.name.lower(),
+        'domain': dnshost.domain.lower(),
+        'fqdn': get_site_key(dnshost.name, dnshost.domain),
+        'platform': dnshost.platform,
+        'description': dnshost.description,
+        'template': site.website.template,
+        'access': site.website.access,
+        'database_type': site.database.type,
+        'database_name': site.database.name,
+        'database_username': site.database.username,
+        }
+
+    for name, value in variables.items():
+        if value is None:
+            variables[name] = u''
+
+    return variables
+
+
+def get_vhost_templates(site):
+    """
+    Returns the templates of the virtual host of a site, or None if its
+    website is disabled
+    """
+    website = site.website
+
+    if not website.enabled:
+        return None
+
+    templates = [ ('access_rules', 'access/%s.conf' % website.access) ]
+
+    if website.maintenance:
+        templates.append(('maintenance_rules', 'vhost/maintenance.conf'))
+
+    templates.append((None, 'vhost/%s.conf' % website.template))
+
+    return templates
+
+
+def get_dns_templates(site):
+    """
+    Returns the templates of the DNS record of a site
+    """
+    return [ (None, 'dns/record.zone') ]
+
+
+def get_grants_templates(site):
+    """
+    Returns the templates of the database grants of a site, or None if its
+    database is disabled
+    """
+    if not site.database.enabled:
+        return None
+
+    return [ (None, 'grants/%s.sql' % site.database.type) ]
+
+
+# Artifacts kinds: (kind, file extension, templates function). Templates
+# functions return lists of (variable, template path) tuples: each template
+# is rendered in turn, and stored in variable for the next ones. The last
+# one, whose variable is None, renders the artifact.
+ARTIFACT_KINDS = (
+    ('vhost', '.conf', get_vhost_templates),
+    ('dns', '.zone', get_dns_templates),
+    ('grants', '.sql', get_grants_templates),
+    )
+
+# Variables templates may use, set by other templates
+_SNIPPETS = ('access_rules', 'maintenance_rules')
+
+
+def get_artifact_path(kind, name, domain, extension):
+    """
+    Returns the path of a site artifact, relative to the artifacts
+    directory.
+
+    >>> get_artifact_path('vhost', u'Name0', u'bpinet.com', '.conf')
+    u'vhost/bpinet.com/name0.conf'
+    """
+    return u'%s/%s/%s%s' % (kind, domain.lower(), name.lower(), extension)
+
+
+def open_temp_file(path):
+    """
+    Returns a (stream, path) tuple of a new temporary file, opened for
+    writing in the directory of a file it will replace, so that it is
+    renamed atomically. Each writer gets its own file. Missing directories
+    are created.
+    """
+    directory = os.path.dirname(path)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    handle, temp_path = mkstemp(dir=directory,
+                                prefix='.%s.' % os.path.basename(path))
+    os.fchmod(handle, _FILE_MODE)
+
+    return os.fdopen(handle, 'wb'), temp_path
+
+
+def write_file(path, content):
+    """
+    Replaces a file content atomically: content is written to a temporary
+    file, renamed once complete. The temporary file is removed if writing
+    fails. Missing directories are created.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> path = os.path.join(directory, 'vhost', 'name0.conf')
+    >>> write_file(path, 'content')
+    >>> write_file(path, None)
+    Traceback (most recent call last):
+        ...
+    TypeError: argument 1 must be string or buffer, not None
+    >>> open(path).read(), os.listdir(os.path.dirname(path))
+    ('content', ['name0.conf'])
+    >>> rmtree(directory)
+    """
+    stream, temp_path = open_temp_file(path)
+
+    try:
+        with stream:
+            stream.write(content)
+
+        os.rename(temp_path, path)
+    except:
+        os.unlink(temp_path)
+        raise
+
+
+class TemplateCache(object):
+    """
+    Compiled templates, loaded once from a templates directory, with the
+    digests of their sources.
+
+    >>> cache = TemplateCache(TEMPLATES_BASEDIR)
+    >>> template, digest, names = cache.get('dns/record.zone')
+    >>> template is cache.get('dns/record.zone')[0], len(digest)
+    (True, 40)
+    >>> sorted(names)
+    ['domain', 'name', 'platform']
+    >>> cache.get('vhost/unknown.conf')
+    Traceback (most recent call last):
+        ...
+    SiteError: Unknown template vhost/unknown.conf
+    """
+
+    def __init__(self, directory=TEMPLATES_BASEDIR):
+        """
+        Cache initialization
+        """
+        self.directory = directory
+        self._templates = {}
+        self._lock = Lock()
+
+    def get(self, path):
+        """
+        Returns the (template, source digest, variables names) tuple of a
+        template, given its path relative to the templates directory
+        """
+        result = self._templates.get(path)
+
+        if result is None:
+            try:
+                with open(os.path.join(self.directory, path), 'rb') as stream:
+                    source = stream.read()
+            except IOError:
+                raise SiteError("Unknown template %s" % path)
+
+            template = Template(source.decode('utf-8'))
+            names = frozenset([ str(match.group('named') or
+                                    match.group('braced'))
+                                for match in
+                                template.pattern.finditer(template.template)
+                                if match.group('named') or
+                                match.group('braced') ])
+            result = (template, sha1(source).hexdigest(), names)
+
+            with self._lock:
+                self._templates[path] = result
+
+        return result
+
+    def get_digest(self):
+        """
+        Returns a digest of the paths and modification times of the
+        templates files. It changes when templates are changed.
+        """
+        digest = sha1()
+
+        for root, directories, files in sorted(os.walk(self.directory)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(path)
+                digest.update(repr(os.path.getmtime(path)))
+
+        return digest.hexdigest()
+
+    def clear(self):
+        """
+        Forgets compiled templates, so that they are loaded again
+        """
+        with self._lock:
+            self._templates.clear()
+
+
+class ArtifactGenerator(object):
+    """
+    Incremental site configuration artifacts generator.
+
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> driver = MemoryBackendDriver()
+    >>> driver.add_sites([ get_test_site(u'name%d' % num) for num in range(3) ])
+    >>> generator = ArtifactGenerator(directory)
+
+    The first pass renders all the artifacts
+
+    >>> written, removed = generator.update(driver)
+    >>> len(written), removed
+    (9, [])
+    >>> print open(os.path.join(directory, 'dns/bpinet.com/name0.zone')).read(),
+    name0    IN    CNAME    front-prod.bpinet.com.
+
+    Next passes only render the artifacts of changed sites, whose inputs
+    changed
+
+    >>> site = driver.get_site_by_name(u'name1', u'bpinet.com')
+    >>> site.website.maintenance = False
+    >>> driver.update_site(site)
+    >>> generator.update(driver)
+    ([u'vhost/bpinet.com/name1.conf'], [])
+    >>> 'maintenance' in open(os.path.join(
+    ...     directory, 'vhost/bpinet.com/name1.conf')).read()
+    False
+    >>> site.dnshost.description = u'new desc'
+    >>> driver.update_site(site)
+    >>> generator.update(driver)
+    ([u'grants/bpinet.com/name1.sql', u'vhost/bpinet.com/name1.conf'], [])
+    >>> driver.update_site(site)
+    >>> generator.update(driver)
+    ([], [])
+    >>> site.database.enabled = False
+    >>> driver.update_site(site)
+    >>> driver.delete_site(u'name2', u'bpinet.com')
+    >>> written, removed = generator.update(driver)
+    >>> written, sorted(removed)
+    ([], [u'dns/bpinet.com/name2.zone', u'grants/bpinet.com/name1.sql', \
+u'grants/bpinet.com/name2.sql', u'vhost/bpinet.com/name2.conf'])
+
+    Fingerprints are kept in the manifest, so that a new generator doesn't
+    render artifacts again
+
+    >>> generator.close()
+    >>> generator = ArtifactGenerator(directory)
+    >>> generator.generate(driver)
+    ([], [])
+    >>> sorted(os.listdir(os.path.join(directory, 'vhost/bpinet.com')))
+    ['name0.conf', 'name1.conf']
+
+    A replaced catalog, whose version is lower than the previous pass one,
+    gets a full pass
+
+    >>> other = MemoryBackendDriver()
+    >>> other.add_site(get_test_site(u'name3'))
+    >>> other.get_version() < generator.version
+    True
+    >>> written, removed = generator.update(other)
+    >>> written
+    [u'dns/bpinet.com/name3.zone', u'grants/bpinet.com/name3.sql', \
+u'vhost/bpinet.com/name3.conf']
+    >>> sorted(os.listdir(os.path.join(directory, 'vhost/bpinet.com')))
+    ['name3.conf']
+    >>> generator.close()
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, directory=ARTIFACTS_DIR, templates=None):
+        """
+        Generator initialization.
+
+        Parameters:
+            directory   Artifacts directory
+            templates   Template cache (one using TEMPLATES_BASEDIR by
+                        default)
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if templates is None:
+            templates = TemplateCache()
+
+        self.directory = directory
+        self.templates = templates
+        self._path = os.path.join(directory, MANIFEST_FILE)
+        self._local = local()
+        self._lock = Lock()
+
+        connection = self._get_connection()
+        connection.executescript(_SCHEMA)
+        self._fingerprints = dict(connection.execute(
+            "SELECT path, fingerprint FROM artifact").fetchall())
+        values = dict(connection.execute(
+            "SELECT name, value FROM generator").fetchall())
+
+        # Catalog version and templates digest of the last pass
+        self.version = values.get('version') and int(values['version'])
+        self._templates_digest = values.get('templates')
+
+    def _get_connection(self):
+        """
+        Returns the calling thread manifest connection
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30)
+            self._local.connection = connection
+
+        return connection
+
+    def close(self):
+        """
+        Closes the calling thread manifest connection
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def render(self, site):
+        """
+        Returns the dictionnary of the (fingerprint, render function) tuples
+        of the artifacts of a site, by artifact path. Artifacts are only
+        rendered by calling their render function.
+        """
+        variables = get_variables(site)
+        artifacts = {}
+
+        for kind, extension, get_templates in ARTIFACT_KINDS:
+            templates = get_templates(site)
+
+            if templates is None:
+                continue
+
+            compiled = [ (variable, self.templates.get(path))
+                         for variable, path in templates ]
+            names = set()
+
+            for variable, (template, digest, used) in compiled:
+                names.update(used)
+
+            fingerprint = sha1(repr((
+                [ (variable, digest)
+                  for variable, (template, digest, used) in compiled ],
+                [ (name, variables.get(name)) for name in sorted(names) ]))
+                ).hexdigest()
+            path = get_artifact_path(kind, variables['name'],
+                                     variables['domain'], extension)
+            artifacts[path] = (fingerprint,
+                               lambda compiled=compiled: self._render(
+                                   compiled, variables))
+
+        return artifacts
+
+    @staticmethod
+    def _render(compiled, variables):
+        """
+        Renders templates, and returns the result of the last one
+        """
+        values = dict.fromkeys(_SNIPPETS, u'')
+        values.update(variables)
+
+        for variable, (template, digest, used) in compiled:
+            try:
+                content = template.substitute(values)
+            except (KeyError, ValueError), e:
+                raise SiteError("Template error: %s" % e)
+
+            if variable is None:
+                return content.encode('utf-8')
+
+            values[variable] = content
+
+    def _update(self, name, domain, site, changes):
+        """
+        Writes the artifacts of a site (None if deleted) whose fingerprint
+        changed, removes its other artifacts, and records fingerprints
+        changes (None for removed artifacts)
+        """
+        if site is None:
+            artifacts = {}
+        else:
+            artifacts = self.render(site)
+
+        for kind, extension, get_templates in ARTIFACT_KINDS:
+            path = get_artifact_path(kind, name, domain, extension)
+
+            if path in artifacts or not path in self._fingerprints:
+                continue
+
+            try:
+                os.unlink(os.path.join(self.directory, path))
+            except OSError:
+                pass
+
+            del self._fingerprints[path]
+            changes[path] = None
+
+        for path, (fingerprint, render) in artifacts.iteritems():
+            if self._fingerprints.get(path) == fingerprint:
+                continue
+
+            write_file(os.path.join(self.directory, path), render())
+            self._fingerprints[path] = fingerprint
+            changes[path] = fingerprint
+
+    def _save(self, changes, version, templates_digest):
+        """
+        Records fingerprints changes, and the catalog version and templates
+        digest of a pass, in the manifest. Returns the (written, removed)
+        tuple of the lists of the changed artifacts paths.
+        """
+        connection = self._get_connection()
+        written = sorted([ path for path, fingerprint in changes.iteritems()
+                           if fingerprint is not None ])
+        removed = sorted([ path for path, fingerprint in changes.iteritems()
+                           if fingerprint is None ])
+
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO artifact (path, fingerprint) "
+                "VALUES (?, ?)", [ (path, changes[path]) for path in written ])
+            connection.executemany("DELETE FROM artifact WHERE path = ?",
+                                   [ (path,) for path in removed ])
+            connection.executemany(
+                "INSERT OR REPLACE INTO generator (name, value) "
+                "VALUES (?, ?)", [ ('version', version),
+                                   ('templates', templates_digest) ])
+
+        self.version = version
+        self._templates_digest = templates_digest
+
+        return written, removed
+
+    def generate(self, driver):
+        """
+        Full pass: renders the artifacts of all the sites of a driver whose
+        inputs changed, and removes the artifacts of the sites that no
+        longer exist. Returns the (written, removed) tuple of the lists of
+        the changed artifacts paths.
+        """
+        with self._lock:
+            # Sites changed while iterating are rendered again next pass
+            version = driver.get_version()
+            self.templates.clear()
+            templates_digest = self.templates.get_digest()
+            changes = {}
+            seen = set()
+
+            for site in driver.iter_sites():
+                name = site.dnshost.name
+                domain = site.dnshost.domain
+                self._update(name, domain, site, changes)
+                seen.update([ get_artifact_path(kind, name, domain, extension)
+                              for kind, extension, get_templates
+                              in ARTIFACT_KINDS ])
+
+            for path in set(self._fingerprints) - seen:
+                try:
+                    os.unlink(os.path.join(self.directory, path))
+                except OSError:
+                    pass
+
+                del self._fingerprints[path]
+                changes[path] = None
+
+            return self._save(changes, version, templates_digest)
+
+    def update(self, driver):
+        """
+        Incremental pass: renders the artifacts of the sites changed since
+        the previous pass whose inputs changed, and removes the artifacts of
+        deleted sites. A full pass is done instead if no pass was done yet,
+        if changes are no longer kept by the driver, if templates changed,
+        or if the catalog version went back (the catalog was replaced).
+        Returns the (written, removed) tuple of the lists of the changed
+        artifacts paths.
+        """
+        if self.version is None or \
+                self.templates.get_digest() != self._templates_digest:
+            return self.generate(driver)
+
+        with self._lock:
+            version, changes = driver.changes_since(self.version)
+
+            if changes is not None and version >= self.version:
+                sites = {}
+
+                for num, kind, name, domain in changes:
+                    sites[get_site_key(name, domain)] = (name, domain)
+
+                changes = {}
+
+                for name, domain in sites.itervalues():
+                    self._update(name, domain,
+                                 driver.get_site_snapshot(name, domain),
+                                 changes)
+
+                return self._save(changes, version, self._templates_digest)
+
+        return self.generate(driver)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+DNS zone files builder.
+
+Each domain (see SiteDefaultsManager.get_domains) gets a zone file listing
+its hosts, rendered from the dns/zone.zone (header) and dns/record.zone (one
+per host) templates. Hosts are streamed from the driver by pages, and
+records are written by chunks to a temporary file while their digest is
+computed, so that memory use doesn't depend on the number of hosts.
+
+The first line of a zone file records the digest of its content and its
+serial:
+
+    ; sitebuilder zone digest=<sha1> serial=2010010100
+
+A zone file is only replaced when its digest changed. Its serial is then
+bumped (YYYYMMDDNN), so that secondary servers only transfer zones that
+really changed. Builders of several processes sharing a directory would
+bump serials twice: the application runs them in a single process (see
+sitebuilder.command.scheduler.PeriodicJob).
+
+Several domains are built in parallel by a pool of threads, which overlap
+the drivers lookups and the files writes of the domains.
+"""
+
+from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
+from sitebuilder.generator.artifact import TemplateCache, open_temp_file
+from sitebuilder.utils.driver.index import get_cursor
+from sitebuilder.utils.parameters import ZONES_DIR, ZONE_BATCH_SIZE
+from sitebuilder.utils.parameters import ZONE_WORKERS
+from sitebuilder.exception import SiteError
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from hashlib import sha1
+from time import strftime
+import re
+import os
+
+# First line of zone files, of fixed width so that it is written last
+_FIRST_LINE = "; sitebuilder zone digest=%s serial=%010d\n"
+_FIRST_LINE_RE = re.compile(r"^; sitebuilder zone digest=([0-9a-f]{40}) "
+                            r"serial=(\d{10})$")
+
+# Number of records written at once
+_CHUNK_SIZE = 500
+
+
+def get_next_serial(serial, today=None):
+    """
+    Returns the serial following a zone serial (None for a new zone): the
+    first one of the day (YYYYMMDD00), or the next one if the day's one was
+    already used.
+
+    >>> get_next_serial(None, '20100102')
+    2010010200
+    >>> get_next_serial(2010010200, '20100102')
+    2010010201
+    >>> get_next_serial(2010010105, '20100102')
+    2010010200
+    """
+    if today is None:
+        today = strftime('%Y%m%d')
+
+    first = int(today) * 100
+
+    if serial is None or serial < first:
+        return first
+
+    return serial + 1
+
+
+def read_zone_state(path):
+    """
+    Returns the (digest, serial) tuple recorded in the first line of a zone
+    file, or (None, None) if it doesn't exist or wasn't built by a zone
+    builder
+    """
+    try:
+        with open(path, 'rb') as stream:
+            line = stream.readline().rstrip('\n')
+    except IOError:
+        return None, None
+
+    match = _FIRST_LINE_RE.match(line)
+
+    if match is None:
+        return None, None
+
+    return match.group(1), int(match.group(2))
+
+
+class ZoneBuilder(object):
+    """
+    DNS zone files builder.
+
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> driver = MemoryBackendDriver()
+    >>> driver.add_sites([ get_test_site(u'name%d' % num) for num in range(3) ])
+    >>> builder = ZoneBuilder(directory)
+
+    Zones of all the domains are built
+
+    >>> [ (domain, changed, count) for domain, changed, serial, count in
+    ...   builder.build_all(driver) ]
+    [(u'bpi-group.com', True, 0), (u'bpinet.com', True, 3), \
+(u'groupe-bpi.com', True, 0)]
+    >>> path = os.path.join(directory, 'bpinet.com.zone')
+    >>> digest, serial = read_zone_state(path)
+    >>> print ''.join(open(path).readlines()[-3:]),
+    name0    IN    CNAME    front-prod.bpinet.com.
+    name1    IN    CNAME    front-prod.bpinet.com.
+    name2    IN    CNAME    front-prod.bpinet.com.
+
+    Zones whose content didn't change are left as is
+
+    >>> builder.build(driver, u'bpinet.com')[1:]
+    (False, None, 3)
+    >>> driver.delete_site(u'name1', u'bpinet.com')
+    >>> domain, changed, new_serial, count = builder.build(driver, u'bpinet.com')
+    >>> changed, new_serial == serial + 1, count
+    (True, True, 2)
+    >>> read_zone_state(path)[1] == new_serial
+    True
+
+    Temporary files are removed if a build fails
+
+    >>> def lookup_host_fields(*args, **kwargs):
+    ...     raise SiteError("Lookup failed")
+    >>> driver.lookup_host_fields = lookup_host_fields
+    >>> builder.build(driver, u'bpinet.com')
+    Traceback (most recent call last):
+        ...
+    SiteError: Lookup failed
+    >>> del driver.lookup_host_fields
+    >>> sorted(os.listdir(directory))
+    ['bpi-group.com.zone', 'bpinet.com.zone', 'groupe-bpi.com.zone']
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, directory=ZONES_DIR, templates=None,
+                 workers=ZONE_WORKERS):
+        """
+        Builder initialization.
+
+        Parameters:
+            directory   Zone files directory
+            templates   Template cache (one using TEMPLATES_BASEDIR by
+                        default)
+            workers     Number of domains built in parallel
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if templates is None:
+            templates = TemplateCache()
+
+        self.directory = directory
+        self.templates = templates
+        self.workers = workers
+
+        # Catalog version of the last build of all the zones
+        self.version = None
+        self._lock = Lock()
+
+    def get_path(self, domain):
+        """
+        Returns the zone file path of a domain
+        """
+        return os.path.join(self.directory, '%s.zone' % domain.lower())
+
+    def _iter_records(self, driver, domain, record):
+        """
+        Generator yielding the rendered records of the hosts of a domain,
+        looked up ZONE_BATCH_SIZE hosts at a time
+        """
+        after = None
+
+        while True:
+            hosts = driver.lookup_host_fields(
+                u'*', domain, ('name', 'domain', 'platform'),
+                limit=ZONE_BATCH_SIZE, after=after)
+
+            for name, host_domain, platform in hosts:
+                try:
+                    yield record.substitute(name=name.lower(),
+                                            domain=host_domain.lower(),
+                                            platform=platform)
+                except (KeyError, ValueError), e:
+                    raise SiteError("Template error: %s" % e)
+
+            if len(hosts) < ZONE_BATCH_SIZE:
+                break
+
+            after = get_cursor(hosts[-1][0], hosts[-1][1])
+
+    def build(self, driver, domain):
+        """
+        Builds the zone file of a domain, only replaced if its content
+        changed. Returns the (domain, changed, serial, number of hosts)
+        tuple of the build, serial being None if the zone didn't change.
+        The temporary file the zone is written to is removed if the build
+        fails.
+        """
+        header, header_digest, names = self.templates.get('dns/zone.zone')
+        record, record_digest, names = self.templates.get('dns/record.zone')
+        path = self.get_path(domain)
+        old_digest, old_serial = read_zone_state(path)
+        serial = get_next_serial(old_serial)
+        digest = sha1(header_digest + record_digest)
+        count = 0
+
+        # The serial is left out of the digest, it changes on each build
+        try:
+            digest.update(header.substitute(domain=domain.lower(),
+                                            serial=u'').encode('utf-8'))
+            header = header.substitute(domain=domain.lower(), serial=serial)
+        except (KeyError, ValueError), e:
+            raise SiteError("Template error: %s" % e)
+
+        stream, temp_path = open_temp_file(path)
+
+        try:
+            with stream:
+                # Replaced once the digest is known
+                stream.write(_FIRST_LINE % ('0' * 40, serial))
+                stream.write(header.encode('utf-8'))
+                chunk = []
+
+                for line in self._iter_records(driver, domain, record):
+                    chunk.append(line)
+                    count += 1
+
+                    if len(chunk) >= _CHUNK_SIZE:
+                        data = u''.join(chunk).encode('utf-8')
+                        digest.update(data)
+                        stream.write(data)
+                        chunk = []
+
+                data = u''.join(chunk).encode('utf-8')
+                digest.update(data)
+                stream.write(data)
+
+                digest = digest.hexdigest()
+
+                if digest != old_digest:
+                    stream.seek(0)
+                    stream.write(_FIRST_LINE % (digest, serial))
+
+            if digest != old_digest:
+                os.rename(temp_path, path)
+                return domain, True, serial, count
+        except:
+            os.unlink(temp_path)
+            raise
+
+        os.unlink(temp_path)
+
+        return domain, False, None, count
+
+    def build_all(self, driver, domains=None):
+        """
+        Builds the zone files of several domains (all the domains by
+        default) in parallel, and returns the list of their builds results
+        (see build), ordered by domain.
+        """
+        version = driver.get_version()
+
+        if domains is None:
+            domains = SiteDefaultsManager.get_domains().keys()
+
+        domains = sorted(domains)
+        pool = ThreadPool(max(1, min(self.workers, len(domains))))
+
+        try:
+            results = pool.map(lambda domain: self.build(driver, domain),
+                               domains)
+        finally:
+            pool.close()
+            pool.join()
+
+        with self._lock:
+            self.version = version
+
+        return results
+
+    def update(self, driver):
+        """
+        Builds the zone files of the domains whose hosts changed since the
+        previous build (of all the domains if changes are not known), and
+        returns the list of their builds results (see build).
+        """
+        if self.version is None:
+            return self.build_all(driver)
+
+        version, changes = driver.changes_since(self.version)
+
+        if changes is None:
+            return self.build_all(driver)
+
+        domains = set([ domain.lower()
+                        for num, kind, name, domain in changes ])
+
+        if not len(domains):
+            return []
+
+        return self.build_all(driver, domains)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Site builder history is a command line interface used to query the history
+of executed commands.
+
+Example: what happened to foo.bpinet.com this week
+
+    python -m sitebuilder.history --site foo.bpinet.com --since 7d
+"""
+
+from sitebuilder.command.store import HistoryStore
+from sitebuilder.utils.parameters import HISTORY_FILE, HISTORY_RETENTION
+from time import time, localtime, strftime, mktime, strptime
+from argparse import ArgumentParser
+import json
+import sys
+
+_UNITS = { 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800 }
+
+
+def parse_time(value, now=None):
+    """
+    Returns a time (seconds since epoch) from either a relative duration
+    (30m, 12h, 7d, 2w), or a YYYY-MM-DD[THH:MM] local date.
+
+    >>> parse_time('12h', now=100000)
+    56800
+    >>> parse_time('2010-01-02') == mktime(strptime('2010-01-02', '%Y-%m-%d'))
+    True
+    """
+    if now is None:
+        now = time()
+
+    unit = value[-1:]
+
+    if unit in _UNITS and value[:-1].isdigit():
+        return now - int(value[:-1]) * _UNITS[unit]
+
+    for pattern in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return mktime(strptime(value, pattern))
+        except ValueError:
+            pass
+
+    raise ValueError("Invalid time: %s" % value)
+
+
+def format_record(record):
+    """
+    Returns a log record as a human readable line.
+
+    >>> format_record({'time': 0, 'command': 'DeleteSite',
+    ...                'target': u'name0.bpinet.com', 'status': 'error',
+    ...                'duration': 0.0015, 'mesg': 'Unknown site'})[19:]
+    u' DeleteSite name0.bpinet.com: error (1.5 ms): Unknown site'
+    """
+    duration = record.get('duration')
+
+    if duration is None:
+        duration = u'-'
+    else:
+        duration = u"%.1f ms" % (duration * 1000)
+
+    return u"%s %s %s: %s (%s): %s" % (
+        strftime('%Y-%m-%d %H:%M:%S', localtime(record['time'])),
+        record['command'], record['target'], record['status'], duration,
+        record.get('mesg'))
+
+
+def main(argv=None):
+    """
+    Command line main function
+    """
+    parser = ArgumentParser(description="Query the commands history")
+    parser.add_argument('--site', metavar='NAME.DOMAIN',
+                        help="site key, a trailing * matches any prefix")
+    parser.add_argument('--command', help="command class name (AddSite...)")
+    parser.add_argument('--status', help="command status (success, error)")
+    parser.add_argument('--since', type=parse_time,
+                        help="minimum time: 12h, 7d, 2w or YYYY-MM-DD")
+    parser.add_argument('--until', type=parse_time,
+                        help="maximum time: 12h, 7d, 2w or YYYY-MM-DD")
+    parser.add_argument('--limit', type=int, default=100,
+                        help="maximum number of records (0 for no limit)")
+    parser.add_argument('--json', action='store_true',
+                        help="write records as JSON lines")
+    parser.add_argument('--purge', action='store_true',
+                        help="delete records older than the retention time")
+    parser.add_argument('--compact', action='store_true',
+                        help="purge, then compact the history file")
+    parser.add_argument('--file', default=HISTORY_FILE,
+                        help="history file (default: %(default)s)")
+    options = parser.parse_args(argv)
+
+    store = HistoryStore(options.file, HISTORY_RETENTION)
+
+    if options.compact:
+        store.compact()
+        return 0
+
+    if options.purge:
+        print "%d records purged" % store.purge()
+        return 0
+
+    records = store.query(options.site, options.command, options.status,
+                          options.since, options.until, options.limit or None)
+
+    for record in reversed(records):
+        if options.json:
+            line = json.dumps(record, sort_keys=True)
+        else:
+            line = format_record(record)
+
+        print line.encode('utf-8')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
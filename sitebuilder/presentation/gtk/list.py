@@ -8,7 +8,7 @@ from sitebuilder.utils.parameters import GLADE_BASEDIR
 from sitebuilder.utils.parameters import ACTION_ADD, ACTION_VIEW
 from sitebuilder.utils.parameters import ACTION_EDIT, ACTION_DELETE
 from sitebuilder.utils.parameters import ACTION_RELOAD, ACTION_CLEARLOGS
-from sitebuilder.utils.parameters import ACTION_SHOWLOGS
+from sitebuilder.utils.parameters import ACTION_SHOWLOGS, ACTION_LOADMORE
 from sitebuilder.command.interface import COMMAND_SUCCESS
 from sitebuilder.presentation.gtk.base import GtkBasePresentationAgent
 from sitebuilder.observer.action import Action
@@ -79,6 +79,63 @@ class ListSitesPresentationAgent(GtkBasePresentationAgent):
         self['delete'].connect('activate', self.on_delete_activate)
         self['reload'].connect('activate', self.on_reload_activate)
 
+        # Next sites page is requested when the list is scrolled down
+        adjustment = self['scrolled_sites'].get_vadjustment()
+        adjustment.connect('value-changed', self.on_sites_scrolled)
+        adjustment.connect('changed', self.on_sites_scrolled)
+
+    def append_items(self, name, items):
+        """
+        Appends rows at the end of a list, without reloading it
+        """
+        model = self[name].get_model()
+
+        for item in items:
+            model.append(item)
+
+    def find_site_row(self, name, domain):
+        """
+        Returns the site_list model iterator of a site row, or None. Rows are
+        looked up by value, as the list may be sorted by any column.
+        """
+        model = self['site_list'].get_model()
+        name = name.lower()
+        domain = domain.lower()
+        treeiter = model.get_iter_first()
+
+        while treeiter is not None:
+            if model.get_value(treeiter, 0).lower() == name and \
+               model.get_value(treeiter, 1).lower() == domain:
+                return treeiter
+
+            treeiter = model.iter_next(treeiter)
+
+        return None
+
+    def insert_site_row(self, index, row):
+        """
+        Inserts a site row at index (sorted lists place it themselves)
+        """
+        self['site_list'].get_model().insert(index, row)
+
+    def update_site_row(self, row):
+        """
+        Replaces the values of a site row
+        """
+        treeiter = self.find_site_row(row[0], row[1])
+
+        if treeiter is not None:
+            self['site_list'].get_model()[treeiter] = row
+
+    def remove_site_row(self, name, domain):
+        """
+        Removes a site row
+        """
+        treeiter = self.find_site_row(name, domain)
+
+        if treeiter is not None:
+            self['site_list'].get_model().remove(treeiter)
+
     def set_value(self, name, hosts):
         """
         Loads site items data into widgets
@@ -172,6 +229,18 @@ class ListSitesPresentationAgent(GtkBasePresentationAgent):
         """
         self.get_event_bus().publish(UIActionEvent(self, action=ACTION_RELOAD))
 
+    def on_sites_scrolled(self, adjustment):
+        """
+        Signal handler associated with the site list vertical scrollbar.
+        Requests more sites when less than a page of rows is left below the
+        visible ones.
+        """
+        left = adjustment.upper - adjustment.value - adjustment.page_size
+
+        if left <= adjustment.page_size:
+            self.get_event_bus().publish(
+                UIActionEvent(self, action=ACTION_LOADMORE))
+
     def destroy(self):
         """
         Cleanly destroyes components
@@ -219,23 +288,51 @@ class ListLogsPresentationAgent(GtkBasePresentationAgent):
         self['clearlogs'].connect('activate', self.on_clearlogs_activate)
         self['showlogs'].connect('activate', self.on_showlogs_activate)
 
+    def get_row(self, command):
+        """
+        Returns logs list model row for a command (or a command summary)
+        """
+        if command.status == COMMAND_SUCCESS:
+            img = gtk.STOCK_OK
+            text = command.mesg
+        else:
+            img = gtk.STOCK_CANCEL
+            text = command.exception
+
+        return (img, command.description, text, command)
+
     def set_items(self, name, commands):
         """
         Loads logs items data into widgets
         """
         # Appends items to the site_list
-        model = self['logs_list'].get_model()
+        model = self[name].get_model()
         model.clear()
 
         for command in commands:
-            if command.status == COMMAND_SUCCESS:
-                img = gtk.STOCK_OK
-                text = command.mesg
-            else:
-                img = gtk.STOCK_CANCEL
-                text = command.exception
-
-            model.append((img, command.description, text, command))
+            model.append(self.get_row(command))
+
+    def append_item(self, name, command):
+        """
+        Appends a single command row at the end of the list
+        """
+        self[name].get_model().append(self.get_row(command))
+
+    def update_item(self, name, index, command):
+        """
+        Replaces the command row at index
+        """
+        model = self[name].get_model()
+        model[index] = self.get_row(command)
+
+    def remove_items(self, name, count):
+        """
+        Removes count rows from the head of the list
+        """
+        model = self[name].get_model()
+
+        for i in range(min(count, len(model))):
+            model.remove(model.get_iter_first())
 
     def get_selected_commands(self):
         """
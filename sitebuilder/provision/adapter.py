@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+"""
+Database adapters (see sitebuilder.provision.interface.IDatabaseAdapter).
+
+MySQL and PostgreSQL adapters rely on the MySQLdb and psycopg2 modules,
+only imported when a first connection is opened. The SQLite adapter stands
+in for a database server: it records created databases, owners and grants
+in tables of a SQLite file, so that provisioning can be run offline.
+
+Identifiers can't be sent as statements parameters: they are checked
+against the database settings constraint (^[\w\d_]+$) before being quoted
+into statements. Passwords are always sent as parameters.
+"""
+
+from sitebuilder.provision.interface import IDatabaseAdapter
+from sitebuilder.exception import BackendError, SiteError
+from zope.interface import implements
+from threading import Lock
+import sqlite3
+import re
+
+_IDENTIFIER_RE = re.compile(r'^[\w\d_]+$')
+
+# Tables of the SQLite adapter, created by the first adapter of a file
+_SQLITE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS db_database (\n"
+    "    name TEXT PRIMARY KEY,\n"
+    "    owner TEXT NOT NULL\n"
+    ");\n"
+    "CREATE TABLE IF NOT EXISTS db_user (\n"
+    "    name TEXT PRIMARY KEY,\n"
+    "    password TEXT NOT NULL\n"
+    ");\n"
+    "CREATE TABLE IF NOT EXISTS db_grant (\n"
+    "    database TEXT NOT NULL,\n"
+    "    user TEXT NOT NULL,\n"
+    "    PRIMARY KEY (database, user)\n"
+    ");")
+
+# Serializes the SQLite adapters schema creation
+_SQLITE_SCHEMA_LOCK = Lock()
+
+
+def check_identifier(identifier):
+    """
+    Returns a database or user name, once checked it can be quoted into
+    statements.
+
+    >>> check_identifier(u'db_name0')
+    u'db_name0'
+    >>> check_identifier(u'name`; DROP')
+    Traceback (most recent call last):
+        ...
+    SiteError: Invalid database identifier u'name`; DROP'
+    """
+    if identifier is None or not _IDENTIFIER_RE.match(identifier):
+        raise SiteError("Invalid database identifier %r" % identifier)
+
+    return identifier
+
+
+def import_module(name):
+    """
+    Imports and returns a database module, only required by its adapter.
+
+    >>> import_module('sqlite3').__name__
+    'sqlite3'
+    >>> import_module('nodb')
+    Traceback (most recent call last):
+        ...
+    BackendError: Database module nodb is not available
+    """
+    try:
+        return __import__(name, fromlist=['connect'])
+    except ImportError:
+        raise BackendError("Database module %s is not available" % name)
+
+
+class MySQLAdapter(object):
+    """
+    MySQL servers adapter. Connections are opened with multiple statements
+    enabled, so that the statements of a batch of databases are sent at
+    once.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> sql, parameters = MySQLAdapter().get_statements([
+    ...     get_test_site(u'name0').database])
+    >>> print sql
+    CREATE DATABASE IF NOT EXISTS `db_name0`;
+    CREATE USER IF NOT EXISTS 'username_name0'@'%%' IDENTIFIED BY %s;
+    GRANT ALL PRIVILEGES ON `db_name0`.* TO 'username_name0'@'%%'
+    >>> parameters
+    [u'password_name0']
+    """
+    implements(IDatabaseAdapter)
+
+    type = u'mysql'
+
+    def __init__(self, **options):
+        """
+        Adapter initialization.
+
+        Parameters:
+            options     MySQLdb.connect options (host, port, user, passwd)
+        """
+        self.options = options
+
+    def connect(self):
+        """
+        Opens and returns a new administrator connection to the server
+        """
+        MySQLdb = import_module('MySQLdb')
+        from MySQLdb.constants.CLIENT import MULTI_STATEMENTS
+
+        options = dict(self.options)
+        options['client_flag'] = options.get('client_flag', 0) | \
+                                 MULTI_STATEMENTS
+
+        try:
+            return MySQLdb.connect(**options)
+        except MySQLdb.Error, e:
+            raise BackendError("Database server connection failed: %s" % e)
+
+    @staticmethod
+    def get_statements(databases):
+        """
+        Returns the statements creating databases, owners and grants, and
+        their parameters
+        """
+        statements = []
+        parameters = []
+
+        for database in databases:
+            name = check_identifier(database.name)
+            username = check_identifier(database.username)
+
+            # Percent signs are escaped, statements being formatted by
+            # MySQLdb to bind parameters
+            statements.append("CREATE DATABASE IF NOT EXISTS `%s`" % name)
+            statements.append("CREATE USER IF NOT EXISTS '%s'@'%%%%' "
+                              "IDENTIFIED BY %%s" % username)
+            statements.append("GRANT ALL PRIVILEGES ON `%s`.* TO '%s'@'%%%%'"
+                              % (name, username))
+            parameters.append(database.password)
+
+        return ";\n".join(statements), parameters
+
+    def provision(self, connection, databases):
+        """
+        Creates databases, owners and grants if they don't exist, sending
+        all the statements at once
+        """
+        sql, parameters = self.get_statements(databases)
+
+        if not len(parameters):
+            return
+
+        MySQLdb = import_module('MySQLdb')
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(sql, parameters)
+
+            # Each statement returns a result, which raises its error
+            while cursor.nextset():
+                pass
+        except MySQLdb.Error, e:
+            raise BackendError("Database provisioning failed: %s" % e)
+        finally:
+            cursor.close()
+
+    def close(self, connection):
+        """
+        Closes an administrator connection
+        """
+        connection.close()
+
+
+class PgSQLAdapter(object):
+    """
+    PostgreSQL servers adapter. PostgreSQL doesn't allow CREATE DATABASE in
+    transactions nor in multiple statements: existing databases and roles
+    are looked up at once, missing roles and grants are created by batches,
+    and missing databases one by one on the same connection.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> databases = [ get_test_site(u'name%d' % num).database
+    ...               for num in range(2) ]
+    >>> print PgSQLAdapter().get_grants(databases)
+    GRANT ALL PRIVILEGES ON DATABASE "db_name0" TO "username_name0";
+    GRANT ALL PRIVILEGES ON DATABASE "db_name1" TO "username_name1"
+    """
+    implements(IDatabaseAdapter)
+
+    type = u'pgsql'
+
+    def __init__(self, **options):
+        """
+        Adapter initialization.
+
+        Parameters:
+            options     psycopg2.connect options (host, port, user,
+                        password, dbname)
+        """
+        self.options = options
+
+    def connect(self):
+        """
+        Opens and returns a new administrator connection to the server, in
+        autocommit mode
+        """
+        psycopg2 = import_module('psycopg2')
+
+        try:
+            connection = psycopg2.connect(**self.options)
+        except psycopg2.Error, e:
+            raise BackendError("Database server connection failed: %s" % e)
+
+        connection.autocommit = True
+
+        return connection
+
+    @staticmethod
+    def get_grants(databases):
+        """
+        Returns the statements granting databases to their owners
+        """
+        return ";\n".join([
+            'GRANT ALL PRIVILEGES ON DATABASE "%s" TO "%s"' % (
+                check_identifier(database.name),
+                check_identifier(database.username))
+            for database in databases ])
+
+    def provision(self, connection, databases):
+        """
+        Creates databases, owners and grants if they don't exist
+        """
+        if not len(databases):
+            return
+
+        psycopg2 = import_module('psycopg2')
+
+        # Checks all the identifiers before any statement is sent
+        grants = self.get_grants(databases)
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute("SELECT rolname FROM pg_roles WHERE rolname IN %s",
+                           (tuple([ database.username
+                                    for database in databases ]),))
+            roles = set([ row[0] for row in cursor.fetchall() ])
+            cursor.execute("SELECT datname FROM pg_database "
+                           "WHERE datname IN %s",
+                           (tuple([ database.name
+                                    for database in databases ]),))
+            names = set([ row[0] for row in cursor.fetchall() ])
+
+            statements = []
+            parameters = []
+
+            for database in databases:
+                if not database.username in roles:
+                    roles.add(database.username)
+                    statements.append('CREATE ROLE "%s" LOGIN PASSWORD %%s'
+                                      % database.username)
+                    parameters.append(database.password)
+
+            if len(statements):
+                cursor.execute(";\n".join(statements), parameters)
+
+            for database in databases:
+                if not database.name in names:
+                    names.add(database.name)
+                    cursor.execute('CREATE DATABASE "%s" OWNER "%s"' % (
+                        database.name, database.username))
+
+            cursor.execute(grants)
+        except psycopg2.Error, e:
+            raise BackendError("Database provisioning failed: %s" % e)
+        finally:
+            cursor.close()
+
+    def close(self, connection):
+        """
+        Closes an administrator connection
+        """
+        connection.close()
+
+
+class SQLiteAdapter(object):
+    """
+    Stand-in adapter, recording databases, owners and grants in a SQLite
+    file instead of creating them on a server. Its tables are created once,
+    when the adapter is built, so that connections opened concurrently by
+    a pool don't race to create them.
+
+    >>> from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> import os
+    >>> directory = mkdtemp()
+    >>> adapter = SQLiteAdapter(os.path.join(directory, 'server.db'))
+    >>> connection = adapter.connect()
+    >>> adapter.provision(connection, [ get_test_site(u'name%d' % num).database
+    ...                                 for num in range(2) ])
+    >>> adapter.provision(connection, [ get_test_site(u'name0').database ])
+    >>> adapter.get_grants(connection)
+    [(u'db_name0', u'username_name0'), (u'db_name1', u'username_name1')]
+    >>> snapshot = SiteSnapshot.from_site(get_test_site(u'name0'))
+    >>> adapter.provision(connection, [
+    ...     snapshot.replace('database', name=u'db name').database ])
+    Traceback (most recent call last):
+        ...
+    SiteError: Invalid database identifier u'db name'
+    >>> adapter.close(connection)
+    >>> adapter.connections
+    1
+    >>> rmtree(directory)
+    """
+    implements(IDatabaseAdapter)
+
+    def __init__(self, path, type=u'mysql'):
+        """
+        Adapter initialization.
+
+        Parameters:
+            path    SQLite file path, shared by the adapter connections
+            type    Database type the adapter stands in for
+        """
+        self.path = path
+        self.type = type
+
+        # Number of connections opened by the adapter
+        self.connections = 0
+
+        with _SQLITE_SCHEMA_LOCK:
+            try:
+                connection = sqlite3.connect(path)
+
+                try:
+                    connection.executescript(_SQLITE_SCHEMA)
+                finally:
+                    connection.close()
+            except sqlite3.Error, e:
+                raise BackendError("Database server connection failed: %s"
+                                   % e)
+
+    def connect(self):
+        """
+        Opens and returns a new connection to the SQLite file. Connections
+        may be used by several threads, one at a time.
+        """
+        try:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+        except sqlite3.Error, e:
+            raise BackendError("Database server connection failed: %s" % e)
+
+        self.connections += 1
+
+        return connection
+
+    def provision(self, connection, databases):
+        """
+        Records databases, owners and grants if they don't exist, in a
+        single transaction
+        """
+        rows = [ (check_identifier(database.name),
+                  check_identifier(database.username),
+                  database.password)
+                 for database in databases ]
+
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO db_user (name, password) "
+                    "VALUES (?, ?)",
+                    [ (username, password)
+                      for name, username, password in rows ])
+                connection.executemany(
+                    "INSERT OR IGNORE INTO db_database (name, owner) "
+                    "VALUES (?, ?)",
+                    [ (name, username) for name, username, password in rows ])
+                connection.executemany(
+                    "INSERT OR IGNORE INTO db_grant (database, user) "
+                    "VALUES (?, ?)",
+                    [ (name, username) for name, username, password in rows ])
+        except sqlite3.Error, e:
+            raise BackendError("Database provisioning failed: %s" % e)
+
+    @staticmethod
+    def get_grants(connection):
+        """
+        Returns the recorded (database, user) grants
+        """
+        return connection.execute("SELECT database, user FROM db_grant "
+                                  "ORDER BY database, user").fetchall()
+
+    def close(self, connection):
+        """
+        Closes a connection
+        """
+        connection.close()
+
+
+# Adapters classes, by name (see DATABASE_SERVERS)
+ADAPTERS = {
+    'mysql': MySQLAdapter,
+    'pgsql': PgSQLAdapter,
+    'sqlite': SQLiteAdapter,
+    }
+
+
+def get_adapter(name, **options):
+    """
+    Returns a new adapter, built from its name and options.
+
+    >>> get_adapter('mysql', host='localhost').options
+    {'host': 'localhost'}
+    >>> get_adapter('oracle')
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown database adapter oracle
+    """
+    if not name in ADAPTERS:
+        raise BackendError("Unknown database adapter %s" % name)
+
+    return ADAPTERS[name](**options)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Databases provisioning step executor.
+
+Sites whose database is enabled but not done yet get their database, owner
+and grant created on the server of their database type (and platform, see
+DATABASE_SERVERS), through a database adapter (see
+sitebuilder.provision.adapter). Their database is then marked as done.
+
+Sites are provisioned by batches of DATABASE_BATCH_SIZE databases of a same
+server, each batch using a connection of the server pool (see
+sitebuilder.provision.pool): hundreds of databases are provisioned with a
+few connections and round trips. Batches run in parallel, at most
+DATABASE_POOL_SIZE on each server.
+
+A connection failure is retried (DATABASE_CONNECT_ATTEMPTS attempts), a
+pool discarding connections that failed. A failed batch is provisioned
+again site by site, so that only the sites that really failed are reported,
+and left to the next pass.
+"""
+
+from sitebuilder.provision.adapter import get_adapter
+from sitebuilder.provision.pool import ConnectionPool
+from sitebuilder.utils.driver.index import get_host_cursor
+from sitebuilder.utils.parameters import DATABASE_SERVERS
+from sitebuilder.utils.parameters import DATABASE_BATCH_SIZE
+from sitebuilder.utils.parameters import DATABASE_WORKERS, DATABASE_POOL_SIZE
+from sitebuilder.utils.parameters import DATABASE_CONNECT_ATTEMPTS
+from sitebuilder.exception import BackendError, ConflictError, SiteError
+from multiprocessing.pool import ThreadPool
+
+
+class DatabaseProvisioner(object):
+    """
+    Databases provisioning step executor.
+
+    >>> from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+    >>> from sitebuilder.provision.adapter import SQLiteAdapter
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> import os
+    >>> directory = mkdtemp()
+    >>> sites = [ SiteSnapshot.from_site(get_test_site(u'name%d' % num))
+    ...           for num in range(10) ]
+    >>> sites = [ site.replace('database', done=False) for site in sites ]
+    >>> sites[3] = sites[3].replace('database', type=u'pgsql')
+    >>> sites[5] = sites[5].replace('database', name=u'db name')
+    >>> driver = MemoryBackendDriver()
+    >>> driver.add_sites(sites)
+    >>> adapter = SQLiteAdapter(os.path.join(directory, 'server.db'))
+    >>> provisioner = DatabaseProvisioner({u'mysql': adapter}, batch_size=3)
+
+    Databases are provisioned by batches, reusing connections, and marked as
+    done. Sites without server or that failed are reported.
+
+    >>> done, failed = provisioner.run(driver)
+    >>> len(done)
+    8
+    >>> for site, error in failed:
+    ...     print site.dnshost.name, error
+    name3 No pgsql database server for platform prod
+    name5 Invalid database identifier u'db name'
+    >>> adapter.connections <= DATABASE_POOL_SIZE
+    True
+    >>> driver.get_site_snapshot(u'name0', u'bpinet.com').database.done
+    True
+
+    Only databases not done yet are provisioned on next passes
+
+    >>> done, failed = provisioner.run(driver)
+    >>> len(done), len(failed)
+    (0, 2)
+    >>> provisioner.close()
+
+    Connection failures are retried
+
+    >>> class FlakyAdapter(SQLiteAdapter):
+    ...     failures = 1
+    ...     def connect(self):
+    ...         if self.failures:
+    ...             self.failures -= 1
+    ...             raise BackendError("Database server connection failed")
+    ...         return SQLiteAdapter.connect(self)
+    >>> adapter = FlakyAdapter(os.path.join(directory, 'flaky.db'))
+    >>> provisioner = DatabaseProvisioner({u'mysql': adapter})
+    >>> done, failed = provisioner.provision(sites[:2])
+    >>> len(done), len(failed), adapter.failures
+    (2, 0, 0)
+    >>> provisioner.close()
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, servers=None, batch_size=DATABASE_BATCH_SIZE,
+                 workers=DATABASE_WORKERS):
+        """
+        Executor initialization.
+
+        Parameters:
+            servers     Database adapters, or (adapter name, options)
+                        tuples, by database type or (database type,
+                        platform) tuple (DATABASE_SERVERS by default)
+            batch_size  Number of databases provisioned at once
+            workers     Number of batches provisioned in parallel
+        """
+        if servers is None:
+            servers = DATABASE_SERVERS
+
+        self._pools = {}
+
+        for key, adapter in servers.items():
+            if isinstance(adapter, tuple):
+                adapter = get_adapter(adapter[0], **adapter[1])
+
+            self._pools[key] = ConnectionPool(adapter)
+
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def get_pool(self, site):
+        """
+        Returns the connections pool of the database server of a site
+        """
+        database_type = site.database.type
+        pool = self._pools.get((database_type, site.dnshost.platform))
+
+        if pool is None:
+            pool = self._pools.get(database_type)
+
+        if pool is None:
+            raise SiteError("No %s database server for platform %s" % (
+                database_type, site.dnshost.platform))
+
+        return pool
+
+    def _provision_batch(self, batch):
+        """
+        Provisions a (pool, sites) batch, and returns the (done, failed)
+        tuple of the lists of provisioned sites, and of failed (site,
+        exception) tuples
+        """
+        pool, sites = batch
+
+        for attempt in range(DATABASE_CONNECT_ATTEMPTS):
+            try:
+                connection = pool.acquire()
+                break
+            except BackendError, e:
+                error = e
+        else:
+            return [], [ (site, error) for site in sites ]
+
+        try:
+            pool.adapter.provision(connection,
+                                   [ site.database for site in sites ])
+        except (BackendError, SiteError), e:
+            # Invalid settings are found before anything is sent
+            pool.release(connection, discard=isinstance(e, BackendError))
+
+            if len(sites) == 1:
+                return [], [ (sites[0], e) ]
+
+            done = []
+            failed = []
+
+            for site in sites:
+                result = self._provision_batch((pool, [ site ]))
+                done.extend(result[0])
+                failed.extend(result[1])
+
+            return done, failed
+
+        pool.release(connection)
+
+        return sites, []
+
+    def provision(self, sites):
+        """
+        Provisions the databases of sites, and returns the (done, failed)
+        tuple of the lists of provisioned sites, and of failed (site,
+        exception) tuples
+        """
+        groups = {}
+        failed = []
+
+        for site in sites:
+            try:
+                groups.setdefault(self.get_pool(site), []).append(site)
+            except SiteError, e:
+                failed.append((site, e))
+
+        batches = [ (pool, group[num:num + self.batch_size])
+                    for pool, group in groups.items()
+                    for num in range(0, len(group), self.batch_size) ]
+        done = []
+
+        if not len(batches):
+            return done, failed
+
+        workers = ThreadPool(max(1, min(self.workers, len(batches))))
+
+        try:
+            results = workers.map(self._provision_batch, batches)
+        finally:
+            workers.close()
+            workers.join()
+
+        for batch_done, batch_failed in results:
+            done.extend(batch_done)
+            failed.extend(batch_failed)
+
+        return done, failed
+
+    def run(self, driver):
+        """
+        Provisions the databases of the sites whose database is enabled but
+        not done, and marks them as done. Returns the (done, failed) tuple
+        of the lists of provisioned sites, and of failed (site, exception)
+        tuples.
+
+        Sites changed while being provisioned are left to the next pass.
+        """
+        limit = self.batch_size * self.workers
+        after = None
+        done = []
+        failed = []
+
+        while True:
+            sites = driver.find_sites(limit=limit, after=after,
+                                      database_enabled=True,
+                                      database_done=False)
+
+            if not len(sites):
+                break
+
+            batch_done, batch_failed = self.provision(sites)
+
+            for site in batch_done:
+                try:
+                    driver.update_if_version(
+                        site.replace('database', done=True), site.version)
+                except ConflictError:
+                    continue
+
+                done.append(site)
+
+            failed.extend(batch_failed)
+
+            if len(sites) < limit:
+                break
+
+            after = get_host_cursor(sites[-1].dnshost)
+
+        return done, failed
+
+    def close(self):
+        """
+        Closes the idle connections of all the servers
+        """
+        for pool in self._pools.values():
+            pool.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
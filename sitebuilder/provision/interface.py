@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Provisioning components related interfaces definition
+"""
+
+from zope.interface import Interface, Attribute
+
+
+class IDatabaseAdapter(Interface):
+    """
+    Database adapters create sites databases, their owners and grants on a
+    database server, through administrator connections (DB-API connections)
+    opened by the adapter and kept in a pool (see
+    sitebuilder.provision.pool).
+    """
+
+    # Database type handled by the adapter (see
+    # SiteDefaultsManager.get_database_types)
+    type = Attribute(u"Database type")
+
+    def connect():
+        """
+        Opens and returns a new administrator connection to the server
+        """
+
+    def provision(connection, databases):
+        """
+        Creates databases, owners and grants if they don't exist, using an
+        administrator connection. Databases are sites database settings
+        (name, username and password attributes, see IDatabase). Statements
+        are sent by batches, as few round trips as the server allows.
+
+        An error for any database fails the whole call: callers provision
+        databases one by one again to know which one failed.
+        """
+
+    def close(connection):
+        """
+        Closes an administrator connection
+        """
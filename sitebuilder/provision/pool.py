@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Database servers administrator connections pool.
+
+Provisioning hundreds of databases on a server reuses a few connections
+instead of opening one per site: connections are released in the pool once
+used, and handed to the next user. Connections that failed are discarded,
+a new one is opened when needed.
+"""
+
+from sitebuilder.utils.parameters import DATABASE_POOL_SIZE
+from threading import Condition
+
+
+class ConnectionPool(object):
+    """
+    Pool of at most size connections, opened by a database adapter (see
+    sitebuilder.provision.interface.IDatabaseAdapter) when first needed.
+    Several threads may use it: they wait for a connection once size
+    connections are in use.
+
+    >>> from sitebuilder.provision.adapter import SQLiteAdapter
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> import os
+    >>> directory = mkdtemp()
+    >>> adapter = SQLiteAdapter(os.path.join(directory, 'server.db'))
+    >>> pool = ConnectionPool(adapter, 2)
+    >>> connection = pool.acquire()
+    >>> pool.release(connection)
+    >>> pool.acquire() is connection
+    True
+    >>> other = pool.acquire()
+    >>> adapter.connections, pool.opened
+    (2, 2)
+
+    Discarded connections are closed and replaced when needed
+
+    >>> pool.release(connection, discard=True)
+    >>> pool.release(other)
+    >>> pool.opened
+    1
+    >>> pool.close()
+    >>> pool.opened
+    0
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, adapter, size=DATABASE_POOL_SIZE):
+        """
+        Pool initialization.
+
+        Parameters:
+            adapter     Database adapter opening connections
+            size        Maximum number of opened connections
+        """
+        self.adapter = adapter
+        self.size = size
+
+        # Number of opened connections, either idle or in use
+        self.opened = 0
+        self._idle = []
+        self._condition = Condition()
+
+    def acquire(self):
+        """
+        Returns an idle connection, or a new one if none is idle and less
+        than size are opened. Waits for a connection to be released
+        otherwise.
+        """
+        with self._condition:
+            while not len(self._idle) and self.opened >= self.size:
+                self._condition.wait()
+
+            if len(self._idle):
+                return self._idle.pop()
+
+            self.opened += 1
+
+        try:
+            return self.adapter.connect()
+        except:
+            with self._condition:
+                self.opened -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """
+        Hands a connection back to the pool, or closes it if discard is
+        True (after an error, the connection state being unknown)
+        """
+        if discard:
+            try:
+                self.adapter.close(connection)
+            except Exception:
+                pass
+
+        with self._condition:
+            if discard:
+                self.opened -= 1
+            else:
+                self._idle.append(connection)
+
+            self._condition.notify()
+
+    def close(self):
+        """
+        Closes idle connections
+        """
+        with self._condition:
+            idle = self._idle
+            self._idle = []
+            self.opened -= len(idle)
+
+        for connection in idle:
+            self.adapter.close(connection)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
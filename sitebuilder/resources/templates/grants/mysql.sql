@@ -0,0 +1,3 @@
+-- ${fqdn}: ${description}
+CREATE DATABASE IF NOT EXISTS `${database_name}`;
+GRANT ALL PRIVILEGES ON `${database_name}`.* TO '${database_username}'@'%';
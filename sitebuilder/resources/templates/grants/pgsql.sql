@@ -0,0 +1,3 @@
+-- ${fqdn}: ${description}
+CREATE DATABASE "${database_name}" OWNER "${database_username}";
+GRANT ALL PRIVILEGES ON DATABASE "${database_name}" TO "${database_username}";
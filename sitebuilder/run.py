@@ -5,14 +5,24 @@ Site builder GUI is an interface used as frontend to Site builder scheduler
 
 from sitebuilder.application import init, uninit
 from sitebuilder.control.list import ListMainControlAgent
+from sitebuilder.utils.parameters import QUEUE_FILE, CATALOG_SOCKET
+from sitebuilder.utils.parameters import ARTIFACTS_DIR, ZONES_DIR
 import gtk
+import os
 
 
 def main():
     """
     Appplication main function
     """
-    init()
+    catalog_socket = None
+
+    # Shares the catalog of the catalog server, if it runs
+    if os.path.exists(CATALOG_SOCKET):
+        catalog_socket = CATALOG_SOCKET
+
+    init(QUEUE_FILE, catalog_socket=catalog_socket,
+         artifacts_dir=ARTIFACTS_DIR, zones_dir=ZONES_DIR)
     control = ListMainControlAgent()
     presentation = control.get_presentation_agent()
     presentation.get_toplevel().connect("destroy", gtk.main_quit)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Site builder server is a command line interface used to run the local
+catalog server: GUIs and command line tools started while it runs share its
+catalog instead of each loading their own (see
+sitebuilder.utils.driver.remote).
+
+Example: serve the catalog, then import sites through the server
+
+    python -m sitebuilder.server &
+    python -m sitebuilder.catalog --server import newplatform.csv
+"""
+
+from sitebuilder.utils.driver.remote import CatalogServer
+from sitebuilder.utils.driver.registry import get_backend_driver
+from sitebuilder.utils.parameters import CATALOG_SOCKET
+from sitebuilder.exception import BackendError
+from argparse import ArgumentParser
+import sys
+
+
+def main(argv=None):
+    """
+    Command line main function
+    """
+    parser = ArgumentParser(description="Serve the sites catalog")
+    parser.add_argument('--socket', default=CATALOG_SOCKET,
+                        help="server socket path (default: %(default)s)")
+    options = parser.parse_args(argv)
+
+    try:
+        server = CatalogServer(get_backend_driver(), options.socket)
+    except BackendError, e:
+        print >> sys.stderr, "Server failed: %s" % e
+        return 1
+
+    print >> sys.stderr, "Serving the catalog on %s" % options.socket
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
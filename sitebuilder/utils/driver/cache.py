@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+"""
+Read-through caching backend driver.
+
+CachingBackendDriver wraps any backend driver, and keeps the most recently
+read sites snapshots, and lookups results, in size and time bounded LRU
+caches. Writes made through the wrapper invalidate the cached site, and the
+cached lookups whose name and domain patterns match it: other entries stay
+valid.
+
+Writes made by other processes (or directly through the wrapped driver) are
+found by checking the wrapped driver version before serving cached
+entries: the entries of the sites changed meanwhile are invalidated the
+same way (see driver.changes_since), or all the entries if these changes
+are no longer known.
+
+Sites are cached as immutable snapshots: get_site_by_name still returns a
+new mutable site object on each call.
+"""
+
+from sitebuilder.utils.driver.index import SORT_DOMAIN, iter_host_pages
+from sitebuilder.utils.driver.index import get_wildcard_re
+from sitebuilder.utils.parameters import SITES_CACHE_SIZE
+from sitebuilder.utils.parameters import LOOKUPS_CACHE_SIZE, CACHE_TTL
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used cache, whose entries expire after ttl
+    seconds.
+
+    >>> now = [ 0 ]
+    >>> cache = LRUCache(2, 10, clock=lambda: now[0])
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> now[0] = 11
+    >>> cache.get('a') is None
+    True
+    >>> stats = cache.get_stats()
+    >>> [ stats[key] for key in ('hits', 'misses', 'evictions', 'expirations') ]
+    [1, 2, 1, 1]
+
+    Values read before an invalidation are not cached
+
+    >>> generation = cache.generation
+    >>> cache.discard('c')
+    >>> cache.put('c', 3, generation)
+    >>> cache.get('c') is None
+    True
+    """
+
+    def __init__(self, size, ttl, clock=time):
+        """
+        Cache initialization.
+
+        Parameters:
+            size    Maximum number of entries
+            ttl     Entries time to live, in seconds
+            clock   Function returning the current time
+        """
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+
+        # Incremented by each invalidation
+        self.generation = 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._stats = dict.fromkeys(('hits', 'misses', 'evictions',
+                                     'expirations', 'invalidations'), 0)
+
+    def __len__(self):
+        """
+        Returns the number of cached entries
+        """
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the value cached for a key, or None
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            if entry[0] <= self.clock():
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+
+            # Moves the entry to the most recently used end
+            self._entries[key] = entry
+            self._stats['hits'] += 1
+
+            return entry[1]
+
+    def put(self, key, value, generation=None):
+        """
+        Caches a value. If generation is given (the generation attribute
+        value read before reading value), the value is only cached if no
+        entry was invalidated meanwhile, as it may be stale.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._entries.pop(key, None)
+            self._entries[key] = (self.clock() + self.ttl, value)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def discard(self, key):
+        """
+        Invalidates the entry of a key
+        """
+        with self._lock:
+            self.generation += 1
+
+            if self._entries.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def discard_matching(self, predicate):
+        """
+        Invalidates the entries whose key matches a predicate
+        """
+        with self._lock:
+            self.generation += 1
+            keys = [ key for key in self._entries if predicate(key) ]
+
+            for key in keys:
+                del self._entries[key]
+
+            self._stats['invalidations'] += len(keys)
+
+    def clear(self):
+        """
+        Invalidates all the entries
+        """
+        with self._lock:
+            self.generation += 1
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def get_stats(self):
+        """
+        Returns the cache counters, and its current size
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+
+        return stats
+
+
+class CachingBackendDriver(object):
+    """
+    Backend driver wrapper caching sites and lookups results.
+
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> driver = CachingBackendDriver(MemoryBackendDriver())
+    >>> driver.add_site(get_test_site(u'name0'))
+    >>> driver.add_site(get_test_site(u'other0'))
+    >>> site = driver.get_site_by_name(u'name0', u'bpinet.com')
+    >>> driver.get_site_snapshot(u'NAME0', u'bpinet.com') is \\
+    ...     driver.get_site_snapshot(u'name0', u'bpinet.com')
+    True
+    >>> [ host.name for host in driver.lookup_host_by_name(u'name*', u'*') ]
+    [u'name0']
+    >>> [ host.name for host in driver.lookup_host_by_name(u'other*', u'*') ]
+    [u'other0']
+    >>> stats = driver.get_stats()
+    >>> stats['sites']['hits'], stats['lookups']['size']
+    (2, 2)
+
+    Writes only invalidate the matching entries
+
+    >>> site.dnshost.description = u'new desc'
+    >>> driver.update_site(site)
+    >>> driver.get_site_by_name(u'name0', u'bpinet.com').dnshost.description
+    u'new desc'
+    >>> driver.get_stats()['lookups']['size']
+    1
+    >>> driver.add_site(get_test_site(u'name1'))
+    >>> [ host.name for host in driver.lookup_host_by_name(u'name*', u'*') ]
+    [u'name0', u'name1']
+    >>> driver.delete_site(u'name1', u'bpinet.com')
+    >>> driver.get_site_snapshot(u'name1', u'bpinet.com') is None
+    True
+    >>> [ host.name for host in driver.lookup_host_by_name(u'name*', u'*') ]
+    [u'name0']
+
+    Writes made by other processes are seen on next reads
+
+    >>> site = driver.driver.get_site_by_name(u'name0', u'bpinet.com')
+    >>> site.dnshost.description = u'other desc'
+    >>> driver.driver.update_site(site)
+    >>> driver.driver.add_site(get_test_site(u'name2'))
+    >>> driver.get_site_snapshot(u'name0', u'bpinet.com').dnshost.description
+    u'other desc'
+    >>> [ host.name for host in driver.lookup_host_by_name(u'name*', u'*') ]
+    [u'name0', u'name2']
+    >>> snapshot = driver.get_site_snapshot(u'other0', u'bpinet.com')
+    >>> driver.get_site_snapshot(u'other0', u'bpinet.com') is snapshot
+    True
+    """
+
+    def __init__(self, driver, size=SITES_CACHE_SIZE,
+                 lookups_size=LOOKUPS_CACHE_SIZE, ttl=CACHE_TTL):
+        """
+        Wrapper initialization.
+
+        Parameters:
+            driver          Wrapped backend driver
+            size            Maximum number of cached sites
+            lookups_size    Maximum number of cached lookups results
+            ttl             Cached entries time to live, in seconds
+        """
+        self.driver = driver
+        self.sites = LRUCache(size, ttl)
+        self.lookups = LRUCache(lookups_size, ttl)
+
+        # Wrapped driver version cached entries were checked against
+        self._version = None
+        self._lock = Lock()
+
+    def get_stats(self):
+        """
+        Returns the sites and lookups caches counters (hits, misses,
+        evictions, expirations, invalidations and size), by cache name
+        """
+        return {'sites': self.sites.get_stats(),
+                'lookups': self.lookups.get_stats()}
+
+    def clear(self):
+        """
+        Invalidates all the cached entries
+        """
+        self.sites.clear()
+        self.lookups.clear()
+
+    def _invalidate(self, name, domain):
+        """
+        Invalidates the cached entries a site change may alter: the site
+        itself, and the lookups matching its name and domain
+        """
+        name = name.lower()
+        domain = domain.lower()
+
+        def matches(key):
+            return (get_wildcard_re(key[0]).match(name) and
+                    get_wildcard_re(key[1]).match(domain))
+
+        self.sites.discard((name, domain))
+        self.lookups.discard_matching(matches)
+
+    def _check_version(self):
+        """
+        Invalidates the cached entries of the sites changed since the
+        previous check, by any process
+        """
+        version = self.driver.get_version()
+
+        if version == self._version:
+            return
+
+        with self._lock:
+            if self._version is None:
+                changes = None
+            else:
+                version, changes = self.driver.changes_since(self._version)
+
+            if changes is None:
+                self.clear()
+            else:
+                for num, kind, name, domain in changes:
+                    self._invalidate(name, domain)
+
+            self._version = version
+
+    def get_site_by_name(self, name, domain):
+        """
+        Loads a site item based on its name and domain. It returns a new
+        mutable site object, or None if no site matches.
+        """
+        snapshot = self.get_site_snapshot(name, domain)
+
+        if snapshot is None:
+            return None
+
+        return snapshot.to_site()
+
+    def get_site_snapshot(self, name, domain):
+        """
+        Returns the immutable snapshot of a site, or None if no site matches.
+        """
+        self._check_version()
+        key = (name.lower(), domain.lower())
+        snapshot = self.sites.get(key)
+
+        if snapshot is None:
+            generation = self.sites.generation
+            snapshot = self.driver.get_site_snapshot(name, domain)
+
+            if snapshot is not None:
+                self.sites.put(key, snapshot, generation)
+
+        return snapshot
+
+    def _lookup(self, key, lookup, *args):
+        """
+        Returns a copy of the cached result of a lookup, calling it on
+        misses
+        """
+        self._check_version()
+        result = self.lookups.get(key)
+
+        if result is None:
+            generation = self.lookups.generation
+            result = lookup(*args)
+            self.lookups.put(key, result, generation)
+
+        return list(result)
+
+    def lookup_host_by_name(self, name, domain, limit=None, offset=0,
+                            after=None, sort=SORT_DOMAIN):
+        """
+        Looks for hosts whose name and domain match wildcard patterns (see
+        the wrapped driver)
+        """
+        key = (name.lower(), domain.lower(), None, limit, offset, after, sort)
+
+        return self._lookup(key, self.driver.lookup_host_by_name, name,
+                            domain, limit, offset, after, sort)
+
+    def lookup_host_fields(self, name, domain, fields, limit=None, offset=0,
+                           after=None, sort=SORT_DOMAIN):
+        """
+        Looks for hosts like lookup_host_by_name, returning only some fields
+        values (see the wrapped driver)
+        """
+        key = (name.lower(), domain.lower(), tuple(fields), limit, offset,
+               after, sort)
+
+        return self._lookup(key, self.driver.lookup_host_fields, name,
+                            domain, fields, limit, offset, after, sort)
+
+    def iter_hosts_by_name(self, name, domain, sort=SORT_DOMAIN,
+                           batch_size=500):
+        """
+        Generator yielding the hosts whose name and domain match wildcard
+        patterns, looked up batch_size hosts at a time. Streamed lookups are
+        not cached.
+        """
+        return iter_host_pages(self.driver.lookup_host_by_name, name, domain,
+                               sort, batch_size)
+
+    def find_sites(self, limit=None, after=None, **criteria):
+        """
+        Returns the snapshots of the sites matching all the criteria (not
+        cached: see the wrapped driver)
+        """
+        return self.driver.find_sites(limit, after, **criteria)
+
+    def search_descriptions(self, query, limit=None, after=None):
+        """
+        Returns the hosts whose description holds all the words of a query
+        (not cached: see the wrapped driver)
+        """
+        return self.driver.search_descriptions(query, limit, after)
+
+    def get_catalog_stats(self):
+        """
+        Returns the catalog statistics (not cached: the wrapped driver keeps
+        them up to date)
+        """
+        return self.driver.get_catalog_stats()
+
+    def iter_sites(self, batch_size=500):
+        """
+        Generator yielding all the sites snapshots (not cached)
+        """
+        return self.driver.iter_sites(batch_size)
+
+    def get_version(self):
+        """
+        Returns the current change version
+        """
+        return self.driver.get_version()
+
+    def changes_since(self, version):
+        """
+        Returns the (current version, changes) tuple of the changes made
+        after version
+        """
+        return self.driver.changes_since(version)
+
+    def add_site(self, site):
+        """
+        Adds a site
+        """
+        try:
+            self.driver.add_site(site)
+        finally:
+            self._invalidate(site.dnshost.name, site.dnshost.domain)
+
+    def add_sites(self, sites):
+        """
+        Adds several sites at once. If one of them already exists, none is
+        added.
+        """
+        try:
+            self.driver.add_sites(sites)
+        finally:
+            for site in sites:
+                self._invalidate(site.dnshost.name, site.dnshost.domain)
+
+    def insert_if_absent(self, site):
+        """
+        Adds a site if no site has the same name and domain. Returns True if
+        the site was added.
+        """
+        try:
+            return self.driver.insert_if_absent(site)
+        finally:
+            self._invalidate(site.dnshost.name, site.dnshost.domain)
+
+    def update_site(self, site):
+        """
+        Applies site object changes to the stored site
+        """
+        try:
+            self.driver.update_site(site)
+        finally:
+            self._invalidate(site.dnshost.name, site.dnshost.domain)
+
+    def update_if_version(self, site, version):
+        """
+        Applies site object changes to the stored site if its version is
+        still version, and returns its new version
+        """
+        try:
+            return self.driver.update_if_version(site, version)
+        finally:
+            self._invalidate(site.dnshost.name, site.dnshost.domain)
+
+    def delete_site(self, name, domain):
+        """
+        Deletes a site
+        """
+        try:
+            self.driver.delete_site(name, domain)
+        finally:
+            self._invalidate(name, domain)
+
+    def delete_if_exists(self, name, domain):
+        """
+        Deletes a site if it exists. Returns True if the site was deleted.
+        """
+        try:
+            return self.driver.delete_if_exists(name, domain)
+        finally:
+            self._invalidate(name, domain)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Backend drivers change feed.
+
+Each write to a driver increments its change version, a monotonic integer,
+and records the change in a bounded log. Views holding a copy of some sites
+(such as the sites list) remember the version they were loaded at, and ask
+the driver for the changes since this version (see changes_since driver
+methods) to apply them, instead of reloading everything.
+
+Changes are (version, kind, name, domain) tuples. When the log no longer
+holds all the changes since a version, drivers return None as changes: the
+view has to be reloaded.
+"""
+
+from collections import deque
+from threading import Lock
+
+# Change kinds
+CHANGE_INSERT = 'insert'
+CHANGE_UPDATE = 'update'
+CHANGE_DELETE = 'delete'
+
+
+def merge_changes(changes):
+    """
+    Returns the last change kind of each changed site, as (kind, name,
+    domain) tuples ordered by last change. A site deleted then inserted
+    again is updated.
+
+    >>> merge_changes([ (1, CHANGE_INSERT, u'name0', u'bpinet.com'),
+    ...                 (2, CHANGE_UPDATE, u'Name0', u'bpinet.com'),
+    ...                 (3, CHANGE_DELETE, u'name1', u'bpinet.com') ])
+    [('insert', u'Name0', u'bpinet.com'), ('delete', u'name1', u'bpinet.com')]
+    >>> merge_changes([ (1, CHANGE_DELETE, u'name0', u'bpinet.com'),
+    ...                 (2, CHANGE_INSERT, u'name0', u'bpinet.com') ])
+    [('update', u'name0', u'bpinet.com')]
+    """
+    merged = {}
+    order = []
+
+    for version, kind, name, domain in changes:
+        key = (name.lower(), domain.lower())
+        first = merged.get(key)
+
+        if first is None:
+            order.append(key)
+        elif first[0] == CHANGE_INSERT and kind != CHANGE_DELETE:
+            kind = CHANGE_INSERT
+        elif first[0] == CHANGE_INSERT:
+            # Inserted then deleted: nothing changed
+            order.remove(key)
+            del merged[key]
+            continue
+        elif first[0] == CHANGE_DELETE and kind == CHANGE_INSERT:
+            kind = CHANGE_UPDATE
+        else:
+            order.remove(key)
+            order.append(key)
+
+        merged[key] = (kind, name, domain)
+
+    return [ merged[key] for key in order ]
+
+
+class ChangeLog(object):
+    """
+    In memory bounded change log.
+
+    >>> log = ChangeLog(2)
+    >>> log.append(CHANGE_INSERT, u'name0', u'bpinet.com')
+    1
+    >>> log.append(CHANGE_UPDATE, u'name0', u'bpinet.com')
+    2
+    >>> log.since(1)
+    (2, [(2, 'update', u'name0', u'bpinet.com')])
+    >>> log.append(CHANGE_DELETE, u'name0', u'bpinet.com')
+    3
+    >>> log.since(0)
+    (3, None)
+    >>> log.since(3)
+    (3, [])
+    """
+
+    def __init__(self, size):
+        """
+        Log initialization.
+
+        Parameters:
+            size    Maximum number of changes kept
+        """
+        self.version = 0
+        self._changes = deque(maxlen=size)
+        self._lock = Lock()
+
+    def append(self, kind, name, domain):
+        """
+        Records a change, and returns the new version
+        """
+        with self._lock:
+            self.version += 1
+            self._changes.append((self.version, kind, name, domain))
+
+            return self.version
+
+    def since(self, version):
+        """
+        Returns the (current version, changes) tuple of the changes recorded
+        after version. Changes are None if some of them are no longer kept.
+        """
+        with self._lock:
+            changes = list(self._changes)
+            current = self.version
+
+        if version >= current:
+            return current, []
+
+        if not len(changes) or changes[0][0] > version + 1:
+            return current, None
+
+        return current, changes[version + 1 - changes[0][0]:]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
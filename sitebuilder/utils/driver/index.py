@@ -0,0 +1,585 @@
+#!/usr/bin/env python
+"""
+Site names index used by backend drivers to resolve wildcard lookups.
+
+Names are kept sorted per domain, so that a pattern starting with a literal
+prefix (such as the abc* filters used by the sites list) is resolved by a
+range scan instead of matching every site. Patterns with wildcards in other
+places are matched using cached compiled regular expressions, on the prefix
+range only.
+
+Sites are also indexed by the values of the attributes operators filter on
+(platform, database type...), so that multi-criteria queries intersect
+sorted lists of matching sites keys instead of scanning all the sites. Lists
+being sorted in results order, a page of results starts with a bisection
+from its cursor, and only costs its own length.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from heapq import merge
+from sitebuilder.exception import BackendError
+import re
+
+# Lookup sort orders: by domain then name, or by name then domain
+SORT_DOMAIN = 'domain'
+SORT_NAME = 'name'
+SORT_ORDERS = (SORT_DOMAIN, SORT_NAME)
+
+# Compiled wildcard patterns cache, and its maximum size
+_PATTERNS = {}
+_PATTERNS_SIZE = 256
+
+# Character sorting after any character names may use
+_MAX_CHAR = u'\uffff'
+
+# Site query criteria, and the (component, attribute) they filter on
+SITE_CRITERIA = {
+    'platform': ('dnshost', 'platform'),
+    'domain': ('dnshost', 'domain'),
+    'website_enabled': ('website', 'enabled'),
+    'website_maintenance': ('website', 'maintenance'),
+    'website_template': ('website', 'template'),
+    'database_enabled': ('database', 'enabled'),
+    'database_type': ('database', 'type'),
+    'database_done': ('database', 'done'),
+    'repository_type': ('repository', 'type'),
+    }
+
+
+def get_host_cursor(host, sort=SORT_DOMAIN):
+    """
+    Returns the cursor pointing after a host in lookup results sorted using
+    sort order: a tuple of normalized sort keys. Passed as after parameter to
+    lookups, it returns the hosts following this one.
+
+    >>> from sitebuilder.abstraction.site.snapshot import DNSHostSnapshot
+    >>> host = DNSHostSnapshot(name=u'Name0', domain=u'bpinet.com')
+    >>> get_host_cursor(host), get_host_cursor(host, SORT_NAME)
+    ((u'bpinet.com', u'name0'), (u'name0', u'bpinet.com'))
+    """
+    return get_cursor(host.name, host.domain, sort)
+
+
+def get_cursor(name, domain, sort=SORT_DOMAIN):
+    """
+    Returns the cursor pointing after a host name and domain in lookup
+    results sorted using sort order (see get_host_cursor).
+
+    >>> get_cursor(u'Name0', u'bpinet.com')
+    (u'bpinet.com', u'name0')
+    """
+    if sort == SORT_NAME:
+        return (name.lower(), domain.lower())
+
+    return (domain.lower(), name.lower())
+
+
+def iter_host_pages(lookup, name, domain, sort=SORT_DOMAIN, batch_size=500):
+    """
+    Generator yielding the hosts returned by a driver lookup method, one page
+    of batch_size hosts being requested at a time. Each page starts after the
+    last host of the previous one, so that sites added or removed meanwhile
+    neither shift nor repeat results.
+    """
+    after = None
+
+    while True:
+        hosts = lookup(name, domain, limit=batch_size, after=after, sort=sort)
+
+        for host in hosts:
+            yield host
+
+        if len(hosts) < batch_size:
+            break
+
+        after = get_host_cursor(hosts[-1], sort)
+
+
+def get_criteria(criteria):
+    """
+    Returns the list of (criterion, value) tuples of a site query, sorted by
+    criterion. Domains are case insensitive, and normalized.
+
+    >>> get_criteria({'domain': u'BPINET.com', 'database_enabled': True})
+    [('database_enabled', True), ('domain', u'bpinet.com')]
+    >>> get_criteria({'owner': u'me'})
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown site criterion owner
+    """
+    result = []
+
+    for criterion, value in sorted(criteria.items()):
+        if not criterion in SITE_CRITERIA:
+            raise BackendError("Unknown site criterion %s" % criterion)
+
+        if criterion == 'domain':
+            value = value.lower()
+
+        result.append((criterion, value))
+
+    return result
+
+
+def get_wildcard_re(pattern):
+    """
+    Returns the compiled regular expression matching a wildcard (*) pattern.
+    Compiled expressions are cached.
+
+    >>> get_wildcard_re(u'ab*.com').match(u'abc.com') is not None
+    True
+    >>> get_wildcard_re(u'ab*.com').match(u'abcxcom') is None
+    True
+    >>> get_wildcard_re(u'ab*.com') is get_wildcard_re(u'ab*.com')
+    True
+    """
+    regexp = _PATTERNS.get(pattern)
+
+    if regexp is None:
+        if len(_PATTERNS) >= _PATTERNS_SIZE:
+            _PATTERNS.clear()
+
+        regexp = re.compile("^%s$" % ".*".join(
+            [ re.escape(part) for part in pattern.split('*') ]))
+        _PATTERNS[pattern] = regexp
+
+    return regexp
+
+
+def match_range(names, pattern):
+    """
+    Returns the (start, end) range of a sorted list of names holding all the
+    names which may match a wildcard pattern, and a boolean telling if
+    names of this range still have to be filtered.
+
+    >>> match_range([u'abc', u'abd', u'b', u'bab'], u'ab*')
+    (0, 2, False)
+    >>> match_range([u'abc', u'abd', u'b', u'bab'], u'b*b')
+    (2, 4, True)
+    """
+    star = pattern.find('*')
+
+    # No wildcard: exact match
+    if star < 0:
+        start = bisect_left(names, pattern)
+        if start < len(names) and names[start] == pattern:
+            return start, start + 1, False
+        return start, start, False
+
+    # Literal prefix: range scan
+    prefix = pattern[:star]
+    start = 0
+    end = len(names)
+
+    if len(prefix):
+        start = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + _MAX_CHAR, start)
+
+    return start, end, star != len(pattern) - 1
+
+
+def filter_range(names, values, start, end, pattern):
+    """
+    Returns the values of the start:end range whose names match a wildcard
+    pattern. Names and values are parallel lists. If values is None, the
+    indexes of the matching names are returned.
+
+    Suffix (*abc) and substring (*abc*) patterns are matched using string
+    methods, which is way faster than regular expressions.
+
+    >>> names = [u'abc', u'abd', u'b', u'bab']
+    >>> filter_range(names, range(4), 0, 4, u'*b*')
+    [0, 1, 2, 3]
+    >>> filter_range(names, range(4), 0, 4, u'*d')
+    [1]
+    >>> filter_range(names, range(4), 2, 4, u'b*b')
+    [3]
+    """
+    if values is None:
+        values = xrange(len(names))
+    if pattern[0] == '*':
+        rest = pattern[1:]
+
+        if not '*' in rest:
+            return [ values[i] for i in xrange(start, end)
+                     if names[i].endswith(rest) ]
+
+        if rest.find('*') == len(rest) - 1:
+            rest = rest[:-1]
+            return [ values[i] for i in xrange(start, end)
+                     if rest in names[i] ]
+
+    match = get_wildcard_re(pattern).match
+    return [ values[i] for i in xrange(start, end) if match(names[i]) ]
+
+
+def match_sorted(names, pattern):
+    """
+    Returns the names of a sorted list matching a wildcard pattern, in
+    order.
+
+    >>> names = [u'abc', u'abd', u'b', u'bab']
+    >>> match_sorted(names, u'ab*')
+    [u'abc', u'abd']
+    >>> match_sorted(names, u'b')
+    [u'b']
+    >>> match_sorted(names, u'*b*')
+    [u'abc', u'abd', u'b', u'bab']
+    """
+    start, end, filtered = match_range(names, pattern)
+
+    if filtered:
+        return filter_range(names, names, start, end, pattern)
+
+    return names[start:end]
+
+
+class SiteNameIndex(object):
+    """
+    Index of values by normalized (lower case) site name, per domain.
+
+    >>> index = SiteNameIndex()
+    >>> for name, domain in ((u'Abc', u'bpinet.com'), (u'abd', u'bpinet.com'),
+    ...                      (u'abc', u'bpinet.fr'), (u'b', u'bpinet.com')):
+    ...     index.add(name, domain, u'%s.%s' % (name, domain))
+    >>> index.search(u'ab*', u'bpinet.com')
+    [u'Abc.bpinet.com', u'abd.bpinet.com']
+    >>> index.search(u'ABC', u'*')
+    [u'Abc.bpinet.com', u'abc.bpinet.fr']
+    >>> index.search(u'*b*', u'bpinet.com')
+    [u'Abc.bpinet.com', u'abd.bpinet.com', u'b.bpinet.com']
+    >>> index.replace(u'B', u'bpinet.com', u'B.bpinet.com')
+    >>> index.search(u'b', u'bpinet.com')
+    [u'B.bpinet.com']
+
+    Results may be sorted by name, and paginated using an offset or a cursor
+
+    >>> index.search(u'ab*', u'*', sort=SORT_NAME)
+    [u'Abc.bpinet.com', u'abc.bpinet.fr', u'abd.bpinet.com']
+    >>> index.search(u'*', u'*', limit=2, offset=1)
+    [u'abd.bpinet.com', u'B.bpinet.com']
+    >>> index.search(u'*', u'*', after=(u'bpinet.com', u'abd'))
+    [u'B.bpinet.com', u'abc.bpinet.fr']
+    >>> index.search(u'*', u'*', sort=SORT_NAME, after=(u'abc', u'bpinet.com'),
+    ...              limit=2)
+    [u'abc.bpinet.fr', u'abd.bpinet.com']
+
+    >>> index.remove(u'abc', u'bpinet.com')
+    >>> index.search(u'*', u'*.com')
+    [u'abd.bpinet.com', u'B.bpinet.com']
+    >>> len(index)
+    3
+    """
+
+    def __init__(self):
+        """
+        Index initialization.
+
+        For each domain, sorted names and their values are kept in two
+        parallel lists, so that ranges of values are mere list slices.
+        """
+        self._names = {}
+        self._values = {}
+        self._domains = []
+        self._len = 0
+
+    def __len__(self):
+        """
+        Returns the number of indexed values
+        """
+        return self._len
+
+    def add(self, name, domain, value):
+        """
+        Adds a value to the index
+        """
+        name = name.lower()
+        domain = domain.lower()
+        names = self._names.get(domain)
+
+        if names is None:
+            names = self._names[domain] = []
+            self._values[domain] = []
+            insort(self._domains, domain)
+
+        index = bisect_left(names, name)
+
+        if index < len(names) and names[index] == name:
+            raise KeyError("%s.%s" % (name, domain))
+
+        names.insert(index, name)
+        self._values[domain].insert(index, value)
+        self._len += 1
+
+    def replace(self, name, domain, value):
+        """
+        Replaces the value indexed for a name and a domain
+        """
+        name = name.lower()
+        domain = domain.lower()
+        names = self._names[domain]
+        index = bisect_left(names, name)
+
+        if index == len(names) or names[index] != name:
+            raise KeyError("%s.%s" % (name, domain))
+
+        self._values[domain][index] = value
+
+    def remove(self, name, domain):
+        """
+        Removes a value from the index
+        """
+        name = name.lower()
+        domain = domain.lower()
+        names = self._names[domain]
+        index = bisect_left(names, name)
+
+        if index == len(names) or names[index] != name:
+            raise KeyError("%s.%s" % (name, domain))
+
+        del names[index]
+        del self._values[domain][index]
+        self._len -= 1
+
+        if not len(names):
+            del self._names[domain]
+            del self._values[domain]
+            del self._domains[bisect_left(self._domains, domain)]
+
+    def search(self, name, domain, sort=SORT_DOMAIN, after=None,
+               limit=None, offset=0):
+        """
+        Returns the values whose name and domain match wildcard patterns.
+
+        Parameters:
+            sort    Sort order: SORT_DOMAIN (domain, then name) or SORT_NAME
+                    (name, then domain)
+            after   Cursor: only values following it in sort order are
+                    returned (see get_host_cursor)
+            limit   Maximum number of values returned (None for no limit)
+            offset  Number of values skipped
+        """
+        name = name.lower()
+        domain = domain.lower()
+
+        if sort == SORT_NAME:
+            values = merge(*[ self._iter_domain(name, value, after)
+                              for value in match_sorted(self._domains, domain) ])
+            if limit is None:
+                stop = None
+            else:
+                stop = offset + limit
+
+            return [ value for key, key_domain, value in
+                     islice(values, offset, stop) ]
+
+        result = []
+
+        for domain in match_sorted(self._domains, domain):
+            if after is not None and domain < after[0]:
+                continue
+
+            names = self._names[domain]
+            values = self._values[domain]
+            start, end, filtered = match_range(names, name)
+
+            if after is not None and domain == after[0]:
+                start = max(start, bisect_right(names, after[1]))
+
+            if filtered:
+                values = filter_range(names, values, start, end, name)
+                start, end = 0, len(values)
+
+            # Skips offset values, then takes at most limit values
+            skipped = min(offset, max(end - start, 0))
+            start += skipped
+            offset -= skipped
+
+            if limit is not None:
+                end = min(end, start + limit - len(result))
+
+            result.extend(values[start:end])
+
+            if limit is not None and len(result) >= limit:
+                break
+
+        return result
+
+    def _iter_domain(self, name, domain, after=None):
+        """
+        Generator yielding the (name, domain, value) tuples of a domain whose
+        name matches a wildcard pattern, following an after cursor in
+        SORT_NAME order.
+        """
+        names = self._names[domain]
+        values = self._values[domain]
+        start, end, filtered = match_range(names, name)
+
+        if after is not None:
+            if domain > after[1]:
+                start = max(start, bisect_left(names, after[0]))
+            else:
+                start = max(start, bisect_right(names, after[0]))
+
+        if filtered:
+            indexes = filter_range(names, None, start, end, name)
+        else:
+            indexes = xrange(start, end)
+
+        for i in indexes:
+            yield names[i], domain, values[i]
+
+
+class AttributeIndex(object):
+    """
+    Secondary index of site keys by criterion value (see SITE_CRITERIA):
+    for each (criterion, value) tuple, the sorted list of the keys of the
+    sites matching it. Keys may be any sortable value identifying a site,
+    such as its cursor: results are returned in keys order.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+    >>> site = SiteSnapshot.from_site(get_test_site(u'name0'))
+    >>> index = AttributeIndex()
+    >>> index.add(u'name0.bpinet.com', site)
+    >>> index.add(u'name1.bpinet.com', site.replace('website', enabled=False))
+    >>> index.add(u'name2.bpinet.com', site)
+    >>> index.find({'website_enabled': True, 'platform': u'prod'})
+    [u'name0.bpinet.com', u'name2.bpinet.com']
+
+    Results may be paginated using a cursor
+
+    >>> index.find({'website_enabled': True, 'platform': u'prod'},
+    ...            after=u'name0.bpinet.com', limit=1)
+    [u'name2.bpinet.com']
+    >>> index.find({'platform': u'prod'}, after=u'name0.bpinet.com', limit=1)
+    [u'name1.bpinet.com']
+
+    >>> index.replace(u'name0.bpinet.com', site,
+    ...               site.replace('website', enabled=False))
+    >>> index.find({'website_enabled': True, 'platform': u'prod'})
+    [u'name2.bpinet.com']
+    >>> index.remove(u'name1.bpinet.com',
+    ...              site.replace('website', enabled=False))
+    >>> index.find({'domain': u'BPINET.COM'})
+    [u'name0.bpinet.com', u'name2.bpinet.com']
+    >>> index.find({'platform': u'test'})
+    []
+    """
+
+    def __init__(self):
+        """
+        Index initialization
+        """
+        self._postings = {}
+        self._criteria = SITE_CRITERIA.items()
+
+    def _iter_values(self, site):
+        """
+        Generator yielding the (criterion, value) tuples of a site
+        """
+        for criterion, (component, attr) in self._criteria:
+            value = getattr(getattr(site, component), attr)
+
+            if criterion == 'domain':
+                value = value.lower()
+
+            yield criterion, value
+
+    def _discard(self, item, key):
+        """
+        Removes a key from the list of a (criterion, value) tuple
+        """
+        keys = self._postings[item]
+        index = bisect_left(keys, key)
+
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+        if not len(keys):
+            del self._postings[item]
+
+    def add(self, key, site):
+        """
+        Indexes a site by its criteria values
+        """
+        for item in self._iter_values(site):
+            insort(self._postings.setdefault(item, []), key)
+
+    def remove(self, key, site):
+        """
+        Removes a site from the index
+        """
+        for item in self._iter_values(site):
+            self._discard(item, key)
+
+    def replace(self, key, old, new):
+        """
+        Updates the index of a site whose values changed from the old site
+        ones to the new site ones
+        """
+        for item, new_item in zip(self._iter_values(old),
+                                  self._iter_values(new)):
+            if item != new_item:
+                self._discard(item, key)
+                insort(self._postings.setdefault(new_item, []), key)
+
+    def find(self, criteria, after=None, limit=None):
+        """
+        Returns the sorted list of the keys of the sites matching all the
+        criteria (see get_criteria), which may not be empty. Only the keys
+        following the after key are returned, at most limit ones.
+
+        The smallest list is scanned from the after key, and its keys are
+        looked up in the other lists by bisection, each lookup starting
+        from the previous one.
+        """
+        postings = []
+
+        for item in get_criteria(criteria):
+            keys = self._postings.get(item)
+
+            if keys is None:
+                return []
+
+            postings.append(keys)
+
+        postings.sort(key=len)
+        first = postings[0]
+        others = postings[1:]
+        start = 0
+
+        if after is not None:
+            start = bisect_right(first, after)
+
+        if not len(others):
+            if limit is None:
+                return first[start:]
+
+            return first[start:start + limit]
+
+        positions = [ 0 ] * len(others)
+        result = []
+
+        for i in xrange(start, len(first)):
+            key = first[i]
+
+            for num, keys in enumerate(others):
+                position = bisect_left(keys, key, positions[num])
+                positions[num] = position
+
+                if position == len(keys) or keys[position] != key:
+                    break
+            else:
+                result.append(key)
+
+                if limit is not None and len(result) >= limit:
+                    break
+
+        return result
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
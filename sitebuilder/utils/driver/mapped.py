@@ -0,0 +1,893 @@
+#!/usr/bin/env python
+"""
+Memory mapped catalog snapshot backend driver.
+
+Building a driver holding the whole catalog (or its indexes) takes time
+proportional to the number of sites, before the sites list may render. A
+catalog snapshot is a compact binary file written from a driver (see
+write_catalog) which is memory mapped instead: opening it only reads its
+header, and lookups read rows straight from the mapped file, only turning
+the rows they return into snapshot objects.
+
+File layout (little endian unsigned 32 bits integers):
+
+    header      magic, number of fields per site, number of sites, catalog
+                version, and offsets of the other sections
+    rows        one fixed width row per site, sorted by domain then name:
+                domain key, name key, site version, then the site attributes
+                in SITE_FIELDS order
+    name order  rows numbers sorted by name then domain
+    strings     string table: length prefixed UTF-8 strings, each value
+                being stored once
+
+Attributes values are string table offsets, or one of the NONE, FALSE and
+TRUE codes. Keys are the lower case name and domain, so that rows are found
+by binary searches on the mapped file.
+
+Snapshots are read only. Given the driver they were written from, the
+driver serves reads from the snapshot as long as it is up to date: the
+wrapped driver version is checked on each read, and once it differs from
+the snapshot one (after writes of any process), reads and writes are
+forwarded to the wrapped driver. The registry wraps the configured driver
+this way when a snapshot file is configured (see
+sitebuilder.utils.driver.registry).
+"""
+
+from sitebuilder.abstraction.site.record import SITE_FIELDS
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.abstraction.site.snapshot import DNSHostSnapshot
+from sitebuilder.utils.driver.index import SORT_DOMAIN, SORT_NAME
+from sitebuilder.utils.driver.index import SITE_CRITERIA
+from sitebuilder.utils.driver.index import get_cursor, get_host_cursor
+from sitebuilder.utils.driver.index import get_criteria, get_wildcard_re
+from sitebuilder.utils.driver.index import iter_host_pages
+from sitebuilder.utils.driver.memory import get_host_getter
+from sitebuilder.utils.driver.text import tokenize, parse_query
+from sitebuilder.utils.driver.stats import get_deltas, build_stats
+from sitebuilder.utils.lock import ReadWriteLock
+from sitebuilder.exception import BackendError
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from mmap import mmap, ACCESS_READ
+from tempfile import mkstemp
+import struct
+import os
+
+_MAGIC = 'SBCAT001'
+_HEADER = struct.Struct('<8s7I')
+_UINT = struct.Struct('<I')
+
+# Attributes values codes which aren't string table offsets
+NONE = 0xffffffff
+FALSE = 0xfffffffe
+TRUE = 0xfffffffd
+
+# Site attributes, in rows order, and their positions
+_FIELDS = [ (component, attr) for component, attrs in SITE_FIELDS
+            for attr in attrs ]
+_POSITIONS = dict([ (field, num) for num, field in enumerate(_FIELDS) ])
+
+# Number of dnshost attributes, which come first
+_HOST_SIZE = len(SITE_FIELDS[0][1])
+
+# Rows hold the domain and name keys, and the site version, before the
+# attributes values
+_ROW = struct.Struct('<%dI' % (len(_FIELDS) + 3))
+_KEYS = struct.Struct('<2I')
+
+# Character sorting after any character names may use
+_MAX_CHAR = u'\uffff'
+
+
+class _StringTable(object):
+    """
+    String table being written: each string is stored once
+    """
+
+    def __init__(self):
+        """
+        Table initialization
+        """
+        self._offsets = {}
+        self._chunks = []
+        self.size = 0
+
+    def add(self, value):
+        """
+        Returns the code of a value: the offset of a string, added if new,
+        or a NONE, FALSE or TRUE code
+        """
+        if value is None:
+            return NONE
+        if value is True:
+            return TRUE
+        if value is False:
+            return FALSE
+
+        offset = self._offsets.get(value)
+
+        if offset is None:
+            data = unicode(value).encode('utf-8')
+            offset = self._offsets[value] = self.size
+            self._chunks.append(_UINT.pack(len(data)))
+            self._chunks.append(data)
+            self.size += _UINT.size + len(data)
+
+        return offset
+
+    def write(self, stream):
+        """
+        Writes the table to a stream
+        """
+        stream.writelines(self._chunks)
+
+
+def write_catalog(path, sites, version=0):
+    """
+    Writes a catalog snapshot file holding sites (objects or snapshots), as
+    of catalog version. The file is written aside, then renamed, so that
+    readers never see a partial file. Returns the number of sites written.
+    """
+    strings = _StringTable()
+    rows = []
+    deltas = {}
+
+    for site in sites:
+        dnshost = site.dnshost
+        values = [ strings.add(dnshost.domain.lower()),
+                   strings.add(dnshost.name.lower()),
+                   getattr(site, 'version', 0) or 0 ]
+        values.extend([ strings.add(getattr(getattr(site, component), attr))
+                        for component, attr in _FIELDS ])
+        rows.append((get_cursor(dnshost.name, dnshost.domain), values))
+
+        for item, delta in get_deltas(None, site).iteritems():
+            deltas[item] = deltas.get(item, 0) + delta
+
+    rows.sort()
+
+    for num in xrange(1, len(rows)):
+        if rows[num][0] == rows[num - 1][0]:
+            raise BackendError("Site %s.%s already exists" % (
+                rows[num][0][1], rows[num][0][0]))
+
+    # Rows numbers in SORT_NAME order
+    order = sorted(xrange(len(rows)),
+                   key=lambda num: (rows[num][0][1], rows[num][0][0]))
+    stats = strings.add(u'\n'.join([ u'%s\t%s\t%d' % (group, value, count)
+                                     for (group, value), count
+                                     in deltas.iteritems() if count ]))
+
+    rows_offset = _HEADER.size
+    order_offset = rows_offset + len(rows) * _ROW.size
+    strings_offset = order_offset + len(rows) * _UINT.size
+
+    # Each writer uses its own temporary file
+    handle, temp_path = mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            stream.write(_HEADER.pack(_MAGIC, len(_FIELDS), len(rows),
+                                      version, rows_offset, order_offset,
+                                      strings_offset, stats))
+            stream.writelines([ _ROW.pack(*values)
+                                for cursor, values in rows ])
+            stream.write(struct.pack('<%dI' % len(order), *order))
+            strings.write(stream)
+
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    return len(rows)
+
+
+def save_catalog(driver, path):
+    """
+    Writes the catalog snapshot of all the sites of a driver. The version is
+    read first: if sites change meanwhile, the snapshot is seen as outdated.
+    Returns the number of sites written.
+    """
+    version = driver.get_version()
+
+    return write_catalog(path, driver.iter_sites(), version)
+
+
+class _KeyColumn(object):
+    """
+    Sequence of the rows keys of a catalog, in a sort order, that bisect
+    functions may search
+    """
+
+    def __init__(self, catalog, sort):
+        """
+        Column initialization
+        """
+        self._catalog = catalog
+        self._sort = sort
+
+    def __len__(self):
+        """
+        Returns the number of rows
+        """
+        return len(self._catalog)
+
+    def __getitem__(self, position):
+        """
+        Returns the cursor of the row at a position
+        """
+        return self._catalog.get_cursor(
+            self._catalog.get_row(position, self._sort), self._sort)
+
+
+class MappedCatalog(object):
+    """
+    Memory mapped catalog snapshot file.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> path = os.path.join(directory, 'sites.snap')
+    >>> write_catalog(path, [ get_test_site(u'name%d' % num)
+    ...                       for num in (2, 0, 1) ], 7)
+    3
+    >>> catalog = MappedCatalog(path)
+    >>> len(catalog), catalog.version
+    (3, 7)
+    >>> catalog.get_site(catalog.find_row(u'NAME1', u'bpinet.com')).dnshost.name
+    u'name1'
+    >>> catalog.find_row(u'name3', u'bpinet.com') is None
+    True
+    >>> [ catalog.get_host(row).name for row in catalog.search(u'*', u'*') ]
+    [u'name0', u'name1', u'name2']
+    >>> catalog.get_stats()['sites']
+    3
+    >>> catalog.close()
+    >>> open(path, 'wb').write('sites')
+    >>> MappedCatalog(path)
+    Traceback (most recent call last):
+        ...
+    BackendError: Invalid catalog snapshot file
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, path):
+        """
+        Maps a catalog snapshot file, and reads its header
+        """
+        self.path = path
+
+        with open(path, 'rb') as stream:
+            try:
+                self._map = mmap(stream.fileno(), 0, access=ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                raise BackendError("Invalid catalog snapshot file")
+
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise BackendError("Invalid catalog snapshot file")
+
+        (magic, fields, self._len, self.version, self._rows, self._order,
+         self._strings, self._stats) = _HEADER.unpack_from(self._map)
+
+        if magic != _MAGIC or fields != len(_FIELDS):
+            self.close()
+            raise BackendError("Invalid catalog snapshot file")
+
+        self._keys = { SORT_DOMAIN: _KeyColumn(self, SORT_DOMAIN),
+                       SORT_NAME: _KeyColumn(self, SORT_NAME) }
+
+    def __len__(self):
+        """
+        Returns the number of sites
+        """
+        return self._len
+
+    def close(self):
+        """
+        Unmaps the file
+        """
+        self._map.close()
+
+    def get_string(self, offset):
+        """
+        Returns the value of a code (see NONE, FALSE and TRUE) or a string
+        table offset
+        """
+        if offset == NONE:
+            return None
+        if offset == TRUE:
+            return True
+        if offset == FALSE:
+            return False
+
+        start = self._strings + offset
+        length, = _UINT.unpack_from(self._map, start)
+        start += _UINT.size
+
+        return self._map[start:start + length].decode('utf-8')
+
+    def get_row(self, position, sort=SORT_DOMAIN):
+        """
+        Returns the number of the row at a position in a sort order
+        """
+        if sort == SORT_NAME:
+            return _UINT.unpack_from(
+                self._map, self._order + position * _UINT.size)[0]
+
+        return position
+
+    def get_cursor(self, row, sort=SORT_DOMAIN):
+        """
+        Returns the cursor of a row (see
+        sitebuilder.utils.driver.index.get_cursor)
+        """
+        domain, name = _KEYS.unpack_from(self._map,
+                                         self._rows + row * _ROW.size)
+
+        if sort == SORT_NAME:
+            return (self.get_string(name), self.get_string(domain))
+
+        return (self.get_string(domain), self.get_string(name))
+
+    def get_value(self, row, component, attr):
+        """
+        Returns the value of a site attribute of a row
+        """
+        offset = self._rows + row * _ROW.size
+        offset += (_POSITIONS[(component, attr)] + 3) * _UINT.size
+
+        return self.get_string(_UINT.unpack_from(self._map, offset)[0])
+
+    def get_host(self, row):
+        """
+        Returns the dnshost snapshot of a row
+        """
+        values = _ROW.unpack_from(self._map, self._rows + row * _ROW.size)
+
+        return DNSHostSnapshot.from_tuple(
+            [ self.get_string(value) for value in values[3:3 + _HOST_SIZE] ])
+
+    def get_site(self, row):
+        """
+        Returns the site snapshot of a row
+        """
+        values = _ROW.unpack_from(self._map, self._rows + row * _ROW.size)
+
+        return SiteSnapshot.from_tuple(
+            [ self.get_string(value) for value in values[3:] ], values[2])
+
+    def find_row(self, name, domain):
+        """
+        Returns the number of the row of a site, or None
+        """
+        cursor = get_cursor(name, domain)
+        row = bisect_left(self._keys[SORT_DOMAIN], cursor)
+
+        if row < self._len and self.get_cursor(row) == cursor:
+            return row
+
+        return None
+
+    def iter_rows(self, sort=SORT_DOMAIN, after=None):
+        """
+        Generator yielding rows numbers in a sort order, following an after
+        cursor
+        """
+        start = 0
+
+        if after is not None:
+            start = bisect_right(self._keys[sort], tuple(after))
+
+        for position in xrange(start, self._len):
+            yield self.get_row(position, sort)
+
+    def search(self, name, domain, sort=SORT_DOMAIN, after=None, limit=None,
+               offset=0):
+        """
+        Returns the numbers of the rows matching name and domain wildcard
+        patterns (see sitebuilder.utils.driver.index.SiteNameIndex.search
+        for sorting and pagination parameters). Rows are scanned from the
+        range of the literal prefix of the sort order first pattern. If the
+        second pattern has a literal prefix too, the scan jumps to its range
+        in each block of rows sharing their first key. The scan stops once
+        limit rows matched.
+        """
+        name = name.lower()
+        domain = domain.lower()
+        patterns = (domain, name)
+
+        if sort == SORT_NAME:
+            patterns = (name, domain)
+
+        keys = self._keys[sort]
+        first, second = [ pattern.split('*', 1)[0] for pattern in patterns ]
+        start = 0
+        end = self._len
+
+        if not '*' in patterns[0]:
+            start = bisect_left(keys, (first,))
+            end = bisect_left(keys, (first + u'\0',), start)
+        elif len(first):
+            start = bisect_left(keys, (first,))
+            end = bisect_left(keys, (first + _MAX_CHAR,), start)
+
+        if after is not None:
+            start = max(start, bisect_right(keys, tuple(after), start))
+
+        matches = [ get_wildcard_re(pattern).match for pattern in patterns ]
+
+        def iter_ranges():
+            if not len(second):
+                yield start, end
+                return
+
+            position = start
+
+            while position < end:
+                key = keys[position][0]
+                block_end = bisect_left(keys, (key + u'\0',), position, end)
+
+                if matches[0](key):
+                    yield (bisect_left(keys, (key, second), position,
+                                       block_end),
+                           bisect_left(keys, (key, second + _MAX_CHAR),
+                                       position, block_end))
+
+                position = block_end
+
+        def scan():
+            for range_start, range_end in iter_ranges():
+                for position in xrange(range_start, range_end):
+                    cursor = keys[position]
+
+                    if matches[0](cursor[0]) and matches[1](cursor[1]):
+                        yield self.get_row(position, sort)
+
+        if limit is None:
+            return list(islice(scan(), offset, None))
+
+        return list(islice(scan(), offset, offset + limit))
+
+    def find(self, criteria, after=None, limit=None):
+        """
+        Returns the numbers of the rows matching all the criteria (see
+        sitebuilder.utils.driver.index.SITE_CRITERIA), ordered by domain then
+        name. Rows are scanned, until limit rows matched.
+        """
+        criteria = [ (SITE_CRITERIA[criterion], value)
+                     for criterion, value in get_criteria(criteria) ]
+
+        def scan():
+            for row in self.iter_rows(SORT_DOMAIN, after):
+                for (component, attr), value in criteria:
+                    found = self.get_value(row, component, attr)
+
+                    if attr == 'domain':
+                        found = found.lower()
+                    if found != value:
+                        break
+                else:
+                    yield row
+
+        return list(islice(scan(), limit))
+
+    def search_descriptions(self, query, after=None, limit=None):
+        """
+        Returns the numbers of the rows whose description holds all the
+        words of a query (see sitebuilder.utils.driver.text.parse_query),
+        ordered by domain then name. Rows are scanned, until limit rows
+        matched.
+        """
+        terms = parse_query(query)
+
+        if not len(terms):
+            return []
+
+        def matches(tokens, token, prefix):
+            if not prefix:
+                return token in tokens
+
+            for found in tokens:
+                if found.startswith(token):
+                    return True
+
+            return False
+
+        def scan():
+            for row in self.iter_rows(SORT_DOMAIN, after):
+                tokens = tokenize(self.get_value(row, 'dnshost',
+                                                 'description'))
+
+                for token, prefix in terms:
+                    if not matches(tokens, token, prefix):
+                        break
+                else:
+                    yield row
+
+        return list(islice(scan(), limit))
+
+    def get_stats(self):
+        """
+        Returns the catalog statistics stored when the file was written (see
+        sitebuilder.utils.driver.stats.build_stats)
+        """
+        counts = {}
+
+        for line in self.get_string(self._stats).splitlines():
+            group, value, count = line.split(u'\t')
+            counts[(str(group), value)] = int(count)
+
+        return build_stats(counts)
+
+
+class MappedBackendDriver(object):
+    """
+    Catalog snapshot backend driver.
+
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> path = os.path.join(directory, 'sites.snap')
+    >>> memory = MemoryBackendDriver()
+    >>> memory.add_sites([ get_test_site(u'name%d' % num) for num in range(5) ])
+    >>> save_catalog(memory, path)
+    5
+
+    Reads are served from the snapshot
+
+    >>> driver = MappedBackendDriver(path)
+    >>> driver.get_site_by_name(u'NAME3', u'bpinet.com').dnshost.name
+    u'name3'
+    >>> driver.get_site_snapshot(u'name3', u'bpinet.com').version
+    4
+    >>> [ host.name for host in driver.lookup_host_by_name(
+    ...       u'name*', u'*', limit=2, after=(u'bpinet.com', u'name0')) ]
+    [u'name1', u'name2']
+    >>> driver.lookup_host_fields(u'*', u'*', ('name', 'platform'),
+    ...                           sort=SORT_NAME, limit=1, offset=4)
+    [(u'name4', u'prod')]
+    >>> [ found.dnshost.name for found in driver.find_sites(
+    ...       limit=2, after=(u'bpinet.com', u'name1'), platform=u'prod') ]
+    [u'name2', u'name3']
+    >>> [ host.name for host in driver.search_descriptions(u'DESC name4*') ]
+    [u'name4']
+    >>> driver.get_catalog_stats()['sites'], driver.changes_since(3)
+    (5, (5, None))
+    >>> driver.delete_site(u'name0', u'bpinet.com')
+    Traceback (most recent call last):
+        ...
+    BackendError: Catalog snapshot is read only
+
+    Given the driver the snapshot was written from, writes are forwarded to
+    it, which then serves reads too
+
+    >>> driver = MappedBackendDriver(path, memory)
+    >>> driver.is_mapped()
+    True
+    >>> catalog = driver._catalog
+    >>> driver.delete_site(u'name0', u'bpinet.com')
+    >>> driver.is_mapped(), len(list(driver.iter_sites(batch_size=2)))
+    (False, 4)
+
+    Dropped snapshots are unmapped, as are closed ones
+
+    >>> len(catalog._map)
+    Traceback (most recent call last):
+        ...
+    ValueError: mmap closed or invalid
+    >>> readonly = MappedBackendDriver(path)
+    >>> readonly.close()
+    >>> readonly.get_site_snapshot(u'name3', u'bpinet.com')
+    Traceback (most recent call last):
+        ...
+    BackendError: Catalog snapshot is closed
+
+    Outdated snapshots are not used
+
+    >>> MappedBackendDriver(path, memory).is_mapped()
+    False
+
+    Snapshots outdated by writes made meanwhile, by other processes, stop
+    being used too
+
+    >>> save_catalog(memory, path)
+    4
+    >>> driver = MappedBackendDriver(path, memory)
+    >>> driver.is_mapped(), driver.changes_since(memory.get_version())
+    (True, (6, []))
+    >>> memory.delete_site(u'name1', u'bpinet.com')
+    >>> driver.get_site_snapshot(u'name1', u'bpinet.com') is None
+    True
+    >>> driver.is_mapped(), driver.changes_since(6)[1]
+    (False, [(7, 'delete', u'name1', u'bpinet.com')])
+
+    Missing or invalid snapshots are not used either
+
+    >>> MappedBackendDriver(os.path.join(directory, 'none.snap'),
+    ...                     memory).is_mapped()
+    False
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, path, driver=None):
+        """
+        Driver initialization.
+
+        Parameters:
+            path    Catalog snapshot file path (see write_catalog)
+            driver  Driver the snapshot was written from, to which writes
+                    are forwarded. If not set, the snapshot is read only.
+        """
+        self.driver = driver
+        self._catalog = None
+
+        # Reads hold the lock for reading while they use the snapshot,
+        # which is only unmapped once they are done
+        self._lock = ReadWriteLock()
+
+        try:
+            self._catalog = MappedCatalog(path)
+        except (BackendError, EnvironmentError):
+            if driver is None:
+                raise
+
+    def _drop(self):
+        """
+        Stops serving reads from the snapshot, and unmaps it once the
+        reads using it are done
+        """
+        with self._lock.writing():
+            catalog = self._catalog
+            self._catalog = None
+
+        if catalog is not None:
+            catalog.close()
+
+    @contextmanager
+    def _reading(self):
+        """
+        Context manager returning the snapshot reads are served from, which
+        isn't unmapped meanwhile, or None if it is outdated: reads are then
+        served by the wrapped driver
+        """
+        catalog = self._catalog
+
+        if catalog is not None and self.driver is not None and \
+                self.driver.get_version() != catalog.version:
+            self._drop()
+
+        with self._lock.reading():
+            if self._catalog is None and self.driver is None:
+                raise BackendError("Catalog snapshot is closed")
+
+            yield self._catalog
+
+    def is_mapped(self):
+        """
+        Returns True if reads are served from the snapshot
+        """
+        with self._reading() as catalog:
+            return catalog is not None
+
+    def close(self):
+        """
+        Unmaps the snapshot. Reads and writes are then forwarded to the
+        wrapped driver, if any, which is left open.
+        """
+        self._drop()
+
+    def _write(self):
+        """
+        Returns the driver writes are forwarded to, reads being served by it
+        from now on
+        """
+        if self.driver is None:
+            raise BackendError("Catalog snapshot is read only")
+
+        self._drop()
+
+        return self.driver
+
+    def get_version(self):
+        """
+        Returns the current change version
+        """
+        if self.driver is not None:
+            return self.driver.get_version()
+
+        with self._reading() as catalog:
+            return catalog.version
+
+    def changes_since(self, version):
+        """
+        Returns the (current version, changes) tuple of the changes made
+        after version (see sitebuilder.utils.driver.changes). Snapshots
+        don't keep changes: they are read from the wrapped driver.
+        """
+        if self.driver is not None:
+            return self.driver.changes_since(version)
+
+        with self._reading() as catalog:
+            if version >= catalog.version:
+                return catalog.version, []
+
+            return catalog.version, None
+
+    def get_site_by_name(self, name, domain):
+        """
+        Loads a site item based on its name and domain. It returns a new
+        mutable site object, or None if no site matches.
+        """
+        site = self.get_site_snapshot(name, domain)
+
+        if site is None:
+            return None
+
+        return site.to_site()
+
+    def get_site_snapshot(self, name, domain):
+        """
+        Returns the immutable snapshot of a site, or None if no site matches.
+        """
+        with self._reading() as catalog:
+            if catalog is not None:
+                row = catalog.find_row(name, domain)
+
+                if row is None:
+                    return None
+
+                return catalog.get_site(row)
+
+        return self.driver.get_site_snapshot(name, domain)
+
+    def lookup_host_by_name(self, name, domain, limit=None, offset=0,
+                            after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites using name and domain as search filter, and returns
+        the matching sites dnshost immutable snapshots (see
+        sitebuilder.utils.driver.memory.MemoryBackendDriver.lookup_host_by_name)
+        """
+        with self._reading() as catalog:
+            if catalog is not None:
+                return [ catalog.get_host(row) for row in
+                         catalog.search(name, domain, sort, after, limit,
+                                        offset) ]
+
+        return self.driver.lookup_host_by_name(name, domain, limit, offset,
+                                               after, sort)
+
+    def lookup_host_fields(self, name, domain, fields, limit=None, offset=0,
+                           after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites like lookup_host_by_name, but only returns tuples of
+        the requested dnshost fields values.
+        """
+        getter = get_host_getter(fields)
+
+        with self._reading() as catalog:
+            if catalog is not None:
+                return [ getter(catalog.get_host(row)) for row in
+                         catalog.search(name, domain, sort, after, limit,
+                                        offset) ]
+
+        return self.driver.lookup_host_fields(name, domain, fields, limit,
+                                              offset, after, sort)
+
+    def iter_hosts_by_name(self, name, domain, sort=SORT_DOMAIN,
+                           batch_size=500):
+        """
+        Generator yielding the hosts matching name and domain wildcard
+        patterns, looked up batch_size hosts at a time.
+        """
+        return iter_host_pages(self.lookup_host_by_name, name, domain, sort,
+                               batch_size)
+
+    def iter_sites(self, batch_size=500):
+        """
+        Generator yielding all the sites snapshots, ordered by domain then
+        name, looked up batch_size sites at a time.
+        """
+        after = None
+
+        while True:
+            sites = self.find_sites(batch_size, after)
+
+            for site in sites:
+                yield site
+
+            if len(sites) < batch_size:
+                break
+
+            after = get_host_cursor(sites[-1].dnshost)
+
+    def find_sites(self, limit=None, after=None, **criteria):
+        """
+        Returns the snapshots of the sites matching all the criteria, given
+        as keyword arguments (see
+        sitebuilder.utils.driver.index.SITE_CRITERIA), ordered by domain
+        then name. Snapshots rows are scanned.
+        """
+        with self._reading() as catalog:
+            if catalog is not None:
+                return [ catalog.get_site(row)
+                         for row in catalog.find(criteria, after, limit) ]
+
+        return self.driver.find_sites(limit, after, **criteria)
+
+    def search_descriptions(self, query, limit=None, after=None):
+        """
+        Returns the dnshost immutable snapshots of the sites whose
+        description holds all the words of a query, ordered by domain then
+        name. Snapshots rows are scanned.
+        """
+        with self._reading() as catalog:
+            if catalog is not None:
+                return [ catalog.get_host(row) for row in
+                         catalog.search_descriptions(query, after, limit) ]
+
+        return self.driver.search_descriptions(query, limit, after)
+
+    def get_catalog_stats(self):
+        """
+        Returns the catalog statistics (see sitebuilder.utils.driver.stats)
+        """
+        with self._reading() as catalog:
+            if catalog is not None:
+                return catalog.get_stats()
+
+        return self.driver.get_catalog_stats()
+
+    def add_site(self, site):
+        """
+        Adds a site
+        """
+        self._write().add_site(site)
+
+    def add_sites(self, sites):
+        """
+        Adds several sites at once
+        """
+        self._write().add_sites(sites)
+
+    def insert_if_absent(self, site):
+        """
+        Adds a site if no site has the same name and domain. Returns True if
+        the site was added.
+        """
+        return self._write().insert_if_absent(site)
+
+    def update_site(self, site):
+        """
+        Applies site object changes to the stored site
+        """
+        self._write().update_site(site)
+
+    def update_if_version(self, site, version):
+        """
+        Applies site object changes to the stored site if its version is
+        still version, and returns its new version
+        """
+        return self._write().update_if_version(site, version)
+
+    def delete_site(self, name, domain):
+        """
+        Deletes a site
+        """
+        self._write().delete_site(name, domain)
+
+    def delete_if_exists(self, name, domain):
+        """
+        Deletes a site if it exists. Returns True if the site was deleted.
+        """
+        return self._write().delete_if_exists(name, domain)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,656 @@
+#!/usr/bin/env python
+"""
+In memory backend driver implementation.
+
+Sites are kept in insertion order, and indexed by their normalized
+name.domain key (see sitebuilder.abstraction.site.record.get_site_key), so
+that exact lookups, updates and deletes are done in constant time. Secondary
+indexes resolve multi-criteria queries (see find_sites), and descriptions
+searches (see search_descriptions). Catalog statistics are counted as sites
+change (see get_catalog_stats).
+
+Sites are stored as immutable snapshots, which read methods return without
+copying them. Updates replace stored snapshots.
+
+Writes are recorded in a bounded change log (see
+sitebuilder.utils.driver.changes).
+
+Drivers may be shared by several threads (such as the scheduler workers):
+reads hold a reader-writer lock for reading, so that lookups run
+concurrently, while writes hold it alone and are serialized.
+"""
+
+from sitebuilder.abstraction.site.record import get_site_key, SITE_FIELDS
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.index import SiteNameIndex, SORT_DOMAIN
+from sitebuilder.utils.driver.index import iter_host_pages, get_host_cursor
+from sitebuilder.utils.driver.index import AttributeIndex
+from sitebuilder.utils.driver.text import DescriptionIndex
+from sitebuilder.utils.driver.stats import CatalogStats
+from sitebuilder.utils.driver.changes import ChangeLog
+from sitebuilder.utils.driver.changes import CHANGE_INSERT, CHANGE_UPDATE
+from sitebuilder.utils.driver.changes import CHANGE_DELETE
+from sitebuilder.utils.parameters import CHANGE_LOG_SIZE
+from sitebuilder.utils.lock import ReadWriteLock
+from sitebuilder.exception import BackendError, ConflictError
+from collections import OrderedDict
+from operator import attrgetter
+from heapq import nsmallest
+
+# Host attributes lookups may project
+_HOST_FIELDS = frozenset(SITE_FIELDS[0][1])
+
+
+def get_host_getter(fields):
+    """
+    Returns a function returning the tuple of a host fields values.
+
+    >>> from sitebuilder.abstraction.site.snapshot import DNSHostSnapshot
+    >>> host = DNSHostSnapshot(name=u'name0', domain=u'bpinet.com')
+    >>> get_host_getter(('name', 'domain'))(host)
+    (u'name0', u'bpinet.com')
+    >>> get_host_getter(('name',))(host)
+    (u'name0',)
+    >>> get_host_getter(('unknown',))
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown host field unknown
+    """
+    for field in fields:
+        if not field in _HOST_FIELDS:
+            raise BackendError("Unknown host field %s" % field)
+
+    getter = attrgetter(*fields)
+
+    # Single attribute getters return the value itself
+    if len(fields) == 1:
+        return lambda host: (getter(host),)
+
+    return getter
+
+
+class SiteTable(object):
+    """
+    Ordered collection of sites indexed by site key, and by site names for
+    wildcard searches.
+
+    Iterating over a table yields sites in insertion order.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> table = SiteTable()
+    >>> site = site_factory()
+    >>> site.dnshost.name = u'Name0'
+    >>> table.append(site)
+    >>> len(table), table.get(u'name0', site.dnshost.domain) is site
+    (1, True)
+    >>> table.append(site)
+    Traceback (most recent call last):
+        ...
+    BackendError: Site Name0.bpinet.com already exists
+    >>> table.find({'platform': u'prod'}) == [ site ]
+    True
+    >>> table.remove(u'NAME0', u'bpinet.com') is site
+    True
+    >>> list(table), table.find({'platform': u'prod'})
+    ([], [])
+    >>> site.dnshost.description = u'Marketing blog'
+    >>> table.append(site)
+    >>> table.search_descriptions(u'market*') == [ site ]
+    True
+    >>> table.get_stats()['platform']
+    {u'prod': 1}
+    """
+
+    def __init__(self, sites=()):
+        """
+        Table initialization
+        """
+        self._sites = OrderedDict()
+        self._index = SiteNameIndex()
+        self._attributes = AttributeIndex()
+        self._descriptions = DescriptionIndex()
+        self._stats = CatalogStats()
+
+        for site in sites:
+            self.append(site)
+
+    def __len__(self):
+        """
+        Returns the number of sites
+        """
+        return len(self._sites)
+
+    def __iter__(self):
+        """
+        Iterates over sites, in insertion order
+        """
+        return self._sites.itervalues()
+
+    def __contains__(self, key):
+        """
+        Returns True if a site is stored using key
+        """
+        return key in self._sites
+
+    def keys(self):
+        """
+        Returns sites keys, in insertion order
+        """
+        return self._sites.keys()
+
+    def get(self, name, domain):
+        """
+        Returns the site stored for name and domain, or None
+        """
+        return self._sites.get(get_site_key(name, domain))
+
+    def append(self, site):
+        """
+        Appends a site to the table
+        """
+        dnshost = site.dnshost
+        key = get_site_key(dnshost.name, dnshost.domain)
+
+        if key in self._sites:
+            mesg = "Site %s.%s already exists" % (dnshost.name, dnshost.domain)
+            raise BackendError(mesg)
+
+        self._sites[key] = site
+        self._index.add(dnshost.name, dnshost.domain, site)
+        cursor = get_host_cursor(dnshost)
+        self._attributes.add(cursor, site)
+        self._descriptions.add(cursor, dnshost.description)
+        self._stats.add(site)
+
+    def remove(self, name, domain):
+        """
+        Removes the site stored for name and domain, and returns it
+        """
+        key = get_site_key(name, domain)
+
+        try:
+            site = self._sites.pop(key)
+        except KeyError:
+            raise BackendError("Unknown site %s.%s" % (name, domain))
+
+        self._index.remove(name, domain)
+        cursor = get_host_cursor(site.dnshost)
+        self._attributes.remove(cursor, site)
+        self._descriptions.remove(cursor, site.dnshost.description)
+        self._stats.remove(site)
+        return site
+
+    def replace(self, site):
+        """
+        Replaces the site stored using the same name and domain
+        """
+        dnshost = site.dnshost
+        key = get_site_key(dnshost.name, dnshost.domain)
+
+        old = self._sites.get(key)
+
+        if old is None:
+            mesg = "Unknown site %s.%s" % (dnshost.name, dnshost.domain)
+            raise BackendError(mesg)
+
+        self._sites[key] = site
+        self._index.replace(dnshost.name, dnshost.domain, site)
+        cursor = get_host_cursor(dnshost)
+        self._attributes.replace(cursor, old, site)
+        self._descriptions.replace(cursor, old.dnshost.description,
+                                   dnshost.description)
+        self._stats.replace(old, site)
+
+    def search(self, name, domain, sort=SORT_DOMAIN, after=None, limit=None,
+               offset=0):
+        """
+        Returns the sites matching name and domain wildcard patterns (see
+        SiteNameIndex.search for sorting and pagination parameters)
+        """
+        return self._index.search(name, domain, sort, after, limit, offset)
+
+    def find(self, criteria, after=None, limit=None):
+        """
+        Returns the sites matching all the criteria (see
+        sitebuilder.utils.driver.index.SITE_CRITERIA), ordered by domain then
+        name. Only the sites following the after cursor are returned, at
+        most limit ones.
+        """
+        if not len(criteria):
+            return self._index.search(u'*', u'*', after=after, limit=limit)
+
+        return [ self._sites[get_site_key(name, domain)]
+                 for domain, name in self._attributes.find(criteria, after,
+                                                           limit) ]
+
+    def search_descriptions(self, query, after=None, limit=None):
+        """
+        Returns the sites whose description holds all the words of a query
+        (see sitebuilder.utils.driver.text.parse_query), ordered by domain
+        then name. Only the sites following the after cursor are returned,
+        at most limit ones.
+        """
+        return self._get_page(self._descriptions.search(query), after, limit)
+
+    def get_stats(self):
+        """
+        Returns the catalog statistics (see
+        sitebuilder.utils.driver.stats.build_stats)
+        """
+        return self._stats.get()
+
+    def _get_page(self, cursors, after, limit):
+        """
+        Returns the sites of a set of cursors, ordered by domain then name,
+        following the after cursor, and at most limit ones. The description
+        index stores sites cursors, which are also their sort key.
+        """
+        if after is not None:
+            cursors = [ cursor for cursor in cursors if cursor > after ]
+
+        if limit is None:
+            cursors = sorted(cursors)
+        else:
+            cursors = nsmallest(limit, cursors)
+
+        return [ self._sites[get_site_key(name, domain)]
+                 for domain, name in cursors ]
+
+
+class MemoryBackendDriver(object):
+    """
+    In memory backend driver.
+
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> driver = MemoryBackendDriver()
+    >>> site = site_factory()
+    >>> site.dnshost.name = u'Name0'
+    >>> site.dnshost.description = u'desc'
+    >>> driver.add_site(site)
+    >>> driver.add_site(site)
+    Traceback (most recent call last):
+        ...
+    BackendError: Site Name0.bpinet.com already exists
+
+    Names and domains are case insensitive
+
+    >>> copy = driver.get_site_by_name(u'NAME0', u'bpinet.com')
+    >>> copy.dnshost.name, copy is site
+    (u'Name0', False)
+
+    Read methods return shared immutable snapshots
+
+    >>> snapshot = driver.get_site_snapshot(u'name0', u'bpinet.com')
+    >>> snapshot is driver.get_site_snapshot(u'name0', u'bpinet.com')
+    True
+    >>> driver.lookup_host_by_name(u'name0', u'*')[0] is snapshot.dnshost
+    True
+    >>> copy.dnshost.description = u'new desc'
+    >>> driver.update_site(copy)
+    >>> driver.get_site_by_name(u'name0', u'bpinet.com').dnshost.description
+    u'new desc'
+    >>> [ host.name for host in driver.lookup_host_by_name(u'name*', u'*') ]
+    [u'Name0']
+
+    Lookups may be paginated, or streamed
+
+    >>> site.dnshost.name = u'name1'
+    >>> driver.add_site(site)
+    >>> [ host.name for host in driver.lookup_host_by_name(u'*', u'*', limit=1,
+    ...                                                    offset=1) ]
+    [u'name1']
+    >>> [ host.name for host in driver.iter_hosts_by_name(u'*', u'*',
+    ...                                                   batch_size=1) ]
+    [u'Name0', u'name1']
+
+    Lookups may return only some fields values
+
+    >>> driver.lookup_host_fields(u'*', u'*', ('name', 'description'))
+    [(u'Name0', u'new desc'), (u'name1', u'desc')]
+
+    Sites may be queried by attributes values
+
+    >>> [ found.dnshost.name for found in driver.find_sites(platform=u'prod') ]
+    [u'Name0', u'name1']
+    >>> [ found.dnshost.name for found in driver.find_sites(
+    ...       limit=1, after=(u'bpinet.com', u'name0'), platform=u'prod',
+    ...       database_enabled=False) ]
+    [u'name1']
+    >>> driver.find_sites(owner=u'me')
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown site criterion owner
+
+    Descriptions may be searched
+
+    >>> [ host.name for host in driver.search_descriptions(u'NEW de*') ]
+    [u'Name0']
+
+    Catalog statistics are kept up to date
+
+    >>> stats = driver.get_catalog_stats()
+    >>> stats['sites'], stats['platform'], stats['database_type']
+    (2, {u'prod': 2}, {})
+
+    Sites may be added, and read, by batches
+
+    >>> site.dnshost.name = u'name2'
+    >>> copy.dnshost.name = u'name0'
+    >>> driver.add_sites([ site, copy ])
+    Traceback (most recent call last):
+        ...
+    BackendError: Site name0.bpinet.com already exists
+    >>> driver.add_sites([ site ])
+    >>> [ site.dnshost.name for site in driver.iter_sites(batch_size=2) ]
+    [u'Name0', u'name1', u'name2']
+    >>> driver.delete_site(u'name2', u'bpinet.com')
+
+    Writes are recorded in the change log
+
+    >>> version = driver.get_version()
+    >>> driver.delete_site(u'name1', u'bpinet.com')
+    >>> driver.changes_since(version)
+    (6, [(6, 'delete', u'name1', u'bpinet.com')])
+
+    Sites are stamped with the version of their last change. Writes may be
+    conditional
+
+    >>> snapshot = driver.get_site_snapshot(u'name0', u'bpinet.com')
+    >>> snapshot.version
+    2
+    >>> driver.insert_if_absent(copy)
+    False
+    >>> driver.update_if_version(copy, 1)
+    Traceback (most recent call last):
+        ...
+    ConflictError: Site name0.bpinet.com was changed since version 1
+    >>> driver.update_if_version(copy, 2)
+    7
+    >>> driver.delete_if_exists(u'name0', u'bpinet.com')
+    True
+    >>> driver.delete_if_exists(u'name0', u'bpinet.com')
+    False
+    >>> driver.get_site_by_name(u'name0', u'bpinet.com') is None
+    True
+    >>> driver.delete_site(u'name0', u'bpinet.com')
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown site name0.bpinet.com
+    """
+
+    def __init__(self, sites=None):
+        """
+        Driver initialization.
+
+        Parameters:
+            sites   SiteTable holding driver sites snapshots. A new empty
+                    table is used if not set.
+        """
+        if sites is None:
+            sites = SiteTable()
+
+        self.sites = sites
+        self.changes = ChangeLog(CHANGE_LOG_SIZE)
+
+        # Reads share the lock, writes checks and changes are done alone
+        self._lock = ReadWriteLock()
+
+    def get_version(self):
+        """
+        Returns the current change version
+        """
+        return self.changes.version
+
+    def changes_since(self, version):
+        """
+        Returns the (current version, changes) tuple of the changes made
+        after version (see sitebuilder.utils.driver.changes)
+        """
+        with self._lock.reading():
+            return self.changes.since(version)
+
+    def get_site_by_name(self, name, domain):
+        """
+        Loads a site item based on its name and domain. It returns a new
+        mutable site object, or None if no site matches.
+        """
+        with self._lock.reading():
+            site = self.sites.get(name, domain)
+
+        if site is None:
+            return None
+
+        return site.to_site()
+
+    def get_site_snapshot(self, name, domain):
+        """
+        Returns the immutable snapshot of a site, or None if no site matches.
+        """
+        with self._lock.reading():
+            return self.sites.get(name, domain)
+
+    def lookup_host_by_name(self, name, domain, limit=None, offset=0,
+                            after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites using name and domain as search filter, and returns
+        the matching sites dnshost immutable snapshots.
+
+        Name and domain parameters may use wilcard characters (*).
+
+        Parameters:
+            limit   Maximum number of hosts returned (None for no limit)
+            offset  Number of hosts skipped
+            after   Cursor: only hosts following it are returned (see
+                    sitebuilder.utils.driver.index.get_host_cursor)
+            sort    Sort order: SORT_DOMAIN (domain, then name) or SORT_NAME
+                    (name, then domain)
+        """
+        if not '*' in name and not '*' in domain and after is None:
+            with self._lock.reading():
+                site = self.sites.get(name, domain)
+
+            if site is None or offset > 0 or limit == 0:
+                return []
+
+            return [ site.dnshost ]
+
+        with self._lock.reading():
+            sites = self.sites.search(name, domain, sort, after, limit, offset)
+
+        return [ site.dnshost for site in sites ]
+
+    def lookup_host_fields(self, name, domain, fields, limit=None, offset=0,
+                           after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites like lookup_host_by_name, but only returns tuples of
+        the requested dnshost fields values.
+        """
+        getter = get_host_getter(fields)
+
+        return [ getter(host) for host in
+                 self.lookup_host_by_name(name, domain, limit, offset, after,
+                                          sort) ]
+
+    def iter_hosts_by_name(self, name, domain, sort=SORT_DOMAIN,
+                           batch_size=500):
+        """
+        Generator yielding the hosts matching name and domain wildcard
+        patterns, looked up batch_size hosts at a time.
+        """
+        return iter_host_pages(self.lookup_host_by_name, name, domain, sort,
+                               batch_size)
+
+    def iter_sites(self, batch_size=500):
+        """
+        Generator yielding all the sites snapshots, ordered by domain then
+        name, looked up batch_size sites at a time.
+        """
+        after = None
+
+        while True:
+            with self._lock.reading():
+                sites = self.sites.search(u'*', u'*', after=after,
+                                          limit=batch_size)
+
+            for site in sites:
+                yield site
+
+            if len(sites) < batch_size:
+                break
+
+            after = get_host_cursor(sites[-1].dnshost)
+
+    def find_sites(self, limit=None, after=None, **criteria):
+        """
+        Returns the snapshots of the sites matching all the criteria, given
+        as keyword arguments (see
+        sitebuilder.utils.driver.index.SITE_CRITERIA), ordered by domain
+        then name.
+
+        Parameters:
+            limit   Maximum number of sites returned (None for no limit)
+            after   Cursor: only sites following it are returned (see
+                    sitebuilder.utils.driver.index.get_host_cursor)
+        """
+        with self._lock.reading():
+            return self.sites.find(criteria, after, limit)
+
+    def search_descriptions(self, query, limit=None, after=None):
+        """
+        Returns the dnshost immutable snapshots of the sites whose
+        description holds all the words of a query, ordered by domain then
+        name. Words ending with * are prefixes (see
+        sitebuilder.utils.driver.text.parse_query).
+
+        Parameters:
+            limit   Maximum number of hosts returned (None for no limit)
+            after   Cursor: only hosts following it are returned (see
+                    sitebuilder.utils.driver.index.get_host_cursor)
+        """
+        with self._lock.reading():
+            sites = self.sites.search_descriptions(query, after, limit)
+
+        return [ site.dnshost for site in sites ]
+
+    def get_catalog_stats(self):
+        """
+        Returns the catalog statistics: numbers of sites per platform,
+        domain and database type, and of done provisioning steps (see
+        sitebuilder.utils.driver.stats)
+        """
+        with self._lock.reading():
+            return self.sites.get_stats()
+
+    def add_site(self, site):
+        """
+        Adds a site
+        """
+        if not self.insert_if_absent(site):
+            raise BackendError("Site %s.%s already exists" % (
+                site.dnshost.name, site.dnshost.domain))
+
+    def add_sites(self, sites):
+        """
+        Adds several sites at once. If one of them already exists, none is
+        added.
+        """
+        snapshots = [ SiteSnapshot.from_site(site) for site in sites ]
+        keys = set()
+
+        with self._lock.writing():
+            for snapshot in snapshots:
+                dnshost = snapshot.dnshost
+                key = get_site_key(dnshost.name, dnshost.domain)
+
+                if key in self.sites or key in keys:
+                    raise BackendError("Site %s.%s already exists" % (
+                        dnshost.name, dnshost.domain))
+
+                keys.add(key)
+
+            for snapshot in snapshots:
+                version = self.changes.append(CHANGE_INSERT,
+                                              snapshot.dnshost.name,
+                                              snapshot.dnshost.domain)
+                self.sites.append(snapshot.stamp(version))
+
+    def insert_if_absent(self, site):
+        """
+        Adds a site if no site has the same name and domain. Returns True if
+        the site was added.
+        """
+        snapshot = SiteSnapshot.from_site(site)
+        dnshost = snapshot.dnshost
+
+        with self._lock.writing():
+            if get_site_key(dnshost.name, dnshost.domain) in self.sites:
+                return False
+
+            version = self.changes.append(CHANGE_INSERT, dnshost.name,
+                                          dnshost.domain)
+            self.sites.append(snapshot.stamp(version))
+
+        return True
+
+    def update_site(self, site):
+        """
+        Applies site object changes to the stored site. Name can't be
+        changed.
+        """
+        self.update_if_version(site, None)
+
+    def update_if_version(self, site, version):
+        """
+        Applies site object changes to the stored site if its version is
+        still version (None to skip the check), and returns its new version.
+        Name can't be changed.
+        """
+        name = site.dnshost.name
+        domain = site.dnshost.domain
+        snapshot = SiteSnapshot.from_site(site)
+
+        with self._lock.writing():
+            dbsite = self.sites.get(name, domain)
+
+            if dbsite is None:
+                raise BackendError("Unknown site %s.%s" % (name, domain))
+
+            if version is not None and dbsite.version != version:
+                raise ConflictError("Site %s.%s was changed since version %d"
+                                    % (name, domain, version))
+
+            if snapshot.dnshost.name != dbsite.dnshost.name:
+                snapshot = snapshot.replace('dnshost',
+                                            name=dbsite.dnshost.name)
+
+            version = self.changes.append(CHANGE_UPDATE, dbsite.dnshost.name,
+                                          dbsite.dnshost.domain)
+            self.sites.replace(snapshot.stamp(version))
+
+        return version
+
+    def delete_site(self, name, domain):
+        """
+        Deletes a site
+        """
+        if not self.delete_if_exists(name, domain):
+            raise BackendError("Unknown site %s.%s" % (name, domain))
+
+    def delete_if_exists(self, name, domain):
+        """
+        Deletes a site if it exists. Returns True if the site was deleted.
+        """
+        with self._lock.writing():
+            if self.sites.get(name, domain) is None:
+                return False
+
+            site = self.sites.remove(name, domain)
+            self.changes.append(CHANGE_DELETE, site.dnshost.name,
+                                site.dnshost.domain)
+
+        return True
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Backend drivers registry.
+
+Drivers are registered by name using the path of the callable building them
+("module:attribute"), and are only imported when first used. Each
+application context is configured with a driver name and its options. The
+driver instance is built once per context and shared by all its users (the
+site configuration manager, the command scheduler...). It may be wrapped in
+a catalog snapshot driver (see sitebuilder.utils.driver.mapped), serving
+reads from a snapshot file while it is up to date, and in a caching driver
+(see sitebuilder.utils.driver.cache).
+
+>>> register_driver('memory', 'sitebuilder.utils.driver.memory:MemoryBackendDriver')
+>>> configure_driver(u'test', 'memory')
+>>> driver = get_backend_driver(u'test')
+>>> type(driver).__name__
+'MemoryBackendDriver'
+>>> get_backend_driver(u'test') is driver
+True
+>>> configure_driver(u'test', 'memory', cache=True)
+>>> type(get_backend_driver(u'test')).__name__
+'CachingBackendDriver'
+
+Snapshots are written on demand, and mapped by the next drivers built
+
+>>> from tempfile import mkdtemp
+>>> from shutil import rmtree
+>>> import os
+>>> directory = mkdtemp()
+>>> path = os.path.join(directory, 'sites.snap')
+>>> configure_driver(u'test', 'memory', snapshot=path)
+>>> driver = get_backend_driver(u'test')
+>>> driver.is_mapped(), save_snapshot(u'test')
+(False, 0)
+>>> MappedBackendDriver(path, driver.driver).is_mapped()
+True
+>>> rmtree(directory)
+
+>>> configure_driver(u'test', 'unknown')
+Traceback (most recent call last):
+    ...
+BackendError: Unknown backend driver unknown
+>>> reset_drivers()
+"""
+
+from sitebuilder.utils.parameters import get_application_context
+from sitebuilder.utils.parameters import CONTEXT_NORMAL, CONTEXT_TEST
+from sitebuilder.utils.parameters import SITES_FILE, SNAPSHOT_FILE
+from sitebuilder.utils.driver.cache import CachingBackendDriver
+from sitebuilder.utils.driver.mapped import MappedBackendDriver, save_catalog
+from sitebuilder.exception import BackendError
+from threading import Lock
+
+# Registered drivers factories paths, by driver name
+_DRIVERS = {
+    'test': 'sitebuilder.utils.driver.test:get_test_driver',
+    'memory': 'sitebuilder.utils.driver.memory:MemoryBackendDriver',
+    'sqlite': 'sitebuilder.utils.driver.sqlite:SQLiteBackendDriver',
+    'mapped': 'sitebuilder.utils.driver.mapped:MappedBackendDriver',
+    'remote': 'sitebuilder.utils.driver.remote:RemoteBackendDriver',
+    }
+
+# Default driver name, options, caching and snapshot file, by application
+# context
+_DEFAULT_CONFIG = {
+    CONTEXT_NORMAL: ('sqlite', { 'path': SITES_FILE }, True, SNAPSHOT_FILE),
+    CONTEXT_TEST: ('test', {}, False, None),
+    }
+
+_CONFIG = dict(_DEFAULT_CONFIG)
+_INSTANCES = {}
+_LOCK = Lock()
+
+
+def import_object(path):
+    """
+    Imports and returns an object from its "module:attribute" path.
+
+    >>> import_object('sitebuilder.exception:BackendError').__name__
+    'BackendError'
+    """
+    module_name, attribute = path.split(':', 1)
+    module = __import__(module_name, fromlist=[attribute])
+
+    return getattr(module, attribute)
+
+
+def register_driver(name, path):
+    """
+    Registers a driver factory, using its "module:attribute" path. The
+    factory is called with the driver options as keyword arguments.
+    """
+    with _LOCK:
+        _DRIVERS[name] = path
+
+
+def configure_driver(context, name, cache=False, snapshot=None, **options):
+    """
+    Sets the driver used in an application context, wrapped in a caching
+    driver if cache is True, and in a snapshot driver if snapshot is the
+    path of a catalog snapshot file. The driver instance already built for
+    this context, if any, is discarded.
+    """
+    if not name in _DRIVERS:
+        raise BackendError("Unknown backend driver %s" % name)
+
+    with _LOCK:
+        _CONFIG[context] = (name, options, cache, snapshot)
+        _INSTANCES.pop(context, None)
+
+
+def get_backend_driver(context=None):
+    """
+    Returns the driver used in an application context (the current one by
+    default). The driver is imported and built on first use.
+    """
+    if context is None:
+        context = get_application_context()
+
+    with _LOCK:
+        driver = _INSTANCES.get(context)
+
+        if driver is None:
+            if not context in _CONFIG:
+                raise RuntimeError("unknonw application context: %s" % context)
+
+            name, options, cache, snapshot = _CONFIG[context]
+            driver = import_object(_DRIVERS[name])(**options)
+
+            if snapshot is not None:
+                driver = MappedBackendDriver(snapshot, driver)
+
+            if cache:
+                driver = CachingBackendDriver(driver)
+
+            _INSTANCES[context] = driver
+
+    return driver
+
+
+def save_snapshot(context=None):
+    """
+    Writes the catalog snapshot of the driver used in an application context
+    (the current one by default) if it has a snapshot file, and it is not
+    up to date. Returns the number of sites written, or None if the
+    snapshot wasn't written.
+    """
+    if context is None:
+        context = get_application_context()
+
+    with _LOCK:
+        snapshot = _CONFIG[context][3]
+
+    if snapshot is None:
+        return None
+
+    driver = get_backend_driver(context)
+
+    if isinstance(driver, CachingBackendDriver):
+        driver = driver.driver
+
+    if driver.is_mapped():
+        return None
+
+    return save_catalog(driver.driver, snapshot)
+
+
+def reset_drivers():
+    """
+    Discards built drivers and restores default configuration
+    """
+    with _LOCK:
+        _CONFIG.clear()
+        _CONFIG.update(_DEFAULT_CONFIG)
+        _INSTANCES.clear()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,616 @@
+#!/usr/bin/env python
+"""
+Local catalog server, and the backend driver used by its clients.
+
+A catalog server (see CatalogServer) serves the sites of one backend driver
+over a Unix domain socket, so that several GUIs and command line tools share
+the same catalog, indexed once, instead of each loading its own copy.
+
+Messages are framed: a 4 bytes big endian length followed by a compact JSON
+payload (nothing is pickled). Requests are [id, method, arguments] lists,
+replies are [id, status, result] lists, status being 'ok' or 'error'. Site
+snapshots are sent as [values, version] lists, values following SITE_FIELDS
+order, and hosts as their dnshost values.
+
+Clients may send several requests without waiting for their replies
+(pipelining, see RemoteBackendDriver.call_many). The server executes the
+requests it received in order, and sends their replies at once.
+"""
+
+from sitebuilder.abstraction.site.record import site_to_tuple
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.abstraction.site.snapshot import DNSHostSnapshot
+from sitebuilder.utils.driver.index import SORT_DOMAIN, iter_host_pages
+from sitebuilder.utils.driver.index import get_host_cursor
+from sitebuilder.utils.parameters import CATALOG_SOCKET
+from sitebuilder.exception import BackendError, ConflictError
+from SocketServer import ThreadingUnixStreamServer, BaseRequestHandler
+from threading import local
+import socket
+import struct
+import json
+import os
+
+_LENGTH = struct.Struct('>I')
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+# Maximum frame payload size
+_MAX_FRAME = 64 * 1024 * 1024
+
+# Number of bytes read from sockets at once
+_READ_SIZE = 64 * 1024
+
+
+def encode_site(site):
+    """
+    Returns the [values, version] list sent for a site object or snapshot
+    (None for None)
+    """
+    if site is None:
+        return None
+
+    return [ site_to_tuple(site), getattr(site, 'version', 0) ]
+
+
+def decode_site(value):
+    """
+    Returns the site snapshot of a [values, version] list.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> site = get_test_site(u'name0')
+    >>> site.version = 3
+    >>> copy = decode_site(json.loads(json.dumps(encode_site(site))))
+    >>> copy.dnshost.name, copy.version
+    (u'name0', 3)
+    >>> site_to_tuple(copy) == site_to_tuple(site)
+    True
+    """
+    if value is None:
+        return None
+
+    return SiteSnapshot.from_tuple(value[0], value[1])
+
+
+def _decode_stats(value):
+    """
+    Returns catalog statistics decoded from JSON, whose done components
+    names are strings
+    """
+    value['done'] = dict([ (str(component), count)
+                           for component, count in value['done'].items() ])
+
+    return value
+
+
+def _decode_changes(value):
+    """
+    Returns the (version, changes) tuple of changes decoded from JSON
+    """
+    version, changes = value
+
+    if changes is not None:
+        changes = [ (num, str(kind), name, domain)
+                    for num, kind, name, domain in changes ]
+
+    return version, changes
+
+
+# Methods arguments sent encoded, with their encoding and decoding functions
+_ARGUMENTS = {
+    'site': (encode_site, decode_site),
+    'sites': (lambda sites: [ encode_site(site) for site in sites ],
+              lambda values: [ decode_site(value) for value in values ]),
+    'after': (lambda after: after, lambda after: after and tuple(after)),
+    'fields': (list, lambda fields: tuple([ str(field)
+                                            for field in fields ])),
+    'sort': (lambda sort: sort, str),
+    }
+
+
+def _convert_arguments(arguments, index):
+    """
+    Returns methods arguments, encoded (index 0) or decoded (index 1) (see
+    _ARGUMENTS)
+    """
+    result = {}
+
+    for name, value in arguments.items():
+        if name in _ARGUMENTS:
+            value = _ARGUMENTS[name][index](value)
+
+        result[str(name)] = value
+
+    return result
+
+
+# Served driver methods, with the functions encoding their result on the
+# server and decoding it on clients
+_RESULTS = {
+    'get_version': (None, None),
+    'changes_since': (None, _decode_changes),
+    'get_site_snapshot': (encode_site, decode_site),
+    'lookup_host_by_name': (
+        lambda hosts: [ [ getattr(host, attr) for attr in
+                          DNSHostSnapshot.__slots__ ] for host in hosts ],
+        lambda values: [ DNSHostSnapshot.from_tuple(value)
+                         for value in values ]),
+    'lookup_host_fields': (None, lambda values: [ tuple(value)
+                                                  for value in values ]),
+    'find_sites': (lambda sites: [ encode_site(site) for site in sites ],
+                   lambda values: [ decode_site(value) for value in values ]),
+    'get_catalog_stats': (None, _decode_stats),
+    'add_site': (None, None),
+    'add_sites': (None, None),
+    'insert_if_absent': (None, None),
+    'update_site': (None, None),
+    'update_if_version': (None, None),
+    'delete_site': (None, None),
+    'delete_if_exists': (None, None),
+    }
+_RESULTS['search_descriptions'] = _RESULTS['lookup_host_by_name']
+
+
+def encode_frame(message):
+    """
+    Returns the frame of a message.
+
+    >>> encode_frame([1, 'get_version', {}])
+    '\\x00\\x00\\x00\\x14[1,"get_version",{}]'
+    """
+    payload = _encoder.encode(message)
+
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def decode_frames(buf):
+    """
+    Returns the list of the messages of the complete frames at the start of
+    a buffer, and the rest of the buffer.
+
+    >>> frames = encode_frame([1, 'ok', None]) + encode_frame([2, 'ok', 3])
+    >>> decode_frames(frames + '\\x00\\x00')
+    ([[1, u'ok', None], [2, u'ok', 3]], '\\x00\\x00')
+    """
+    messages = []
+    start = 0
+
+    while len(buf) - start >= _LENGTH.size:
+        length, = _LENGTH.unpack_from(buf, start)
+
+        if length > _MAX_FRAME:
+            raise BackendError("Catalog frame too large: %d bytes" % length)
+
+        end = start + _LENGTH.size + length
+
+        if len(buf) < end:
+            break
+
+        messages.append(json.loads(buf[start + _LENGTH.size:end]))
+        start = end
+
+    return messages, buf[start:]
+
+
+class _CatalogRequestHandler(BaseRequestHandler):
+    """
+    Catalog server connection handler: executes requests as they come, and
+    sends the replies of all the requests received at once together
+    """
+
+    def handle(self):
+        """
+        Serves a client connection until it is closed
+        """
+        buf = ''
+
+        try:
+            while True:
+                data = self.request.recv(_READ_SIZE)
+
+                if not data:
+                    break
+
+                requests, buf = decode_frames(buf + data)
+
+                if len(requests):
+                    self.request.sendall(''.join(
+                        [ encode_frame(self.server.execute(request))
+                          for request in requests ]))
+        except (socket.error, BackendError, ValueError):
+            # Broken connections and invalid frames close the connection
+            pass
+
+
+class CatalogServer(ThreadingUnixStreamServer):
+    """
+    Catalog server: serves the sites of a driver on a Unix domain socket,
+    only accessible to its owner. Each client connection is served by a
+    thread: the driver must support concurrent use.
+    """
+    daemon_threads = True
+
+    def __init__(self, driver, path=CATALOG_SOCKET):
+        """
+        Server initialization. A socket file left by a stopped server is
+        removed.
+        """
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+            try:
+                probe.connect(path)
+            except socket.error:
+                os.unlink(path)
+            else:
+                raise BackendError("Catalog server already running on %s"
+                                   % path)
+            finally:
+                probe.close()
+
+        self.driver = driver
+        self.path = path
+        ThreadingUnixStreamServer.__init__(self, path, _CatalogRequestHandler)
+        os.chmod(path, 0600)
+
+    def execute(self, request):
+        """
+        Executes a request, and returns its reply
+        """
+        num, method, arguments = request
+
+        try:
+            encoder = _RESULTS[method][0]
+        except KeyError:
+            return [ num, 'error', ['BackendError',
+                                    "Unknown catalog method %s" % method] ]
+
+        try:
+            arguments = _convert_arguments(arguments, 1)
+            result = getattr(self.driver, method)(**arguments)
+        except ConflictError, e:
+            return [ num, 'error', ['ConflictError', unicode(e)] ]
+        except Exception, e:
+            return [ num, 'error', ['BackendError', unicode(e)] ]
+
+        if encoder is not None:
+            result = encoder(result)
+
+        return [ num, 'ok', result ]
+
+    def server_close(self):
+        """
+        Closes the server socket, and removes its file
+        """
+        ThreadingUnixStreamServer.server_close(self)
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class RemoteBackendDriver(object):
+    """
+    Backend driver forwarding calls to a catalog server.
+
+    >>> from sitebuilder.utils.driver.memory import MemoryBackendDriver
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> from threading import Thread
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> path = os.path.join(directory, 'catalog.sock')
+    >>> server = CatalogServer(MemoryBackendDriver(), path)
+    >>> thread = Thread(target=server.serve_forever)
+    >>> thread.start()
+
+    Clients share the server catalog
+
+    >>> driver = RemoteBackendDriver(path)
+    >>> other = RemoteBackendDriver(path)
+    >>> driver.add_sites([ get_test_site(u'name%d' % num) for num in range(3) ])
+    >>> other.get_site_by_name(u'NAME1', u'bpinet.com').dnshost.name
+    u'name1'
+    >>> other.lookup_host_fields(u'name*', u'*', ('name', 'platform'),
+    ...                          limit=2, after=(u'bpinet.com', u'name0'))
+    [(u'name1', u'prod'), (u'name2', u'prod')]
+    >>> [ host.name for host in other.search_descriptions(u'desc name2') ]
+    [u'name2']
+    >>> [ found.dnshost.name for found in other.find_sites(platform=u'prod') ]
+    [u'name0', u'name1', u'name2']
+    >>> other.get_catalog_stats()['sites']
+    3
+
+    Errors are raised by clients
+
+    >>> site = other.get_site_by_name(u'name0', u'bpinet.com')
+    >>> other.update_if_version(site, 0)
+    Traceback (most recent call last):
+        ...
+    ConflictError: Site name0.bpinet.com was changed since version 0
+    >>> driver.add_site(site)
+    Traceback (most recent call last):
+        ...
+    BackendError: Site name0.bpinet.com already exists
+
+    Requests may be pipelined
+
+    >>> driver.call_many([ ('delete_if_exists', {'name': u'name2',
+    ...                                          'domain': u'bpinet.com'}),
+    ...                    ('get_version', {}),
+    ...                    ('changes_since', {'version': 3}) ])
+    [True, 4, (4, [(4, 'delete', u'name2', u'bpinet.com')])]
+    >>> [ found.dnshost.name for found in other.iter_sites(batch_size=1) ]
+    [u'name0', u'name1']
+
+    >>> driver.close()
+    >>> other.close()
+    >>> server.shutdown()
+    >>> thread.join()
+    >>> server.server_close()
+    >>> driver.get_version() # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    BackendError: Catalog server unavailable on ...catalog.sock
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, path=CATALOG_SOCKET):
+        """
+        Driver initialization.
+
+        Parameters:
+            path    Catalog server socket path
+        """
+        self.path = path
+
+        # Each thread uses its own connection, opened on first use
+        self._local = local()
+
+    def _get_connection(self):
+        """
+        Returns the connection of the current thread
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+            try:
+                connection.connect(self.path)
+            except socket.error:
+                connection.close()
+                raise BackendError("Catalog server unavailable on %s"
+                                   % self.path)
+
+            self._local.connection = connection
+            self._local.buf = ''
+            self._local.num = 0
+
+        return connection
+
+    def close(self):
+        """
+        Closes the connection of the current thread, if any. Connections of
+        other threads are closed when they end.
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def call_many(self, calls):
+        """
+        Sends several (method, arguments dictionnary) requests at once, then
+        reads their replies, and returns their results. If requests failed,
+        the error of the first one is raised once all the replies are read.
+        """
+        connection = self._get_connection()
+        start = self._local.num + 1
+        frames = []
+
+        for num, (method, arguments) in enumerate(calls):
+            frames.append(encode_frame([start + num, method,
+                                        _convert_arguments(arguments, 0)]))
+
+        self._local.num += len(frames)
+        replies = []
+
+        try:
+            connection.sendall(''.join(frames))
+
+            while len(replies) < len(frames):
+                data = connection.recv(_READ_SIZE)
+
+                if not data:
+                    raise socket.error("connection closed")
+
+                messages, self._local.buf = decode_frames(self._local.buf +
+                                                          data)
+                replies.extend(messages)
+        except (socket.error, BackendError, ValueError):
+            # The connection is left in an unknown state
+            self.close()
+            raise BackendError("Catalog server connection failed")
+
+        results = []
+        error = None
+
+        for (method, arguments), (num, status, result) in zip(calls, replies):
+            if status != 'ok':
+                if error is None:
+                    error = result
+                results.append(None)
+                continue
+
+            decoder = _RESULTS[method][1]
+
+            if decoder is not None:
+                result = decoder(result)
+
+            results.append(result)
+
+        if error is not None:
+            if error[0] == 'ConflictError':
+                raise ConflictError(error[1])
+            raise BackendError(error[1])
+
+        return results
+
+    def _call(self, method, **arguments):
+        """
+        Sends a request, and returns its result
+        """
+        return self.call_many([ (method, arguments) ])[0]
+
+    def get_version(self):
+        """
+        Returns the current change version
+        """
+        return self._call('get_version')
+
+    def changes_since(self, version):
+        """
+        Returns the (current version, changes) tuple of the changes made
+        after version (see sitebuilder.utils.driver.changes)
+        """
+        return self._call('changes_since', version=version)
+
+    def get_site_by_name(self, name, domain):
+        """
+        Loads a site item based on its name and domain. It returns a new
+        mutable site object, or None if no site matches.
+        """
+        site = self.get_site_snapshot(name, domain)
+
+        if site is None:
+            return None
+
+        return site.to_site()
+
+    def get_site_snapshot(self, name, domain):
+        """
+        Returns the immutable snapshot of a site, or None if no site matches.
+        """
+        return self._call('get_site_snapshot', name=name, domain=domain)
+
+    def lookup_host_by_name(self, name, domain, limit=None, offset=0,
+                            after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites using name and domain as search filter, and returns
+        the matching sites dnshost immutable snapshots (see
+        sitebuilder.utils.driver.memory.MemoryBackendDriver.lookup_host_by_name)
+        """
+        return self._call('lookup_host_by_name', name=name, domain=domain,
+                          limit=limit, offset=offset, after=after, sort=sort)
+
+    def lookup_host_fields(self, name, domain, fields, limit=None, offset=0,
+                           after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites like lookup_host_by_name, but only returns tuples of
+        the requested dnshost fields values.
+        """
+        return self._call('lookup_host_fields', name=name, domain=domain,
+                          fields=fields, limit=limit, offset=offset,
+                          after=after, sort=sort)
+
+    def iter_hosts_by_name(self, name, domain, sort=SORT_DOMAIN,
+                           batch_size=500):
+        """
+        Generator yielding the hosts matching name and domain wildcard
+        patterns, looked up batch_size hosts at a time.
+        """
+        return iter_host_pages(self.lookup_host_by_name, name, domain, sort,
+                               batch_size)
+
+    def iter_sites(self, batch_size=500):
+        """
+        Generator yielding all the sites snapshots, ordered by domain then
+        name, looked up batch_size sites at a time.
+        """
+        after = None
+
+        while True:
+            sites = self.find_sites(batch_size, after)
+
+            for site in sites:
+                yield site
+
+            if len(sites) < batch_size:
+                break
+
+            after = get_host_cursor(sites[-1].dnshost)
+
+    def find_sites(self, limit=None, after=None, **criteria):
+        """
+        Returns the snapshots of the sites matching all the criteria, given
+        as keyword arguments (see
+        sitebuilder.utils.driver.index.SITE_CRITERIA), ordered by domain
+        then name.
+        """
+        return self._call('find_sites', limit=limit, after=after, **criteria)
+
+    def search_descriptions(self, query, limit=None, after=None):
+        """
+        Returns the dnshost immutable snapshots of the sites whose
+        description holds all the words of a query, ordered by domain then
+        name.
+        """
+        return self._call('search_descriptions', query=query, limit=limit,
+                          after=after)
+
+    def get_catalog_stats(self):
+        """
+        Returns the catalog statistics (see sitebuilder.utils.driver.stats)
+        """
+        return self._call('get_catalog_stats')
+
+    def add_site(self, site):
+        """
+        Adds a site
+        """
+        self._call('add_site', site=site)
+
+    def add_sites(self, sites):
+        """
+        Adds several sites at once. If one of them already exists, none is
+        added.
+        """
+        self._call('add_sites', sites=sites)
+
+    def insert_if_absent(self, site):
+        """
+        Adds a site if no site has the same name and domain. Returns True if
+        the site was added.
+        """
+        return self._call('insert_if_absent', site=site)
+
+    def update_site(self, site):
+        """
+        Applies site object changes to the stored site. Name can't be
+        changed.
+        """
+        self._call('update_site', site=site)
+
+    def update_if_version(self, site, version):
+        """
+        Applies site object changes to the stored site if its version is
+        still version (None to skip the check), and returns its new version.
+        """
+        return self._call('update_if_version', site=site, version=version)
+
+    def delete_site(self, name, domain):
+        """
+        Deletes a site
+        """
+        self._call('delete_site', name=name, domain=domain)
+
+    def delete_if_exists(self, name, domain):
+        """
+        Deletes a site if it exists. Returns True if the site was deleted.
+        """
+        return self._call('delete_if_exists', name=name, domain=domain)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,988 @@
+#!/usr/bin/env python
+"""
+SQLite backend driver implementation.
+
+Sites are stored in a local SQLite database file using one table per site
+component. Each thread gets its own connection, so that several scheduler
+workers may read concurrently while an other one writes (the database runs
+in WAL mode).
+
+Writes are recorded in a bounded change log table, in the same transaction
+(see sitebuilder.utils.driver.changes). Sites rows are stamped with the
+version of their last change, which conditional updates compare.
+
+Descriptions words are stored in a token table, maintained with the sites
+rows, and used to search descriptions (see sitebuilder.utils.driver.text).
+Catalog statistics counters are updated the same way (see
+sitebuilder.utils.driver.stats).
+"""
+
+from sitebuilder.abstraction.site.record import SITE_FIELDS
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot, DNSHostSnapshot
+from sitebuilder.abstraction.interface import ISite
+from sitebuilder.utils.driver.index import SORT_DOMAIN, SORT_NAME
+from sitebuilder.utils.driver.index import iter_host_pages, get_host_cursor
+from sitebuilder.utils.driver.index import SITE_CRITERIA, get_criteria
+from sitebuilder.utils.driver.text import tokenize, parse_query
+from sitebuilder.utils.driver.stats import get_deltas, build_stats
+from sitebuilder.utils.driver.changes import CHANGE_INSERT, CHANGE_UPDATE
+from sitebuilder.utils.driver.changes import CHANGE_DELETE
+from sitebuilder.utils.parameters import CHANGE_LOG_SIZE
+from sitebuilder.exception import BackendError, ConflictError
+from zope.schema import Bool
+from threading import local
+import sqlite3
+import os
+
+_FIELDS = dict(SITE_FIELDS)
+
+# Component tables, dnshost attributes being stored in the site table itself
+_TABLES = dict([ (component, component == 'dnshost' and 'site' or
+                  'site_%s' % component) for component, attrs in SITE_FIELDS ])
+
+# Boolean attributes, stored as integers
+_BOOLEANS = set([ (component, attr) for component, attrs in SITE_FIELDS
+                  for attr in attrs
+                  if isinstance(ISite[component].schema[attr], Bool) ])
+
+
+def _get_schema():
+    """
+    Returns the database schema creation script
+    """
+    script = []
+
+    for component, attributes in SITE_FIELDS:
+        columns = []
+
+        for attr in attributes:
+            if (component, attr) in _BOOLEANS:
+                columns.append("%s INTEGER NOT NULL DEFAULT 0" % attr)
+            else:
+                columns.append("%s TEXT" % attr)
+
+        if component == 'dnshost':
+            columns = [ "id INTEGER PRIMARY KEY",
+                        "name_key TEXT NOT NULL",
+                        "domain_key TEXT NOT NULL",
+                        "version INTEGER NOT NULL DEFAULT 0" ] + columns
+        else:
+            columns = [ "site_id INTEGER PRIMARY KEY "
+                        "REFERENCES site (id) ON DELETE CASCADE" ] + columns
+
+        script.append("CREATE TABLE IF NOT EXISTS %s (\n    %s\n);" % (
+            _TABLES[component], ",\n    ".join(columns)))
+
+    script.append("CREATE TABLE IF NOT EXISTS site_change (\n"
+                  "    version INTEGER PRIMARY KEY AUTOINCREMENT,\n"
+                  "    kind TEXT NOT NULL,\n"
+                  "    name TEXT NOT NULL,\n"
+                  "    domain TEXT NOT NULL\n"
+                  ");")
+    script.append("CREATE UNIQUE INDEX IF NOT EXISTS site_key "
+                  "ON site (name_key, domain_key);")
+    script.append("CREATE INDEX IF NOT EXISTS site_domain "
+                  "ON site (domain_key, name_key);")
+
+    script.append("CREATE TABLE IF NOT EXISTS site_token (\n"
+                  "    token TEXT NOT NULL,\n"
+                  "    site_id INTEGER NOT NULL "
+                  "REFERENCES site (id) ON DELETE CASCADE,\n"
+                  "    PRIMARY KEY (token, site_id)\n"
+                  ");")
+    script.append("CREATE INDEX IF NOT EXISTS site_token_site "
+                  "ON site_token (site_id);")
+    script.append("CREATE TABLE IF NOT EXISTS site_stat (\n"
+                  "    grp TEXT NOT NULL,\n"
+                  "    value TEXT NOT NULL,\n"
+                  "    count INTEGER NOT NULL,\n"
+                  "    PRIMARY KEY (grp, value)\n"
+                  ");")
+
+    # Secondary indexes used by multi-criteria queries
+    for criterion, (component, attr) in sorted(SITE_CRITERIA.items()):
+        if criterion != 'domain':
+            script.append("CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s);" % (
+                _TABLES[component], attr, _TABLES[component], attr))
+
+    return "\n".join(script)
+
+
+def _get_select():
+    """
+    Returns the query selecting complete sites, and its columns as
+    (component, attribute) tuples. The site version is selected last.
+    """
+    columns = [ (component, attr) for component, attributes in SITE_FIELDS
+                for attr in attributes ]
+    joins = [ "JOIN %s ON %s.site_id = site.id" % (_TABLES[component],
+                                                    _TABLES[component])
+              for component, attributes in SITE_FIELDS
+              if component != 'dnshost' ]
+    sql = "SELECT %s, site.version FROM site %s" % (
+        ", ".join([ "%s.%s" % (_TABLES[component], attr)
+                    for component, attr in columns ]),
+        " ".join(joins))
+
+    return sql, columns
+
+
+_SCHEMA = _get_schema()
+
+# Driver methods upgrading databases created by previous versions, in order.
+# The number of migrations applied to a database is kept in its
+# user_version, so that each one only runs once.
+_MIGRATIONS = ('_migrate_version', '_migrate_tokens', '_migrate_stats')
+_SELECT_SITE, _SITE_COLUMNS = _get_select()
+_HOST_COLUMNS = [ ('dnshost', attr) for attr in SITE_FIELDS[0][1] ]
+_SELECT_HOST = "SELECT %s FROM site" % ", ".join(
+    [ attr for component, attr in _HOST_COLUMNS ])
+
+# Boolean columns indexes in site and host rows
+_SITE_BOOLEANS = [ i for i, column in enumerate(_SITE_COLUMNS)
+                   if column in _BOOLEANS ]
+_HOST_BOOLEANS = [ i for i, column in enumerate(_HOST_COLUMNS)
+                   if column in _BOOLEANS ]
+
+# Character sorting after any character names may use
+_MAX_CHAR = u'\uffff'
+
+
+def get_pattern_clause(column, pattern):
+    """
+    Returns a (clause, parameters) tuple filtering a key column on a wildcard
+    pattern. Patterns starting with a literal prefix use an index range.
+
+    >>> get_pattern_clause('name_key', u'abc')
+    ('name_key = ?', [u'abc'])
+    >>> get_pattern_clause('name_key', u'*')
+    (None, [])
+    >>> get_pattern_clause('name_key', u'Ab*')
+    ('name_key >= ? AND name_key < ?', [u'ab', u'ab\\uffff'])
+    >>> get_pattern_clause('name_key', u'*b?')
+    ('name_key GLOB ?', [u'*b[?]'])
+    """
+    pattern = pattern.lower()
+    star = pattern.find('*')
+
+    if star < 0:
+        return "%s = ?" % column, [pattern]
+
+    if pattern == '*':
+        return None, []
+
+    clauses = []
+    parameters = []
+    prefix = pattern[:star]
+
+    if len(prefix):
+        clauses.append("%s >= ? AND %s < ?" % (column, column))
+        parameters.extend([prefix, prefix + _MAX_CHAR])
+
+    if star != len(pattern) - 1:
+        # GLOB special characters other than * are matched literally
+        glob = pattern.replace('[', '[[]').replace('?', '[?]')
+        clauses.append("%s GLOB ?" % column)
+        parameters.append(glob)
+
+    return " AND ".join(clauses), parameters
+
+
+class SQLiteBackendDriver(object):
+    """
+    SQLite backend driver.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> from sitebuilder.abstraction.site.factory import site_factory
+    >>> tmpdir = mkdtemp()
+    >>> driver = SQLiteBackendDriver(os.path.join(tmpdir, 'sites.db'))
+    >>> site = site_factory()
+    >>> site.dnshost.name = u'Name0'
+    >>> site.database.enabled = True
+    >>> driver.add_site(site)
+    >>> driver.add_site(site)
+    Traceback (most recent call last):
+        ...
+    BackendError: Site Name0.bpinet.com already exists
+
+    Names and domains are case insensitive
+
+    >>> copy = driver.get_site_by_name(u'NAME0', u'bpinet.com')
+    >>> copy.dnshost.name, copy.database.enabled
+    (u'Name0', True)
+    >>> copy.dnshost.description = u'new desc'
+    >>> driver.update_site(copy)
+    >>> driver.get_site_by_name(u'name0', u'bpinet.com').dnshost.description
+    u'new desc'
+    >>> [ host.name for host in driver.lookup_host_by_name(u'name*', u'*') ]
+    [u'Name0']
+
+    Lookups may be paginated, or streamed
+
+    >>> site.dnshost.name = u'name1'
+    >>> driver.add_site(site)
+    >>> [ host.name for host in driver.lookup_host_by_name(u'*', u'*', limit=1,
+    ...                                                    offset=1) ]
+    [u'name1']
+    >>> [ host.name for host in driver.lookup_host_by_name(
+    ...       u'*', u'*', after=(u'name0', u'bpinet.com'), sort=SORT_NAME) ]
+    [u'name1']
+    >>> [ host.name for host in driver.iter_hosts_by_name(u'*', u'*',
+    ...                                                   batch_size=1) ]
+    [u'Name0', u'name1']
+
+    Lookups may return only some fields values
+
+    >>> driver.lookup_host_fields(u'*', u'*', ('name', 'description'))
+    [(u'Name0', u'new desc'), (u'name1', u'')]
+    >>> driver.lookup_host_fields(u'*', u'*', ('password',))
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown host field password
+
+    Sites may be queried by attributes values
+
+    >>> [ found.dnshost.name for found in driver.find_sites(platform=u'prod') ]
+    [u'Name0', u'name1']
+    >>> [ found.dnshost.name for found in driver.find_sites(
+    ...       limit=1, after=(u'bpinet.com', u'name0'), platform=u'prod',
+    ...       database_enabled=True) ]
+    [u'name1']
+    >>> driver.find_sites(owner=u'me')
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown site criterion owner
+
+    Descriptions may be searched
+
+    >>> [ host.name for host in driver.search_descriptions(u'NEW de*') ]
+    [u'Name0']
+    >>> driver.search_descriptions(u'new unknown')
+    []
+    >>> driver.search_descriptions(u'desc', after=(u'bpinet.com', u'name0'))
+    []
+
+    Catalog statistics are kept up to date
+
+    >>> stats = driver.get_catalog_stats()
+    >>> stats['sites'], stats['platform'], stats['database_type']
+    (2, {u'prod': 2}, {u'mysql': 2})
+
+    Sites may be added, and read, by batches
+
+    >>> site.dnshost.name = u'name2'
+    >>> copy.dnshost.name = u'name0'
+    >>> driver.add_sites([ site, copy ])
+    Traceback (most recent call last):
+        ...
+    BackendError: Site name0.bpinet.com already exists
+    >>> driver.add_sites([ site ])
+    >>> [ site.dnshost.name for site in driver.iter_sites(batch_size=2) ]
+    [u'Name0', u'name1', u'name2']
+    >>> driver.delete_site(u'name2', u'bpinet.com')
+
+    Writes are recorded in the change log
+
+    >>> version = driver.get_version()
+    >>> driver.delete_site(u'name1', u'bpinet.com')
+    >>> driver.changes_since(version)
+    (6, [(6, 'delete', u'name1', u'bpinet.com')])
+    >>> driver.changes_since(0)[1][0]
+    (1, 'insert', u'Name0', u'bpinet.com')
+
+    Sites are stamped with the version of their last change. Writes may be
+    conditional
+
+    >>> driver.get_site_snapshot(u'name0', u'bpinet.com').version
+    2
+    >>> driver.insert_if_absent(copy)
+    False
+    >>> driver.update_if_version(copy, 1)
+    Traceback (most recent call last):
+        ...
+    ConflictError: Site name0.bpinet.com was changed since version 1
+    >>> driver.update_if_version(copy, 2)
+    7
+    >>> driver.get_site_by_name(u'name0', u'bpinet.com').version
+    7
+    >>> driver.delete_if_exists(u'name0', u'bpinet.com')
+    True
+    >>> driver.delete_if_exists(u'name0', u'bpinet.com')
+    False
+    >>> driver.get_site_by_name(u'name0', u'bpinet.com') is None
+    True
+    >>> driver.delete_site(u'name0', u'bpinet.com')
+    Traceback (most recent call last):
+        ...
+    BackendError: Unknown site name0.bpinet.com
+
+    Databases are only migrated once (see _MIGRATIONS)
+
+    >>> other = SQLiteBackendDriver(os.path.join(tmpdir, 'sites.db'))
+    >>> connection = other._get_connection()
+    >>> connection.execute("PRAGMA user_version").fetchone()[0]
+    3
+    >>> other.close()
+    >>> driver.close()
+    >>> rmtree(tmpdir)
+    """
+
+    def __init__(self, path):
+        """
+        Driver initialization.
+
+        Parameters:
+            path    SQLite database file path
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._local = local()
+
+        connection = self._get_connection()
+        connection.executescript(_SCHEMA)
+
+        # Takes the write lock first, and holds it until all the migrations
+        # are done, so that concurrent openings don't migrate the same file
+        # twice. Implicit transactions are disabled meanwhile: PRAGMA and
+        # ALTER TABLE statements would commit them.
+        connection.isolation_level = None
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            level = connection.execute("PRAGMA user_version").fetchone()[0]
+
+            for migration in _MIGRATIONS[level:]:
+                getattr(self, migration)(connection)
+
+            if level < len(_MIGRATIONS):
+                connection.execute("PRAGMA user_version = %d" %
+                                   len(_MIGRATIONS))
+
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.isolation_level = ''
+
+    def _migrate_version(self, connection):
+        """
+        Adds the version column to databases created before sites versions
+        """
+        columns = [ row[1] for row in
+                    connection.execute("PRAGMA table_info(site)") ]
+
+        if not 'version' in columns:
+            connection.execute("ALTER TABLE site ADD COLUMN "
+                               "version INTEGER NOT NULL DEFAULT 0")
+
+    def _migrate_tokens(self, connection):
+        """
+        Builds the descriptions words of databases created before
+        descriptions searches
+        """
+        connection.execute("DELETE FROM site_token")
+
+        for site_id, description in connection.execute(
+                "SELECT id, description FROM site").fetchall():
+            self._add_tokens(connection, site_id, description)
+
+    def _migrate_stats(self, connection):
+        """
+        Builds the statistics of databases created before statistics
+        """
+        deltas = {}
+
+        for site in self.iter_sites():
+            self._merge_deltas(deltas, get_deltas(None, site))
+
+        connection.execute("DELETE FROM site_stat")
+        self._update_stats(connection, deltas)
+
+    def _get_connection(self):
+        """
+        Returns the calling thread database connection
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         cached_statements=64)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+
+        return connection
+
+    def close(self):
+        """
+        Closes the calling thread database connection
+        """
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @staticmethod
+    def _get_row_values(row, booleans):
+        """
+        Returns row values, boolean columns being converted from integers
+        """
+        values = list(row)
+
+        for i in booleans:
+            values[i] = bool(values[i])
+
+        return values
+
+    @staticmethod
+    def _add_tokens(connection, site_id, description):
+        """
+        Stores the words of a site description in the token table, in the
+        current transaction
+        """
+        connection.executemany(
+            "INSERT INTO site_token (token, site_id) VALUES (?, ?)",
+            [ (token, site_id) for token in tokenize(description) ])
+
+    @staticmethod
+    def _merge_deltas(deltas, other):
+        """
+        Adds statistics counters changes to an other changes dictionnary
+        """
+        for item, delta in other.iteritems():
+            deltas[item] = deltas.get(item, 0) + delta
+
+    @staticmethod
+    def _update_stats(connection, deltas):
+        """
+        Applies statistics counters changes (see
+        sitebuilder.utils.driver.stats.get_deltas) in the current
+        transaction
+        """
+        changes = [ (delta, group, value)
+                    for (group, value), delta in deltas.iteritems() if delta ]
+
+        connection.executemany(
+            "INSERT OR IGNORE INTO site_stat (grp, value, count) "
+            "VALUES (?, ?, 0)", [ change[1:] for change in changes ])
+        connection.executemany(
+            "UPDATE site_stat SET count = count + ? "
+            "WHERE grp = ? AND value = ?", changes)
+        connection.execute("DELETE FROM site_stat WHERE count = 0")
+
+    @classmethod
+    def _get_snapshot(cls, row):
+        """
+        Returns the snapshot of a site row selected using _SELECT_SITE
+        """
+        return SiteSnapshot.from_tuple(
+            cls._get_row_values(row[:-1], _SITE_BOOLEANS), row[-1])
+
+    @staticmethod
+    def _get_values(site, component, skip=()):
+        """
+        Returns a site component attributes values, in SITE_FIELDS order
+        """
+        obj = getattr(site, component)
+        values = []
+
+        for attr in _FIELDS[component]:
+            if not attr in skip:
+                values.append(getattr(obj, attr))
+
+        return values
+
+    def get_site_by_name(self, name, domain):
+        """
+        Loads a site item based on its name and domain. It returns a new
+        mutable site object, or None if no site matches.
+        """
+        snapshot = self.get_site_snapshot(name, domain)
+
+        if snapshot is None:
+            return None
+
+        return snapshot.to_site()
+
+    def get_site_snapshot(self, name, domain):
+        """
+        Returns the immutable snapshot of a site, or None if no site matches.
+        """
+        row = self._get_connection().execute(
+            _SELECT_SITE + " WHERE site.name_key = ? AND site.domain_key = ?",
+            (name.lower(), domain.lower())).fetchone()
+
+        if row is None:
+            return None
+
+        return self._get_snapshot(row)
+
+    def lookup_host_by_name(self, name, domain, limit=None, offset=0,
+                            after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites using name and domain as search filter, and returns
+        the matching sites dnshost immutable snapshots.
+
+        Name and domain parameters may use wilcard characters (*).
+
+        Parameters:
+            limit   Maximum number of hosts returned (None for no limit)
+            offset  Number of hosts skipped
+            after   Cursor: only hosts following it are returned (see
+                    sitebuilder.utils.driver.index.get_host_cursor)
+            sort    Sort order: SORT_DOMAIN (domain, then name) or SORT_NAME
+                    (name, then domain)
+        """
+        sql, parameters = self._get_lookup_query(
+            _SELECT_HOST, name, domain, limit, offset, after, sort)
+        get_values = self._get_row_values
+        from_tuple = DNSHostSnapshot.from_tuple
+
+        return [ from_tuple(get_values(row, _HOST_BOOLEANS)) for row in
+                 self._get_connection().execute(sql, parameters) ]
+
+    def lookup_host_fields(self, name, domain, fields, limit=None, offset=0,
+                           after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites like lookup_host_by_name, but only returns tuples of
+        the requested dnshost fields values, read from the site table
+        columns.
+        """
+        for field in fields:
+            if not field in _FIELDS['dnshost']:
+                raise BackendError("Unknown host field %s" % field)
+
+        sql, parameters = self._get_lookup_query(
+            "SELECT %s FROM site" % ", ".join(fields), name, domain, limit,
+            offset, after, sort)
+        rows = self._get_connection().execute(sql, parameters).fetchall()
+        booleans = [ i for i, field in enumerate(fields)
+                     if ('dnshost', field) in _BOOLEANS ]
+
+        if len(booleans):
+            get_values = self._get_row_values
+            return [ tuple(get_values(row, booleans)) for row in rows ]
+
+        return rows
+
+    @staticmethod
+    def _get_lookup_query(select, name, domain, limit, offset, after, sort):
+        """
+        Returns the (sql, parameters) tuple of a host lookup query
+        """
+        clauses = []
+        parameters = []
+
+        for column, pattern in (('domain_key', domain), ('name_key', name)):
+            clause, values = get_pattern_clause(column, pattern)
+
+            if clause is not None:
+                clauses.append(clause)
+                parameters.extend(values)
+
+        if sort == SORT_NAME:
+            keys = ('name_key', 'domain_key')
+        else:
+            keys = ('domain_key', 'name_key')
+
+        # Keyset pagination: (first, second) > (after[0], after[1])
+        if after is not None:
+            clauses.append("(%s > ? OR (%s = ? AND %s > ?))" % (
+                keys[0], keys[0], keys[1]))
+            parameters.extend([after[0], after[0], after[1]])
+
+        sql = select
+
+        if len(clauses):
+            sql += " WHERE " + " AND ".join(clauses)
+
+        sql += " ORDER BY %s, %s" % keys
+
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            parameters.extend([limit is None and -1 or limit, offset])
+
+        return sql, parameters
+
+    def iter_hosts_by_name(self, name, domain, sort=SORT_DOMAIN,
+                           batch_size=500):
+        """
+        Generator yielding the hosts matching name and domain wildcard
+        patterns, looked up batch_size hosts at a time.
+        """
+        return iter_host_pages(self.lookup_host_by_name, name, domain, sort,
+                               batch_size)
+
+    def iter_sites(self, batch_size=500):
+        """
+        Generator yielding all the sites snapshots, ordered by domain then
+        name, looked up batch_size sites at a time.
+        """
+        connection = self._get_connection()
+        first = _SELECT_SITE + (" ORDER BY site.domain_key, site.name_key "
+                                "LIMIT ?")
+        following = _SELECT_SITE + (
+            " WHERE site.domain_key > ? OR (site.domain_key = ? AND "
+            "site.name_key > ?) ORDER BY site.domain_key, site.name_key "
+            "LIMIT ?")
+        rows = connection.execute(first, (batch_size,)).fetchall()
+
+        while True:
+            for row in rows:
+                site = self._get_snapshot(row)
+                yield site
+
+            if len(rows) < batch_size:
+                break
+
+            domain, name = get_host_cursor(site.dnshost)
+            rows = connection.execute(
+                following, (domain, domain, name, batch_size)).fetchall()
+
+    def search_descriptions(self, query, limit=None, after=None):
+        """
+        Returns the dnshost immutable snapshots of the sites whose
+        description holds all the words of a query, ordered by domain then
+        name. Words ending with * are prefixes (see
+        sitebuilder.utils.driver.text.parse_query).
+
+        Parameters:
+            limit   Maximum number of hosts returned (None for no limit)
+            after   Cursor: only hosts following it are returned (see
+                    sitebuilder.utils.driver.index.get_host_cursor)
+        """
+        connection = self._get_connection()
+        terms = []
+
+        for token, prefix in parse_query(query):
+            if prefix:
+                terms.append(("token >= ? AND token < ?",
+                              [token, token + _MAX_CHAR]))
+            else:
+                terms.append(("token = ?", [token]))
+
+        # The rarest word (up to a bound) selects the candidate sites, the
+        # other ones are checked for each candidate only
+        counts = [ connection.execute(
+                       "SELECT COUNT(*) FROM (SELECT 1 FROM site_token "
+                       "WHERE %s LIMIT 1000)" % clause, values).fetchone()[0]
+                   for clause, values in terms ]
+        terms = [ term for count, term in sorted(zip(counts, terms)) ]
+
+        if not len(terms) or not min(counts):
+            return []
+
+        clause, parameters = terms[0]
+        parameters = list(parameters)
+        clauses = [ "id IN (SELECT site_id FROM site_token WHERE %s)" %
+                    clause ]
+
+        for clause, values in terms[1:]:
+            clauses.append("EXISTS (SELECT 1 FROM site_token WHERE "
+                           "site_id = site.id AND %s)" % clause)
+            parameters.extend(values)
+
+        if after is not None:
+            clauses.append("(domain_key > ? OR (domain_key = ? AND "
+                           "name_key > ?))")
+            parameters.extend([after[0], after[0], after[1]])
+
+        sql = "%s WHERE %s ORDER BY domain_key, name_key" % (
+            _SELECT_HOST, " AND ".join(clauses))
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+
+        get_values = self._get_row_values
+        from_tuple = DNSHostSnapshot.from_tuple
+
+        return [ from_tuple(get_values(row, _HOST_BOOLEANS)) for row in
+                 connection.execute(sql, parameters) ]
+
+    def get_catalog_stats(self):
+        """
+        Returns the catalog statistics: numbers of sites per platform,
+        domain and database type, and of done provisioning steps (see
+        sitebuilder.utils.driver.stats)
+        """
+        rows = self._get_connection().execute(
+            "SELECT grp, value, count FROM site_stat").fetchall()
+
+        return build_stats(dict([ ((str(group), value), count)
+                                  for group, value, count in rows ]))
+
+    def find_sites(self, limit=None, after=None, **criteria):
+        """
+        Returns the snapshots of the sites matching all the criteria, given
+        as keyword arguments (see
+        sitebuilder.utils.driver.index.SITE_CRITERIA), ordered by domain
+        then name.
+
+        Parameters:
+            limit   Maximum number of sites returned (None for no limit)
+            after   Cursor: only sites following it are returned (see
+                    sitebuilder.utils.driver.index.get_host_cursor)
+        """
+        clauses = []
+        parameters = []
+
+        for criterion, value in get_criteria(criteria):
+            if criterion == 'domain':
+                clauses.append("site.domain_key = ?")
+            else:
+                component, attr = SITE_CRITERIA[criterion]
+                clauses.append("%s.%s = ?" % (_TABLES[component], attr))
+
+            parameters.append(value)
+
+        if after is not None:
+            clauses.append("(site.domain_key > ? OR (site.domain_key = ? AND "
+                           "site.name_key > ?))")
+            parameters.extend([after[0], after[0], after[1]])
+
+        sql = _SELECT_SITE
+
+        if len(clauses):
+            sql += " WHERE " + " AND ".join(clauses)
+
+        sql += " ORDER BY site.domain_key, site.name_key"
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+
+        return [ self._get_snapshot(row) for row in
+                 self._get_connection().execute(sql, parameters) ]
+
+    def add_site(self, site):
+        """
+        Adds a site
+        """
+        self.add_sites([ site ])
+
+    def add_sites(self, sites):
+        """
+        Adds several sites in a single transaction. If one of them already
+        exists, none is added.
+        """
+        connection = self._get_connection()
+        rows = dict([ (component, []) for component, attributes in SITE_FIELDS
+                      if component != 'dnshost' ])
+        insert_site = "INSERT INTO site (name_key, domain_key, version, " \
+                      "%s) VALUES (?, ?, ?, %s)" % (
+                          ", ".join(_FIELDS['dnshost']),
+                          ", ".join("?" * len(_FIELDS['dnshost'])))
+
+        deltas = {}
+
+        with connection:
+            for site in sites:
+                name = site.dnshost.name
+                domain = site.dnshost.domain
+
+                version = self._record_change(connection, CHANGE_INSERT,
+                                              name, domain)
+
+                try:
+                    cursor = connection.execute(
+                        insert_site, [name.lower(), domain.lower(), version] +
+                        self._get_values(site, 'dnshost'))
+                except sqlite3.IntegrityError:
+                    raise BackendError("Site %s.%s already exists" % (
+                        name, domain))
+
+                for component in rows:
+                    rows[component].append(
+                        [cursor.lastrowid] + self._get_values(site, component))
+
+                self._add_tokens(connection, cursor.lastrowid,
+                                 site.dnshost.description)
+                self._merge_deltas(deltas, get_deltas(None, site))
+
+            # Other components rows are inserted at once
+            for component, values in rows.iteritems():
+                attributes = _FIELDS[component]
+                connection.executemany(
+                    "INSERT INTO %s (site_id, %s) VALUES (?, %s)" % (
+                        _TABLES[component], ", ".join(attributes),
+                        ", ".join("?" * len(attributes))),
+                    values)
+
+            self._update_stats(connection, deltas)
+
+    def insert_if_absent(self, site):
+        """
+        Adds a site if no site has the same name and domain. Returns True if
+        the site was added.
+        """
+        # The unique site key makes the check and the insert atomic
+        try:
+            self.add_sites([ site ])
+        except BackendError:
+            return False
+
+        return True
+
+    def update_site(self, site):
+        """
+        Applies site object changes to the stored site. Name and domain
+        can't be changed.
+        """
+        self.update_if_version(site, None)
+
+    def update_if_version(self, site, version):
+        """
+        Applies site object changes to the stored site if its version is
+        still version (None to skip the check), and returns its new version.
+        Name and domain can't be changed.
+        """
+        name = site.dnshost.name
+        domain = site.dnshost.domain
+        connection = self._get_connection()
+
+        with connection:
+            # Takes the write lock first, so that the check and the update
+            # are atomic
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id, version FROM site "
+                "WHERE name_key = ? AND domain_key = ?",
+                (name.lower(), domain.lower())).fetchone()
+
+            if row is None:
+                raise BackendError("Unknown site %s.%s" % (name, domain))
+
+            if version is not None and row[1] != version:
+                raise ConflictError("Site %s.%s was changed since version %d"
+                                    % (name, domain, version))
+
+            old = self._get_snapshot(connection.execute(
+                _SELECT_SITE + " WHERE site.id = ?", (row[0],)).fetchone())
+            new_version = self._record_change(connection, CHANGE_UPDATE,
+                                              name, domain)
+
+            for component, attributes in SITE_FIELDS:
+                if component == 'dnshost':
+                    skip = ('name', 'domain')
+                    key = 'id'
+                    assignments = [ "version = ?" ]
+                    values = [ new_version ]
+                else:
+                    skip = ()
+                    key = 'site_id'
+                    assignments = []
+                    values = []
+
+                assignments.extend([ "%s = ?" % attr for attr in attributes
+                                     if not attr in skip ])
+                values.extend(self._get_values(site, component, skip))
+                connection.execute(
+                    "UPDATE %s SET %s WHERE %s = ?" % (
+                        _TABLES[component], ", ".join(assignments), key),
+                    values + [row[0]])
+
+            connection.execute("DELETE FROM site_token WHERE site_id = ?",
+                               (row[0],))
+            self._add_tokens(connection, row[0], site.dnshost.description)
+            self._update_stats(connection, get_deltas(old, site))
+
+        return new_version
+
+    def delete_site(self, name, domain):
+        """
+        Deletes a site
+        """
+        if not self.delete_if_exists(name, domain):
+            raise BackendError("Unknown site %s.%s" % (name, domain))
+
+    def delete_if_exists(self, name, domain):
+        """
+        Deletes a site if it exists. Returns True if the site was deleted.
+        """
+        connection = self._get_connection()
+
+        with connection:
+            # The deleted site is read in the same write transaction
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                _SELECT_SITE + " WHERE site.name_key = ? AND "
+                "site.domain_key = ?", (name.lower(), domain.lower())
+                ).fetchone()
+
+            if row is None:
+                return False
+
+            connection.execute(
+                "DELETE FROM site WHERE name_key = ? AND domain_key = ?",
+                (name.lower(), domain.lower()))
+            self._record_change(connection, CHANGE_DELETE, name, domain)
+            self._update_stats(connection,
+                               get_deltas(self._get_snapshot(row), None))
+
+        return True
+
+    @staticmethod
+    def _record_change(connection, kind, name, domain):
+        """
+        Records a change in the change log, in the current transaction, and
+        returns its version. The oldest changes are discarded.
+        """
+        cursor = connection.execute(
+            "INSERT INTO site_change (kind, name, domain) VALUES (?, ?, ?)",
+            (kind, name, domain))
+        connection.execute("DELETE FROM site_change WHERE version <= ?",
+                           (cursor.lastrowid - CHANGE_LOG_SIZE,))
+
+        return cursor.lastrowid
+
+    def get_version(self):
+        """
+        Returns the current change version
+        """
+        row = self._get_connection().execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'site_change'"
+            ).fetchone()
+
+        if row is None:
+            return 0
+
+        return row[0]
+
+    def changes_since(self, version):
+        """
+        Returns the (current version, changes) tuple of the changes made
+        after version (see sitebuilder.utils.driver.changes)
+        """
+        connection = self._get_connection()
+
+        # Reads are done in a single transaction, for a consistent view
+        with connection:
+            connection.execute("BEGIN")
+            current = self.get_version()
+
+            if version >= current:
+                return current, []
+
+            changes = connection.execute(
+                "SELECT version, kind, name, domain FROM site_change "
+                "WHERE version > ? ORDER BY version", (version,)).fetchall()
+
+        if not len(changes) or changes[0][0] > version + 1:
+            return current, None
+
+        return current, [ (num, str(kind), name, domain)
+                          for num, kind, name, domain in changes ]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Sites catalog statistics.
+
+Drivers keep counters of sites per platform, per domain and per database
+type (of sites using a database), and of the sites whose provisioning steps
+are done. Counters are updated by each write with the site contributions,
+so that reading statistics doesn't depend on the number of sites.
+
+Statistics are returned as a dictionnary:
+
+    {'sites': 10,
+     'platform': {u'prod': 8, u'dev': 2},
+     'domain': {u'bpinet.com': 10},
+     'database_type': {u'mysql': 3},
+     'done': {'dnshost': 10, 'repository': 5, 'website': 5, 'database': 3}}
+"""
+
+from collections import defaultdict
+
+# Components whose done attribute is counted
+DONE_COMPONENTS = ('dnshost', 'repository', 'website', 'database')
+
+# Counter groups, besides the total number of sites
+STAT_GROUPS = ('platform', 'domain', 'database_type', 'done')
+
+
+def get_contributions(site):
+    """
+    Returns the list of the (group, value) counters a site increments.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> site = get_test_site(u'name0')
+    >>> site.website.done = False
+    >>> get_contributions(site)[:3]
+    [('sites', u''), ('platform', u'prod'), ('domain', u'bpinet.com')]
+    >>> [ value for group, value in get_contributions(site)[3:] ]
+    [u'mysql', u'repository', u'database']
+    """
+    contributions = [ ('sites', u''),
+                      ('platform', site.dnshost.platform),
+                      ('domain', site.dnshost.domain) ]
+
+    if site.database.enabled:
+        contributions.append(('database_type', site.database.type))
+
+    for component in DONE_COMPONENTS:
+        if getattr(site, component).done:
+            contributions.append(('done', unicode(component)))
+
+    return contributions
+
+
+def get_deltas(old=None, new=None):
+    """
+    Returns the dictionnary of counters changes, by (group, value), of a site
+    change from old to new (None for an insert or a delete). Unchanged
+    counters are left out.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> old = get_test_site(u'name0')
+    >>> new = get_test_site(u'name0')
+    >>> new.database.enabled = False
+    >>> sorted(get_deltas(old, new).items())
+    [(('database_type', u'mysql'), -1)]
+    """
+    deltas = defaultdict(int)
+
+    if old is not None:
+        for item in get_contributions(old):
+            deltas[item] -= 1
+    if new is not None:
+        for item in get_contributions(new):
+            deltas[item] += 1
+
+    return dict([ (item, delta) for item, delta in deltas.iteritems()
+                  if delta ])
+
+
+def build_stats(counts):
+    """
+    Returns the statistics dictionnary of counters values, given by (group,
+    value).
+
+    >>> stats = build_stats({('sites', u''): 2, ('platform', u'prod'): 2,
+    ...                      ('done', u'website'): 1})
+    >>> stats['sites'], stats['platform'], stats['done']['website']
+    (2, {u'prod': 2}, 1)
+    >>> stats['done']['database'], stats['database_type']
+    (0, {})
+    """
+    stats = dict([ (group, {}) for group in STAT_GROUPS ])
+    stats['sites'] = 0
+    stats['done'] = dict.fromkeys(DONE_COMPONENTS, 0)
+
+    for (group, value), count in counts.iteritems():
+        if group == 'sites':
+            stats['sites'] = count
+        elif group == 'done':
+            stats['done'][str(value)] = count
+        else:
+            stats[group][value] = count
+
+    return stats
+
+
+class CatalogStats(object):
+    """
+    In memory catalog counters.
+
+    >>> from sitebuilder.utils.driver.test import get_test_site
+    >>> stats = CatalogStats()
+    >>> site = get_test_site(u'name0')
+    >>> stats.add(site)
+    >>> stats.add(get_test_site(u'name1'))
+    >>> other = get_test_site(u'name0')
+    >>> other.dnshost.platform = u'dev'
+    >>> stats.replace(site, other)
+    >>> stats.remove(other)
+    >>> result = stats.get()
+    >>> result['sites'], result['platform'], result['done']['website']
+    (1, {u'prod': 1}, 1)
+    """
+
+    def __init__(self):
+        """
+        Counters initialization
+        """
+        self._counts = defaultdict(int)
+
+    def update(self, deltas):
+        """
+        Applies counters changes (see get_deltas)
+        """
+        for item, delta in deltas.iteritems():
+            count = self._counts[item] + delta
+
+            if count:
+                self._counts[item] = count
+            else:
+                del self._counts[item]
+
+    def add(self, site):
+        """
+        Counts a new site
+        """
+        self.update(get_deltas(None, site))
+
+    def remove(self, site):
+        """
+        Uncounts a removed site
+        """
+        self.update(get_deltas(site, None))
+
+    def replace(self, old, new):
+        """
+        Counts a site change
+        """
+        self.update(get_deltas(old, new))
+
+    def get(self):
+        """
+        Returns the statistics dictionnary (see build_stats)
+        """
+        return build_stats(self._counts)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -4,9 +4,9 @@ Test backend driver implementation
 """
 
 from sitebuilder.abstraction.site.factory import site_factory
-from sitebuilder.exception import BackendError
-from copy import deepcopy
-import re
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver, SiteTable
+from sitebuilder.utils.driver.index import SORT_DOMAIN
 
 
 def get_test_site(name):
@@ -35,13 +35,23 @@ def get_test_site(name):
     return site
 
 
-# Module level site list
-_SITES = [ get_test_site("name%d" % num) for num in range(10) ]
+# Module level site table, and the in memory driver working on it
+_SITES = SiteTable([ SiteSnapshot.from_site(get_test_site("name%d" % num))
+                     for num in range(10) ])
+_DRIVER = MemoryBackendDriver(_SITES)
+
+
+def get_test_driver():
+    """
+    Returns the in memory driver working on the module level site table
+    """
+    return _DRIVER
 
 
 class TestBackendDriver(object):
     """
-    Test implementation backend driver
+    Test implementation backend driver. It works on the module level site
+    table, through an in memory driver: several threads may use it.
     """
 
     @staticmethod
@@ -60,16 +70,23 @@ class TestBackendDriver(object):
         >>> site.dnshost.domain == SiteDefaultsManager.get_default_domain()
         True
         """
-        for site in _SITES:
-            dnshost = site.dnshost
-            if dnshost.name.lower() == name.lower() and \
-               dnshost.domain.lower() == domain.lower():
-                return deepcopy(site)
+        return _DRIVER.get_site_by_name(name, domain)
 
-        return None
+    @staticmethod
+    def get_site_snapshot(name, domain):
+        """
+        Returns the immutable snapshot of a site, or None if no site matches.
+
+        >>> from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
+        >>> site = TestBackendDriver.get_site_snapshot('name0', SiteDefaultsManager.get_default_domain())
+        >>> site.dnshost.name
+        u'name0'
+        """
+        return _DRIVER.get_site_snapshot(name, domain)
 
     @staticmethod
-    def lookup_host_by_name(name, domain):
+    def lookup_host_by_name(name, domain, limit=None, offset=0, after=None,
+                            sort=SORT_DOMAIN):
         """
         Looks for sites using name and domain as search filter.
 
@@ -94,18 +111,110 @@ class TestBackendDriver(object):
         >>> test = [ True for i in range(len(_SITES)) ]
         >>> test == found
         True
+
+        Lookups may be paginated using limit, offset and after parameters
+
+        >>> page = TestBackendDriver.lookup_host_by_name('*', '*', limit=2,
+        ...     after=(hosts[0].domain.lower(), hosts[0].name.lower()))
+        >>> [ host.name for host in page ] == [ host.name for host in hosts[1:3] ]
+        True
         """
-        sites = []
+        return _DRIVER.lookup_host_by_name(name, domain, limit, offset, after,
+                                           sort)
 
-        name_re = re.compile("^%s$" % name.replace('*', '.*'))
-        domain_re = re.compile("^%s$" % domain.replace('*', '.*'))
+    @staticmethod
+    def lookup_host_fields(name, domain, fields, limit=None, offset=0,
+                           after=None, sort=SORT_DOMAIN):
+        """
+        Looks for sites like lookup_host_by_name, but only returns tuples of
+        the requested dnshost fields values.
 
-        for site in _SITES:
-            dnshost = site.dnshost
-            if name_re.match(dnshost.name) and domain_re.match(dnshost.domain):
-                sites.append(deepcopy(dnshost))
+        >>> rows = TestBackendDriver.lookup_host_fields('*', '*', ('name', 'domain'))
+        >>> len(rows) == len(_SITES), type(rows[0]), len(rows[0])
+        (True, <type 'tuple'>, 2)
+        """
+        return _DRIVER.lookup_host_fields(name, domain, fields, limit, offset,
+                                          after, sort)
 
-        return sites
+    @staticmethod
+    def iter_hosts_by_name(name, domain, sort=SORT_DOMAIN, batch_size=500):
+        """
+        Generator yielding the hosts matching name and domain wildcard
+        patterns, looked up batch_size hosts at a time.
+
+        >>> hosts = list(TestBackendDriver.iter_hosts_by_name('*', '*', batch_size=3))
+        >>> len(hosts) == len(_SITES)
+        True
+        """
+        return _DRIVER.iter_hosts_by_name(name, domain, sort, batch_size)
+
+    @staticmethod
+    def find_sites(limit=None, after=None, **criteria):
+        """
+        Returns the snapshots of the sites matching all the criteria, given
+        as keyword arguments (see
+        sitebuilder.utils.driver.index.SITE_CRITERIA), ordered by domain
+        then name.
+
+        >>> sites = TestBackendDriver.find_sites(database_enabled=True,
+        ...                                      platform=u'prod', limit=2)
+        >>> [ site.dnshost.name for site in sites ]
+        [u'name0', u'name2']
+        """
+        return _DRIVER.find_sites(limit, after, **criteria)
+
+    @staticmethod
+    def search_descriptions(query, limit=None, after=None):
+        """
+        Returns the dnshost immutable snapshots of the sites whose
+        description holds all the words of a query, ordered by domain then
+        name.
+
+        >>> [ host.name for host in
+        ...   TestBackendDriver.search_descriptions(u'DESC name3*') ]
+        [u'name3']
+        """
+        return _DRIVER.search_descriptions(query, limit, after)
+
+    @staticmethod
+    def get_catalog_stats():
+        """
+        Returns the catalog statistics (see sitebuilder.utils.driver.stats)
+
+        >>> stats = TestBackendDriver.get_catalog_stats()
+        >>> stats['sites'] == len(list(TestBackendDriver.iter_sites()))
+        True
+        >>> sum(stats['platform'].values()) == stats['sites']
+        True
+        """
+        return _DRIVER.get_catalog_stats()
+
+    @staticmethod
+    def get_version():
+        """
+        Returns the current change version
+
+        >>> version = TestBackendDriver.get_version()
+        >>> TestBackendDriver.update_site(
+        ...     TestBackendDriver.get_site_by_name('name2', 'bpinet.com'))
+        >>> TestBackendDriver.get_version() == version + 1
+        True
+        """
+        return _DRIVER.get_version()
+
+    @staticmethod
+    def changes_since(version):
+        """
+        Returns the (current version, changes) tuple of the changes made
+        after version (see sitebuilder.utils.driver.changes)
+
+        >>> version = TestBackendDriver.get_version()
+        >>> TestBackendDriver.update_site(
+        ...     TestBackendDriver.get_site_by_name('name2', 'bpinet.com'))
+        >>> TestBackendDriver.changes_since(version)[1][0][1:]
+        ('update', u'name2', u'bpinet.com')
+        """
+        return _DRIVER.changes_since(version)
 
     @staticmethod
     def add_site(site):
@@ -126,43 +235,55 @@ class TestBackendDriver(object):
         >>> found
         True
         """
-        name = site.dnshost.name
-        domain = site.dnshost.domain
-
-        hosts = TestBackendDriver.lookup_host_by_name(name, domain)
-
-        if len(hosts):
-            mesg = "Site %s.%s already exists" % (name, domain)
-            raise BackendError(mesg)
+        _DRIVER.add_site(site)
 
-        dbsite = site_factory()
-
-        dbsite.dnshost.name = site.dnshost.name
-        dbsite.dnshost.domain = site.dnshost.domain
-        dbsite.dnshost.description = site.dnshost.description
-        dbsite.dnshost.platform = site.dnshost.platform
-        dbsite.dnshost.done = site.dnshost.done
+    @staticmethod
+    def add_sites(sites):
+        """
+        Adds several sites at once. If one of them already exists, none is
+        added.
 
-        dbsite.website.enabled = site.website.enabled
-        dbsite.website.maintenance = site.website.maintenance
-        dbsite.website.access = site.website.access
-        dbsite.website.template = site.website.template
-        dbsite.website.done = site.website.done
+        >>> initlen = len(_SITES)
+        >>> TestBackendDriver.add_sites([ get_test_site(u'bulk0'),
+        ...                               get_test_site(u'bulk1') ])
+        >>> len(_SITES) == (initlen + 2)
+        True
+        >>> TestBackendDriver.add_sites([ get_test_site(u'bulk2'),
+        ...                               get_test_site(u'bulk0') ])
+        Traceback (most recent call last):
+            ...
+        BackendError: Site bulk0.bpinet.com already exists
+        >>> len(_SITES) == (initlen + 2)
+        True
+        >>> TestBackendDriver.delete_site(u'bulk0', u'bpinet.com')
+        >>> TestBackendDriver.delete_site(u'bulk1', u'bpinet.com')
+        """
+        _DRIVER.add_sites(sites)
 
-        dbsite.repository.enabled = site.repository.enabled
-        dbsite.repository.name = site.repository.name
-        dbsite.repository.type = site.repository.type
-        dbsite.repository.done = site.repository.done
+    @staticmethod
+    def insert_if_absent(site):
+        """
+        Adds a site if no site has the same name and domain. Returns True if
+        the site was added.
 
-        dbsite.database.enabled = site.database.enabled
-        dbsite.database.name = site.database.name
-        dbsite.database.username = site.database.username
-        dbsite.database.password = site.database.password
-        dbsite.database.type = site.database.type
-        dbsite.database.done = site.database.done
+        >>> TestBackendDriver.insert_if_absent(get_test_site(u'name3'))
+        False
+        >>> TestBackendDriver.insert_if_absent(get_test_site(u'absent'))
+        True
+        >>> TestBackendDriver.delete_site(u'absent', u'bpinet.com')
+        """
+        return _DRIVER.insert_if_absent(site)
 
-        _SITES.append(dbsite)
+    @staticmethod
+    def iter_sites(batch_size=500):
+        """
+        Generator yielding all the sites snapshots, looked up batch_size
+        sites at a time.
 
+        >>> len(list(TestBackendDriver.iter_sites(batch_size=3))) == len(_SITES)
+        True
+        """
+        return _DRIVER.iter_sites(batch_size)
 
     @staticmethod
     def update_site(site):
@@ -192,48 +313,24 @@ class TestBackendDriver(object):
         >>> hosts[0].name
         u'name0'
         """
-        name = site.dnshost.name
-        domain = site.dnshost.domain
-
-        hosts = TestBackendDriver.lookup_host_by_name(name, domain)
-
-        if not len(hosts):
-            mesg = "Unknown site %s.%s" % (name, domain)
-            raise BackendError(mesg)
-
-        if len(hosts) > 1:
-            mesg = "Several sites named %s.%s found" % (name, domain)
-            raise BackendError(mesg)
-
-        for dbsite in _SITES:
-            dnshost = dbsite.dnshost
-            if dnshost.name.lower() == name.lower() and \
-               dnshost.domain.lower() == domain.lower():
-                break
-
-        # Apply changes. No chnage on name nor domain allowed
-        dbsite.dnshost.description = site.dnshost.description
-        dbsite.dnshost.platform = site.dnshost.platform
-        dbsite.dnshost.domain = site.dnshost.domain
-        dbsite.dnshost.done = site.dnshost.done
-
-        dbsite.website.enabled = site.website.enabled
-        dbsite.website.maintenance = site.website.maintenance
-        dbsite.website.access = site.website.access
-        dbsite.website.template = site.website.template
-        dbsite.website.done = site.website.done
-
-        dbsite.repository.enabled = site.repository.enabled
-        dbsite.repository.name = site.repository.name
-        dbsite.repository.type = site.repository.type
-        dbsite.repository.done = site.repository.done
-
-        dbsite.database.enabled = site.database.enabled
-        dbsite.database.name = site.database.name
-        dbsite.database.username = site.database.username
-        dbsite.database.password = site.database.password
-        dbsite.database.type = site.database.type
-        dbsite.database.done = site.database.done
+        _DRIVER.update_site(site)
+
+    @staticmethod
+    def update_if_version(site, version):
+        """
+        Applies site object changes to the stored site if its version is
+        still version (None to skip the check), and returns its new version.
+
+        >>> site = TestBackendDriver.get_site_by_name(u'name4', u'bpinet.com')
+        >>> version = TestBackendDriver.update_if_version(site, site.version)
+        >>> TestBackendDriver.update_if_version(site, site.version)
+        Traceback (most recent call last):
+            ...
+        ConflictError: Site name4.bpinet.com was changed since version 0
+        >>> TestBackendDriver.update_if_version(site, version) == version + 1
+        True
+        """
+        return _DRIVER.update_if_version(site, version)
 
     @staticmethod
     def delete_site(name, domain):
@@ -249,21 +346,20 @@ class TestBackendDriver(object):
         >>> hosts
         []
         """
-        hosts = TestBackendDriver.lookup_host_by_name(name, domain)
+        _DRIVER.delete_site(name, domain)
 
-        if not len(hosts):
-            mesg = "Site %s.%s already exists" % (name, domain)
-            raise BackendError(mesg)
-
-        i = 0
-        for site in _SITES:
-            dnshost = site.dnshost
-            if dnshost.name.lower() == name.lower() and \
-               dnshost.domain.lower() == domain.lower():
-                # Deletes site
-                del(_SITES[i])
+    @staticmethod
+    def delete_if_exists(name, domain):
+        """
+        Deletes a site if it exists. Returns True if the site was deleted.
 
-            i += 1
+        >>> TestBackendDriver.add_site(get_test_site(u'deleted'))
+        >>> TestBackendDriver.delete_if_exists(u'deleted', u'bpinet.com')
+        True
+        >>> TestBackendDriver.delete_if_exists(u'deleted', u'bpinet.com')
+        False
+        """
+        return _DRIVER.delete_if_exists(name, domain)
 
 
 if __name__ == "__main__":
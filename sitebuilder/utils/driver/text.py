@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Full text index of site descriptions.
+
+Descriptions are split into lower case words (tokens), and each token maps
+to the set of the keys of the sites whose description holds it. Tokens are
+also kept sorted, so that prefix terms (abc*) are resolved by a range scan.
+
+Queries are lists of words, all of which sites descriptions must hold
+(AND). A word ending with * matches any token starting with it.
+"""
+
+from bisect import bisect_left, insort
+import re
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Character sorting after any character tokens may use
+_MAX_CHAR = u'\uffff'
+
+
+def tokenize(text):
+    """
+    Returns the set of the lower case words of a text.
+
+    >>> sorted(tokenize(u'Blog of the Marketing team - marketing'))
+    [u'blog', u'marketing', u'of', u'team', u'the']
+    """
+    if not text:
+        return set()
+
+    return set(_TOKEN_RE.findall(text.lower()))
+
+
+def parse_query(query):
+    """
+    Returns the (word, prefix) tuples of a query, prefix being True for
+    words ending with *.
+
+    >>> parse_query(u'Blog market*')
+    [(u'blog', False), (u'market', True)]
+    >>> parse_query(u'* - web-site*')
+    [(u'web', False), (u'site', True)]
+    """
+    terms = []
+
+    for word in query.lower().split():
+        tokens = _TOKEN_RE.findall(word)
+
+        if not len(tokens):
+            continue
+
+        # Only the last token of a word may be a prefix
+        terms.extend([ (token, False) for token in tokens[:-1] ])
+        terms.append((tokens[-1], word.endswith('*')))
+
+    return terms
+
+
+class DescriptionIndex(object):
+    """
+    Inverted index of site keys by description token.
+
+    >>> index = DescriptionIndex()
+    >>> index.add(u'site0', u'Marketing blog')
+    >>> index.add(u'site1', u'Market data API')
+    >>> sorted(index.search(u'market*'))
+    [u'site0', u'site1']
+    >>> sorted(index.search(u'BLOG market*'))
+    [u'site0']
+    >>> index.replace(u'site0', u'Marketing blog', u'Sales blog')
+    >>> sorted(index.search(u'market*'))
+    [u'site1']
+    >>> index.remove(u'site1', u'Market data API')
+    >>> index.search(u'market*'), len(index)
+    (set([]), 2)
+    """
+
+    def __init__(self):
+        """
+        Index initialization
+        """
+        self._postings = {}
+        self._tokens = []
+
+    def __len__(self):
+        """
+        Returns the number of indexed tokens
+        """
+        return len(self._tokens)
+
+    def _add_tokens(self, key, tokens):
+        """
+        Adds a key to the postings of tokens
+        """
+        for token in tokens:
+            keys = self._postings.get(token)
+
+            if keys is None:
+                keys = self._postings[token] = set()
+                insort(self._tokens, token)
+
+            keys.add(key)
+
+    def _remove_tokens(self, key, tokens):
+        """
+        Removes a key from the postings of tokens
+        """
+        for token in tokens:
+            keys = self._postings[token]
+            keys.discard(key)
+
+            if not len(keys):
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def add(self, key, text):
+        """
+        Indexes a site key by the tokens of its description
+        """
+        self._add_tokens(key, tokenize(text))
+
+    def remove(self, key, text):
+        """
+        Removes a site key indexed by the tokens of its description
+        """
+        self._remove_tokens(key, tokenize(text))
+
+    def replace(self, key, old, new):
+        """
+        Updates the index of a site key whose description changed: only
+        removed and added tokens are updated
+        """
+        if old == new:
+            return
+
+        old = tokenize(old)
+        new = tokenize(new)
+        self._remove_tokens(key, old - new)
+        self._add_tokens(key, new - old)
+
+    def _get_keys(self, token, prefix):
+        """
+        Returns the set of the keys indexed by a token, or by the tokens
+        starting with it if prefix is True
+        """
+        if not prefix:
+            return self._postings.get(token, set())
+
+        start = bisect_left(self._tokens, token)
+        end = bisect_left(self._tokens, token + _MAX_CHAR, start)
+
+        if end - start == 1:
+            return self._postings[self._tokens[start]]
+
+        keys = set()
+
+        for i in xrange(start, end):
+            keys.update(self._postings[self._tokens[i]])
+
+        return keys
+
+    def search(self, query):
+        """
+        Returns the set of the keys of the sites whose description matches
+        all the words of a query (see parse_query). Sets are intersected from
+        the smallest one.
+        """
+        terms = parse_query(query)
+
+        if not len(terms):
+            return set()
+
+        postings = sorted([ self._get_keys(token, prefix)
+                            for token, prefix in terms ], key=len)
+        result = set(postings[0])
+
+        for keys in postings[1:]:
+            if not len(result):
+                break
+
+            result.intersection_update(keys)
+
+        return result
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Reader-writer lock, and process lock.
+
+Any number of threads may hold the lock for reading at the same time, while
+a writer holds it alone. Waiting writers are served first: new readers wait
+for them, so that a steady flow of lookups can't starve writes.
+
+Both modes are reentrant: a thread holding the lock for reading may read
+again even if a writer waits, and the writing thread may read or write
+again. A reader can't upgrade to writing, as two upgrading readers would
+wait for each other forever.
+
+A process lock is held by a single process at a time, such as the one
+running the periodic jobs writing shared files.
+"""
+
+from contextlib import contextmanager
+from threading import Condition, Lock, current_thread
+import fcntl
+import errno
+import os
+
+
+class ReadWriteLock(object):
+    """
+    Writer preferring reentrant reader-writer lock.
+
+    >>> lock = ReadWriteLock()
+    >>> with lock.reading():
+    ...     with lock.reading():
+    ...         lock.readers
+    1
+    >>> with lock.writing():
+    ...     with lock.reading():
+    ...         lock.writer is current_thread()
+    True
+    >>> with lock.reading():
+    ...     lock.acquire_write()
+    Traceback (most recent call last):
+        ...
+    RuntimeError: cannot upgrade a read lock to a write lock
+    >>> lock.readers, lock.writer
+    (0, None)
+    """
+
+    def __init__(self):
+        """
+        Lock initialization
+        """
+        self._condition = Condition(Lock())
+
+        # Read lock counts by thread, and writing thread with its count
+        self._reads = {}
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+
+    @property
+    def readers(self):
+        """
+        Number of threads holding the lock for reading
+        """
+        return len(self._reads)
+
+    @property
+    def writer(self):
+        """
+        Thread holding the lock for writing, or None
+        """
+        return self._writer
+
+    def acquire_read(self):
+        """
+        Acquires the lock for reading, waiting for the writer and the
+        waiting writers, if any
+        """
+        me = current_thread()
+
+        with self._condition:
+            if me in self._reads or self._writer is me:
+                self._reads[me] = self._reads.get(me, 0) + 1
+                return
+
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+
+            self._reads[me] = 1
+
+    def release_read(self):
+        """
+        Releases the lock held for reading
+        """
+        me = current_thread()
+
+        with self._condition:
+            count = self._reads.get(me)
+
+            if count is None:
+                raise RuntimeError("cannot release an unacquired read lock")
+
+            if count > 1:
+                self._reads[me] = count - 1
+            else:
+                del self._reads[me]
+
+                if not self._reads:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        """
+        Acquires the lock for writing, waiting for readers and the current
+        writer to release it
+        """
+        me = current_thread()
+
+        with self._condition:
+            if self._writer is me:
+                self._writes += 1
+                return
+
+            if me in self._reads:
+                raise RuntimeError("cannot upgrade a read lock to a write "
+                                   "lock")
+
+            self._waiting_writers += 1
+
+            try:
+                while self._writer is not None or self._reads:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+
+            self._writer = me
+            self._writes = 1
+
+    def release_write(self):
+        """
+        Releases the lock held for writing
+        """
+        with self._condition:
+            if self._writer is not current_thread():
+                raise RuntimeError("cannot release an unacquired write lock")
+
+            self._writes -= 1
+
+            if not self._writes:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextmanager
+    def reading(self):
+        """
+        Context manager holding the lock for reading
+        """
+        self.acquire_read()
+
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        """
+        Context manager holding the lock for writing
+        """
+        self.acquire_write()
+
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class ProcessLock(object):
+    """
+    Lock held by a single process at a time, using an exclusive flock on a
+    lock file. The system releases it when its process exits, even if it
+    crashed: another process may then acquire it.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> directory = mkdtemp()
+    >>> lock = ProcessLock(os.path.join(directory, 'jobs.lock'))
+    >>> other = ProcessLock(os.path.join(directory, 'jobs.lock'))
+    >>> lock.try_acquire(), other.try_acquire(), lock.try_acquire()
+    (True, False, True)
+    >>> lock.release()
+    >>> lock.held, other.try_acquire(), other.held
+    (False, True, True)
+    >>> other.release()
+    >>> rmtree(directory)
+    """
+
+    def __init__(self, path):
+        """
+        Lock initialization.
+
+        Parameters:
+            path    Lock file path, created if needed
+        """
+        self.path = path
+        self._stream = None
+        self._lock = Lock()
+
+    @property
+    def held(self):
+        """
+        Tells if the lock is held by this object
+        """
+        return self._stream is not None
+
+    def try_acquire(self):
+        """
+        Acquires the lock if no other process holds it, without waiting.
+        Returns True if the lock is held, which it remains until released.
+        """
+        with self._lock:
+            if self._stream is not None:
+                return True
+
+            directory = os.path.dirname(self.path)
+
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            stream = open(self.path, 'a')
+
+            try:
+                fcntl.flock(stream.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                stream.close()
+
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+
+                raise
+
+            self._stream = stream
+            return True
+
+    def release(self):
+        """
+        Releases the lock, if held
+        """
+        with self._lock:
+            if self._stream is not None:
+                fcntl.flock(self._stream.fileno(), fcntl.LOCK_UN)
+                self._stream.close()
+                self._stream = None
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -3,11 +3,49 @@
 This module contains several application parameters used in other modules.
 """
 
-from os.path import abspath, dirname
+from os.path import abspath, dirname, expanduser, join
 
 # Glade resources related constants
 GLADE_BASEDIR = dirname(abspath( __file__ )) + "/../resources/glade"
 
+# Configuration artifacts templates
+TEMPLATES_BASEDIR = dirname(abspath( __file__ )) + "/../resources/templates"
+
+# Local data files related constants
+DATA_DIR = expanduser("~/.sitebuilder")
+QUEUE_FILE = join(DATA_DIR, "queue.db")
+LOG_FILE = join(DATA_DIR, "commands.log")
+HISTORY_FILE = join(DATA_DIR, "history.db")
+SITES_FILE = join(DATA_DIR, "sites.db")
+SNAPSHOT_FILE = join(DATA_DIR, "sites.snap")
+CATALOG_SOCKET = join(DATA_DIR, "catalog.sock")
+ARTIFACTS_DIR = join(DATA_DIR, "artifacts")
+ZONES_DIR = join(DATA_DIR, "zones")
+JOBS_LOCK_FILE = join(DATA_DIR, "jobs.lock")
+
+# Number of seconds executed commands are kept in the history file
+HISTORY_RETENTION = 90 * 86400
+
+# Number of commands dequeued at once from queues supporting batches
+QUEUE_BATCH_SIZE = 50
+
+# Durable queues consumers: heartbeat interval, and delay after which the
+# leases of a consumer without heartbeat expire (in seconds)
+QUEUE_HEARTBEAT_INTERVAL = 10
+QUEUE_LEASE_TIMEOUT      = 30
+
+# Number of sites validated and added at once by catalog imports
+IMPORT_CHUNK_SIZE = 500
+
+# Number of changes kept by backend drivers change logs
+CHANGE_LOG_SIZE = 1000
+
+# Caching backend driver related constants: maximum number of cached sites
+# and lookups results, and their time to live (in seconds)
+SITES_CACHE_SIZE   = 1000
+LOOKUPS_CACHE_SIZE = 100
+CACHE_TTL          = 60
+
 # GUI actions related constants
 ACTION_SUBMIT    = u'submit'
 ACTION_CANCEL    = u'cancel'
@@ -18,6 +56,45 @@ ACTION_DELETE    = u'delete'
 ACTION_RELOAD    = u'reload'
 ACTION_CLEARLOGS = u'clearlogs'
 ACTION_SHOWLOGS  = u'showlogs'
+ACTION_LOADMORE  = u'loadmore'
+
+# Sites list related constants: number of hosts looked up per page, the next
+# page being requested when the list is scrolled down
+SITES_PAGE_SIZE = 200
+
+# Logs list related constants: number of commands kept, and number of most
+# recent commands kept with full details (site, exception, traceback)
+LOGS_HISTORY_SIZE = 1000
+LOGS_DETAIL_SIZE  = 50
+
+# Periodic jobs related constants (in seconds)
+RECONCILE_INTERVAL = 300
+RECONCILE_JITTER   = 30
+ARTIFACTS_INTERVAL = 60
+ARTIFACTS_JITTER   = 10
+ZONES_INTERVAL     = 300
+ZONES_JITTER       = 30
+
+# DNS zones related constants: number of hosts looked up at once, and
+# number of domains built in parallel
+ZONE_BATCH_SIZE = 1000
+ZONE_WORKERS    = 4
+
+# Databases provisioning related constants: administrator connections per
+# server, databases provisioned at once, number of concurrent batches, and
+# number of attempts to get a connection for a batch
+DATABASE_POOL_SIZE  = 2
+DATABASE_BATCH_SIZE = 50
+DATABASE_WORKERS    = 4
+DATABASE_CONNECT_ATTEMPTS = 2
+
+# Database servers: adapter name and options (see
+# sitebuilder.provision.adapter), by database type or by (database type,
+# platform) tuple for platforms using their own servers
+DATABASE_SERVERS = {
+    u'mysql': ('mysql', {'host': 'localhost', 'user': 'root'}),
+    u'pgsql': ('pgsql', {'host': 'localhost', 'user': 'postgres'}),
+    }
 
 # The following variables are module closed. They should NEVER be directly set
 CONTEXT_NORMAL = u'normal'
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Configuration artifacts generator benchmark.
+
+Measures a full pass over a 50k sites catalog, a pass without any change,
+and an incremental pass after a single site edit, and prints the number of
+artifacts each pass wrote.
+
+Usage: bench_artifact.py [sites]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver
+from sitebuilder.utils.driver.test import get_test_site
+from sitebuilder.generator.artifact import ArtifactGenerator
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import sys
+
+
+def bench(name, function):
+    """
+    Runs a generator pass, and prints its duration and written artifacts
+    """
+    start = time()
+    written, removed = function()
+
+    print "%-26s %10.3f s %7d written %7d removed" % (
+        name, time() - start, len(written), len(removed))
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    size = len(sys.argv) > 1 and int(sys.argv[1]) or 50000
+    directory = mkdtemp()
+
+    try:
+        driver = MemoryBackendDriver()
+        driver.add_sites([ SiteSnapshot.from_site(get_test_site(
+                               u"name%d" % num)) for num in range(size) ])
+        generator = ArtifactGenerator(directory)
+
+        bench("full pass", lambda: generator.update(driver))
+        bench("unchanged full pass", lambda: generator.generate(driver))
+
+        site = driver.get_site_by_name(u'name%d' % (size / 2), u'bpinet.com')
+        site.website.maintenance = False
+        driver.update_site(site)
+        bench("single site edit", lambda: generator.update(driver))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
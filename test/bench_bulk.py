@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Sites catalog bulk import and export benchmark.
+
+Generates a CSV and a JSON lines file of 10k sites, then measures import
+and export throughput (rows/second) with the in memory and SQLite drivers,
+and the peak memory use of the process.
+
+Usage: bench_bulk.py [sites]
+"""
+
+from sitebuilder.abstraction.site.bulk import import_sites, export_sites
+from sitebuilder.abstraction.site.bulk import write_sites
+from sitebuilder.abstraction.site.bulk import FORMAT_CSV, FORMAT_JSONL
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver
+from sitebuilder.utils.driver.sqlite import SQLiteBackendDriver
+from sitebuilder.utils.driver.test import get_test_site
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import resource
+import os
+import sys
+
+
+def bench(name, size, function):
+    """
+    Runs function, and prints rows per second and peak memory use
+    """
+    start = time()
+    function()
+    duration = time() - start
+
+    print "%-28s %7d sites %10.0f rows/s %8d KB max RSS" % (
+        name, size, size / duration,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    size = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+    tmpdir = mkdtemp()
+
+    try:
+        template = SiteSnapshot.from_site(get_test_site(u'name'))
+        sites = ( template.replace('dnshost', name=u'name%d' % num)
+                  for num in xrange(size) )
+        paths = {}
+
+        for format in (FORMAT_CSV, FORMAT_JSONL):
+            paths[format] = os.path.join(tmpdir, 'sites.%s' % format)
+
+            with open(paths[format], 'wb') as stream:
+                write_sites(sites, stream, format)
+
+            sites = ( template.replace('dnshost', name=u'name%d' % num)
+                      for num in xrange(size) )
+
+        for format in (FORMAT_CSV, FORMAT_JSONL):
+            drivers = (
+                ('memory', MemoryBackendDriver()),
+                ('sqlite', SQLiteBackendDriver(
+                    os.path.join(tmpdir, 'sites-%s.db' % format))),
+                )
+
+            for name, driver in drivers:
+                def run_import():
+                    with open(paths[format], 'rb') as stream:
+                        import_sites(driver, stream, format)
+
+                def run_export():
+                    with open(os.devnull, 'wb') as stream:
+                        export_sites(driver, stream, format)
+
+                bench("import %s %s" % (format, name), size, run_import)
+                bench("export %s %s" % (format, name), size, run_export)
+    finally:
+        rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+In memory backend driver concurrency benchmark.
+
+Runs 1, 2, 4 and 8 reader threads doing paginated wildcard lookups against
+10k sites for a few seconds, while a writer thread keeps updating sites, and
+prints lookups and writes throughput.
+
+Usage: bench_concurrency.py [sites] [seconds]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver, SiteTable
+from sitebuilder.utils.driver.test import get_test_site
+from threading import Thread, Event
+from time import time, sleep
+import sys
+
+
+def run(driver, size, readers, duration):
+    """
+    Runs readers threads and a writer thread for duration seconds, and
+    prints their throughput
+    """
+    stop = Event()
+    counts = [ 0 ] * (readers + 1)
+
+    def read(num):
+        while not stop.is_set():
+            driver.lookup_host_by_name(u'name%d*' % (counts[num] % 10),
+                                       u'*', limit=50)
+            counts[num] += 1
+
+    def write():
+        site = driver.get_site_by_name(u'name0', u'bpinet.com')
+
+        while not stop.is_set():
+            site.dnshost.name = u'name%d' % (counts[-1] % size)
+            driver.update_site(site)
+            counts[-1] += 1
+
+    threads = [ Thread(target=read, args=(num,)) for num in range(readers) ]
+    threads.append(Thread(target=write))
+
+    for thread in threads:
+        thread.start()
+
+    sleep(duration)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    print "%d readers %10.0f lookups/s %10.0f writes/s" % (
+        readers, sum(counts[:-1]) / duration, counts[-1] / duration)
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    size = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+    duration = len(sys.argv) > 2 and float(sys.argv[2]) or 3.0
+    driver = MemoryBackendDriver(SiteTable(
+        [ SiteSnapshot.from_site(get_test_site(u"name%d" % num))
+          for num in range(size) ]))
+
+    for readers in (1, 2, 4, 8):
+        run(driver, size, readers, duration)
+
+
+if __name__ == "__main__":
+    main()
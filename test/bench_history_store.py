@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+History store benchmark.
+
+Fills a history store with records spread over sites, commands, statuses
+and time, then measures typical queries.
+
+Usage: bench_history_store.py [records]
+"""
+
+from sitebuilder.command.store import HistoryStore
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import random
+import os
+import sys
+
+_COMMANDS = ('AddSite', 'UpdateSite', 'DeleteSite', 'LookupHostByName',
+             'ReconcileSites')
+_SITES = 10000
+_SPAN = 365 * 86400
+_NOW = 1300000000.0
+
+
+def get_record(num):
+    """
+    Returns a random log record
+    """
+    site = random.randrange(_SITES)
+    command = random.choice(_COMMANDS)
+
+    return {
+        'time': _NOW - random.random() * _SPAN,
+        'command': command,
+        'description': command,
+        'target': u'name%d.bpinet.com' % site,
+        'status': random.random() < 0.05 and 'error' or 'success',
+        'wait': 0.01,
+        'duration': 0.1,
+        'mesg': u'Site name%d.bpinet.com processed' % site,
+        'exception': None,
+        }
+
+
+def bench(name, function, repeat=20):
+    """
+    Runs function repeat times and prints its mean duration
+    """
+    start = time()
+
+    for i in range(repeat):
+        count = len(function())
+
+    print "%-40s %8.2f ms (%d records)" % (
+        name, (time() - start) * 1000 / repeat, count)
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 1000000
+    tmpdir = mkdtemp()
+
+    try:
+        store = HistoryStore(os.path.join(tmpdir, 'history.db'))
+        start = time()
+
+        for offset in range(0, count, 10000):
+            store.insert_many([ get_record(num) for num in
+                                range(offset, min(offset + 10000, count)) ])
+
+        print "%-40s %8.0f records/s" % ("insert_many",
+                                          count / (time() - start))
+        week = _NOW - 7 * 86400
+
+        bench("site, last week", lambda: store.query(
+            target='name42.bpinet.com', since=week))
+        bench("site, all", lambda: store.query(
+            target='name42.bpinet.com', limit=None))
+        bench("site prefix, last week", lambda: store.query(
+            target='name42*', since=week, limit=None))
+        bench("errors, last week", lambda: store.query(
+            status='error', since=week, limit=None))
+        bench("command, latest 100", lambda: store.query(
+            command='DeleteSite'))
+        bench("latest 100", lambda: store.query())
+
+        start = time()
+        deleted = store.purge(before=_NOW - 180 * 86400)
+        print "%-40s %8.2f ms (%d records)" % (
+            "purge half", (time() - start) * 1000, deleted)
+        store.close()
+    finally:
+        rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
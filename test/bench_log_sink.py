@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Log sinks throughput benchmark.
+
+Measures how many records per second a caller may hand to each sink, and
+how long it takes for all of them to reach the disk.
+
+Usage: bench_log_sink.py [records]
+"""
+
+from sitebuilder.command.sink import JSONLinesFileSink, StreamLogSink
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import os
+import sys
+
+
+def get_record(num):
+    """
+    Returns a typical log record
+    """
+    return {
+        'time': 1300000000.0 + num,
+        'command': 'UpdateSite',
+        'description': 'Update site',
+        'target': 'name%d.bpinet.com' % num,
+        'status': 'success',
+        'enqueued': 1300000000.0 + num,
+        'started': 1300000000.1 + num,
+        'finished': 1300000000.2 + num,
+        'wait': 0.1,
+        'duration': 0.1,
+        'mesg': 'Site name%d.bpinet.com successfully updated' % num,
+        'exception': None,
+        }
+
+
+def bench(name, sink, records):
+    """
+    Writes records into a sink and prints throughput
+    """
+    start = time()
+
+    for record in records:
+        sink.write(record)
+
+    written = time()
+    sink.close()
+    closed = time()
+
+    print "%-28s %10.0f records/s (caller) %10.0f records/s (disk)" % (
+        name, len(records) / (written - start), len(records) / (closed - start))
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    records = [ get_record(num) for num in range(count) ]
+    tmpdir = mkdtemp()
+
+    try:
+        bench("StreamLogSink (file)",
+              StreamLogSink(open(os.path.join(tmpdir, 'stream.log'), 'w')),
+              records)
+        bench("JSONLinesFileSink",
+              JSONLinesFileSink(os.path.join(tmpdir, 'json.log')), records)
+        bench("JSONLinesFileSink (rotate)",
+              JSONLinesFileSink(os.path.join(tmpdir, 'rotate.log'),
+                                max_bytes=1024 * 1024), records)
+    finally:
+        rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Catalog snapshot driver benchmark.
+
+Measures the time to the first sites list page (opening the driver, then
+looking up the first page of hosts fields) of a memory driver loaded from
+snapshots and of a memory mapped catalog snapshot, and mapped exact and
+prefix lookups, with 1k, 10k and 100k sites.
+
+Usage: bench_mapped_driver.py [sizes...]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver, SiteTable
+from sitebuilder.utils.driver.mapped import MappedBackendDriver
+from sitebuilder.utils.driver.mapped import write_catalog
+from sitebuilder.utils.driver.test import get_test_site
+from sitebuilder.utils.parameters import SITES_PAGE_SIZE
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import os
+import sys
+
+# Fields shown by the sites list
+_FIELDS = ('name', 'domain', 'platform', 'description')
+
+
+def bench(name, size, function, keys):
+    """
+    Calls function for each key and prints mean duration
+    """
+    start = time()
+
+    for key in keys:
+        function(key)
+
+    print "%-26s %7d sites %10.1f us/op" % (
+        name, size, (time() - start) * 1e6 / len(keys))
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    sizes = [ int(arg) for arg in sys.argv[1:] ] or [ 1000, 10000, 100000 ]
+    directory = mkdtemp()
+    path = os.path.join(directory, 'sites.snap')
+
+    try:
+        for size in sizes:
+            sites = [ SiteSnapshot.from_site(get_test_site(u"name%d" % num))
+                      for num in range(size) ]
+            keys = [ u"name%d" % num for num in range(0, size, size / 100) ]
+            write_catalog(path, sites)
+
+            def memory_first_page(name):
+                driver = MemoryBackendDriver(SiteTable(sites))
+                driver.lookup_host_fields(u'*', u'*', _FIELDS,
+                                          limit=SITES_PAGE_SIZE)
+
+            def mapped_first_page(name):
+                driver = MappedBackendDriver(path)
+                driver.lookup_host_fields(u'*', u'*', _FIELDS,
+                                          limit=SITES_PAGE_SIZE)
+
+            bench("memory first page", size, memory_first_page, keys[:3])
+            bench("mapped first page", size, mapped_first_page, keys)
+
+            driver = MappedBackendDriver(path)
+            bench("mapped get_site_snapshot", size,
+                  lambda name: driver.get_site_snapshot(name, u'bpinet.com'),
+                  keys)
+            bench("mapped search name*", size,
+                  lambda name: driver.lookup_host_by_name(
+                      u'%s*' % name, u'*', limit=50), keys)
+    finally:
+        rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
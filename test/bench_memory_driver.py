@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+In memory backend driver benchmark.
+
+Measures exact lookups, wildcard searches, paginated and projected
+lookups, multi-criteria queries, descriptions searches, catalog statistics,
+updates and deletes with 1k, 10k and 100k sites.
+
+Usage: bench_memory_driver.py [sizes...]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver, SiteTable
+from sitebuilder.utils.driver.test import get_test_site
+from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
+from time import time
+import random
+import sys
+
+
+def bench(name, size, function, keys):
+    """
+    Calls function for each key and prints mean duration
+    """
+    start = time()
+
+    for key in keys:
+        function(key)
+
+    print "%-26s %7d sites %10.1f us/op" % (
+        name, size, (time() - start) * 1000000 / len(keys))
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    sizes = [ int(size) for size in sys.argv[1:] ] or [1000, 10000, 100000]
+    domain = SiteDefaultsManager.get_default_domain()
+
+    for size in sizes:
+        driver = MemoryBackendDriver(SiteTable(
+            [ SiteSnapshot.from_site(get_test_site(u"name%d" % num))
+              for num in range(size) ]))
+        keys = [ u"NAME%d" % random.randrange(size) for i in range(1000) ]
+        site = driver.get_site_by_name(keys[0], domain)
+
+        def update(name):
+            site.dnshost.name = name
+            driver.update_site(site)
+
+        bench("get_site_by_name", size,
+              lambda name: driver.get_site_by_name(name, domain), keys)
+        bench("get_site_snapshot", size,
+              lambda name: driver.get_site_snapshot(name, domain), keys)
+        bench("lookup_host_by_name", size,
+              lambda name: driver.lookup_host_by_name(name, domain), keys)
+        bench("search name*", size,
+              lambda name: driver.sites.search(u'%s*' % name, domain), keys)
+        bench("search *name*", size,
+              lambda name: driver.sites.search(u'*%s*' % name, u'*'),
+              keys[:10])
+        bench("search *", size,
+              lambda name: driver.sites.search(u'*', u'*'), keys[:10])
+        bench("lookup_host_by_name name*", size,
+              lambda name: driver.lookup_host_by_name(u'%s*' % name, u'*'),
+              keys[:100])
+        bench("lookup_host_by_name * page", size,
+              lambda name: driver.lookup_host_by_name(
+                  u'*', u'*', limit=200, after=(domain, name.lower())),
+              keys[:100])
+        bench("lookup_host_fields * page", size,
+              lambda name: driver.lookup_host_fields(
+                  u'*', u'*', ('name', 'domain', 'platform', 'description'),
+                  limit=200, after=(domain, name.lower())),
+              keys[:100])
+        bench("iter_hosts_by_name *", size,
+              lambda name: sum(1 for host in
+                               driver.iter_hosts_by_name(u'*', u'*')),
+              keys[:10])
+        bench("find_sites 2 criteria page", size,
+              lambda name: driver.find_sites(
+                  limit=200, platform=u'prod', database_enabled=True),
+              keys[:10])
+        bench("search_descriptions word", size,
+              lambda name: driver.search_descriptions(u'desc %s' % name),
+              keys[:100])
+        bench("search_descriptions prefix", size,
+              lambda name: driver.search_descriptions(u'%s*' % name[:-1],
+                                                      limit=200),
+              keys[:100])
+        bench("get_catalog_stats", size,
+              lambda name: driver.get_catalog_stats(), keys[:100])
+        bench("update_site", size, update, keys)
+        bench("delete_site", size,
+              lambda name: driver.delete_site(name, domain), set(keys))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Databases provisioning benchmark.
+
+Provisions the databases of 500 sites on the SQLite stand-in server, by
+batches and one database at a time, and prints the duration and the number
+of connections opened by each pass.
+
+Usage: bench_provision.py [sites]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver
+from sitebuilder.utils.driver.test import get_test_site
+from sitebuilder.provision.adapter import SQLiteAdapter
+from sitebuilder.provision.database import DatabaseProvisioner
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import os
+import sys
+
+
+def bench(name, size, directory, batch_size):
+    """
+    Provisions size databases, and prints the pass duration and opened
+    connections
+    """
+    driver = MemoryBackendDriver()
+    driver.add_sites([ SiteSnapshot.from_site(get_test_site(
+                           u"name%d" % num)).replace('database', done=False)
+                       for num in range(size) ])
+    adapter = SQLiteAdapter(os.path.join(directory, '%s.db' % batch_size))
+    provisioner = DatabaseProvisioner({u'mysql': adapter},
+                                      batch_size=batch_size)
+    start = time()
+    done, failed = provisioner.run(driver)
+
+    print "%-26s %10.3f s %7d done %7d connections" % (
+        name, time() - start, len(done), adapter.connections)
+    provisioner.close()
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    size = len(sys.argv) > 1 and int(sys.argv[1]) or 500
+    directory = mkdtemp()
+
+    try:
+        bench("one database at a time", size, directory, 1)
+        bench("batches", size, directory, 50)
+    finally:
+        rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Catalog server benchmark.
+
+Serves a 10k sites memory driver from a separate process, and measures
+exact lookups sent one at a time and pipelined by batches, and sites list
+pages lookups, from one client.
+
+Usage: bench_remote_driver.py [sites]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver, SiteTable
+from sitebuilder.utils.driver.remote import CatalogServer
+from sitebuilder.utils.driver.remote import RemoteBackendDriver
+from sitebuilder.utils.driver.test import get_test_site
+from sitebuilder.utils.parameters import SITES_PAGE_SIZE
+from multiprocessing import Process
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time, sleep
+import os
+import sys
+
+# Number of pipelined requests
+_BATCH_SIZE = 50
+
+
+def bench(name, count, function, keys):
+    """
+    Calls function for each key and prints mean duration per request
+    """
+    start = time()
+
+    for key in keys:
+        function(key)
+
+    print "%-26s %10.1f us/request" % (
+        name, (time() - start) * 1e6 / (len(keys) * count))
+
+
+def serve(path, size):
+    """
+    Serves size test sites on path
+    """
+    driver = MemoryBackendDriver(SiteTable(
+        [ SiteSnapshot.from_site(get_test_site(u"name%d" % num))
+          for num in range(size) ]))
+    CatalogServer(driver, path).serve_forever()
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    size = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+    directory = mkdtemp()
+    path = os.path.join(directory, 'catalog.sock')
+    server = Process(target=serve, args=(path, size))
+    server.start()
+
+    try:
+        while not os.path.exists(path):
+            sleep(0.1)
+
+        driver = RemoteBackendDriver(path)
+        keys = [ u"name%d" % num for num in range(0, size, size / 1000) ]
+        batches = [ keys[num:num + _BATCH_SIZE]
+                    for num in range(0, len(keys), _BATCH_SIZE) ]
+
+        bench("get_site_snapshot", 1,
+              lambda name: driver.get_site_snapshot(name, u'bpinet.com'),
+              keys)
+        bench("get_site_snapshot x%d" % _BATCH_SIZE, _BATCH_SIZE,
+              lambda names: driver.call_many(
+                  [ ('get_site_snapshot', {'name': name,
+                                           'domain': u'bpinet.com'})
+                    for name in names ]), batches)
+        bench("sites list page", 1,
+              lambda name: driver.lookup_host_fields(
+                  u'%s*' % name, u'*', ('name', 'domain', 'description'),
+                  limit=SITES_PAGE_SIZE), keys[:100])
+    finally:
+        server.terminate()
+        server.join()
+        rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Site list reload benchmark: deep copies versus immutable snapshots.
+
+Measures the time and the number of objects allocated to return every host
+of a 10k sites catalog, as lookup_host_by_name does on list reloads.
+
+Usage: bench_snapshot.py [sites]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver, SiteTable
+from sitebuilder.utils.driver.sqlite import SQLiteBackendDriver
+from sitebuilder.utils.driver.test import get_test_site
+from tempfile import mkdtemp
+from shutil import rmtree
+from copy import deepcopy
+from time import time
+import gc
+import os
+import sys
+
+
+def bench(name, function):
+    """
+    Runs function, and prints its duration and the number of objects it
+    allocated (objects tracked by the garbage collector)
+    """
+    gc.collect()
+    gc.disable()
+    before = len(gc.get_objects())
+    start = time()
+    result = function()
+    duration = time() - start
+    allocated = len(gc.get_objects()) - before
+    gc.enable()
+
+    print "%-32s %8.1f ms %10d objects (%d hosts)" % (
+        name, duration * 1000, allocated, len(result))
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+    sites = [ get_test_site(u"name%d" % num) for num in range(count) ]
+    driver = MemoryBackendDriver(SiteTable(
+        [ SiteSnapshot.from_site(site) for site in sites ]))
+
+    bench("deepcopy (previous read path)",
+          lambda: [ deepcopy(site.dnshost) for site in sites ])
+    bench("memory driver snapshots",
+          lambda: driver.lookup_host_by_name(u'*', u'*'))
+
+    tmpdir = mkdtemp()
+
+    try:
+        sqlite = SQLiteBackendDriver(os.path.join(tmpdir, 'sites.db'))
+        for site in sites:
+            sqlite.add_site(site)
+        bench("sqlite driver snapshots",
+              lambda: sqlite.lookup_host_by_name(u'*', u'*'))
+        sqlite.close()
+    finally:
+        rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
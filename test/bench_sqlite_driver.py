@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+SQLite backend driver benchmark.
+
+Measures exact lookups, wildcard searches, paginated and projected
+lookups, descriptions searches, catalog statistics, updates and deletes with
+1k, 10k and 100k sites, and concurrent reads from several threads.
+
+Usage: bench_sqlite_driver.py [sizes...]
+"""
+
+from sitebuilder.utils.driver.sqlite import SQLiteBackendDriver
+from sitebuilder.utils.driver.test import get_test_site
+from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
+from tempfile import mkdtemp
+from shutil import rmtree
+from threading import Thread
+from time import time
+import random
+import os
+import sys
+
+
+def bench(name, size, function, keys):
+    """
+    Calls function for each key and prints mean duration
+    """
+    start = time()
+
+    for key in keys:
+        function(key)
+
+    print "%-26s %7d sites %10.1f us/op" % (
+        name, size, (time() - start) * 1000000 / len(keys))
+
+
+def bench_threads(size, driver, keys, count=4):
+    """
+    Runs exact lookups from several threads and prints throughput
+    """
+    domain = SiteDefaultsManager.get_default_domain()
+
+    def read():
+        for name in keys:
+            driver.get_site_by_name(name, domain)
+        driver.close()
+
+    threads = [ Thread(target=read) for i in range(count) ]
+    start = time()
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print "%-26s %7d sites %10.0f ops/s" % (
+        "get_site_by_name x%d" % count, size,
+        count * len(keys) / (time() - start))
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    sizes = [ int(size) for size in sys.argv[1:] ] or [1000, 10000, 100000]
+    domain = SiteDefaultsManager.get_default_domain()
+    tmpdir = mkdtemp()
+
+    try:
+        for size in sizes:
+            driver = SQLiteBackendDriver(os.path.join(tmpdir, '%d.db' % size))
+            site = get_test_site(u"name0")
+
+            start = time()
+            for num in range(size):
+                site.dnshost.name = u"name%d" % num
+                driver.add_site(site)
+            print "%-26s %7d sites %10.1f us/op" % (
+                "add_site", size, (time() - start) * 1000000 / size)
+
+            keys = [ u"NAME%d" % random.randrange(size) for i in range(1000) ]
+
+            def update(name):
+                site.dnshost.name = name
+                driver.update_site(site)
+
+            bench("get_site_by_name", size,
+                  lambda name: driver.get_site_by_name(name, domain), keys)
+            bench("lookup_host_by_name", size,
+                  lambda name: driver.lookup_host_by_name(name, domain), keys)
+            bench("lookup_host_by_name name*", size,
+                  lambda name: driver.lookup_host_by_name(u'%s*' % name, u'*'),
+                  keys[:100])
+            bench("lookup_host_by_name *1", size,
+                  lambda name: driver.lookup_host_by_name(u'*1', u'*'),
+                  keys[:5])
+            bench("lookup_host_by_name * page", size,
+                  lambda name: driver.lookup_host_by_name(
+                      u'*', u'*', limit=200, after=(domain, name.lower())),
+                  keys[:100])
+            bench("lookup_host_fields * page", size,
+                  lambda name: driver.lookup_host_fields(
+                      u'*', u'*', ('name', 'domain', 'platform', 'description'),
+                      limit=200, after=(domain, name.lower())),
+                  keys[:100])
+            bench("iter_hosts_by_name *", size,
+                  lambda name: sum(1 for host in
+                                   driver.iter_hosts_by_name(u'*', u'*')),
+                  keys[:2])
+            bench_threads(size, driver, keys)
+            bench("search_descriptions word", size,
+                  lambda name: driver.search_descriptions(
+                      u'desc %s' % name), keys[:100])
+            bench("get_catalog_stats", size,
+                  lambda name: driver.get_catalog_stats(), keys[:100])
+            bench("update_site", size, update, keys)
+            bench("delete_site", size,
+                  lambda name: driver.delete_site(name, domain), set(keys))
+            driver.close()
+    finally:
+        rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+DNS zones builder benchmark.
+
+Measures the build of the zones of a 100k hosts catalog, a build without
+any change, and an incremental build after a single site deletion, and
+prints the number of replaced zones of each build.
+
+Usage: bench_zone.py [hosts]
+"""
+
+from sitebuilder.abstraction.site.snapshot import SiteSnapshot
+from sitebuilder.utils.driver.memory import MemoryBackendDriver
+from sitebuilder.utils.driver.test import get_test_site
+from sitebuilder.generator.zone import ZoneBuilder
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import sys
+
+
+def bench(name, function):
+    """
+    Runs a zones build, and prints its duration and replaced zones
+    """
+    start = time()
+    results = function()
+
+    print "%-26s %10.3f s %7d zones %7d replaced" % (
+        name, time() - start, len(results),
+        len([ result for result in results if result[1] ]))
+
+
+def main():
+    """
+    Benchmark main function
+    """
+    size = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    directory = mkdtemp()
+
+    try:
+        driver = MemoryBackendDriver()
+        driver.add_sites([ SiteSnapshot.from_site(get_test_site(
+                               u"name%d" % num)) for num in range(size) ])
+        builder = ZoneBuilder(directory)
+
+        bench("full build", lambda: builder.update(driver))
+        bench("unchanged full build", lambda: builder.build_all(driver))
+
+        driver.delete_site(u'name%d' % (size / 2), u'bpinet.com')
+        bench("single site deletion", lambda: builder.update(driver))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,8 @@ Test classes for abstraction.site moodule
 import unittest
 import doctest
 from sitebuilder.utils.parameters import set_application_context
-from sitebuilder.abstraction.site import manager
+from sitebuilder.abstraction.site import manager, snapshot, bulk
+import sitebuilder.catalog
 from sitebuilder.abstraction.site.defaults import SiteDefaultsManager
 from sitebuilder.abstraction.site.manager import SiteConfigurationManager
 from zope.schema import ValidationError
@@ -28,6 +29,21 @@ class Test(unittest.TestCase):
         """
         doctest.testmod(manager)
 
+    def test_snapshot_doctests(self):
+        """
+        Run site snapshots doctests
+        """
+        failures, tests = doctest.testmod(snapshot)
+        self.assertEquals(failures, 0)
+
+    def test_bulk_doctests(self):
+        """
+        Run catalog import and export doctests
+        """
+        for module in (bulk, sitebuilder.catalog):
+            failures, tests = doctest.testmod(module)
+            self.assertEquals(failures, 0)
+
     def test_default_site(self):
         """
         Tests that default site builds correctly and that attributes
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Test classes for command modules
+"""
+
+import unittest
+import doctest
+from sitebuilder.utils.parameters import set_application_context
+from sitebuilder.command import reconcile, queue, sink, history, store, host
+from sitebuilder.command import site, artifact, provision
+import sitebuilder.history
+
+
+class Test(unittest.TestCase):
+    """
+    Unit tests for commands.
+    """
+
+    def setUp(self):
+        """
+        Enables test context
+        """
+        set_application_context('test')
+
+    def test_doctests(self):
+        """
+        Run commands doctests
+        """
+        for module in (reconcile, queue, sink, history, store, host, site,
+                       artifact, provision, sitebuilder.history):
+            failures, tests = doctest.testmod(module)
+            self.assertEquals(failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Test classes for concurrent drivers use
+"""
+
+import unittest
+import doctest
+from threading import Thread
+from sitebuilder.utils.parameters import set_application_context
+from sitebuilder.utils import lock
+from sitebuilder.utils.driver.memory import MemoryBackendDriver
+from sitebuilder.utils.driver.index import get_cursor
+from sitebuilder.abstraction.site.factory import site_factory
+
+# Stress test threads, and number of writes per writer
+_READERS = 4
+_WRITERS = 2
+_WRITES = 200
+
+
+def make_site(name):
+    """
+    Returns a new site whose description starts with its name
+    """
+    site = site_factory()
+    site.dnshost.name = name
+    site.dnshost.description = name
+
+    return site
+
+
+class Test(unittest.TestCase):
+    """
+    Unit tests for concurrent drivers use.
+    """
+
+    def setUp(self):
+        """
+        Enables test context
+        """
+        set_application_context('test')
+
+    def test_doctests(self):
+        """
+        Run lock doctests
+        """
+        failures, tests = doctest.testmod(lock)
+        self.assertEquals(failures, 0)
+
+    def test_memory_driver_stress(self):
+        """
+        Runs lookups while several threads add, update and delete sites,
+        and checks that readers only see consistent states
+        """
+        driver = MemoryBackendDriver()
+        driver.add_sites([ make_site(u'base%d' % num) for num in range(200) ])
+        errors = []
+        expected = set([ u'base%d' % num for num in range(200) ])
+        done = []
+
+        def write(num):
+            for i in xrange(_WRITES):
+                name = u'w%d-%d' % (num, i)
+                site = make_site(name)
+                driver.add_site(site)
+                site.dnshost.description = u'%s updated' % name
+                driver.update_site(site)
+
+                if i % 2:
+                    driver.delete_site(name, site.dnshost.domain)
+                else:
+                    expected.add(name)
+
+                base = driver.get_site_by_name(u'base%d' % (i % 200),
+                                               site.dnshost.domain)
+                base.dnshost.description = u'%s %d' % (base.dnshost.name, i)
+                driver.update_site(base)
+
+        def read():
+            while len(done) < _WRITERS:
+                hosts = driver.lookup_host_fields(
+                    u'*', u'*', ('name', 'domain', 'description'))
+                cursors = [ get_cursor(name, domain)
+                            for name, domain, desc in hosts ]
+
+                if cursors != sorted(set(cursors)):
+                    errors.append("Unsorted or duplicated hosts")
+
+                for name, domain, desc in hosts:
+                    if not desc.startswith(name):
+                        errors.append("Torn site %s: %s" % (name, desc))
+
+                if driver.get_site_snapshot(u'base0', u'bpinet.com') is None:
+                    errors.append("Missing site base0")
+
+        def run(function, *args):
+            try:
+                function(*args)
+            except Exception, e:
+                errors.append(repr(e))
+            finally:
+                if function is write:
+                    done.append(args)
+
+        threads = [ Thread(target=run, args=(read,))
+                    for num in range(_READERS) ]
+        threads.extend([ Thread(target=run, args=(write, num))
+                         for num in range(_WRITERS) ])
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(errors[:5], [])
+        self.assertEquals(
+            set([ site.dnshost.name for site in driver.iter_sites() ]),
+            expected)
+        self.assertEquals(driver.get_version(),
+                          200 + _WRITERS * _WRITES * 3 + _WRITERS * _WRITES / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""
+Test classes for backend drivers
+"""
+
+import unittest
+import doctest
+from sitebuilder.utils.parameters import set_application_context
+from sitebuilder.utils.driver import memory, index, sqlite, registry, changes
+from sitebuilder.utils.driver import cache, text, stats, mapped, remote
+
+
+class Test(unittest.TestCase):
+    """
+    Unit tests for backend drivers.
+    """
+
+    def setUp(self):
+        """
+        Enables test context
+        """
+        set_application_context('test')
+
+    def test_doctests(self):
+        """
+        Run drivers doctests
+        """
+        for module in (memory, index, sqlite, registry, changes, cache,
+                       text, stats, mapped, remote):
+            failures, tests = doctest.testmod(module)
+            self.assertEquals(failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
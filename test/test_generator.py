@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Test classes for configuration generators
+"""
+
+import unittest
+import doctest
+from sitebuilder.utils.parameters import set_application_context
+from sitebuilder.generator import artifact, zone
+
+
+class Test(unittest.TestCase):
+    """
+    Unit tests for configuration generators.
+    """
+
+    def setUp(self):
+        """
+        Enables test context
+        """
+        set_application_context('test')
+
+    def test_doctests(self):
+        """
+        Run generators doctests
+        """
+        for module in (artifact, zone):
+            failures, tests = doctest.testmod(module)
+            self.assertEquals(failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,8 @@ from sitebuilder.control.list import ListLogsControlAgent
 from sitebuilder.command.base import BaseCommand
 from sitebuilder.observer.command import ICommandSubject, CommandSubject
 from sitebuilder.command.interface import COMMAND_SUCCESS
+from sitebuilder.command.history import CommandHistory, CommandSummary
+from sitebuilder.event.events import CommandExecEvent
 from sitebuilder.application import init, uninit
 from zope.interface import implements
 
@@ -232,6 +234,27 @@ class TestGtkListLogsAgent(unittest.TestCase):
         refresh_gui()
         self.assertEquals(len(model), 0)
 
+    def test_list_logs_bounded(self):
+        """
+        Tests that logs list keeps a bounded number of rows, and that old
+        commands are reduced to summaries
+        """
+        control_agent = ListLogsControlAgent()
+        control_agent._commands = CommandHistory(3, 1)
+        presentation_agent = control_agent.get_presentation_agent()
+        model = presentation_agent['logs_list'].get_model()
+        commands = [ TestCommand() for i in range(5) ]
+
+        for command in commands:
+            command.status = COMMAND_SUCCESS
+            control_agent.command_evt_callback(CommandExecEvent(command))
+
+        refresh_gui()
+        self.assertEquals(len(model), 3)
+        self.assertTrue(model[2][3] is commands[4])
+        self.assertTrue(isinstance(model[1][3], CommandSummary))
+        self.assertTrue(isinstance(model[0][3], CommandSummary))
+
 
 if __name__ == "__main__":
     unittest.main()
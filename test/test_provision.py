@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Test classes for databases provisioning
+"""
+
+import unittest
+import doctest
+from sitebuilder.utils.parameters import set_application_context
+from sitebuilder.provision import adapter, pool, database
+
+
+class Test(unittest.TestCase):
+    """
+    Unit tests for databases provisioning.
+    """
+
+    def setUp(self):
+        """
+        Enables test context
+        """
+        set_application_context('test')
+
+    def test_doctests(self):
+        """
+        Run provisioning doctests
+        """
+        for module in (adapter, pool, database):
+            failures, tests = doctest.testmod(module)
+            self.assertEquals(failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()